@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import json
 import os
 import queue
@@ -22,6 +23,15 @@ import torch
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from faster_qwen3_tts import FasterQwen3TTS
+from tts_synthesis_queue import SynthesisQueue
+from tts_cache import voice_file_version
+
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file as save_safetensors
+except ImportError:  # transformers pulls it in; keep the server usable without it
+    safe_open = None
+    save_safetensors = None
 
 ROOT = Path(__file__).resolve().parents[1]
 SOURCE = ROOT / "source"
@@ -38,6 +48,9 @@ FASTER_OUTPUTS = OUTPUTS / "faster"
 STREAM_OUTPUTS = OUTPUTS / "streaming-captured"
 PORT = 8767
 HWUI_VOICE_TEMPERATURE = 0.8
+# Bump when make_prompt's preprocessing (silence pad, headroom) or the
+# on-disk layout changes, so stale persisted prompts are rebuilt.
+PROMPT_FORMAT_VERSION = 1
 for folder in (VOICES, OUTPUTS, BENCHMARKS, OFFICIAL_OUTPUTS, FASTER_OUTPUTS, STREAM_OUTPUTS):
     folder.mkdir(parents=True, exist_ok=True)
 
@@ -58,6 +71,48 @@ def prompt_key(name: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_.-]+", "_", name.strip())[:60] or "voice"
 
 
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_fingerprint() -> dict[str, Any]:
+    config = MODEL_DIR / "config.json"
+    return {"model_dir": str(MODEL_DIR.resolve()),
+            "model_config_mtime_ns": config.stat().st_mtime_ns if config.is_file() else None}
+
+
+def flatten_prompt(node: Any, path: str, tensors: dict[str, torch.Tensor]) -> dict[str, Any]:
+    """Split a voice-clone prompt into named tensors plus a JSON layout of everything else."""
+    if isinstance(node, torch.Tensor):
+        tensors[path] = node.detach().contiguous().cpu()
+        return {"type": "tensor", "key": path, "device": str(node.device)}
+    if isinstance(node, dict):
+        return {"type": "dict", "items": {str(k): flatten_prompt(v, f"{path}.{k}", tensors) for k, v in node.items()}}
+    if isinstance(node, (list, tuple)):
+        return {"type": "tuple" if isinstance(node, tuple) else "list",
+                "items": [flatten_prompt(v, f"{path}.{i}", tensors) for i, v in enumerate(node)]}
+    if node is None or isinstance(node, (bool, int, float, str)):
+        return {"type": "value", "value": node}
+    raise TypeError(f"Cannot persist prompt field {path} of type {type(node).__name__}")
+
+
+def rebuild_prompt(layout: dict[str, Any], handle: Any) -> Any:
+    kind = layout["type"]
+    if kind == "tensor":
+        device = layout["device"] if torch.cuda.is_available() or not layout["device"].startswith("cuda") else "cpu"
+        return handle.get_tensor(layout["key"]).to(device)
+    if kind == "dict":
+        return {k: rebuild_prompt(v, handle) for k, v in layout["items"].items()}
+    if kind in ("list", "tuple"):
+        items = [rebuild_prompt(v, handle) for v in layout["items"]]
+        return tuple(items) if kind == "tuple" else items
+    return layout["value"]
+
+
 def normalise_text_for_qwen(text: str) -> str:
     """Keep the spoken word ``am`` from being tokenised as the initials A.M."""
     return re.sub(r"\bI\s+AM\b", "I am", text)
@@ -107,6 +162,7 @@ class Runtime:
         self.prompt_meta: dict[str, dict[str, Any]] = {}
         self.primed_voices: set[str] = set()
         self.results: dict[str, dict[str, Any]] = {}
+        self.reference_hashes: dict[tuple[str, int, int], str] = {}
 
     def load(self) -> FasterQwen3TTS:
         if self.model is not None:
@@ -123,6 +179,64 @@ class Runtime:
         self.loaded_vram_mb = gpu_stats()["vram_mb"]
         return self.model
 
+    def prompt_version(self, audio: Path, transcript: str) -> dict[str, Any]:
+        """What a persisted prompt was built from; any difference means rebuild."""
+        stat = audio.stat()
+        stamp = (str(audio.resolve()), stat.st_mtime_ns, stat.st_size)
+        if stamp not in self.reference_hashes:
+            self.reference_hashes[stamp] = file_sha256(audio)
+        return {"format": PROMPT_FORMAT_VERSION, **model_fingerprint(),
+                "reference_sha256": self.reference_hashes[stamp],
+                "reference_text_sha256": hashlib.sha256(transcript.encode("utf-8")).hexdigest()}
+
+    def persist_prompt(self, key: str, prompt: dict[str, Any]) -> None:
+        if save_safetensors is None:
+            return
+        tensors: dict[str, torch.Tensor] = {}
+        try:
+            layout = flatten_prompt(prompt, "prompt", tensors)
+        except TypeError as exc:
+            print(f"Voice prompt {key} not persisted: {exc}")
+            return
+        target = VOICES / f"{key}.prompt.safetensors"
+        partial = target.with_suffix(".tmp")
+        save_safetensors(tensors, str(partial), metadata={"layout": json.dumps(layout)})
+        os.replace(partial, target)
+        self.prompt_meta[key]["tensor_file"] = target.name
+
+    def load_persisted_prompt(self, key: str, version: dict[str, Any]) -> dict[str, Any] | None:
+        meta_path = VOICES / f"{key}.json"
+        if safe_open is None or not meta_path.is_file():
+            return None
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            tensor_path = VOICES / str(meta.get("tensor_file") or "")
+            if meta.get("version") != version or not tensor_path.is_file():
+                return None
+            started = time.perf_counter()
+            # safe_open memory-maps the file; only the tensors are copied to the GPU.
+            with safe_open(str(tensor_path), framework="pt", device="cpu") as handle:
+                prompt = rebuild_prompt(json.loads(handle.metadata()["layout"]), handle)
+        except Exception as exc:
+            print(f"Persisted voice prompt {key} unreadable, rebuilding: {exc}")
+            return None
+        self.prompts[key] = prompt
+        self.prompt_meta[key] = meta
+        print(f"Loaded persisted voice prompt {key} in {time.perf_counter() - started:.3f}s")
+        return prompt
+
+    def voice_prompt(self, name: str, audio: Path, transcript: str) -> tuple[dict[str, Any], float]:
+        """Memory, then disk, then build. The float is prompt-construction seconds (0 on a hit)."""
+        key = prompt_key(name)
+        version = self.prompt_version(audio, transcript)
+        if key in self.prompts and self.prompt_meta.get(key, {}).get("version") == version:
+            return self.prompts[key], 0.0
+        self.primed_voices.discard(key)
+        prompt = self.load_persisted_prompt(key, version)
+        if prompt is not None:
+            return prompt, 0.0
+        return self.make_prompt(name, audio, transcript)
+
     def make_prompt(self, name: str, audio: Path, transcript: str) -> tuple[dict[str, Any], float]:
         model = self.load()
         key = prompt_key(name)
@@ -138,7 +252,12 @@ class Runtime:
         seconds = time.perf_counter() - started
         self.prompts[key] = prompt
         self.prompt_meta[key] = {"id": key, "reference_audio": str(audio), "reference_text": transcript,
-                                 "creation_seconds": round(seconds, 4), "mode": "full_icl"}
+                                 "creation_seconds": round(seconds, 4), "mode": "full_icl",
+                                 "version": self.prompt_version(audio, transcript)}
+        try:
+            self.persist_prompt(key, prompt)
+        except Exception as exc:
+            print(f"Voice prompt {key} not persisted: {exc}")
         (VOICES / f"{key}.json").write_text(json.dumps(self.prompt_meta[key], indent=2), encoding="utf-8")
         return prompt, seconds
 
@@ -149,11 +268,20 @@ class Runtime:
         if not meta_path.is_file():
             raise ValueError(f"Unknown cached voice prompt: {prompt_id}")
         meta = json.loads(meta_path.read_text(encoding="utf-8"))
-        prompt, elapsed = self.make_prompt(meta["id"], Path(meta["reference_audio"]), meta["reference_text"])
+        prompt, elapsed = self.voice_prompt(meta["id"], Path(meta["reference_audio"]), meta["reference_text"])
         return prompt, meta["reference_text"], elapsed
 
 
 runtime = Runtime()
+# HWUI's /tts_to_audio and /tts_stream run through one FIFO worker so waiting
+# sentences keep their order and the backlog shows on /status. Same-voice
+# /tts_to_audio sentences that arrive together are rendered in one
+# generate_voice_clone call (see render_hwui_batch).
+def render_hwui_batch(key: tuple, items: list[tuple[str, str]]) -> list[FileResponse]:
+    return _render_hwui_texts(*key, items)
+
+
+hwui_queue = SynthesisQueue("qwen-fast", run_batch=render_hwui_batch)
 app = FastAPI(title="Faster Qwen3-TTS Native Windows Evaluation", version="1.0")
 
 
@@ -312,14 +440,17 @@ def backend() -> dict[str, Any]:
 # (VoiceName.wav + VoiceName.txt) while the standalone evaluation API remains available.
 @app.get("/voices")
 def hwui_voices() -> dict[str, Any]:
-    return {"voices": shared_voice_names(), "voices_dir": str(SHARED_VOICES)}
+    names = shared_voice_names()
+    # Reference-file stamps — HWUI keys its TTS audio cache on these.
+    versions = {n: voice_file_version(SHARED_VOICES / f"{n}.wav", SHARED_VOICES / f"{n}.txt") for n in names}
+    return {"voices": names, "versions": versions, "voices_dir": str(SHARED_VOICES)}
 
 
 @app.get("/status")
 def hwui_status() -> dict[str, Any]:
     return {"status": "online", "engine": "qwen-fast", "gpu": torch.cuda.get_device_name(0),
             "model_loaded": runtime.model is not None, "cuda_graphs_captured": runtime.cuda_graphs_captured,
-            "voices_dir": str(SHARED_VOICES)}
+            "voices_dir": str(SHARED_VOICES), "queue": hwui_queue.stats()}
 
 
 @app.post("/warmup")
@@ -328,8 +459,7 @@ def hwui_warmup(payload: dict[str, Any]) -> dict[str, Any]:
     with runtime.lock:
         model = runtime.load()
         wav, transcript = shared_voice(voice)
-        key = prompt_key(voice)
-        prompt, seconds = runtime.make_prompt(voice, wav, transcript) if key not in runtime.prompts else (runtime.prompts[key], 0.0)
+        prompt, seconds = runtime.voice_prompt(voice, wav, transcript)
         primed = prime_hwui_voice(model, voice, transcript, prompt)
     return {"status": "ok", "voice": voice, "voice_prompt_processing_seconds": round(seconds, 4),
             "voice_primed": primed}
@@ -342,30 +472,48 @@ def hwui_tts_to_audio(payload: dict[str, Any]) -> FileResponse:
     if not text:
         raise HTTPException(400, "No text provided")
     spoken_text = normalise_text_for_qwen(text)
-    with runtime.lock:
+    key = (voice, str(payload.get("language") or "English"), int(payload.get("seed", 42)),
+           int(payload.get("max_new_tokens", 512)))
+    item = (text, spoken_text)
+
+    def render() -> FileResponse:
         try:
-            model = runtime.load()
-            wav_path, transcript = shared_voice(voice)
-            key = prompt_key(voice)
-            prompt, _seconds = runtime.make_prompt(voice, wav_path, transcript) if key not in runtime.prompts else (runtime.prompts[key], 0.0)
-            prime_hwui_voice(model, voice, transcript, prompt)
-            torch.manual_seed(int(payload.get("seed", 42)))
-            torch.cuda.manual_seed_all(int(payload.get("seed", 42)))
-            wavs, sr = model.generate_voice_clone(
-                text=spoken_text, language=str(payload.get("language") or "English"),
-                ref_text=transcript, voice_clone_prompt=prompt,
-                max_new_tokens=int(payload.get("max_new_tokens", 512)),
-                temperature=HWUI_VOICE_TEMPERATURE, top_k=50, top_p=0.95, do_sample=True,
-                repetition_penalty=1.05, xvec_only=False,
-                non_streaming_mode=False, append_silence=True,
-            )
-            name = output_name(text, f"hwui_{voice}")
-            target = FASTER_OUTPUTS / name
-            sf.write(target, completed_audio_with_headroom(wavs[0]), sr)
-            return FileResponse(target, media_type="audio/wav", filename=name)
+            return _render_hwui_texts(*key, [item])[0]
         except ValueError as exc:
             raise HTTPException(400, str(exc)) from exc
 
+    return hwui_queue.synthesize(key, item, render)
+
+
+def _render_hwui_texts(voice: str, language: str, seed: int, max_new_tokens: int,
+                       items: list[tuple[str, str]]) -> list[FileResponse]:
+    """Render (text, spoken_text) items for one voice in a single inference call."""
+    with runtime.lock:
+        model = runtime.load()
+        wav_path, transcript = shared_voice(voice)
+        prompt, _seconds = runtime.voice_prompt(voice, wav_path, transcript)
+        prime_hwui_voice(model, voice, transcript, prompt)
+        torch.manual_seed(seed)
+        torch.cuda.manual_seed_all(seed)
+        spoken = [spoken_text for _text, spoken_text in items]
+        wavs, sr = model.generate_voice_clone(
+            text=spoken if len(spoken) > 1 else spoken[0], language=language,
+            ref_text=transcript, voice_clone_prompt=prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=HWUI_VOICE_TEMPERATURE, top_k=50, top_p=0.95, do_sample=True,
+            repetition_penalty=1.05, xvec_only=False,
+            non_streaming_mode=False, append_silence=True,
+        )
+        if len(wavs) != len(items):
+            raise RuntimeError(f"generate_voice_clone returned {len(wavs)} clips for {len(items)} texts")
+        responses = []
+        for (text, _spoken_text), wav in zip(items, wavs):
+            name = output_name(text, f"hwui_{voice}")
+            target = FASTER_OUTPUTS / name
+            sf.write(target, completed_audio_with_headroom(wav), sr)
+            responses.append(FileResponse(target, media_type="audio/wav", filename=name))
+        return responses
+
 
 @app.post("/tts_stream")
 async def hwui_tts_stream(payload: dict[str, Any]) -> StreamingResponse:
@@ -378,7 +526,7 @@ async def hwui_tts_stream(payload: dict[str, Any]) -> StreamingResponse:
         items: queue.Queue[bytes | Exception | object] = queue.Queue()
         done = object()
 
-        def producer() -> None:
+        def render() -> None:
             chunks: list[np.ndarray] = []
             sr = 24000
             try:
@@ -388,8 +536,7 @@ async def hwui_tts_stream(payload: dict[str, Any]) -> StreamingResponse:
                 with runtime.lock:
                     model = runtime.load()
                     wav_path, transcript = shared_voice(voice)
-                    key = prompt_key(voice)
-                    prompt, _seconds = runtime.make_prompt(voice, wav_path, transcript) if key not in runtime.prompts else (runtime.prompts[key], 0.0)
+                    prompt, _seconds = runtime.voice_prompt(voice, wav_path, transcript)
                     prime_hwui_voice(model, voice, transcript, prompt)
                     stream = model.generate_voice_clone_streaming(**generation_kwargs(
                         spoken_text, str(payload.get("language") or "English"), transcript,
@@ -409,6 +556,9 @@ async def hwui_tts_stream(payload: dict[str, Any]) -> StreamingResponse:
             finally:
                 items.put(done)
 
+        def producer() -> None:
+            hwui_queue.call(render)
+
         threading.Thread(target=producer, daemon=True).start()
         yield wav_header(24000)
         loop = asyncio.get_running_loop()
@@ -1,12 +1,42 @@
 from flask import Flask, request, jsonify, send_from_directory, render_template, Response
 from flask_cors import CORS
 import requests, os, json, re, hashlib, time, subprocess, sys
-import psutil
+_STARTUP_T0 = time.perf_counter()
 from datetime import datetime, timedelta
 from truncation import trim_chat_history, rough_token_count
+import truncation
 from tts_routes import tts_bp
-from utils.session_handler import get_system_prompt, get_instruction_layer, get_tone_primer
-from whisper_routes import whisper_bp
+from tts_pipeline import tee_chat_stream
+from gguf_catalog import model_catalog, recommended_ctx_size
+from model_prestage import model_prestager, prestage_model_id, resolve_model_path
+from backend_pool import pool as backend_pool, iter_lines as backend_iter_lines
+import attachment_store
+from document_extract import extractor as document_extractor, ExtractionError, SUPPORTED_EXTENSIONS
+from prompt_segments import prompt_segments, make_segment, file_version, settings_version
+from turn_snapshots import turn_snapshots, fingerprint as turn_snapshot_fingerprint
+from nbest import multiplex as nbest_multiplex, clamp_candidates, candidate_slot_ctx as nbest_candidate_slot_ctx
+from prefix_prewarm import PrefixPrewarmer
+import perf_trace
+import gen_metrics
+from utils.session_handler import get_system_prompt, get_instruction_layer, get_tone_primer, get_active_system_prompt_path
+from whisper_routes import whisper_bp, start_prewarm as start_whisper_prewarm
+
+# ── Startup phase timings ──────────────────────────────────────────────────
+# Each phase records how long it took since the previous mark, so a slow cold
+# start can be pinned on a specific step. Printed as a breakdown just before
+# app.run and returned by /health.
+_STARTUP_PHASES = []
+_startup_last_mark = _STARTUP_T0
+
+
+def _startup_phase(label):
+    global _startup_last_mark
+    now = time.perf_counter()
+    _STARTUP_PHASES.append((label, round((now - _startup_last_mark) * 1000, 1)))
+    _startup_last_mark = now
+
+
+_startup_phase("core imports")
 
 _LIVE_HISTORY_FRAME_INSTRUCTION = (
     "Keep separate dreams, stories, hypotheticals, examples, and real-life events distinct. "
@@ -25,119 +55,24 @@ def _live_history_frame_packet():
 # The app runs inside an Electron wrapper where the live Flask console isn't
 # visible. To capture everything the existing bare print() calls emit WITHOUT
 # rewriting a single print statement, sys.stdout / sys.stderr are tee'd: every
-# write still goes to the real console (StreamHandler-equivalent) AND is
-# mirrored, line by line, into rotating logfiles under logs/.
+# write still goes to the real console AND is queued, line by line, for a
+# background listener that writes the rotating logfiles under logs/:
 #
 #   logs/hwui_full.log    — everything (RotatingFileHandler, ~10 MB x 5 backups)
 #   logs/stop_reasons.log — only the 🩺/⏱️/⚠️ stop-reason lines, append-forever
 #
-# CRITICAL: every handler is encoding='utf-8' so the emoji markers (🩺 🔬 🧼 🚀)
-# don't raise UnicodeEncodeError under Windows' default cp1252 console codec.
+# The request thread never touches the disk for a log line. Verbose output
+# goes through the diag / stream / perf category loggers (levels from
+# settings.json `log_levels`). See hwui_log.py.
 import logging
-from logging.handlers import RotatingFileHandler
 import threading
+import hwui_log
 
-_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
-os.makedirs(_LOG_DIR, exist_ok=True)
-
-# Full rotating log — faithful mirror of the console (no added prefix).
-_hwui_full_logger = logging.getLogger("hwui.full")
-_hwui_full_logger.setLevel(logging.INFO)
-_hwui_full_logger.propagate = False
-_full_handler = RotatingFileHandler(
-    os.path.join(_LOG_DIR, "hwui_full.log"),
-    maxBytes=10 * 1024 * 1024,   # ~10 MB per file
-    backupCount=5,               # keep last 5 backups
-    encoding="utf-8",
-)
-_full_handler.setFormatter(logging.Formatter("%(message)s"))
-_hwui_full_logger.addHandler(_full_handler)
-
-# Stop-reason log — tiny lines, append forever (no rotation), timestamp prefix.
-_hwui_stop_logger = logging.getLogger("hwui.stop")
-_hwui_stop_logger.setLevel(logging.INFO)
-_hwui_stop_logger.propagate = False
-_stop_handler = logging.FileHandler(
-    os.path.join(_LOG_DIR, "stop_reasons.log"),
-    encoding="utf-8",
-)
-_stop_handler.setFormatter(logging.Formatter("%(asctime)s  %(message)s"))
-_hwui_stop_logger.addHandler(_stop_handler)
-
-# Lines routed to the dedicated stop-reason log (substring match, emoji-safe).
-_STOP_MARKERS = ("🩺 STOP REASON", "⏱️ TEMP STOP", "PREMATURE EOS")
-
-
-class _TeeStream:
-    """Wrap a console stream so every write is mirrored into the rotating full
-    log, with stop-reason marker lines also copied to stop_reasons.log. The
-    original stream is left fully functional, so existing print() calls keep
-    showing on the console exactly as before."""
-
-    def __init__(self, stream):
-        self._stream = stream
-        self._buf = ""
-        self._lock = threading.Lock()
-
-    def write(self, data):
-        with self._lock:
-            # Mirror to the rotating/stop logs FIRST so a console that can't
-            # render an emoji (e.g. a cp1252 pipe) never costs us the logfile
-            # copy — the UTF-8 file handlers always get the real characters.
-            self._buf += data
-            while "\n" in self._buf:
-                line, self._buf = self._buf.split("\n", 1)
-                self._emit(line)
-            # Then write to the real console. Tolerate a narrow console codec
-            # so an un-encodable emoji can never take the app down.
-            if self._stream is not None:
-                try:
-                    self._stream.write(data)
-                except UnicodeEncodeError:
-                    try:
-                        enc = getattr(self._stream, "encoding", None) or "utf-8"
-                        self._stream.write(data.encode(enc, "replace").decode(enc))
-                    except Exception:
-                        pass
-        return len(data)
-
-    def _emit(self, line):
-        if not line:
-            return
-        try:
-            _hwui_full_logger.info(line)
-            if any(m in line for m in _STOP_MARKERS):
-                _hwui_stop_logger.info(line)
-        except Exception:
-            # Logging must never take the request thread down.
-            pass
-
-    def flush(self):
-        if self._stream is not None:
-            self._stream.flush()
-
-    def __getattr__(self, name):
-        # Delegate isatty(), encoding, fileno(), etc. to the real stream.
-        return getattr(self._stream, name)
-
-
-# Best-effort: make the underlying console UTF-8 too, so the live output can
-# render the emoji markers instead of falling back to replacement chars. Safe
-# no-op on streams that don't support reconfigure() (e.g. a plain pipe).
-for _std in (sys.stdout, sys.stderr):
-    try:
-        _std.reconfigure(encoding="utf-8")  # type: ignore[attr-defined]
-    except Exception:
-        pass
-
-# Install the tee. Guarded against a None stream (e.g. a windowed pythonw host).
-if sys.stdout is not None:
-    sys.stdout = _TeeStream(sys.stdout)
-if sys.stderr is not None:
-    sys.stderr = _TeeStream(sys.stderr)
+hwui_log.install()
 # ============================================================================
 
 print(f"💡 Flask is using: {os.path.abspath(__file__)}")
+_startup_phase("console log tee")
 
 # --------------------------------------------
 # Chat history trimming (simple message window)
@@ -245,6 +180,7 @@ app.register_blueprint(shard_gen_bp)
 app.register_blueprint(helcyon_bench_bp)
 app.register_blueprint(tts_bp, url_prefix='/api/tts')
 app.register_blueprint(whisper_bp)
+_startup_phase("blueprints")
 
 # --------------------------------------------------
 # Placeholder substitution — SINGLE source of truth
@@ -294,11 +230,26 @@ _DOC_NOUN_RE = re.compile(r'\b(document|documents|pdf|attachment|attachments)\b'
 
 
 def _read_doc_content(filepath, max_chars=None):
-    """Read any supported document format; returns content string or None on failure."""
+    """Read any supported document format; returns content string or None on failure.
+
+    Extracted text is cached by document_extract (filled at project upload),
+    so a hit returns without touching the parser at all.
+    """
     fname = os.path.basename(filepath).lower()
-    content = None
+    content = document_extractor.cached_text(filepath)
+    if content is not None:
+        return content[:max_chars] if max_chars else content
     try:
-        if fname.endswith(('.txt', '.md')):
+        if fname.endswith('.pdf') and not max_chars:
+            # Full read — page-parallel on the extraction pool, and cached.
+            try:
+                content = document_extractor.extract(filepath)
+            except ExtractionError as e:
+                if "PyPDF2" in str(e):
+                    content = "[PDF content - PyPDF2 required to read]"
+                else:
+                    print(f"⚠️ PDF read failed {fname}: {e}")
+        elif fname.endswith(('.txt', '.md')):
             try:
                 with open(filepath, 'r', encoding='utf-8-sig') as f:
                     content = f.read()
@@ -714,60 +665,78 @@ def load_global_documents(user_query=""):
 # --------------------------------------------------
 @app.route('/parse_document', methods=['POST'])
 def parse_document():
+    """Extract an uploaded document on the extraction pool.
+
+    By default the request waits for the text (large PDFs are still split
+    across workers). With ?async=1 it returns the job id at once (202); the
+    client follows /document_jobs/<id>/events and then fetches
+    /document_jobs/<id>?content=1.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     file = request.files['file']
     filename = file.filename or 'document'
-    raw = file.read()
-    content = None
-
-    try:
-        if filename.lower().endswith(('.txt', '.md')):
-            try:
-                content = raw.decode('utf-8-sig')
-            except UnicodeDecodeError:
-                content = raw.decode('latin-1')
-
-        elif filename.lower().endswith(('.py', '.html', '.htm')):
-            content = raw.decode('utf-8', errors='replace')
-
-        elif filename.lower().endswith('.docx'):
-            try:
-                import docx, io
-                doc = docx.Document(io.BytesIO(raw))
-                content = "\n".join(para.text for para in doc.paragraphs)
-            except ImportError:
-                return jsonify({'error': 'python-docx is required to read .docx files'}), 500
+    if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        return jsonify({'error': f'Unsupported file type: {filename}'}), 400
 
-        elif filename.lower().endswith('.odt'):
-            try:
-                from odf import text as odf_text, teletype
-                from odf.opendocument import load as odf_load
-                import io
-                doc = odf_load(io.BytesIO(raw))
-                allparas = doc.getElementsByType(odf_text.P)
-                content = "\n".join(teletype.extractText(p) for p in allparas)
-            except ImportError:
-                return jsonify({'error': 'odfpy is required to read .odt files'}), 500
+    job = document_extractor.submit_bytes(file.read(), filename)
+    if request.args.get('async') in ('1', 'true'):
+        return jsonify(job.snapshot()), 202
 
-        elif filename.lower().endswith('.pdf'):
-            try:
-                import PyPDF2, io
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(raw))
-                content = "".join(page.extract_text() or '' for page in pdf_reader.pages)
-            except ImportError:
-                return jsonify({'error': 'PyPDF2 is required to read .pdf files'}), 500
+    job.wait()
+    if job.state != 'done':
+        return jsonify({'error': job.error or 'Could not read document content'}), 500
+    return jsonify(_document_job_result(job))
 
-        else:
-            return jsonify({'error': f'Unsupported file type: {filename}'}), 400
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+def _document_job_result(job):
+    """Final /parse_document payload — the text is stored once by hash so the
+    client sends a reference line in the chat turn instead of the full text
+    (see attachment_store.py)."""
+    content = job.text or ''
+    try:
+        sha256 = attachment_store.put(content)
+    except OSError as e:
+        print(f"⚠️ Attachment store write failed for {job.filename}: {e} — sending inline")
+        sha256 = None
+    return {'filename': job.filename, 'content': content, 'sha256': sha256, 'chars': len(content)}
+
+
+@app.route('/document_jobs/<job_id>', methods=['GET'])
+def document_job_status(job_id):
+    job = document_extractor.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown extraction job'}), 404
+    data = job.snapshot()
+    if job.state == 'done' and request.args.get('content') in ('1', 'true'):
+        data.update(_document_job_result(job))
+    return jsonify(data)
+
+
+@app.route('/document_jobs/<job_id>/events', methods=['GET'])
+def document_job_events(job_id):
+    """SSE progress for an extraction job; the stream ends when the job does."""
+    job = document_extractor.job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown extraction job'}), 404
+
+    def generate():
+        for snapshot in job.events():
+            yield f"data: {json.dumps(snapshot)}\n\n"
+
+    return Response(stream_with_context(generate()),
+                    content_type="text/event-stream; charset=utf-8",
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-    if content is None:
-        return jsonify({'error': 'Could not read document content'}), 500
 
-    return jsonify({'filename': filename, 'content': content})
+@app.route('/attachments/<sha256>', methods=['GET'])
+def get_attachment(sha256):
+    """Full text of a stored attachment (document viewer for reference bodies)."""
+    text = attachment_store.get(sha256)
+    if text is None:
+        return jsonify({'error': 'Attachment not found'}), 404
+    return Response(text, mimetype='text/plain; charset=utf-8',
+                    headers={'Cache-Control': 'private, max-age=31536000, immutable'})
 
 
 # --------------------------------------------------
@@ -815,9 +784,14 @@ if not os.path.exists('settings.json'):
 with open('settings.json', 'r') as f:
     settings = json.load(f)
     _llama_port = settings.get('llama_args', {}).get('port', 8080)
+    # API_URL is the llama-server HWUI launches and manages itself. Inference
+    # goes through backend_pool, which is that same server unless
+    # llama_backends lists several (see backend_pool.py).
     API_URL = f'http://127.0.0.1:{_llama_port}'
     FLASK_PORT = int(settings.get('port', 8081))
     print(f"🔌 API_URL set to: {API_URL}")
+    if settings.get('llama_backends'):
+        print(f"🔀 Backend pool: {', '.join(b.url for b in backend_pool.backends())}")
     # `parallel > 1` enables concurrent slot scheduling in llama-server. HWUI's
     # /chat path uses a global `abort_generation` flag and a single in-flight
     # counter that aren't safe under concurrent requests sharing one server
@@ -863,6 +837,7 @@ try:
 except Exception as _caee:
     print(f"⚠️ Startup cloud/backend reset failed: {_caee!r}", flush=True)
 
+@perf_trace.timed("tokenize")
 def real_token_count(text):
     """Exact BPE token count via llama-server's /tokenize endpoint.
 
@@ -876,8 +851,8 @@ def real_token_count(text):
     unreachable (llama-server not running, network blip).
     """
     try:
-        r = requests.post(
-            f"{API_URL}/tokenize",
+        r = backend_pool.post(
+            "/tokenize",
             json={"content": text},
             timeout=10,
         )
@@ -938,10 +913,14 @@ print("--------------------------------------------------\n")
 # --------------------------------------------------
 # Detect Current Model
 # --------------------------------------------------
-def get_current_model():
+def get_current_model(base_url=None):
+    """Refresh CURRENT_MODEL from /v1/models — on `base_url` if given, else via the backend pool."""
     global CURRENT_MODEL
     try:
-        r = requests.get(f"{API_URL}/v1/models", timeout=5)
+        if base_url:
+            r = requests.get(f"{base_url}/v1/models", timeout=5)
+        else:
+            r = backend_pool.get("/v1/models", timeout=5)
         r.raise_for_status()
         data = r.json()
         if data.get("data"):
@@ -957,11 +936,11 @@ def get_current_model():
 
 def _proxy_llama_v1_response(method, path, *, json_payload=None, stream=False):
     """Expose HWUI's managed llama.cpp server through OpenAI-compatible /v1 routes."""
-    upstream_url = f"{API_URL}{path}"
+    upstream_url = f"{backend_pool.primary_url}{path}"
     try:
-        upstream = requests.request(
+        upstream = backend_pool.open(
             method,
-            upstream_url,
+            path,
             json=json_payload,
             stream=stream,
             timeout=(10, None if stream else 600),
@@ -1024,12 +1003,95 @@ def openai_compat_chat_completions():
     )
 
 
+# ── llama.cpp startup state ───────────────────────────────────────────────
+# auto_launch_llama() runs on a background thread so Flask can serve the UI
+# immediately; /health reports where it has got to. States:
+#   pending → checking → ready                       (server already running)
+#   pending → checking → launching → ready | not_responding | exited
+#   pending → checking → skipped | failed
+LLAMA_READY_TIMEOUT = 120   # seconds to wait for a freshly launched server
+_LLAMA_STARTUP = {"state": "pending", "detail": "", "model": None, "started_at": None, "ready_at": None}
+
+
+def _set_llama_startup(state, detail="", **extra):
+    _LLAMA_STARTUP.update(state=state, detail=detail, **extra)
+
+
+# ctx the managed/attached llama-server is actually running with. Set at
+# launch (or read from /props when attaching to a running server) so request
+# budgeting never works from a raw "auto"/0 setting or a stale value.
+_LLAMA_CTX = {"ctx_size": None, "source": None}
+
+
+def _set_llama_ctx(ctx_size, source):
+    _LLAMA_CTX.update(ctx_size=ctx_size, source=source)
+    truncation.set_effective_ctx_size(ctx_size)
+
+
+def _launch_ctx_size(model_path, args):
+    """--ctx-size for a launch: an explicit llama_args.ctx_size is used as-is
+    (with a warning above the model's training context); 0/"auto" picks the
+    training context capped at 16384. The result is recorded as the effective ctx."""
+    entry = model_catalog.get(model_path)
+    ctx = recommended_ctx_size(entry, args.get("ctx_size", 16384))
+    trained = (entry or {}).get("n_ctx_train")
+    requested = args.get("ctx_size")
+    if requested is not None and str(ctx) != str(requested):
+        # 0 / "auto" resolved from the catalog — the one case the value changes.
+        print(f"📏 ctx_size {requested} → {ctx}" + (f" (model trained for {trained})" if trained else ""))
+    elif trained and ctx > trained:
+        print(f"⚠️ ctx_size {ctx} is above the model's training context ({trained}) — "
+              f"fine with RoPE scaling, otherwise expect degraded output past {trained} tokens")
+    _set_llama_ctx(ctx, "launch")
+    return ctx
+
+
+def _probe_server_ctx(api_url=None):
+    """Record the ctx of an already-running llama-server from /props
+    (per-slot n_ctx × total_slots). Best-effort; returns the value or None."""
+    try:
+        r = requests.get(f"{api_url or API_URL}/props", timeout=3)
+        props = r.json() if r.ok else {}
+        slot_ctx = int((props.get("default_generation_settings") or {}).get("n_ctx") or 0)
+        slots = max(1, int(props.get("total_slots") or 1))
+    except Exception:
+        return None
+    if slot_ctx <= 0:
+        return None
+    _set_llama_ctx(slot_ctx * slots, "props")
+    return _LLAMA_CTX["ctx_size"]
+
+
+def effective_ctx_size(settings=None):
+    """ctx_size to budget a request against: what llama-server was launched
+    with when known, else llama_args.ctx_size resolved the way a launch would
+    (0/"auto" → the last model's training context capped at 16384)."""
+    if _LLAMA_CTX["ctx_size"]:
+        return _LLAMA_CTX["ctx_size"]
+    settings = settings or {}
+    args = settings.get("llama_args", {}) or {}
+    entry = None
+    try:
+        explicit = int(args.get("ctx_size", 16384)) > 0
+    except (TypeError, ValueError):
+        explicit = False
+    if not explicit and settings.get("llama_models_dir") and settings.get("llama_last_model"):
+        entry = model_catalog.get(os.path.join(settings["llama_models_dir"], settings["llama_last_model"]),
+                                  parse=False)
+    return recommended_ctx_size(entry, args.get("ctx_size", 16384))
+
+
 def auto_launch_llama():
     """On startup, try to connect to existing llama.cpp — if not running, launch last used model."""
     global llama_process
-    get_current_model()
+    _set_llama_startup("checking", started_at=time.time())
+    # Only the managed server counts here — a pool backend elsewhere being up
+    # doesn't mean the local one HWUI is responsible for is running.
+    get_current_model(API_URL)
     if CURRENT_MODEL:
         print(f"✅ llama.cpp already running with: {CURRENT_MODEL}")
+        _probe_server_ctx()
+        _set_llama_startup("ready", "already running", model=CURRENT_MODEL, ready_at=time.time())
         return
     try:
         with open('settings.json', 'r') as f:
@@ -1042,21 +1104,25 @@ def auto_launch_llama():
         lora_path = s.get('lora_path', '')
         if not last_model or not exe or not models_dir:
             print("⚠️ No last model or llama config set — skipping auto-launch. Set paths in config page.")
+            _set_llama_startup("skipped", "⚠️ No last model or llama config set — skipping auto-launch. Set paths in config page.")
             return
         model_path = os.path.join(models_dir, last_model)
         if not os.path.isfile(model_path):
             print(f"⚠️ Last model not found at {model_path} — skipping auto-launch.")
+            _set_llama_startup("skipped", f"⚠️ Last model not found at {model_path} — skipping auto-launch.")
             return
         if not os.path.isfile(exe):
             print(f"⚠️ llama-server.exe not found at {exe} — skipping auto-launch.")
+            _set_llama_startup("skipped", f"⚠️ llama-server.exe not found at {exe} — skipping auto-launch.")
             return
         print(f"🚀 Auto-launching llama.cpp with: {last_model}")
+        model_prestager.set_active_model(model_path)
         _startup_template = str(args.get("chat_template", "chatml")).strip().lower()
         cmd = [
             exe, "-m", model_path,
             "--port", str(args.get("port", 8080)),
             "--n-gpu-layers", str(args.get("n_gpu_layers", 44)),
-            "--ctx-size", str(args.get("ctx_size", 16384)),
+            "--ctx-size", str(_launch_ctx_size(model_path, args)),
             "--cache-type-k", str(args.get("cache_type_k", "q8_0")),
             "--cache-type-v", str(args.get("cache_type_v", "q8_0")),
             "--timeout", str(args.get("timeout", 0)),
@@ -1090,21 +1156,47 @@ def auto_launch_llama():
             creationflags=(subprocess.CREATE_NEW_CONSOLE if show_console else subprocess.CREATE_NO_WINDOW) if os.name == 'nt' else 0
         )
         print(f"✅ llama.cpp launched (PID {llama_process.pid}) — waiting for ready...")
-        for _ in range(30):
+        _set_llama_startup("launching", last_model, model=last_model)
+        for _ in range(LLAMA_READY_TIMEOUT):
             time.sleep(1)
+            if llama_process.poll() is not None:
+                print(f"❌ llama.cpp exited during startup (code {llama_process.returncode})")
+                _set_llama_startup("exited", f"exit code {llama_process.returncode}")
+                return
             try:
                 r = requests.get(f"{API_URL}/v1/models", timeout=2)
                 if r.status_code == 200:
                     get_current_model()
                     print(f"✅ llama.cpp ready: {CURRENT_MODEL}")
+                    _set_llama_startup("ready", "launched", model=CURRENT_MODEL, ready_at=time.time())
                     return
             except Exception:
                 pass
-        print("⚠️ llama.cpp launched but not responding after 30s")
+        print(f"⚠️ llama.cpp launched but not responding after {LLAMA_READY_TIMEOUT}s")
+        _set_llama_startup("not_responding", f"no response after {LLAMA_READY_TIMEOUT}s")
     except Exception as e:
         print(f"❌ Auto-launch failed: {e}")
+        _set_llama_startup("failed", str(e))
+
+
+@app.route("/backends", methods=["GET"])
+def backends_status():
+    """Backend pool view: health, slot load, in-flight requests per llama-server."""
+    return jsonify(backend_pool.status())
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Readiness probe: Flask is up; `ready` says whether llama.cpp can take a chat."""
+    state = dict(_LLAMA_STARTUP)
+    return jsonify({
+        "status": "ok",
+        "ready": state["state"] == "ready" and bool(CURRENT_MODEL),
+        "llama": state,
+        "uptime_s": round(time.perf_counter() - _STARTUP_T0, 1),
+        "startup_ms": dict(_STARTUP_PHASES),
+    })
 
-auto_launch_llama()
 
 # --------------------------------------------------
 # Prompt Builder Helper
@@ -1237,15 +1329,15 @@ def strip_chatml_leakage(text):
     _before = text
     text = re.sub(r">(?:user|assistant|system)(?:\n|:)", "\n", text, flags=re.IGNORECASE)
     if text != _before:
-        print(f"\u2702\ufe0f [strip_chatml] FIRED: >role pattern. Was: {repr(_before[-80:])}", flush=True)
+        hwui_log.stream.info("\u2702\ufe0f [strip_chatml] FIRED: >role pattern. Was: %r", _before[-80:])
     _before = text
     text = re.sub(r"\n(?:user|assistant|system)(?:\n|:)", "\n", text, flags=re.IGNORECASE)
     if text != _before:
-        print(f"\u2702\ufe0f [strip_chatml] FIRED: \\nrole pattern. Was: {repr(_before[-80:])}", flush=True)
+        hwui_log.stream.info("\u2702\ufe0f [strip_chatml] FIRED: \\nrole pattern. Was: %r", _before[-80:])
     _before = text
     text = re.sub(r"^(?:user|assistant|system)(?:\n|:)", "", text, flags=re.IGNORECASE)
     if text != _before:
-        print(f"\u2702\ufe0f [strip_chatml] FIRED: ^role pattern. Was: {repr(_before[:80])}", flush=True)
+        hwui_log.stream.info("\u2702\ufe0f [strip_chatml] FIRED: ^role pattern. Was: %r", _before[:80])
     # Strip example dialogue REMINDER block (handles single-chunk / non-streaming case)
     # Full block: \u2550\u2550\u2550 separator + \u26a0\ufe0f REMINDER lines + closing \u2550\u2550\u2550 separator
     text = re.sub(r'\u2550{3,}[^\n]*\n?\u26a0\ufe0f\s*REMINDER:[\s\S]*?\u2550{3,}[^\n]*\n?', '', text)
@@ -1259,7 +1351,8 @@ def strip_chatml_leakage(text):
     text = re.sub(r'(?m)^[ \t]*\u2550{3,}[ \t]*(?:\r?\n|$)', '', text)
     # Log if chunk was significantly shortened
     if len(original) > 10 and len(text) < len(original) * 0.5:
-        print(f"\u26a0\ufe0f [strip_chatml] Chunk shrank >50%: {len(original)}\u2192{len(text)} chars. End was: {repr(original[-60:])}", flush=True)
+        hwui_log.stream.warning("\u26a0\ufe0f [strip_chatml] Chunk shrank >50%%: %d\u2192%d chars. End was: %r",
+                                len(original), len(text), original[-60:])
     return text
 
 
@@ -1479,6 +1572,7 @@ def _detect_freshness(query):
     return None
 
 
+@perf_trace.timed("search_intent_gate")
 def _search_intent_gate(user_msg):
     """Model-judged web-search gate for AMBIGUOUS messages.
 
@@ -1498,8 +1592,8 @@ def _search_intent_gate(user_msg):
     so a missed gate should suppress rather than search.
     """
     try:
-        r = requests.post(
-            f"{API_URL}/v1/chat/completions",
+        r = backend_pool.post(
+            "/v1/chat/completions",
             json={
                 "messages": [
                     {"role": "system", "content":
@@ -1742,19 +1836,25 @@ def get_brave_api_key():
 # module — chat()/continue still call them directly.
 
 
+@perf_trace.timed("web_search")
 def do_search(query):
     """
     Main search dispatcher.
     Uses Brave if API key is configured, falls back to DDG Instant Answer.
     """
     brave_key = get_brave_api_key()
+    _t0 = time.perf_counter()
     if brave_key:
         print(f"🔍 Using Brave Search for: {query}", flush=True)
-        return do_brave_search(query, brave_key)
+        provider, res = "brave", do_brave_search(query, brave_key)
     else:
         print("⚠️ No Brave API key configured — falling back to DDG Instant Answer (limited results). Set brave_api_key in settings.json.", flush=True)
         print(f"🔍 Using DDG (no Brave key configured) for: {query}", flush=True)
-        return do_web_search(query)
+        provider, res = "ddg", do_web_search(query)
+    _found = bool(res and (res.get("pages") or res.get("results") or res.get("summary")))
+    gen_metrics.web_search_seconds.observe(time.perf_counter() - _t0, provider=provider,
+                                           outcome="results" if _found else "empty")
+    return res
 
 
 def format_search_results(query, res):
@@ -1935,6 +2035,7 @@ _CHAT_SEARCH_VERB_RE = re.compile(rf'\b{_CHAT_SEARCH_VERBS}\b', re.IGNORECASE)
 _RECALL_PHRASE_RE    = re.compile(rf'\b{_RECALL_PHRASES}\b',    re.IGNORECASE)
 
 
+@perf_trace.timed("chat_search_intent")
 def _classify_chat_search_intent(user_msg):
     """Decide whether to run cross-chat search on a user message.
 
@@ -2234,6 +2335,7 @@ def _kw_match(kw, text_lower):
     return re.search(r"\b" + re.escape(kw) + r"\b", text_lower) is not None
 
 
+@perf_trace.timed("chat_search")
 def do_chat_search(query, current_filename=None):
     """
     Search all chat .txt files for content matching the query keywords.
@@ -2387,20 +2489,34 @@ def do_chat_search(query, current_filename=None):
     return "\n".join(lines_out), None
 
 
-def stream_model_response(payload):
+def stream_model_response(payload, affinity=None, token_stats=None, reset_abort=True):
+    """Stream /completion tokens. `affinity` (the chat filename) keeps a chat on
+    the backend that already holds its prompt cache.
+
+    Concurrent streams (N-best candidates) pass their own `token_stats` dict
+    instead of writing _LAST_TOKEN_STATS, and reset_abort=False so a candidate
+    that starts late can't clear a Stop meant for all of them."""
     global abort_generation
-    abort_generation = False  # Reset flag at start
+    if reset_abort:
+        abort_generation = False  # Reset flag at start
+    if token_stats is None:
+        token_stats = _LAST_TOKEN_STATS
+    prefix_prewarmer.cancel()  # a speculative prefill must never delay a real reply
 
     if app.debug:
         print("\n🧩 FULL PAYLOAD SENDING TO MODEL:", flush=True)
         print(json.dumps(payload, indent=2), flush=True)
-    response = requests.post(
-        f"{API_URL}/completion",
+    _perf_llm = perf_trace.stream_timer("llm")
+    _gen_t0, _gen_ttft = time.perf_counter(), None
+    response = backend_pool.post(
+        "/completion",
+        affinity=affinity,
         json=payload,
         stream=True,
-        timeout=None
+        timeout=(10, None)
     )
-    print(f"🔗 Response status: {response.status_code}", flush=True)
+    _perf_llm.sent()
+    print(f"🔗 Response status: {response.status_code} ({response.backend.name})", flush=True)
 
     import sys
     total_chunks = 0
@@ -2422,11 +2538,13 @@ def stream_model_response(payload):
     # Pairing the id with that event's own decoded content is exact and free
     # (one event == one token in stream mode) — no /detokenize round-trip.
     _recent_tok_trail = []
+    _aborted = False
 
-    for line in response.iter_lines(chunk_size=1):
+    for line in backend_iter_lines(response, chunk_size=1):
         # Check abort flag
         if abort_generation:
             print("🛑 Generation aborted by user", flush=True)
+            _aborted = True
             response.close()  # Close the connection
             break
 
@@ -2456,9 +2574,11 @@ def stream_model_response(payload):
             total_chunks += 1
 
             if chunk:
+                _perf_llm.first_token()
+                if _gen_ttft is None:
+                    _gen_ttft = time.perf_counter() - _gen_t0
                 all_text.append(chunk)
                 yield chunk
-                sys.stdout.flush()
 
 
         except Exception as e:
@@ -2466,6 +2586,16 @@ def stream_model_response(payload):
             continue
 
     print(f"\n🎯 DONE: {total_chunks} chunks, {len(''.join(all_text))} chars total", flush=True)
+    # llama.cpp's own prefill/decode timings ride on the final event.
+    _timings = last_event.get("timings") or {}
+    _perf_llm.done(
+        backend=response.backend.name,
+        tokens_predicted=last_event.get("tokens_predicted"),
+        tokens_evaluated=last_event.get("tokens_evaluated"),
+        prompt_n=_timings.get("prompt_n"), prompt_ms=_timings.get("prompt_ms"),
+        predicted_n=_timings.get("predicted_n"), predicted_ms=_timings.get("predicted_ms"),
+        aborted=_aborted,
+    )
     # 🩺 Log llama.cpp's stop reason — load-bearing diagnostic for cutoffs.
     if last_event:
         _stop_type   = last_event.get("stop_type", None)
@@ -2508,9 +2638,9 @@ def stream_model_response(payload):
         # processed; we keep it alongside our /tokenize estimate as a
         # cross-check. Best-effort: never let monitor bookkeeping break a stream.
         try:
-            _LAST_TOKEN_STATS["last_gen"] = _tok_pred if isinstance(_tok_pred, int) else None
-            _LAST_TOKEN_STATS["last_eval"] = _tok_eval if isinstance(_tok_eval, int) else None
-            _LAST_TOKEN_STATS["stop_reason"] = _reason
+            token_stats["last_gen"] = _tok_pred if isinstance(_tok_pred, int) else None
+            token_stats["last_eval"] = _tok_eval if isinstance(_tok_eval, int) else None
+            token_stats["stop_reason"] = _reason
         except Exception:
             pass
         # ⏱️ TEMP DIAGNOSTIC (remove after EOS-cliff/Continue verification) —
@@ -2555,19 +2685,40 @@ def stream_model_response(payload):
             )
     else:
         print("🩺 STOP REASON: no metadata captured (final SSE event missing stop flags)", flush=True)
+    # 📈 Time-series metrics (gen_metrics.py) — /metrics and the monitor's history.
+    try:
+        gen_metrics.observe_generation(
+            response.backend.name, CURRENT_MODEL,
+            ttft=_gen_ttft,
+            stop_reason=gen_metrics.stop_reason_code(
+                last_event.get("stop_type"), last_event.get("stopped_eos"),
+                last_event.get("stopped_word"), last_event.get("stopped_limit"),
+                aborted=_aborted),
+            tokens_predicted=last_event.get("tokens_predicted"),
+            tokens_evaluated=last_event.get("tokens_evaluated"),
+            tokens_cached=last_event.get("tokens_cached"),
+            timings=_timings,
+            elapsed=time.perf_counter() - _gen_t0,
+        )
+    except Exception as _me:
+        print(f"⚠️ Generation metrics not recorded: {_me!r}", flush=True)
 
 # --------------------------------------------------
 # Stream vision/multimodal model response
 # Uses /v1/chat/completions (OpenAI-compatible)
 # --------------------------------------------------
-def stream_vision_response(payload):
+def stream_vision_response(payload, affinity=None):
     global abort_generation
     abort_generation = False
+    prefix_prewarmer.cancel()
 
     print("\n🖼️ Sending vision request to model server…", flush=True)
+    _perf_llm = perf_trace.stream_timer("llm")
+    _gen_t0, _gen_ttft = time.perf_counter(), None
     try:
-        response = requests.post(
-            f"{API_URL}/v1/chat/completions",
+        response = backend_pool.post(
+            "/v1/chat/completions",
+            affinity=affinity,
             json=payload,
             stream=True,
             timeout=(15, None),
@@ -2579,6 +2730,7 @@ def stream_vision_response(payload):
         yield f"⚠️ Could not reach the vision model server: {e}"
         return
 
+    _perf_llm.sent()
     print(f"🔗 Vision response status: {response.status_code}", flush=True)
     if response.status_code != 200:
         # Non-200: previously the error body was fed line-by-line into the JSON
@@ -2598,8 +2750,10 @@ def stream_vision_response(payload):
 
     total_chunks = 0
     all_text = []
+    _timings = {}
+    _finish_reason = None
 
-    for line in response.iter_lines(chunk_size=1):
+    for line in backend_iter_lines(response, chunk_size=1):
         if abort_generation:
             print("🛑 Vision generation aborted by user", flush=True)
             response.close()
@@ -2616,21 +2770,47 @@ def stream_vision_response(payload):
                 break
 
             j = json.loads(line_str)
+            if j.get("timings"):
+                _timings = j["timings"]
             # /v1/chat/completions uses choices[0].delta.content
-            delta = j.get("choices", [{}])[0].get("delta", {})
+            _choice = (j.get("choices") or [{}])[0]
+            _finish_reason = _choice.get("finish_reason") or _finish_reason
+            delta = _choice.get("delta", {})
             chunk = strip_chatml_leakage(delta.get("content") or "")
             total_chunks += 1
 
             if chunk:
+                _perf_llm.first_token()
+                if _gen_ttft is None:
+                    _gen_ttft = time.perf_counter() - _gen_t0
                 all_text.append(chunk)
                 yield chunk
-                sys.stdout.flush()
 
         except Exception as e:
             print(f"❌ Vision parse error: {e}", flush=True)
             continue
 
     print(f"\n🎯 VISION DONE: {total_chunks} chunks, {len(''.join(all_text))} chars total", flush=True)
+    _perf_llm.done(
+        backend=response.backend.name, chunks=total_chunks,
+        prompt_n=_timings.get("prompt_n"), prompt_ms=_timings.get("prompt_ms"),
+        predicted_n=_timings.get("predicted_n"), predicted_ms=_timings.get("predicted_ms"),
+        aborted=abort_generation,
+    )
+    try:
+        gen_metrics.observe_generation(
+            response.backend.name, CURRENT_MODEL, ttft=_gen_ttft,
+            stop_reason=gen_metrics.stop_reason_code(
+                "eos" if _finish_reason == "stop" else "limit" if _finish_reason == "length" else None,
+                aborted=abort_generation),
+            tokens_predicted=_timings.get("predicted_n"),
+            tokens_evaluated=(_timings.get("prompt_n") or 0) + (_timings.get("cache_n") or 0) or None,
+            tokens_cached=_timings.get("cache_n"),
+            timings=_timings,
+            elapsed=time.perf_counter() - _gen_t0,
+        )
+    except Exception as _me:
+        print(f"⚠️ Generation metrics not recorded: {_me!r}", flush=True)
 
 # --------------------------------------------------
 # Stream OpenAI API response (cloud backend)
@@ -2663,6 +2843,8 @@ def stream_openai_response(messages, api_key, model, temperature, max_tokens, to
         payload["presence_penalty"] = presence_penalty
     _base_url = get_openai_base_url()
     print(f"☁️ OpenAI stream: base={_base_url} model={model}, msgs={len(messages)}", flush=True)
+    _perf_llm = perf_trace.stream_timer("cloud")
+    _gen_t0, _gen_ttft, _finish_reason = time.perf_counter(), None, None
     response = requests.post(
         f"{_base_url}/chat/completions",
         headers=headers,
@@ -2670,6 +2852,7 @@ def stream_openai_response(messages, api_key, model, temperature, max_tokens, to
         stream=True,
         timeout=None,
     )
+    _perf_llm.sent()
     print(f"🔗 OpenAI response status: {response.status_code}", flush=True)
     if response.status_code != 200:
         err = response.text[:300]
@@ -2693,18 +2876,33 @@ def stream_openai_response(messages, api_key, model, temperature, max_tokens, to
             if line_str == "[DONE]":
                 break
             j = json.loads(line_str)
-            delta = j.get("choices", [{}])[0].get("delta", {})
+            _choice = (j.get("choices") or [{}])[0]
+            _finish_reason = _choice.get("finish_reason") or _finish_reason
+            delta = _choice.get("delta", {})
             chunk = delta.get("content") or ""
             total_chunks += 1
             if chunk:
+                _perf_llm.first_token()
+                if _gen_ttft is None:
+                    _gen_ttft = time.perf_counter() - _gen_t0
                 all_text.append(chunk)
                 yield chunk
-                sys.stdout.flush()
         except Exception as e:
             print(f"❌ OpenAI parse error: {e}", flush=True)
             continue
 
     print(f"\n☁️ OpenAI DONE: {total_chunks} chunks, {len(''.join(all_text))} chars total", flush=True)
+    _perf_llm.done(provider="openai", model=model, chunks=total_chunks, aborted=abort_generation)
+    try:
+        gen_metrics.observe_generation(
+            "openai", model, ttft=_gen_ttft,
+            stop_reason=gen_metrics.stop_reason_code(
+                "eos" if _finish_reason == "stop" else "limit" if _finish_reason == "length" else None,
+                aborted=abort_generation),
+            elapsed=time.perf_counter() - _gen_t0,
+        )
+    except Exception as _me:
+        print(f"⚠️ Generation metrics not recorded: {_me!r}", flush=True)
 
 
 def _rebuild_search_user_turn(original_content, augmented_text):
@@ -3268,6 +3466,8 @@ def stream_anthropic_response(messages, api_key, model, temperature, max_tokens,
 
     _sent = [k for k in ("temperature", "top_p", "top_k") if k in payload]
     print(f"☁️ Anthropic stream: base={_base_url} model={model}, msgs={len(messages)}, sampling={_sent}", flush=True)
+    _perf_llm = perf_trace.stream_timer("cloud")
+    _gen_t0, _gen_ttft, _ant_stop = time.perf_counter(), None, None
     response = _anthropic_post(payload)
 
     # ── Layer 2: retry-on-deprecation safety net ───────────────────────────
@@ -3286,6 +3486,7 @@ def stream_anthropic_response(messages, api_key, model, temperature, max_tokens,
             payload.pop(_bad, None)
             response = _anthropic_post(payload)
 
+    _perf_llm.sent()
     print(f"🔗 Anthropic response status: {response.status_code}", flush=True)
     if response.status_code != 200:
         err = response.text[:300]
@@ -3348,6 +3549,7 @@ def stream_anthropic_response(messages, api_key, model, temperature, max_tokens,
                 usage = evt.get("usage") or {}
                 if "output_tokens" in usage:
                     _ant_cache_usage["output_tokens"] = usage.get("output_tokens")
+                _ant_stop = (evt.get("delta") or {}).get("stop_reason") or _ant_stop
             elif etype == "content_block_delta":
                 delta = evt.get("delta", {}) or {}
                 dtype = delta.get("type")
@@ -3356,12 +3558,14 @@ def stream_anthropic_response(messages, api_key, model, temperature, max_tokens,
                 if dtype == "thinking_delta":
                     _t = delta.get("thinking") or ""
                     if _t:
+                        _perf_llm.first_token()
+                        if _gen_ttft is None:
+                            _gen_ttft = time.perf_counter() - _gen_t0
                         if not _think_streaming:
                             _think_streaming = True
                             yield THINK_OPEN
                         _think_chars += len(_t)
                         yield _t
-                        sys.stdout.flush()
                     continue
                 # The thinking-block signature is verification metadata, not text
                 # — never displayed (we don't replay thinking on later turns).
@@ -3376,9 +3580,11 @@ def stream_anthropic_response(messages, api_key, model, temperature, max_tokens,
                     yield THINK_CLOSE
                 total_chunks += 1
                 if chunk:
+                    _perf_llm.first_token()
+                    if _gen_ttft is None:
+                        _gen_ttft = time.perf_counter() - _gen_t0
                     all_text.append(chunk)
                     yield chunk
-                    sys.stdout.flush()
             elif etype == "message_stop":
                 if _think_streaming:
                     _think_streaming = False
@@ -3404,6 +3610,29 @@ def stream_anthropic_response(messages, api_key, model, temperature, max_tokens,
     _log_anthropic_cache_usage()
     print(f"\n☁️ Anthropic DONE: {total_chunks} deltas, {len(''.join(all_text))} chars total"
           f"{f', {_think_chars} thinking chars' if _think_chars else ''}", flush=True)
+    _perf_llm.done(
+        provider="anthropic", model=model, chunks=total_chunks, thinking_chars=_think_chars,
+        input_tokens=_ant_cache_usage["input_tokens"], output_tokens=_ant_cache_usage["output_tokens"],
+        cache_read_input_tokens=_ant_cache_usage["cache_read_input_tokens"],
+        aborted=abort_generation,
+    )
+    try:
+        _ant_int = lambda k: _ant_cache_usage[k] if isinstance(_ant_cache_usage[k], int) else None
+        _ant_in = _ant_int("input_tokens")
+        _ant_cached = _ant_int("cache_read_input_tokens")
+        gen_metrics.observe_generation(
+            "anthropic", model, ttft=_gen_ttft,
+            stop_reason=gen_metrics.stop_reason_code(
+                {"end_turn": "eos", "stop_sequence": "word", "max_tokens": "limit"}.get(_ant_stop),
+                aborted=abort_generation),
+            tokens_predicted=_ant_int("output_tokens"),
+            # input_tokens excludes cache reads/writes — the prompt is all three.
+            tokens_evaluated=(_ant_in or 0) + (_ant_cached or 0) + (_ant_int("cache_creation_input_tokens") or 0) or None,
+            tokens_cached=_ant_cached,
+            elapsed=time.perf_counter() - _gen_t0,
+        )
+    except Exception as _me:
+        print(f"⚠️ Generation metrics not recorded: {_me!r}", flush=True)
 
 
 # --------------------------------------------------
@@ -3710,6 +3939,23 @@ _chat_inflight_lock = _hwui_threading.Lock()
 _chat_inflight_count = 0
 _chat_request_seq = 0
 
+def _finish_perf_trace(trace=None):
+    _perf = perf_trace.finish(trace)
+    if _perf and _perf["kind"] != "prewarm" and hwui_log.perf.isEnabledFor(logging.INFO):
+        hwui_log.perf.info(f"⏱️ {_perf['kind']} turn {_perf['total_ms']:.0f} ms — "
+                           + ", ".join(f"{k} {v['total_ms']:.0f}" for k, v in _perf["totals"].items()))
+
+@app.after_request
+def _perf_trace_after_request(response):
+    """Publish the request's perf trace (perf_trace.py) once the response body
+    has been sent. call_on_close fires after a streamed reply is exhausted or
+    the client disconnects — teardown_request can run before the stream
+    starts, which would cut the llm spans off the trace."""
+    _trace = perf_trace.current()
+    if _trace is not None:
+        response.call_on_close(lambda: _finish_perf_trace(_trace))
+    return response
+
 @app.teardown_request
 def _chat_inflight_teardown(_exc=None):
     """Decrement the /chat in-flight counter after the request is fully done.
@@ -3720,6 +3966,8 @@ def _chat_inflight_teardown(_exc=None):
     Uses `g.pop()` to be idempotent: Flask debug mode auto-reloads the module
     on file save, which can re-register this teardown so it fires twice per
     request. Without pop, the counter would go negative."""
+    if _exc is not None:
+        _finish_perf_trace()  # after_request was skipped — don't leak the trace
     try:
         rid = _hwui_g.pop("_chat_my_req_id", None)
     except Exception:
@@ -3799,6 +4047,7 @@ def append_character_memory():
         print(f"❌ append_character_memory error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@perf_trace.timed("retrieve_memory")
 def _retrieve_memory(char_data, character_name, user_input, project_rp_mode, _diag_verbose):
     """Select & format relevant memory blocks for the prompt. Extracted from chat() (phase 1)."""
     def load_character_memory(character_name):
@@ -3931,6 +4180,7 @@ def _retrieve_memory(char_data, character_name, user_input, project_rp_mode, _di
     return memory
 
 
+@perf_trace.timed("load_chat")
 def _load_chat_from_disk(active_chat, data, user_name, user_display_name, character_name):
     if not active_chat:
         current_chat_filename = data.get("current_chat_filename", "")
@@ -3982,8 +4232,9 @@ def _rewrite_inline_attachments_for_model(active_chat):
     """Return a request-local copy with inline attachment markers rewritten.
 
     The browser and saved chat files keep compact [ATTACHED DOCUMENT] blocks for
-    display/persistence. Model providers should see clearer reference sections
-    instead, with the newest turn's typed user message placed last.
+    display/persistence — usually holding only an attachment_store reference.
+    Model providers should see clearer reference sections with the document
+    text expanded, with the newest turn's typed user message placed last.
     """
     rewritten = []
     last_idx = len(active_chat) - 1
@@ -4017,6 +4268,8 @@ def _rewrite_inline_attachments_for_model(active_chat):
         typed_text = _INLINE_ATTACHED_DOC_RE.sub("", text_content).strip()
         sections = []
         for doc_name, doc_text in doc_blocks:
+            # Saved chats carry a hash reference; this is where it is expanded.
+            doc_text = attachment_store.load_body(doc_text)
             is_transcript = (
                 "transcript" in (doc_name or "").lower()
                 or bool(re.search(
@@ -4102,7 +4355,12 @@ def _rewrite_inline_attachments_for_model(active_chat):
     return rewritten
 
 
-def _build_system_text(char_data, _char_label, _user_label, user_display_name, user_bio, active_chat, character_name, system_prompt, instruction, tone_primer, project_documents):
+@perf_trace.timed("build_system_text")
+def _build_system_text(char_data, _char_label, _user_label, user_display_name, user_bio, active_chat, character_name, system_prompt, instruction, tone_primer, project_documents, char_version=None):
+    """Assemble the system block. The card fields, user context and core layer
+    are static between edits and come from prompt_segments (keyed by
+    char_version, the settings.json version and the labels); only the session
+    summaries and documents are rendered per turn."""
     char_context = ""
 
     # 🧠 Holds ONLY the most-recent saved session summary. It is NOT placed in
@@ -4131,35 +4389,43 @@ def _build_system_text(char_data, _char_label, _user_label, user_display_name, u
             return text.strip()
 
         # Build character context from JSON fields
-        parts = []
+        def _render_card():
+            card_parts = []
+            if char_data.get("name"):
+                card_parts.append(f"Character Name: {char_data['name']}")
+            if char_data.get("description"):
+                card_parts.append(f"Description: {substitute_placeholders(strip_chatml(char_data['description']), _char_label, _user_label)}")
+            if char_data.get("scenario"):
+                card_parts.append(f"Scenario: {substitute_placeholders(strip_chatml(char_data['scenario']), _char_label, _user_label)}")
+
+            # 📍 CURRENT SITUATION — semi-global, opt-in per character
+            if char_data.get("use_current_situation"):
+                try:
+                    with open("settings.json", "r", encoding="utf-8") as _sf:
+                        _s = json.load(_sf)
+                    _situation = _s.get("current_situation", "").strip()
+                except Exception:
+                    _situation = ""
+                if _situation:
+                    card_parts.append(
+                        f"═══════════════════════════════════════════════════════════\n"
+                        f"WHAT YOU CURRENTLY KNOW ABOUT {user_display_name.upper() if user_display_name else 'THE USER'}\n"
+                        f"(This is your own awareness — do not say you were told this, just know it)\n"
+                        f"═══════════════════════════════════════════════════════════\n"
+                        f"{strip_chatml(_situation)}\n"
+                        f"═══════════════════════════════════════════════════════════"
+                    )
 
-        if char_data.get("name"):
-            parts.append(f"Character Name: {char_data['name']}")
-        if char_data.get("description"):
-            parts.append(f"Description: {substitute_placeholders(strip_chatml(char_data['description']), _char_label, _user_label)}")
-        if char_data.get("scenario"):
-            parts.append(f"Scenario: {substitute_placeholders(strip_chatml(char_data['scenario']), _char_label, _user_label)}")
+            if char_data.get("main_prompt"):
+                card_parts.append(substitute_placeholders(strip_chatml(char_data["main_prompt"]), _char_label, _user_label))
+            return "\n\n".join(card_parts)
 
-        # 📍 CURRENT SITUATION — semi-global, opt-in per character
-        if char_data.get("use_current_situation"):
-            try:
-                with open("settings.json", "r", encoding="utf-8") as _sf:
-                    _s = json.load(_sf)
-                _situation = _s.get("current_situation", "").strip()
-            except Exception:
-                _situation = ""
-            if _situation:
-                parts.append(
-                    f"═══════════════════════════════════════════════════════════\n"
-                    f"WHAT YOU CURRENTLY KNOW ABOUT {user_display_name.upper() if user_display_name else 'THE USER'}\n"
-                    f"(This is your own awareness — do not say you were told this, just know it)\n"
-                    f"═══════════════════════════════════════════════════════════\n"
-                    f"{strip_chatml(_situation)}\n"
-                    f"═══════════════════════════════════════════════════════════"
-                )
-
-        if char_data.get("main_prompt"):
-            parts.append(substitute_placeholders(strip_chatml(char_data["main_prompt"]), _char_label, _user_label))
+        _card_key = None
+        if char_version is not None:
+            _card_key = (char_version, settings_version(), _char_label, _user_label, user_display_name)
+        _card_segment = prompt_segments.segment("card", _card_key, _render_card)
+        parts = [_card_segment.text] if _card_segment.text else []
+        _dynamic_parts = []
 
         # post_history is no longer added to the system block — it moved to the
         # [REPLY INSTRUCTIONS] depth-0 packet (folded into the last user turn)
@@ -4241,7 +4507,7 @@ def _build_system_text(char_data, _char_label, _user_label, user_display_name, u
                 # Older summaries joined with the same SESSION_DIVIDER as before.
                 # Framing/wrapping below is unchanged from the prior task.
                 _older_summaries = SESSION_DIVIDER.join(t for _, t in _cold_sessions)
-                parts.append(
+                _dynamic_parts.append(
                     f"\n═══════════════════════════════════════════════════════════\n"
                     f"YOUR OWN MEMORY OF RECENT SESSIONS\n"
                     f"═══════════════════════════════════════════════════════════\n"
@@ -4261,14 +4527,13 @@ def _build_system_text(char_data, _char_label, _user_label, user_display_name, u
         # echo. They are NOT in the [REPLY INSTRUCTIONS] depth-0 packet —
         # moving them there cost ~539 tokens per turn and was reverted.
 
-        char_context = "\n\n".join(parts)
+        char_context = "\n\n".join(parts + _dynamic_parts)
 
         # 🔥 INJECT USER PERSONA CONTEXT
         # Always inject if we have a user name — bio is optional
-        user_context = ""
-        if user_display_name:
+        def _render_user_context():
             _bio_block = f"{substitute_placeholders(user_bio, _char_label, _user_label)}\n\n" if user_bio else ""
-            user_context = (
+            return (
                 f"\n\n"
                 f"═══════════════════════════════════════════════════════════\n"
                 f"USER CONTEXT - WHO YOU ARE TALKING TO\n"
@@ -4284,6 +4549,17 @@ def _build_system_text(char_data, _char_label, _user_label, user_display_name, u
                 f"END USER CONTEXT\n"
                 f"═══════════════════════════════════════════════════════════\n\n"
             )
+
+        user_context = ""
+        _user_segment = make_segment("")
+        if user_display_name:
+            # Every input is in the key, so no file version is needed here.
+            _user_segment = prompt_segments.segment(
+                "user_context",
+                (char_data.get("name", ""), user_display_name, user_bio, _char_label, _user_label),
+                _render_user_context,
+            )
+            user_context = _user_segment.text
             print(f"✅ Injected user persona context for {user_display_name} (bio: {len(user_bio)} chars)")
         else:
             print(f"⚠️ No user display name, skipping persona injection")
@@ -4292,12 +4568,14 @@ def _build_system_text(char_data, _char_label, _user_label, user_display_name, u
         # Build the system_text (WITHOUT example_dialogue yet)
         # For jinja/Gemma models: skip instruction layer and tone primer — they're Helcyon-specific
         # scaffolding that confuses capable models into treating meta-instructions as output format
-        try:
-            with open('settings.json', 'r') as _stf:
-                _sts = json.load(_stf)
-            _st_template = _sts.get('llama_args', {}).get('chat_template', 'chatml').strip().lower()
-        except Exception:
-            _st_template = 'chatml'
+        def _read_chat_template():
+            try:
+                with open('settings.json', 'r') as _stf:
+                    _sts = json.load(_stf)
+                return _sts.get('llama_args', {}).get('chat_template', 'chatml').strip().lower()
+            except Exception:
+                return 'chatml'
+        _st_template = prompt_segments.get("chat_template", settings_version(), _read_chat_template)
         _st_model = (CURRENT_MODEL or '').lower()
         _is_jinja_model = _st_template in ('jinja', 'qwen') or 'gemma' in _st_model or 'qwen' in _st_model
 
@@ -4314,9 +4592,19 @@ def _build_system_text(char_data, _char_label, _user_label, user_display_name, u
                 f"{system_prompt}\n\n{char_context}{user_context}\n\n{instruction}\n\n{tone_primer}{project_documents}"
             )
 
-        # 📊 LOG SYSTEM MESSAGE SIZE
-        from truncation import rough_token_count
-        system_tokens = rough_token_count(system_text)
+        # 📊 LOG SYSTEM MESSAGE SIZE — static segments carry cached counts;
+        # only the per-turn parts are counted here.
+        _layer_tokens = prompt_segments.get(
+            "layer_tokens", (system_prompt, instruction, tone_primer, _is_jinja_model),
+            lambda: rough_token_count(system_prompt) + (
+                0 if _is_jinja_model else rough_token_count(instruction) + rough_token_count(tone_primer)
+            ),
+        )
+        system_tokens = (
+            _layer_tokens + _card_segment.tokens + _user_segment.tokens
+            + sum(rough_token_count(p) for p in _dynamic_parts)
+            + rough_token_count(project_documents or "")
+        )
         print(f"📊 SYSTEM MESSAGE SIZE: ~{system_tokens} tokens")
         if system_tokens > 6000:
             print(f"🔴 WARNING: System message is very large! May cause context overflow.")
@@ -4343,16 +4631,19 @@ def _load_user_persona(user_name):
     user_display_name = user_name
     try:
         user_file_path = os.path.join(USERS_DIR, f"{user_name}.json")
-        if os.path.exists(user_file_path):
-            with open(user_file_path, "r", encoding="utf-8") as uf:
-                user_data = json.load(uf)
-                user_bio = user_data.get("bio", "")
-                user_display_name = user_data.get("display_name", user_name)
-                print(f"✅ Loaded user persona for {user_name}")
-                print(f"   Display name: {user_display_name}")
-                print(f"   Bio length: {len(user_bio)} chars")
-                if user_bio:
-                    print(f"   Bio preview: {user_bio[:150]}...")
+        _persona_version = file_version(user_file_path)
+        if _persona_version is not None:
+            def _read_persona():
+                with open(user_file_path, "r", encoding="utf-8") as uf:
+                    return json.load(uf)
+            user_data = prompt_segments.get("persona", (user_file_path, _persona_version), _read_persona)
+            user_bio = user_data.get("bio", "")
+            user_display_name = user_data.get("display_name", user_name)
+            print(f"✅ Loaded user persona for {user_name}")
+            print(f"   Display name: {user_display_name}")
+            print(f"   Bio length: {len(user_bio)} chars")
+            if user_bio:
+                print(f"   Bio preview: {user_bio[:150]}...")
         else:
             print(f"⚠️ User persona file not found: {user_file_path}")
     except Exception as e:
@@ -4360,8 +4651,64 @@ def _load_user_persona(user_name):
     return user_bio, user_display_name
 
 
-def _load_documents(user_input, _attached_doc_present):
-    """Load project + global documents for the prompt. Extracted from chat() (phase 1)."""
+@perf_trace.timed("load_character_card")
+def _load_character_card(char_path):
+    """Parsed character JSON, cached per file version.
+
+    Returns (char_data, char_version). char_data is a shallow copy so callers
+    may reassign fields; char_version — (path, mtime_ns, size) — keys every
+    prompt segment rendered from this card.
+    """
+    version = file_version(char_path)
+    char_version = (char_path,) + version if version else None
+
+    def _read():
+        with open(char_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return dict(prompt_segments.get("char_json", char_version, _read)), char_version
+
+
+def _resolve_example_dialogue(char_data, char_version, is_jinja_model):
+    """Example dialogue by priority: 1) character JSON example_dialogue
+    2) settings.json global_example_dialog 3) the paired .example.txt file.
+    Jinja/Gemma models skip both fallbacks — generic global examples confuse
+    capable models that don't need style scaffolding.
+
+    Returns (Segment, source) — source names where the text came from.
+    """
+    _, ex_name, _ = resolve_character_prompt_files(char_data)
+    ex_path = os.path.join(get_system_prompts_dir(), ex_name)
+
+    def _build():
+        text = char_data.get("example_dialogue", "").strip()
+        if text or is_jinja_model:
+            return make_segment(text), "character"
+        try:
+            with open("settings.json", "r", encoding="utf-8") as _sf:
+                text = json.load(_sf).get("global_example_dialog", "").strip()
+        except Exception:
+            text = ""
+        if text:
+            return make_segment(text), "global_example_dialog from settings.json"
+        try:
+            if os.path.exists(ex_path):
+                with open(ex_path, "r", encoding="utf-8") as _ef:
+                    text = _ef.read().strip()
+        except Exception:
+            text = ""
+        return make_segment(text), ex_name
+
+    key = None
+    if char_version is not None:
+        key = (char_version, bool(is_jinja_model), settings_version(), ex_path, file_version(ex_path))
+    return prompt_segments.get("example_dialogue", key, _build)
+
+
+@perf_trace.timed("load_documents")
+def _load_documents(user_input, _attached_doc_present, persist_pin=True):
+    """Load project + global documents for the prompt. Extracted from chat() (phase 1).
+    persist_pin=False (prewarm) never rewrites the project's sticky-doc pin."""
     project_instructions = ""
     project_documents = ""
     global_documents = ""
@@ -4449,7 +4796,7 @@ def _load_documents(user_input, _attached_doc_present):
                     if project_documents:
                         # Update the pinned doc to the newly loaded one
                         match = re.search(r'### Document: (.+?)\n', project_documents)
-                        if match:
+                        if match and persist_pin:
                             new_pinned = match.group(1).strip()
                             try:
                                 with open(config_path, "r", encoding="utf-8") as f:
@@ -4489,7 +4836,7 @@ def _load_documents(user_input, _attached_doc_present):
                     # Only one doc - just load it, no trigger needed
                     auto_fname = all_docs[0]
                     project_documents = load_pinned_doc_direct(active_project, auto_fname)
-                    if project_documents:
+                    if project_documents and persist_pin:
                         print(f"📌 Sticky auto-pinned single doc: {auto_fname}")
                         try:
                             with open(config_path, "r", encoding="utf-8") as f:
@@ -4505,7 +4852,7 @@ def _load_documents(user_input, _attached_doc_present):
                     if project_documents:
                         print(f"📌 Sticky mode - first trigger, loading and pinning doc")
                         match = re.search(r'### Document: (.+?)\n', project_documents)
-                        if match:
+                        if match and persist_pin:
                             pinned_filename = match.group(1).strip()
                             try:
                                 with open(config_path, "r", encoding="utf-8") as f:
@@ -4557,7 +4904,24 @@ def _load_documents(user_input, _attached_doc_present):
     return project_instructions, project_documents, global_documents, project_rp_mode, newly_pinned_doc
 
 
-def _resolve_system_layer(char_data):
+@perf_trace.timed("resolve_system_layer")
+def _resolve_system_layer(char_data, char_version=None):
+    """Cached _build_system_layer. The key covers every file it reads plus the
+    (day-precision) date in its time prefix, so a hit is byte-identical."""
+    if char_version is None:
+        return _build_system_layer(char_data)
+    _sp_name, _, _ = resolve_character_prompt_files(char_data)
+    _char_sp_path = os.path.join(get_system_prompts_dir(), _sp_name)
+    _active_sp_path = get_active_system_prompt_path()
+    key = (
+        char_version, _sp_name, file_version(_char_sp_path),
+        _active_sp_path, file_version(_active_sp_path), settings_version(),
+        datetime.now().strftime("%A, %d %B %Y"),
+    )
+    return prompt_segments.get("system_layer", key, lambda: _build_system_layer(char_data))
+
+
+def _build_system_layer(char_data):
     """Load core system layer (system prompt + instruction + tone primer), apply tone-primer suppression and character-bound system-prompt override. Extracted from chat() (phase 1)."""
     system_prompt, current_time = get_system_prompt()
     instruction = get_instruction_layer()
@@ -4603,6 +4967,208 @@ def _resolve_system_layer(char_data):
     return system_prompt, instruction, tone_primer
 
 
+# --------------------------------------------------
+# Turn snapshots — regenerate / continue reuse (see turn_snapshots.py)
+# --------------------------------------------------
+def _turn_snapshot_key(data, char_version):
+    """(chat key, fingerprint) for the conversation a /chat or /continue
+    request carries. continue_prefix is deliberately not part of it: Continue
+    resends the history of the turn it extends."""
+    chat_key = str(data.get("current_chat_filename") or "").strip() or None
+    if not chat_key:
+        return None, None
+    fp = turn_snapshot_fingerprint(
+        data.get("conversation_history") or [],
+        character=str(data.get("character") or "").strip(),
+        char_version=char_version,
+        user_name=data.get("user_name", "User"),
+        author_note=data.get("author_note", ""),
+        model=CURRENT_MODEL,
+        # The system block carries the current hour — don't serve an old one.
+        hour=time.strftime("%Y-%m-%d %H"),
+    )
+    return chat_key, fp
+
+
+def _turn_snapshot_ttl(settings):
+    try:
+        return float(settings.get("turn_snapshot_ttl_s", turn_snapshots.ttl))
+    except (TypeError, ValueError):
+        return turn_snapshots.ttl
+
+
+def _snapshot_reply_stream(_src):
+    """Output filter for completions streamed outside chat()'s own generators
+    (snapshot replays and N-best candidates).
+
+    The full turn streams through _filtered_stream / _web_search_stream, which
+    live inside chat(). These streams need the two guards that matter for an
+    already-built prompt: halt on a leaked ChatML turn header, and cut at a
+    model-emitted [WEB SEARCH: …] / [CHAT SEARCH: …] tag — they never run
+    searches (a normal send or regenerate with refresh_search does).
+    """
+    _ROLE_LEAK = re.compile(r'\n(?:user|assistant|system)(?:\n|:)', re.IGNORECASE)
+    _SEARCH_TAG = re.compile(r'\[\s*(?:WEB|CHAT)\s+SEARCH\b', re.IGNORECASE)
+    _TAIL_LEN = 40
+    _tail = ""
+    for chunk in _src:
+        combined = _tail + chunk
+        m = _ROLE_LEAK.search(combined) or _SEARCH_TAG.search(combined)
+        if m:
+            print(f"🛑 [snapshot replay] halted at {m.group()!r}", flush=True)
+            safe = combined[:m.start()]
+            if safe.strip():
+                yield safe
+            return
+        if len(combined) > _TAIL_LEN:
+            yield combined[:-_TAIL_LEN]
+            _tail = combined[-_TAIL_LEN:]
+        else:
+            _tail = combined
+    if _tail:
+        yield _tail
+
+
+def _stream_turn_snapshot(snapshot, continue_prefix, affinity, tts_session, ctx_size,
+                          n_candidates=1, settings=None):
+    """Response that replays a snapshot's payload, or None if it can't be reused
+    for this request (Continue and N-best are only supported for raw-prompt turns)."""
+    payload = snapshot["payload"]
+    stats = snapshot.get("stats") or {}
+    if snapshot["kind"] == "messages":
+        if continue_prefix or n_candidates > 1:
+            return None
+        source = stream_vision_response(payload, affinity=affinity)
+    else:
+        prompt_tokens = stats.get("prompt_tokens") or 0
+        if snapshot.get("search"):
+            # The stats describe the pre-search prompt; count the augmented one.
+            prompt_tokens = real_token_count(payload["prompt"])
+        if n_candidates > 1:
+            print(f"♻️ Turn snapshot reused for {n_candidates} candidates — context pipeline skipped", flush=True)
+            gen_metrics.bind(prompt_tokens=prompt_tokens, ctx_size=ctx_size)
+            return _candidates_response(payload, n_candidates, affinity, prompt_tokens, settings or {})
+        if continue_prefix:
+            payload["prompt"] = payload["prompt"].rstrip("\n") + "\n" + continue_prefix
+            prompt_tokens += real_token_count(continue_prefix)
+            payload["n_predict"] = min(payload.get("max_tokens", payload["n_predict"]),
+                                       max(256, ctx_size - prompt_tokens))
+        try:
+            _LAST_TOKEN_STATS.update(stats)
+            _LAST_TOKEN_STATS.update({
+                "prompt_tokens": prompt_tokens,
+                "n_predict": payload.get("n_predict"),
+                "model": CURRENT_MODEL,
+                "ts": time.time(),
+                "last_gen": None,
+                "last_eval": None,
+                "stop_reason": None,
+            })
+            gen_metrics.bind(prompt_tokens=prompt_tokens, ctx_size=ctx_size, n_predict=payload.get("n_predict"))
+        except Exception:
+            pass
+        source = _snapshot_reply_stream(stream_model_response(payload, affinity=affinity))
+
+    _search = snapshot.get("search")
+    print(
+        f"♻️ Turn snapshot reused ({snapshot['kind']}, "
+        f"{'continue' if continue_prefix else 'regenerate'}, "
+        f"age {time.time() - snapshot['created']:.0f}s"
+        f"{', search: ' + repr(_search['query']) if _search else ''}) — context pipeline skipped",
+        flush=True,
+    )
+    resp = Response(
+        stream_with_context(tee_chat_stream(_strip_ooc_stream(source), tts_session)),
+        content_type="text/event-stream; charset=utf-8",
+    )
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Turn-Snapshot'] = 'reused'
+    return resp
+
+
+def _candidates_response(payload, n, affinity, prompt_tokens, settings):
+    """Multiplexed SSE Response streaming `n` candidate replies to one
+    raw-prompt payload (see nbest.py)."""
+    global abort_generation
+    ctx_size = effective_ctx_size(settings)
+    # llama-server splits its context across slots — each candidate only gets
+    # one slot's share for prompt + reply, on whichever backend serves it.
+    slot_ctx, slot_ctx_source = nbest_candidate_slot_ctx(settings, ctx_size, backend_pool.backends())
+    if prompt_tokens and prompt_tokens + 256 > slot_ctx:
+        return jsonify({
+            "error": f"Prompt ({prompt_tokens} tokens) doesn't fit a {slot_ctx}-token slot "
+                     f"({slot_ctx_source}) — generate a single reply instead."
+        }), 400
+
+    # Perf spans and metric labels are thread-local; each candidate streams on
+    # its own nbest worker thread, so carry the request's over explicitly.
+    _trace = perf_trace.current()
+    _labels = gen_metrics.turn_labels()
+
+    def _source(i):
+        p = dict(payload)
+        p["cache_prompt"] = True
+        p["n_predict"] = min(payload.get("n_predict") or payload.get("max_tokens", 512),
+                             max(256, slot_ctx - (prompt_tokens or 0)))
+
+        def _start():
+            perf_trace.attach(_trace)
+            gen_metrics.reset()
+            gen_metrics.bind(**_labels)
+            # Candidate 0 keeps the chat's sticky backend; the rest route
+            # least-busy so a multi-backend pool can spread them. Each gets
+            # its own stats dict; only candidate 0's feeds the token monitor.
+            return _strip_ooc_stream(_snapshot_reply_stream(
+                stream_model_response(p, affinity=affinity if i == 0 else None,
+                                      token_stats=_LAST_TOKEN_STATS if i == 0 else {},
+                                      reset_abort=False)))
+        return _start
+
+    abort_generation = False  # once for the whole set, not per candidate
+    print(f"🎲 N-best: streaming {n} candidates (slot ctx {slot_ctx}, prompt {prompt_tokens} tokens)", flush=True)
+    resp = Response(
+        stream_with_context(nbest_multiplex([_source(i) for i in range(n)])),
+        content_type="text/event-stream; charset=utf-8",
+    )
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Candidates'] = str(n)
+    return resp
+
+
+# --------------------------------------------------
+# Prefix prewarm — speculative prefill while typing (see prefix_prewarm.py)
+# --------------------------------------------------
+prefix_prewarmer = PrefixPrewarmer(backend_pool)
+
+
+@app.route("/chat/prewarm", methods=["POST"])
+def chat_prewarm():
+    """Body as for /chat, with the unsent draft as the last user message.
+    Builds the prompt through chat() and prefills everything before the final
+    user turn; returns immediately — the prefill runs in the background."""
+    try:
+        with open("settings.json", "r", encoding="utf-8") as f:
+            enabled = json.load(f).get("prefix_prewarm_enabled", True)
+    except Exception:
+        enabled = True
+    if not enabled:
+        return jsonify({"status": "disabled"})
+    with _chat_inflight_lock:
+        _generating = _chat_inflight_count > 0
+    if _generating:
+        # A reply is generating — prefilling now would only compete with it.
+        return jsonify({"status": "skipped", "reason": "generation in progress"})
+    _hwui_g._chat_prewarm = True
+    return chat()
+
+
+@app.route("/chat/prewarm/status", methods=["GET"])
+def chat_prewarm_status():
+    return jsonify(prefix_prewarmer.status())
+
+
 # --------------------------------------------------
 # Chat Endpoint (Smart Memory Trigger + Natural Recall + Proper Formatting)
 # --------------------------------------------------
@@ -4639,31 +5205,39 @@ def _append_current_time(messages):
 
 @app.route("/chat", methods=["POST"])
 def chat():
+    _perf_t0 = time.perf_counter()
     print("🔴🔴🔴 CHAT ROUTE HIT - STARTING 🔴🔴🔴")
     import datetime
     import re, os, json, requests
 
+    # 🔥 /chat/prewarm runs this same pipeline to build the prompt prefix, then
+    # returns before anything is generated (see prefix_prewarm.py). It is not
+    # a generation, so it stays out of the in-flight tracker.
+    _prewarm = bool(_hwui_g.get("_chat_prewarm"))
+
     # 🩺 In-flight tracker — see comment above _chat_inflight_lock.
     # Decrement is handled by @app.teardown_request which fires after the
     # streaming response is exhausted (Flask keeps the request context alive
     # via stream_with_context).
     global _chat_inflight_count, _chat_request_seq
-    with _chat_inflight_lock:
-        _chat_request_seq += 1
-        _my_req_id = _chat_request_seq
-        _chat_inflight_count += 1
-        _concurrent = _chat_inflight_count
-    _hwui_g._chat_my_req_id = _my_req_id
-    if _concurrent > 1:
-        print(
-            f"🚨 CONCURRENT /chat DETECTED — req#{_my_req_id} entering while "
-            f"{_concurrent - 1} other /chat request(s) already in flight. "
-            f"With parallel:1 in llama-server this WILL preempt the earlier "
-            f"generation and cause STOP REASON: unknown on the cancelled one.",
-            flush=True,
-        )
-    else:
-        print(f"🩺 /chat req#{_my_req_id} entered (inflight={_concurrent})", flush=True)
+    _my_req_id = 0
+    if not _prewarm:
+        with _chat_inflight_lock:
+            _chat_request_seq += 1
+            _my_req_id = _chat_request_seq
+            _chat_inflight_count += 1
+            _concurrent = _chat_inflight_count
+        _hwui_g._chat_my_req_id = _my_req_id
+        if _concurrent > 1:
+            print(
+                f"🚨 CONCURRENT /chat DETECTED — req#{_my_req_id} entering while "
+                f"{_concurrent - 1} other /chat request(s) already in flight. "
+                f"With parallel:1 in llama-server this WILL preempt the earlier "
+                f"generation and cause STOP REASON: unknown on the cancelled one.",
+                flush=True,
+            )
+        else:
+            print(f"🩺 /chat req#{_my_req_id} entered (inflight={_concurrent})", flush=True)
 
     # Single per-request snapshot of settings.json. Used by the
     # request-critical code paths below (ctx_size for n_predict, ignore_eos
@@ -4676,7 +5250,13 @@ def chat():
     except Exception as _se:
         print(f"⚠️ /chat req#{_my_req_id} settings.json read failed: {_se!r}", flush=True)
         _req_settings = {}
-    _ctx_size_req = int(_req_settings.get("llama_args", {}).get("ctx_size", 16384))
+    # ⏱️ Per-turn timing — spans are recorded by the @perf_trace.timed helpers
+    # and the streamers; the trace is finished when the response closes.
+    perf_trace.begin("prewarm" if _prewarm else "chat", settings=_req_settings,
+                     t0=_perf_t0, req_id=_my_req_id)
+    perf_trace.mark("settings_read")
+    hwui_log.apply_levels(_req_settings)
+    _ctx_size_req = effective_ctx_size(_req_settings)
     _ignore_eos_req = bool(_req_settings.get("ignore_eos", False))
     _diag_verbose = bool(_req_settings.get("diag_verbose", False))
 
@@ -4687,6 +5267,13 @@ def chat():
     # disk-fallback branch below — so a [CHAT SEARCH:] tag on a request that DID
     # supply conversation_history raised NameError. Bind it unconditionally here.
     current_chat_filename = data.get("current_chat_filename", "")
+    # Server-side TTS pipeline (tts_pipeline.py): when the browser opened
+    # /api/tts/pipeline/<id> for this reply, every stream below is teed into
+    # the sentence segmenter so synthesis starts before the text reaches it.
+    _tts_session_id = str(data.get("tts_session") or "").strip()
+    # Sticky backend routing key — a chat keeps hitting the llama-server that
+    # already has its prefix cached (see backend_pool.py).
+    _backend_affinity = current_chat_filename or str(data.get("character") or "").strip() or None
     print(f"🔍 DEBUG: Full request data keys: {data.keys()}")
     
     # Get conversation history from request (more reliable than reading from file)
@@ -4704,6 +5291,9 @@ def chat():
     
     character_name = data.get("character", "").strip()
     user_name = data.get("user_name", "User")
+    # 📈 Per-turn metric labels — read by gen_metrics.observe_generation at end-of-stream.
+    gen_metrics.reset()
+    gen_metrics.bind(character=character_name)
     
     
     # Handle multimodal content (images) — extract text part only for processing
@@ -4742,7 +5332,9 @@ def chat():
                     content or "",
                 ))
             )
-            for name, content in _attached_blocks
+            for name, content in (
+                (name, attachment_store.load_body(body)) for name, body in _attached_blocks
+            )
         )
         user_input = re.sub(
             r"\[ATTACHED DOCUMENT:.*?\[END ATTACHED DOCUMENT\]",
@@ -4782,8 +5374,45 @@ def chat():
     if not os.path.exists(char_path):
         return jsonify({"error": f"Character file not found: {char_path}"}), 404
 
-    with open(char_path, "r", encoding="utf-8") as f:
-        char_data = json.load(f)
+    char_data, _char_version = _load_character_card(char_path)
+
+    # ♻️ Regenerate / Continue: the previous turn's assembled context is still
+    # valid when the conversation it was built from is unchanged — replay its
+    # payload instead of re-running retrieval, search gating, system-text
+    # assembly, trimming and /tokenize. refresh_search forces the full rebuild.
+    _continue_prefix_req = str(data.get("continue_prefix") or "").strip()
+
+    # 🎲 N-best: `candidates: N` streams N replies over one multiplexed SSE
+    # response (nbest.py). Local raw-prompt turns only — it needs llama-server
+    # slots, so it is refused up front for cloud, image and continue turns.
+    _n_candidates = 1
+    try:
+        _candidates_req = int(data.get("candidates") or 1)
+    except (TypeError, ValueError):
+        return jsonify({"error": "candidates must be a whole number."}), 400
+    if _candidates_req > 1:
+        if _continue_prefix_req or _req_settings.get("backend_mode", "local") != "local" \
+                or any(isinstance(m.get("content"), list) for m in active_chat):
+            return jsonify({"error": "Multiple candidates are only available for local text replies."}), 400
+        _n_candidates = clamp_candidates(data.get("candidates"), _req_settings, backend_pool.backends())
+        if _n_candidates < 2:
+            return jsonify({"error": "Multiple candidates need llama-server slots to run in parallel — "
+                                     "set llama_args.parallel above 1 (or add llama_backends)."}), 400
+
+    _snapshot_chat_key, _snapshot_fp = _turn_snapshot_key(data, _char_version)
+    if (data.get("regenerate") or _continue_prefix_req) and not data.get("refresh_search"):
+        _snap = turn_snapshots.get(_snapshot_chat_key, _snapshot_fp, ttl=_turn_snapshot_ttl(_req_settings))
+        if _snap:
+            perf_trace.annotate(path="snapshot")
+            _snap_resp = _stream_turn_snapshot(_snap, _continue_prefix_req, _backend_affinity,
+                                               _tts_session_id, _ctx_size_req,
+                                               n_candidates=_n_candidates, settings=_req_settings)
+            if _snap_resp is not None:
+                return _snap_resp
+    # Only a fresh (non-continue) turn is worth snapshotting — a continue
+    # payload carries the partial reply.
+    if _continue_prefix_req:
+        _snapshot_fp = None
 
     print("🧩 Loaded character file:", char_path)
     print("🧩 example_dialogue present:", "example_dialogue" in char_data)
@@ -4800,13 +5429,13 @@ def chat():
     # --------------------------------------------------
     # Load Helcyon's core system layer (hardcoded)
     # --------------------------------------------------
-    system_prompt, instruction, tone_primer = _resolve_system_layer(char_data)
+    system_prompt, instruction, tone_primer = _resolve_system_layer(char_data, _char_version)
     
     # --------------------------------------------------
     # Load Project Instructions & Documents (if in a project)
     # --------------------------------------------------
     project_instructions, project_documents, global_documents, project_rp_mode, newly_pinned_doc = _load_documents(
-        user_input, _attached_doc_present
+        user_input, _attached_doc_present, persist_pin=not _prewarm
     )
 
     # Exact document set that survives retrieval/suppression and reaches this
@@ -4842,7 +5471,7 @@ def chat():
     _anthropic_static_system_text, char_context, user_context, _recent_session_summary, _recent_session_ts, _is_jinja_model = _build_system_text(
         char_data, _char_label, _user_label, user_display_name, user_bio,
         active_chat, character_name, system_prompt, instruction, tone_primer,
-        project_documents,
+        project_documents, char_version=_char_version,
     )
     system_text = _anthropic_static_system_text + (global_documents or "")
         
@@ -4927,34 +5556,15 @@ def chat():
     # ⚠️ Example dialogue (~2000 tokens) gets appended to system message AFTER this trim.
     # Pass its estimated size as overhead so the trimmer accounts for it upfront.
     _ex_overhead = 0
-    _char_ex_pre = char_data.get("example_dialogue", "").strip()
-    if not _char_ex_pre and not _is_jinja_model:
-        # Fallback chain mirrors actual resolution below — jinja models skip both fallbacks
-        # Priority 2: global_example_dialog from settings.json
-        try:
-            with open("settings.json", "r", encoding="utf-8") as _sf:
-                _char_ex_pre = json.load(_sf).get("global_example_dialog", "").strip()
-        except Exception:
-            pass
-        if not _char_ex_pre:
-            # Priority 3: .example.txt file — must match the path resolution used below
-            try:
-                _, _ex_name_pre, _ = resolve_character_prompt_files(char_data)
-                _ex_path_pre = os.path.join(get_system_prompts_dir(), _ex_name_pre)
-                if os.path.exists(_ex_path_pre):
-                    with open(_ex_path_pre, 'r', encoding='utf-8') as _ef_pre:
-                        _char_ex_pre = _ef_pre.read().strip()
-                    if _char_ex_pre:
-                        print(f"📐 Pre-calc: found {_ex_name_pre} for overhead measurement")
-            except Exception:
-                pass
-    if _char_ex_pre:
+    # Same resolution (and cache entry) as the example-dialogue block below.
+    _ex_segment, _ex_source = _resolve_example_dialogue(char_data, _char_version, _is_jinja_model)
+    if _ex_segment.text:
         # Conservative wrapper overhead estimate. The actual wrapper is a
         # short one-line header (~40 tokens) plus optional emoji/xxx style
         # notes; 400 tokens is intentionally generous to leave headroom
         # against trim under-estimates and ctx_size overflow at runtime.
         _EX_WRAPPER_OVERHEAD = 400
-        _ex_overhead = rough_token_count(_char_ex_pre) + _EX_WRAPPER_OVERHEAD
+        _ex_overhead = _ex_segment.tokens + _EX_WRAPPER_OVERHEAD
         print(f"📐 Example dialogue overhead: ~{_ex_overhead} tokens (dialogue + {_EX_WRAPPER_OVERHEAD} wrapper, pre-accounted in trim)")
 
     # Pre-account for content that is appended AFTER trimming:
@@ -4967,7 +5577,7 @@ def chat():
     _reply_packet_overhead = 0
     if project_instructions and project_instructions.strip():
         _reply_packet_overhead += rough_token_count(project_instructions) + 10
-    if _char_ex_pre:
+    if _ex_segment.text:
         _reply_packet_overhead += 60   # style reminder is fixed ~200 chars
     _ph_pre = char_data.get("post_history", "").strip()
     if _ph_pre:
@@ -5032,7 +5642,8 @@ def chat():
     # the conversation-message count BEFORE trim so the per-turn budget line below
     # can report included-vs-dropped. System message excluded from the count.
     _temp_convo_pretrim = len([m for m in messages if m.get("role") != "system"])
-    messages = trim_chat_history(messages, extra_system_overhead=_ex_overhead)
+    with perf_trace.span("trim_history"):
+        messages = trim_chat_history(messages, extra_system_overhead=_ex_overhead)
     _temp_convo_posttrim = len([m for m in messages if m.get("role") != "system"])  # ⏱️ TEMP
     active_chat = _rewrite_inline_attachments_for_model(
         [m for m in messages if m.get("role") in ("user", "assistant")]
@@ -5052,10 +5663,10 @@ def chat():
     if _diag_verbose:
         _convo_msgs = [m for m in messages if m.get("role") in ("user", "assistant")]
         _tail_msgs = _convo_msgs[-10:]
-        print("\n" + "=" * 70, flush=True)
-        print(f"🩺 TRIMMED HISTORY DUMP — last {len(_tail_msgs)} user/asst messages "
-              f"of {len(_convo_msgs)} total in prompt", flush=True)
-        print("=" * 70, flush=True)
+        hwui_log.diag.debug("\n" + "=" * 70)
+        hwui_log.diag.debug(f"🩺 TRIMMED HISTORY DUMP — last {len(_tail_msgs)} user/asst messages "
+                            f"of {len(_convo_msgs)} total in prompt")
+        hwui_log.diag.debug("=" * 70)
         for _di, _dm in enumerate(_tail_msgs):
             _idx_in_full = len(_convo_msgs) - len(_tail_msgs) + _di
             _drole = _dm.get("role", "?").upper()
@@ -5072,18 +5683,18 @@ def chat():
                 _di == len(_tail_msgs) - 1 and _dm.get("role") == "user"
             )
             if _is_latest_user:
-                print(f"\n[msg #{_idx_in_full}] {_drole}  ({_dchars} chars, ~{_dtok} rough tokens)  ← LATEST", flush=True)
-                print("  FULL CONTENT:", flush=True)
+                hwui_log.diag.debug(f"\n[msg #{_idx_in_full}] {_drole}  ({_dchars} chars, ~{_dtok} rough tokens)  ← LATEST")
+                hwui_log.diag.debug("  FULL CONTENT:")
                 for _line in _dcontent.splitlines() or [""]:
-                    print(f"    {_line}", flush=True)
+                    hwui_log.diag.debug(f"    {_line}")
             else:
                 _head = _dcontent[:200].replace("\n", " ⏎ ")
                 _tail = _dcontent[-200:].replace("\n", " ⏎ ")
-                print(f"\n[msg #{_idx_in_full}] {_drole}  ({_dchars} chars, ~{_dtok} rough tokens)", flush=True)
-                print(f"  HEAD: {_head!r}", flush=True)
+                hwui_log.diag.debug(f"\n[msg #{_idx_in_full}] {_drole}  ({_dchars} chars, ~{_dtok} rough tokens)")
+                hwui_log.diag.debug(f"  HEAD: {_head!r}")
                 if _dchars > 400:
-                    print(f"  TAIL: {_tail!r}", flush=True)
-        print("=" * 70 + "\n", flush=True)
+                    hwui_log.diag.debug(f"  TAIL: {_tail!r}")
+        hwui_log.diag.debug("=" * 70 + "\n")
     
     # (project instructions are already in the system message above - no need to repeat)
 
@@ -5099,35 +5710,11 @@ def chat():
     # Priority: 1) character JSON example_dialogue  2) settings.json global_example_dialog  3) .example.txt file
     # For jinja/Gemma models: skip global fallback if character has no example dialogue —
     # generic global examples confuse capable models that don't need style scaffolding
-    _char_ex = char_data.get("example_dialogue", "").strip()
-    if not _char_ex and not _is_jinja_model:
-        # ── Priority 2: settings.json global_example_dialog ────────────────────
-        _global_ex = ""
-        try:
-            with open("settings.json", "r", encoding="utf-8") as _sf:
-                _settings_ex = json.load(_sf).get("global_example_dialog", "").strip()
-            if _settings_ex:
-                _global_ex = _settings_ex
-                print(f"🌐 No character example dialogue — using global_example_dialog from settings.json")
-        except Exception:
-            pass
-
-        # ── Priority 3: .example.txt file alongside system prompt ──────────────
-        if not _global_ex:
-            try:
-                _, _ex_name, _ = resolve_character_prompt_files(char_data)
-                _ex_path = os.path.join(get_system_prompts_dir(), _ex_name)
-                if os.path.exists(_ex_path):
-                    with open(_ex_path, 'r', encoding='utf-8') as _ef:
-                        _global_ex = _ef.read().strip()
-                    if _global_ex:
-                        print(f"🌐 No character example dialogue — using {_ex_name} as fallback")
-            except Exception:
-                pass
-
-        if _global_ex:
-            char_data = dict(char_data)  # don't mutate original
-            char_data["example_dialogue"] = _global_ex
+    _ex_segment, _ex_source = _resolve_example_dialogue(char_data, _char_version, _is_jinja_model)
+    if _ex_segment.text and _ex_source != "character":
+        print(f"🌐 No character example dialogue — using {_ex_source} as fallback")
+        char_data = dict(char_data)  # don't mutate original
+        char_data["example_dialogue"] = _ex_segment.text
 
     if char_data.get("example_dialogue"):
         ex = char_data["example_dialogue"].strip()
@@ -5496,6 +6083,7 @@ def chat():
                 ).strip()
                 _sections = []
                 for _doc_name, _doc_text in _doc_blocks:
+                    _doc_text = attachment_store.load_body(_doc_text)
                     _is_transcript = (
                         "transcript" in (_doc_name or "").lower()
                         or bool(re.search(
@@ -5786,16 +6374,16 @@ def chat():
             print(f"   msg #{idx} ({role}) has {repr(needle)}: {repr(preview)}", flush=True)
 
     if _diag_verbose:
-        print("\n" + "="*60, flush=True)
-        print(f"🩺 TURN-COMPARISON DIAGNOSTIC", flush=True)
-        print("="*60, flush=True)
-        print(f"   Turn count       : user={_user_count} asst={_asst_count} sys={_sys_count}", flush=True)
-        print(f"   Role sequence    : {' '.join(_role_seq)}", flush=True)
-        print(f"   ChatML alternates: {_expected_seq_ok}", flush=True)
-        print("\n   Last 500 chars of prompt (everything right before <|im_start|>assistant):", flush=True)
-        print(prompt[-500:], flush=True)
-        print("\n🛑 Stop tokens:", get_stop_tokens(), flush=True)
-        print("="*60 + "\n", flush=True)
+        hwui_log.diag.debug("\n" + "="*60)
+        hwui_log.diag.debug(f"🩺 TURN-COMPARISON DIAGNOSTIC")
+        hwui_log.diag.debug("="*60)
+        hwui_log.diag.debug(f"   Turn count       : user={_user_count} asst={_asst_count} sys={_sys_count}")
+        hwui_log.diag.debug(f"   Role sequence    : {' '.join(_role_seq)}")
+        hwui_log.diag.debug(f"   ChatML alternates: {_expected_seq_ok}")
+        hwui_log.diag.debug("\n   Last 500 chars of prompt (everything right before <|im_start|>assistant):")
+        hwui_log.diag.debug(prompt[-500:])
+        hwui_log.diag.debug("\n🛑 Stop tokens: %s", get_stop_tokens())
+        hwui_log.diag.debug("="*60 + "\n")
 
     # --- Final safety clamp ---
     # Last-resort guard only — truncation.py already handles smart context trimming above.
@@ -5936,6 +6524,9 @@ def chat():
             has_images = True
             break
 
+    if _prewarm and (has_images or _req_settings.get("backend_mode", "local") != "local"):
+        return jsonify({"status": "skipped", "reason": "only local text turns are prewarmed"})
+
     sampling = load_sampling_settings()
 
     # ⚠️ DO NOT REVERT this backend_mode-first check (reopens the "images never
@@ -6109,7 +6700,7 @@ def chat():
 
         try:
             return Response(
-                stream_with_context(_strip_ooc_stream(stream_vision_response(vision_payload))),
+                stream_with_context(tee_chat_stream(_strip_ooc_stream(stream_vision_response(vision_payload, affinity=_backend_affinity)), _tts_session_id)),
                 content_type="text/event-stream; charset=utf-8",
             )
         except Exception as e:
@@ -6196,7 +6787,7 @@ def chat():
                     print(f"☁️🔍 OPENAI PATH: web search ENABLED — wrapping stream "
                           f"with [WEB SEARCH: …] tag detector", flush=True)
                     return Response(
-                        stream_with_context(_strip_ooc_stream(_web_search_stream_openai(
+                        stream_with_context(tee_chat_stream(_strip_ooc_stream(_web_search_stream_openai(
                             messages          = _oai_messages,
                             api_key           = _oai_key,
                             model             = _oai_model,
@@ -6206,7 +6797,7 @@ def chat():
                             frequency_penalty = sampling.get("frequency_penalty", 0.0),
                             presence_penalty  = sampling.get("presence_penalty", 0.0),
                             user_input        = user_input,
-                        ))),
+                        )), _tts_session_id)),
                         content_type="text/event-stream; charset=utf-8",
                     )
                 # Web search is OFF for this character (OpenAI path). The base
@@ -6266,7 +6857,7 @@ def chat():
                         yield _rolling[_yielded:]
 
                 return Response(
-                    stream_with_context(_strip_ooc_stream(_oai_offpath_stream())),
+                    stream_with_context(tee_chat_stream(_strip_ooc_stream(_oai_offpath_stream()), _tts_session_id)),
                     content_type="text/event-stream; charset=utf-8",
                 )
             except Exception as e:
@@ -6349,7 +6940,7 @@ def chat():
                     print("☁️🔍 ANTHROPIC PATH: web search ENABLED — wrapping stream "
                           "with [WEB SEARCH: …] tag detector", flush=True)
                     _resp = Response(
-                        stream_with_context(_strip_ooc_stream(_web_search_stream_anthropic(
+                        stream_with_context(tee_chat_stream(_strip_ooc_stream(_web_search_stream_anthropic(
                             messages    = _ant_messages,
                             api_key     = _ant_key,
                             model       = _ant_model,
@@ -6360,7 +6951,7 @@ def chat():
                             system      = _ant_system,
                             thinking        = _ant_thinking,
                             thinking_budget = _ant_think_budget,
-                        ))),
+                        )), _tts_session_id)),
                         content_type="text/event-stream; charset=utf-8",
                     )
                     # Header parity with the local path — disable reverse-proxy /
@@ -6412,7 +7003,7 @@ def chat():
                         yield _rolling[_yielded:]
 
                 _resp = Response(
-                    stream_with_context(_strip_ooc_stream(_ant_offpath_stream())),
+                    stream_with_context(tee_chat_stream(_strip_ooc_stream(_ant_offpath_stream()), _tts_session_id)),
                     content_type="text/event-stream; charset=utf-8",
                 )
                 # Header parity with the local path — disable reverse-proxy /
@@ -6434,6 +7025,9 @@ def chat():
         _model_name = (CURRENT_MODEL or '').lower()
         _use_messages_api = _chat_template in ('jinja', 'qwen') or 'gemma' in _model_name or 'qwen' in _model_name
 
+        if _use_messages_api and _prewarm:
+            return jsonify({"status": "skipped", "reason": "messages-API models are not prewarmed"})
+
         if _use_messages_api:
             # ── Messages array path (Gemma 4 / jinja models) ──
             print("🔀 TEXT via /v1/chat/completions (jinja/non-ChatML model)", flush=True)
@@ -6493,11 +7087,9 @@ def chat():
                         break
             print(f"🧹 ChatML nuked from {len(_text_messages)} messages", flush=True)
 
-            try:
-                with open("_last_messages_api_payload.json", "w", encoding="utf-8") as _mpf:
-                    json.dump(_text_messages, _mpf, ensure_ascii=False, indent=2)
-            except Exception as _mpe:
-                print(f"Could not write _last_messages_api_payload.json: {_mpe!r}", flush=True)
+            # Debug artefact — off-thread, and only with settings `debug_artifacts: true`.
+            hwui_log.write_artifact("_last_messages_api_payload.json",
+                                    [dict(m) for m in _text_messages], _req_settings)
 
             payload = {
                 "model": CURRENT_MODEL or "local",
@@ -6509,9 +7101,14 @@ def chat():
                 "presence_penalty": sampling.get("presence_penalty", 0.0),
                 "stream": True,
             }
+            turn_snapshots.save(_snapshot_chat_key, _snapshot_fp, "messages", payload)
+            perf_trace.mark("prompt_built")
+            perf_trace.annotate(path="messages")
+            if _n_candidates > 1:
+                return jsonify({"error": "Multiple candidates aren't available for chat-template (messages API) models."}), 400
             try:
                 return Response(
-                    stream_with_context(_strip_ooc_stream(stream_vision_response(payload))),
+                    stream_with_context(tee_chat_stream(_strip_ooc_stream(stream_vision_response(payload, affinity=_backend_affinity)), _tts_session_id)),
                     content_type="text/event-stream; charset=utf-8",
                 )
             except Exception as e:
@@ -6520,6 +7117,16 @@ def chat():
 
         # ── Raw prompt path (ChatML / Helcyon / Mistral) ──
 
+        if _prewarm:
+            # Everything before the final user turn is known before Send; the
+            # draft turn itself (and its reply-instruction packet) is volatile.
+            _prefix_end = prompt.rfind("<|im_start|>user\n")
+            if _prefix_end <= 0:
+                return jsonify({"status": "skipped", "reason": "no stable prefix"})
+            _pw = prefix_prewarmer.start(_backend_affinity or "default", prompt[:_prefix_end],
+                                         affinity=_backend_affinity)
+            return jsonify(dict(_pw, status="ok", tokens_est=rough_token_count(prompt[:_prefix_end])))
+
         # ── Dynamic n_predict: cap to actual KV space remaining after prompt ──
         # Use llama-server's /tokenize endpoint for an EXACT BPE count instead
         # of the old rough_token_count * 1.25 estimate. The old estimate
@@ -6576,6 +7183,7 @@ def chat():
                 "last_eval": None,
                 "stop_reason": None,
             })
+            gen_metrics.bind(prompt_tokens=_prompt_real_est, ctx_size=_ctx_size_live, n_predict=_n_predict)
         except Exception:
             pass
 
@@ -6690,7 +7298,26 @@ def chat():
             if (not _ignore_eos and _eos_logit_bias != 0.0)
             else f"<not applied: ignore_eos={_ignore_eos} bias={_eos_logit_bias}>"
         )
-        print(f"🩺 PAYLOAD → llama.cpp: {json.dumps(_log_payload)}", flush=True)
+        if hwui_log.diag.isEnabledFor(logging.INFO):
+            hwui_log.diag.info(f"🩺 PAYLOAD → llama.cpp: {json.dumps(_log_payload)}")
+
+        # ♻️ Snapshot this turn for regenerate / continue (turn_snapshots.py).
+        # The search paths below swap in their augmented payload via
+        # record_search, so a replay keeps the same results.
+        turn_snapshots.save(
+            _snapshot_chat_key, _snapshot_fp, "completion", payload,
+            stats={k: _LAST_TOKEN_STATS.get(k) for k in (
+                "prompt_tokens", "ctx_size", "n_predict",
+                "convo_kept", "convo_dropped", "injected_documents")},
+        )
+        perf_trace.mark("prompt_built")
+        perf_trace.annotate(path="completion", prompt_tokens=_LAST_TOKEN_STATS.get("prompt_tokens"))
+        # 🎲 N-best goes straight to generation — candidates are plain replies
+        # to this prompt; search triggers are left to a normal send.
+        if _n_candidates > 1:
+            perf_trace.annotate(path="candidates", candidates=_n_candidates)
+            return _candidates_response(payload, _n_candidates, _backend_affinity,
+                                        _prompt_real_est, _req_settings)
 
         use_web_search = char_data.get("use_web_search", False)
 
@@ -6845,11 +7472,12 @@ def chat():
                 _cs_payload = dict(payload)
                 _cs_payload["prompt"] = _cs_prompt
                 _cs_payload["n_predict"] = max(_cs_payload.get("n_predict", 512), 1024)
+                turn_snapshots.record_search(_snapshot_chat_key, _snapshot_fp, _cs_payload, _cs_query, "chat")
 
                 _tail = ""
                 _TAIL_LEN = 40
                 _halted = [False]
-                for chunk in stream_model_response(_cs_payload):
+                for chunk in stream_model_response(_cs_payload, affinity=_backend_affinity):
                     if _halted[0]:
                         continue
                     # Suppress any echoed CHAT HISTORY block markers
@@ -6877,7 +7505,7 @@ def chat():
 
             try:
                 resp = Response(
-                    stream_with_context(_chat_search_intent_stream()),
+                    stream_with_context(tee_chat_stream(_chat_search_intent_stream(), _tts_session_id)),
                     content_type="text/event-stream; charset=utf-8",
                 )
                 resp.headers['X-Accel-Buffering'] = 'no'
@@ -6999,6 +7627,7 @@ def chat():
             new_payload = dict(payload)
             new_payload["prompt"] = _search_prompt
             new_payload["n_predict"] = max(new_payload.get("n_predict", 512), 1024)
+            turn_snapshots.record_search(_snapshot_chat_key, _snapshot_fp, new_payload, query, "web")
             _np = new_payload.get("n_predict", "?")
             print(f"\U0001f50d Search prompt length: ~{len(_search_prompt)//4} tokens, n_predict: {_np}", flush=True)
 
@@ -7028,7 +7657,7 @@ def chat():
                     s = _re.sub(r'What do I search for[?]?', '', s)
                     return s
 
-                for chunk in stream_model_response(new_payload):
+                for chunk in stream_model_response(new_payload, affinity=_backend_affinity):
                     _response_chunks.append(chunk)
                     _line_buf += chunk
                     while '\n' in _line_buf:
@@ -7471,7 +8100,7 @@ def chat():
                                 return len(buf) - _k
                         return len(buf)
 
-                    for chunk in stream_model_response(_run_payload):
+                    for chunk in stream_model_response(_run_payload, affinity=_backend_affinity):
                         _ws_rolling += chunk
                         _wsm = _re.search(r"\[WEB SEARCH:\s*(.+?)\]", _ws_rolling, _re.IGNORECASE)
                         if _wsm:
@@ -7616,7 +8245,7 @@ def chat():
                 _tag_found = False
                 _search_query = None
                 try:
-                    for chunk in stream_model_response(payload):
+                    for chunk in stream_model_response(payload, affinity=_backend_affinity):
                         _streamed.append(chunk)
                         _rolling = "".join(_streamed)
                         _match = _re.search(r"\[WEB SEARCH:\s*(.+?)\]", _rolling, _re.IGNORECASE)
@@ -7652,7 +8281,7 @@ def chat():
 
             try:
                 resp = Response(
-                    stream_with_context(_strip_ooc_stream(_web_search_stream())),
+                    stream_with_context(tee_chat_stream(_strip_ooc_stream(_web_search_stream()), _tts_session_id)),
                     content_type="text/event-stream; charset=utf-8",
                 )
                 resp.headers['X-Accel-Buffering'] = 'no'
@@ -7690,7 +8319,7 @@ def chat():
                     _ooc_guard_active = [True]   # True until we've resolved/released the opening region
                     _ooc_holdback = [""]         # buffered opening text while we decide
 
-                    for chunk in stream_model_response(payload):
+                    for chunk in stream_model_response(payload, affinity=_backend_affinity):
                         if _halted[0]:
                             continue
                         _accumulated.append(chunk)
@@ -7902,12 +8531,13 @@ def chat():
                         _cs_pl = dict(payload)
                         _cs_pl["prompt"] = _cs_prompt
                         _cs_pl["n_predict"] = max(_cs_pl.get("n_predict", 512), 1024)
+                        turn_snapshots.record_search(_snapshot_chat_key, _snapshot_fp, _cs_pl, _cs_tag_query, "chat")
                         _cs_tail2 = ""
                         _cs_halted2 = [False]
                         # Same opening guard for the re-prompt stream (its own state).
                         _ooc_guard_active2 = [True]
                         _ooc_holdback2 = [""]
-                        for chunk in stream_model_response(_cs_pl):
+                        for chunk in stream_model_response(_cs_pl, affinity=_backend_affinity):
                             if _cs_halted2[0]:
                                 continue
                             if '[CHAT HISTORY RESULTS' in chunk or '[END CHAT HISTORY' in chunk:
@@ -8012,7 +8642,7 @@ def chat():
                                 yield _buf
 
                 resp = Response(
-                    stream_with_context(_strip_ooc_stream(_filtered_stream())),
+                    stream_with_context(tee_chat_stream(_strip_ooc_stream(_filtered_stream()), _tts_session_id)),
                     content_type="text/event-stream; charset=utf-8",
                 )
                 resp.headers['X-Accel-Buffering'] = 'no'
@@ -8051,7 +8681,7 @@ def token_stats():
         with open(os.path.join(os.path.dirname(__file__), 'settings.json'), 'r', encoding='utf-8') as f:
             _s = json.load(f)
         _args = _s.get('llama_args', {}) or {}
-        ctx_seed = int(_args.get('ctx_size', 16384))
+        ctx_seed = effective_ctx_size(_s)
         gpu_layers = _args.get('n_gpu_layers', None)
         model_seed = _s.get('llama_last_model', None)
     except Exception:
@@ -8079,6 +8709,42 @@ def token_stats():
     })
 
 
+@app.route('/token_stats/history', methods=['GET'])
+def token_stats_history():
+    """Recent per-turn generation records (gen_metrics.py window), oldest
+    first, plus averages over them. `?limit=` (default 30)."""
+    try:
+        limit = max(1, int(request.args.get('limit', 30)))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    turns = gen_metrics.window(limit)
+    return jsonify({"ok": True, "turns": turns, "summary": gen_metrics.window_summary(turns)})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of the generation metrics (gen_metrics.py)."""
+    return Response(gen_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --------------------------------------------------
+# Per-turn timing breakdowns (perf_trace.py)
+# --------------------------------------------------
+@app.route('/perf/recent', methods=['GET'])
+def perf_recent():
+    """Newest-first timing traces of recent /chat, /continue and prewarm
+    requests. `?limit=` (default 20), `?kind=chat|continue|prewarm`, and
+    `?spans=0` to return only the per-phase totals."""
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    traces = perf_trace.recent(limit, kind=request.args.get('kind') or None)
+    if request.args.get('spans') == '0':
+        traces = [{k: v for k, v in t.items() if k != 'spans'} for t in traces]
+    return jsonify({"ok": True, "traces": traces})
+
+
 # --------------------------------------------------
 # Chat History Persistence (NEW SIDEBAR SYSTEM)
 # --------------------------------------------------
@@ -8310,6 +8976,7 @@ def kill_llama_process():
     # Kill our tracked process first
     if llama_process and llama_process.poll() is None:
         try:
+            import psutil
             parent = psutil.Process(llama_process.pid)
             for child in parent.children(recursive=True):
                 child.kill()
@@ -8319,6 +8986,11 @@ def kill_llama_process():
             print(f"⚠️ Error killing tracked process: {e}")
         llama_process = None
     # Also kill any stray llama-server.exe processes
+    try:
+        import psutil
+    except ImportError:
+        print("⚠️ psutil not installed — cannot sweep stray llama-server processes")
+        return
     for proc in psutil.process_iter(['pid', 'name']):
         try:
             if 'llama-server' in proc.info['name'].lower():
@@ -8337,47 +9009,13 @@ def list_models():
     if not os.path.isdir(models_dir):
         return jsonify({"error": f"Models folder not found: {models_dir}", "models": [], "labels": {}, "groups": []})
 
-    # Load all labels from any model_names.txt (root + subfolders)
-    labels = {}
-    def load_labels(folder):
-        try:
-            names_file = os.path.join(folder, 'model_names.txt')
-            if os.path.isfile(names_file):
-                with open(names_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if '=' in line and not line.startswith('#'):
-                            key, val = line.split('=', 1)
-                            labels[key.strip()] = val.strip()
-        except Exception:
-            pass
-
-    load_labels(models_dir)
-
-    # Build grouped structure: root models first, then one entry per subfolder
-    groups = []
-
-    # Collect subfolder models first so we can exclude them from root list
-    subfolder_filenames = set()
-    subfolders = []
-    for entry in sorted(os.listdir(models_dir)):
-        sub_path = os.path.join(models_dir, entry)
-        if os.path.isdir(sub_path) and not entry.startswith('.'):
-            load_labels(sub_path)
-            sub_models = sorted([f for f in os.listdir(sub_path) if f.lower().endswith('.gguf')])
-            if sub_models:
-                subfolder_filenames.update(sub_models)
-                subfolders.append({"folder": entry, "models": sub_models})
-
-    # Root-level .gguf files — exclude any filename already present in a subfolder
-    root_models = sorted([f for f in os.listdir(models_dir)
-                          if f.lower().endswith('.gguf')
-                          and os.path.isfile(os.path.join(models_dir, f))
-                          and f not in subfolder_filenames])
-    if root_models:
-        groups.append({"folder": None, "models": root_models})
-
-    groups.extend(subfolders)
+    # Listing, model_names.txt labels and GGUF header metadata all come from the
+    # persistent catalog (gguf_catalog.py) — folders are only re-listed when
+    # their mtime changes and headers are only re-read when a file changes.
+    try:
+        groups, labels, meta = model_catalog.scan(models_dir)
+    except OSError as e:
+        return jsonify({"error": f"Could not read models folder: {e}", "models": [], "labels": {}, "groups": []})
 
     # Flat list for backwards compat (used by get_model display name matching)
     all_models = []
@@ -8385,7 +9023,8 @@ def list_models():
         prefix = (g["folder"] + "/") if g["folder"] else ""
         all_models.extend([prefix + m for m in g["models"]])
 
-    return jsonify({"models": all_models, "labels": labels, "groups": groups})
+    return jsonify({"models": all_models, "labels": labels, "groups": groups,
+                    "meta": meta, "meta_pending": model_catalog.pending()})
 
 @app.route("/save_model_label", methods=["POST"])
 def save_model_label():
@@ -8435,6 +9074,34 @@ def save_model_label():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/prestage_model", methods=["GET", "POST"])
+def prestage_model():
+    """Warm a model's GGUF into the page cache ahead of a switch (see model_prestage.py).
+
+    POST {"model": "folder/file.gguf"} starts staging (no-op if already staged);
+    GET ?model=... returns its progress, or every job without a model.
+    """
+    if request.method == "GET":
+        model_file = request.args.get("model", "")
+        if not model_file:
+            return jsonify(model_prestager.status())
+        path = resolve_model_path(model_file)
+        if not path:
+            return jsonify({"error": "Unknown model"}), 404
+        return jsonify(model_prestager.status(path) or {"state": "idle"})
+    data = request.get_json(silent=True) or {}
+    model_file = str(data.get("model", "")).strip()
+    if not model_file:
+        return jsonify({"error": "No model specified"}), 400
+    if CURRENT_MODEL and os.path.splitext(os.path.basename(model_file))[0].lower() == \
+            os.path.splitext(os.path.basename(CURRENT_MODEL))[0].lower():
+        return jsonify({"state": "loaded"})
+    status = prestage_model_id(model_file)
+    if status is None:
+        return jsonify({"state": "disabled_or_unknown"}), 200
+    return jsonify(status)
+
+
 @app.route("/load_model", methods=["POST"])
 def load_model():
     """Kill current llama.cpp process and start a new one with the selected model."""
@@ -8461,6 +9128,9 @@ def load_model():
 
     # Kill existing process
     print(f"🔄 Switching model to: {model_file}")
+    # A pre-stage of some other model would only compete with this load for disk.
+    model_prestager.cancel_except(os.path.realpath(model_path))
+    model_prestager.set_active_model(model_path)
     kill_llama_process()
     time.sleep(1)
 
@@ -8471,7 +9141,7 @@ def load_model():
         "-m", model_path,
         "--port", str(args.get("port", 8080)),
         "--n-gpu-layers", str(args.get("n_gpu_layers", 44)),
-        "--ctx-size", str(args.get("ctx_size", 16384)),
+        "--ctx-size", str(_launch_ctx_size(model_path, args)),
         "--cache-type-k", str(args.get("cache_type_k", "q8_0")),
         "--cache-type-v", str(args.get("cache_type_v", "q8_0")),
         "--timeout", str(args.get("timeout", 0)),
@@ -9073,6 +9743,7 @@ def mobile_page():
 @app.route("/continue", methods=["POST"])
 def continue_chat():
     print("✅ Continue route hit")
+    perf_trace.begin("continue")
 
     try:
         data = request.get_json(force=True)
@@ -9080,8 +9751,32 @@ def continue_chat():
         character = data.get("character", "")
         memory_context = data.get("memory_context", "")
 
-        # Load character data — needed both for the bound SP and the main prompt.
+        # Same request shape as /chat's continue (current_chat_filename +
+        # conversation_history + continue_prefix): when the turn being extended
+        # still has a snapshot, stream the continuation from it directly.
         char_file = os.path.join("characters", f"{character}.json")
+        continue_prefix = str(data.get("continue_prefix") or last_response[-200:]).strip()
+        if continue_prefix and data.get("conversation_history") and os.path.exists(char_file):
+            _, char_version = _load_character_card(char_file)
+            chat_key, fp = _turn_snapshot_key(data, char_version)
+            try:
+                with open("settings.json", "r", encoding="utf-8") as f:
+                    settings = json.load(f)
+            except Exception:
+                settings = {}
+            snapshot = turn_snapshots.get(chat_key, fp, ttl=_turn_snapshot_ttl(settings))
+            if snapshot:
+                perf_trace.annotate(path="snapshot")
+                resp = _stream_turn_snapshot(
+                    snapshot, continue_prefix,
+                    chat_key or character or None,
+                    str(data.get("tts_session") or "").strip(),
+                    effective_ctx_size(settings),
+                )
+                if resp is not None:
+                    return resp
+
+        # Load character data — needed both for the bound SP and the main prompt.
         char_data = {}
         if os.path.exists(char_file):
             try:
@@ -9121,7 +9816,8 @@ def continue_chat():
             }
         ]
         # Trim context before sending to llama.cpp
-        messages = trim_chat_history(messages)
+        with perf_trace.span("trim_history"):
+            messages = trim_chat_history(messages)
         if len(messages) == MAX_MESSAGES:
             print("[TrimCheck] Oldest messages trimmed.")
 
@@ -9363,8 +10059,8 @@ def _auto_memory_capture_turn(character, user_text, assistant_text, recent_messa
                 "Recent conversation:\n" + "\n".join(history_lines)
             )
         try:
-            model_response = requests.post(
-                f"{API_URL}/v1/chat/completions",
+            model_response = backend_pool.post(
+                "/v1/chat/completions",
                 json={
                     "model": CURRENT_MODEL or "local",
                     "messages": [
@@ -9682,6 +10378,19 @@ def file_edit():
         return jsonify({'error': error}), 400
     return jsonify({'status': 'ok'})
 
+_startup_phase("route definitions")
+
+# Launch/attach llama.cpp in the background — the UI is served while the model
+# loads and polls /health (or /get_model) to find out when it's ready. Started
+# only once the whole module has run, so the thread never races module-level
+# globals such as llama_process.
+#
+# Skipped if this script is ever re-imported as __mp_main__ by a spawned
+# worker (document_extract starts its pool without it, see
+# _launching_script_hidden) — a worker must not start its own threads.
+if __name__ != '__mp_main__':
+    threading.Thread(target=auto_launch_llama, daemon=True, name="llama-auto-launch").start()
+    backend_pool.start_probing()
 
 # --------------------------------------------------
 # Run Server
@@ -9703,6 +10412,12 @@ if __name__ == '__main__':
     else:
         print('🌐 No SSL certs — running HTTP (local mode)')
         ssl_context = None
+    # Whisper loads lazily on first voice input; optionally warm it in the
+    # background once the server is up (settings.json → whisper_prewarm).
+    start_whisper_prewarm()
+    _startup_phase("route table + ssl")
+    _total_ms = round((time.perf_counter() - _STARTUP_T0) * 1000)
+    print(f"⏱️ Startup {_total_ms} ms — " + ", ".join(f"{label} {ms:.0f} ms" for label, ms in _STARTUP_PHASES), flush=True)
     app.run(debug=False, use_reloader=False, host='0.0.0.0', port=FLASK_PORT,
             ssl_context=ssl_context)
 
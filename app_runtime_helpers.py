@@ -18,11 +18,22 @@ def _read_settings():
 
 
 def get_api_url():
+    """Base URL of the least-busy healthy llama-server (see backend_pool.py)."""
+    from backend_pool import pool
+    backend = pool.pick()
+    if backend is not None:
+        return backend.url
     settings = _read_settings()
     port = settings.get("llama_args", {}).get("port", 8080)
     return f"http://127.0.0.1:{port}"
 
 
+def llama_request(method, path, affinity=None, **kwargs):
+    """requests.request() against the backend pool, with failover between backends."""
+    from backend_pool import pool
+    return pool.open(method, path, affinity=affinity, **kwargs)
+
+
 def substitute_placeholders(text, char_label, user_label):
     """Swap {{char}}/{{user}} (whitespace- and case-tolerant) for live names."""
     if not isinstance(text, str) or not text:
@@ -63,7 +74,7 @@ def get_stop_tokens(current_model=None):
 
 def _detect_current_model():
     try:
-        response = requests.get(f"{get_api_url()}/v1/models", timeout=2)
+        response = llama_request("GET", "/v1/models", timeout=2)
         response.raise_for_status()
         data = response.json()
         models = data.get("data") or []
@@ -0,0 +1,186 @@
+"""Content-addressed store for documents attached to chat messages.
+
+Attached documents used to travel inline — the whole text between
+[ATTACHED DOCUMENT: …] / [END ATTACHED DOCUMENT] markers — so every autosave,
+/chats/open, stale-save parse, message fingerprint and trim pass re-read (and
+re-hashed) megabytes of document text. Now the text is written once to
+attachments/<sha[:2]>/<sha>.txt and the message body between the markers is a
+one-line reference:
+
+    [ATTACHED DOCUMENT: notes.pdf]
+    [ATTACHMENT REF sha256:<64 hex> chars:<n>]
+    [END ATTACHED DOCUMENT]
+
+The markers themselves are unchanged, so the browser's document cards,
+_parse_chat_file's span tracking and the retrieval-query cleanup keep working
+on old and new chats alike. Bodies are only expanded where the model needs
+them — _rewrite_inline_attachments_for_model, the ChatML builder and the
+truncation recall block — via expand() / load_body().
+
+Blobs are immutable and never garbage-collected automatically: the same hash
+may be referenced by copies and branches of a chat.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+ATTACHMENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "attachments")
+# Bodies shorter than this stay inline — a reference line would barely save anything.
+INLINE_MAX_CHARS = 1024
+CACHE_MAX_CHARS = 32 * 1024 * 1024
+
+ATTACHED_DOC_RE = re.compile(
+    r"\[ATTACHED DOCUMENT:\s*([^\]\n]+)\]\n([\s\S]*?)\n\[END ATTACHED DOCUMENT\]"
+)
+REF_RE = re.compile(r"^\[ATTACHMENT REF sha256:([0-9a-f]{64}) chars:(\d+)\]$")
+
+_lock = threading.Lock()
+_cache = OrderedDict()     # sha -> text, LRU
+_cache_chars = 0
+_digests = {}              # text -> sha, for bodies already seen (mirrors _cache)
+
+
+def _blob_path(sha):
+    return os.path.join(ATTACHMENTS_DIR, sha[:2], f"{sha}.txt")
+
+
+def is_sha(value):
+    return bool(value) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def make_ref(sha, chars):
+    return f"[ATTACHMENT REF sha256:{sha} chars:{int(chars)}]"
+
+
+def parse_ref(body):
+    """(sha, chars) when `body` is a reference line, else None."""
+    if not body or len(body) > 128:
+        return None
+    m = REF_RE.match(body.strip())
+    return (m.group(1), int(m.group(2))) if m else None
+
+
+def _remember(sha, text):
+    global _cache_chars
+    with _lock:
+        if sha in _cache:
+            _cache.move_to_end(sha)
+            return
+        _cache[sha] = text
+        _digests[text] = sha
+        _cache_chars += len(text)
+        while _cache_chars > CACHE_MAX_CHARS and len(_cache) > 1:
+            old_sha, old_text = _cache.popitem(last=False)
+            _digests.pop(old_text, None)
+            _cache_chars -= len(old_text)
+
+
+def digest(text):
+    """SHA-256 of `text`, memoised for bodies that passed through the store."""
+    text = text or ""
+    with _lock:
+        sha = _digests.get(text)
+    if sha:
+        return sha
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+def put(text):
+    """Store `text` (idempotent) and return its SHA-256."""
+    text = text or ""
+    sha = digest(text)
+    path = _blob_path(sha)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=".blob_", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+    _remember(sha, text)
+    return sha
+
+
+def get(sha):
+    """Stored text for `sha`, or None if the blob is missing."""
+    if not is_sha(sha):
+        return None
+    with _lock:
+        text = _cache.get(sha)
+        if text is not None:
+            _cache.move_to_end(sha)
+            return text
+    try:
+        with open(_blob_path(sha), "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+    except OSError:
+        return None
+    _remember(sha, text)
+    return text
+
+
+def load_body(body):
+    """Expand a reference body to the document text; inline bodies pass through."""
+    ref = parse_ref(body)
+    if not ref:
+        return body
+    text = get(ref[0])
+    if text is None:
+        logging.warning(f"⚠️ Attachment blob {ref[0][:12]}… missing from {ATTACHMENTS_DIR}")
+        return f"(attachment content unavailable — blob {ref[0][:12]} is missing)"
+    return text
+
+
+def expand(text):
+    """Replace every reference body inside attachment markers with its text."""
+    if not text or "[ATTACHMENT REF sha256:" not in text:
+        return text
+
+    def _sub(m):
+        return f"[ATTACHED DOCUMENT: {m.group(1)}]\n{load_body(m.group(2))}\n[END ATTACHED DOCUMENT]"
+
+    return ATTACHED_DOC_RE.sub(_sub, text)
+
+
+def externalize(text, min_chars=INLINE_MAX_CHARS):
+    """Move inline attachment bodies into the store, leaving reference lines."""
+    if not text or "[ATTACHED DOCUMENT:" not in text:
+        return text
+
+    def _sub(m):
+        body = m.group(2)
+        if len(body) < min_chars or parse_ref(body):
+            return m.group(0)
+        try:
+            sha = put(body)
+        except OSError as e:
+            logging.error(f"❌ Could not store attachment {m.group(1).strip()}: {e}")
+            return m.group(0)
+        return f"[ATTACHED DOCUMENT: {m.group(1)}]\n{make_ref(sha, len(body))}\n[END ATTACHED DOCUMENT]"
+
+    return ATTACHED_DOC_RE.sub(_sub, text)
+
+
+def externalize_messages(messages):
+    """Copy of a chat message list with user attachment bodies externalized."""
+    out = []
+    for msg in messages or []:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if isinstance(content, str) and "[ATTACHED DOCUMENT:" in content:
+            new_content = externalize(content)
+            if new_content is not content:
+                msg = dict(msg, content=new_content)
+        out.append(msg)
+    return out
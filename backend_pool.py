@@ -0,0 +1,369 @@
+"""Pool of llama-server backends with health probing and least-busy routing.
+
+HWUI used to send every request to one API_URL. With `llama_backends` set in
+settings.json (a list of base URLs — or {"url": ..., "name": ...} objects —
+for llama-server instances serving the same model) requests are spread
+across them instead:
+
+  • a probe thread polls each backend's /health and /slots every
+    `llama_backend_probe_interval_s` seconds;
+  • pick() routes to the backend with the lowest busy ratio — busy slots from
+    the last probe plus requests HWUI has in flight, over total slots;
+  • an affinity key (the chat filename) sticks a conversation to the backend
+    that served it last, so that server's prompt cache stays hot;
+  • open() fails over to the next backend when one refuses the connection or
+    answers 5xx *before* any body has been consumed. A stream that dies
+    half-way is not replayed — the tokens are already on their way to the UI.
+
+With `llama_backends` empty the pool holds the single managed llama-server on
+llama_args.port, so existing installs behave exactly as before. Process
+management (launch, /load_model, kill) still only concerns that managed
+server — remote or externally-run backends are never started or stopped here.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+DEFAULT_PROBE_INTERVAL = 5.0
+PROBE_TIMEOUT = 2.0
+MAX_AFFINITY_KEYS = 2048
+# Statuses worth retrying elsewhere: server error / overloaded / still loading.
+_FAILOVER_STATUSES = {500, 502, 503, 504}
+
+
+class NoBackendAvailable(requests.ConnectionError):
+    """Every backend refused or failed the request."""
+
+
+def _read_settings():
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return {}
+
+
+def backend_urls_from_settings(settings):
+    """[(name, base_url)] from settings.json; falls back to the managed llama-server."""
+    entries = settings.get("llama_backends") or []
+    urls = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, str):
+            url, name = entry, None
+        elif isinstance(entry, dict):
+            url, name = entry.get("url", ""), entry.get("name")
+        else:
+            continue
+        url = str(url).strip().rstrip("/")
+        if url:
+            urls.append((name or url, url))
+    if not urls:
+        port = settings.get("llama_args", {}).get("port", 8080)
+        urls.append(("local", f"http://127.0.0.1:{port}"))
+    return urls
+
+
+class Backend:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.healthy = True        # optimistic until the first probe says otherwise
+        self.status = "unknown"
+        self.slots_total = None
+        self.slot_ctx = None       # per-slot context (n_ctx) the server reports
+        self.slots_busy = 0
+        self.in_flight = 0
+        self.served = 0
+        self.failures = 0
+        self.last_probe = None
+        self.last_error = None
+
+    def load(self):
+        """Busy ratio used for least-busy routing."""
+        busy = self.slots_busy + self.in_flight
+        return busy / max(self.slots_total or 1, 1)
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "url": self.url,
+            "healthy": self.healthy,
+            "status": self.status,
+            "slots_total": self.slots_total,
+            "slot_ctx": self.slot_ctx,
+            "slots_busy": self.slots_busy,
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "failures": self.failures,
+            "last_probe": self.last_probe,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    def __init__(self, backends=None, probe_interval=DEFAULT_PROBE_INTERVAL, session=None):
+        """`backends` is [(name, url)]; None reads settings.json (and re-reads it on every probe)."""
+        self._from_settings = backends is None
+        self._lock = threading.Lock()
+        self._backends = []
+        self._affinity = OrderedDict()   # key -> backend url
+        self.probe_interval = probe_interval
+        self._http = session or requests
+        self._probe_thread = None
+        self._stop = threading.Event()
+        self.configure(backends if backends is not None else self._settings_backends())
+
+    # ── configuration ───────────────────────────────────────────────────────
+    def _settings_backends(self):
+        settings = _read_settings()
+        try:
+            self.probe_interval = float(settings.get("llama_backend_probe_interval_s", self.probe_interval))
+        except (TypeError, ValueError):
+            pass
+        return backend_urls_from_settings(settings)
+
+    def configure(self, backends):
+        """Replace the backend list, keeping state for URLs that stay."""
+        with self._lock:
+            existing = {b.url: b for b in self._backends}
+            self._backends = [existing.get(url) or Backend(name, url) for name, url in backends]
+            for backend, (name, _url) in zip(self._backends, backends):
+                backend.name = name
+            live = {b.url for b in self._backends}
+            for key in [k for k, url in self._affinity.items() if url not in live]:
+                del self._affinity[key]
+
+    def backends(self):
+        with self._lock:
+            return list(self._backends)
+
+    @property
+    def primary_url(self):
+        with self._lock:
+            return self._backends[0].url if self._backends else None
+
+    # ── probing ─────────────────────────────────────────────────────────────
+    def probe(self, backend):
+        try:
+            r = self._http.get(f"{backend.url}/health", timeout=PROBE_TIMEOUT)
+            try:
+                status = (r.json() or {}).get("status", "")
+            except ValueError:
+                status = ""
+            backend.status = status or str(r.status_code)
+            healthy = r.status_code == 200
+        except requests.RequestException as e:
+            backend.status = "unreachable"
+            backend.last_error = str(e)
+            healthy = False
+        if healthy:
+            self._probe_slots(backend)
+        backend.healthy = healthy
+        backend.last_probe = time.time()
+        return healthy
+
+    def _probe_slots(self, backend):
+        try:
+            r = self._http.get(f"{backend.url}/slots", timeout=PROBE_TIMEOUT)
+            if r.status_code != 200:
+                # --no-slots build: routing falls back to in-flight counts.
+                self._probe_props(backend)
+                return
+            slots = r.json()
+        except (requests.RequestException, ValueError):
+            return
+        if not isinstance(slots, list):
+            return
+        backend.slots_total = len(slots) or None
+        slot_ctx = next((s.get("n_ctx") for s in slots if isinstance(s, dict) and s.get("n_ctx")), None)
+        if slot_ctx:
+            backend.slot_ctx = int(slot_ctx)
+        else:
+            self._probe_props(backend)
+        # Newer builds expose is_processing; older ones a numeric state (0 = idle).
+        backend.slots_busy = sum(
+            1 for s in slots
+            if isinstance(s, dict) and (s.get("is_processing") or s.get("state", 0) not in (0, None))
+        )
+
+    def _probe_props(self, backend):
+        """Per-slot context from /props, for builds whose /slots lacks n_ctx."""
+        try:
+            r = self._http.get(f"{backend.url}/props", timeout=PROBE_TIMEOUT)
+            if r.status_code != 200:
+                return
+            n_ctx = ((r.json() or {}).get("default_generation_settings") or {}).get("n_ctx")
+        except (requests.RequestException, ValueError, AttributeError):
+            return
+        if isinstance(n_ctx, int) and n_ctx > 0:
+            backend.slot_ctx = n_ctx
+
+    def probe_all(self):
+        if self._from_settings:
+            self.configure(self._settings_backends())
+        for backend in self.backends():
+            self.probe(backend)
+
+    def start_probing(self):
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.probe_all()
+                except Exception as e:
+                    logging.error(f"⚠️ Backend probe loop error: {e}")
+                self._stop.wait(self.probe_interval)
+
+        self._probe_thread = threading.Thread(target=loop, daemon=True, name="llama-backend-probe")
+        self._probe_thread.start()
+
+    def stop_probing(self):
+        self._stop.set()
+
+    # ── routing ─────────────────────────────────────────────────────────────
+    def candidates(self, affinity=None):
+        """Backends in the order a request should try them."""
+        with self._lock:
+            backends = list(self._backends)
+            sticky_url = self._affinity.get(affinity) if affinity else None
+        healthy = sorted((b for b in backends if b.healthy), key=lambda b: (b.load(), b.in_flight))
+        # Unhealthy ones go last: a stale probe shouldn't make a request fail outright.
+        ordered = healthy + [b for b in backends if not b.healthy]
+        if sticky_url:
+            sticky = next((b for b in healthy if b.url == sticky_url), None)
+            if sticky is not None:
+                ordered.remove(sticky)
+                ordered.insert(0, sticky)
+        return ordered
+
+    def pick(self, affinity=None):
+        ordered = self.candidates(affinity)
+        return ordered[0] if ordered else None
+
+    def _remember(self, affinity, backend):
+        if not affinity:
+            return
+        with self._lock:
+            self._affinity[affinity] = backend.url
+            self._affinity.move_to_end(affinity)
+            while len(self._affinity) > MAX_AFFINITY_KEYS:
+                self._affinity.popitem(last=False)
+
+    def _release(self, backend):
+        with self._lock:
+            backend.in_flight = max(0, backend.in_flight - 1)
+
+    def open(self, method, path, affinity=None, **kwargs):
+        """Send a request to the best backend, failing over on connect errors / 5xx.
+
+        Returns the requests.Response with `.backend` set. For stream=True the
+        backend's in-flight count is held until the response is closed — use
+        iter_lines() or close() it explicitly.
+        """
+        stream = kwargs.get("stream", False)
+        last_error = None
+        last_failed = None   # (response, backend) of the last 5xx, kept open in case it's all we get
+        tried = self.candidates(affinity)
+        for i, backend in enumerate(tried):
+            with self._lock:
+                backend.in_flight += 1
+            try:
+                response = self._http.request(method, f"{backend.url}{path}", **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._release(backend)
+                backend.healthy = False
+                backend.failures += 1
+                backend.last_error = str(e)
+                last_error = e
+                if i + 1 < len(tried):
+                    print(f"🔀 Backend {backend.name} failed ({e.__class__.__name__}) — failing over", flush=True)
+                continue
+            except Exception:
+                self._release(backend)
+                raise
+            if response.status_code in _FAILOVER_STATUSES and i + 1 < len(tried):
+                backend.failures += 1
+                backend.last_error = f"HTTP {response.status_code}"
+                print(f"🔀 Backend {backend.name} answered {response.status_code} — failing over", flush=True)
+                self._discard(last_failed)
+                last_failed = (response, backend)
+                continue
+            self._discard(last_failed)
+            return self._deliver(response, backend, affinity, stream)
+        if last_failed is not None:
+            # Every later backend was unreachable: the 5xx is the best answer
+            # there is, and its body is still readable.
+            return self._deliver(*last_failed, None, stream)
+        raise NoBackendAvailable(f"No llama-server backend reachable: {last_error}")
+
+    def _discard(self, failed):
+        if failed is None:
+            return
+        response, backend = failed
+        try:
+            response.close()
+        finally:
+            self._release(backend)
+
+    def _deliver(self, response, backend, affinity, stream):
+        backend.served += 1
+        self._remember(affinity, backend)
+        response.backend = backend
+        if stream:
+            self._hold_until_closed(response, backend)
+        else:
+            self._release(backend)
+        return response
+
+    def _hold_until_closed(self, response, backend):
+        original_close = response.close
+        released = []
+
+        def close():
+            try:
+                original_close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self._release(backend)
+
+        response.close = close
+
+    def request(self, method, path, affinity=None, **kwargs):
+        return self.open(method, path, affinity=affinity, **kwargs)
+
+    def post(self, path, affinity=None, **kwargs):
+        return self.open("POST", path, affinity=affinity, **kwargs)
+
+    def get(self, path, affinity=None, **kwargs):
+        return self.open("GET", path, affinity=affinity, **kwargs)
+
+    def status(self):
+        with self._lock:
+            return {
+                "backends": [b.snapshot() for b in self._backends],
+                "affinity_keys": len(self._affinity),
+                "probe_interval_s": self.probe_interval,
+            }
+
+
+def iter_lines(response, **kwargs):
+    """response.iter_lines() that always closes (and so releases) the response."""
+    try:
+        yield from response.iter_lines(**kwargs)
+    finally:
+        response.close()
+
+
+pool = BackendPool()
@@ -354,6 +354,11 @@ def set_character_voice(n):
         with open(path, "w", encoding="utf-8") as f:
             json.dump(char_data, f, indent=2, ensure_ascii=False)
         print(f"✅ Voice saved for {n}: {voice}")
+        if voice:
+            # Opening lines are the most-repeated audio a character has —
+            # render them into the TTS cache now so the first greeting is instant.
+            from tts_routes import prerender_opening_lines
+            prerender_opening_lines(n, voice)
         return jsonify({"success": True})
     except Exception as e:
         print(f"❌ Failed to save voice for {n}: {e}")
@@ -388,6 +393,10 @@ def set_character_preferred_model(n):
         with open(path, "w", encoding="utf-8") as f:
             json.dump(char_data, f, indent=2, ensure_ascii=False)
         print(f"Preferred model saved for {n}: {preferred_model_id or '(none)'}")
+        if preferred_model_id:
+            # Warm the paired model now so the switch on character select is quick.
+            from model_prestage import prestage_model_id
+            prestage_model_id(preferred_model_id)
         return jsonify({"success": True, "preferred_model_id": preferred_model_id})
     except Exception as e:
         print(f"Failed to save preferred model for {n}: {e}")
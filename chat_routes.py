@@ -2,6 +2,7 @@
 import os, json, re, shutil, subprocess
 from flask import Blueprint, jsonify, request
 from datetime import datetime
+import attachment_store
 from chat_message_metadata import (
     chat_directories,
     delete_chat_metadata,
@@ -923,6 +924,9 @@ def save_chat_messages():
         if " - " in filename:
             char_name = filename.split(" - ", 1)[0]
 
+        # Inline document bodies (pasted transcripts, older clients) go to the
+        # attachment store; the chat file keeps only hash references.
+        messages = attachment_store.externalize_messages(messages)
         text = _format_chat_messages(messages, char_name)
         _atomic_write_text(filepath, text)
         chat_meta = save_chat_metadata(chats_dir, filename, messages)
@@ -953,6 +957,8 @@ def append_chat_turn():
         chats_dir = get_chats_dir()
         filepath = os.path.join(chats_dir, filename)
         
+        user_msg = attachment_store.externalize(user_msg) if isinstance(user_msg, str) else user_msg
+
         # Append messages with timestamp
         now_ts = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         with open(filepath, "a", encoding="utf-8") as f:
@@ -1005,6 +1011,9 @@ def update_chat():
         if " - " in filename:
             char_name = filename.split(" - ", 1)[0]
 
+        # Inline document bodies (pasted transcripts, older clients) go to the
+        # attachment store; the chat file keeps only hash references.
+        messages = attachment_store.externalize_messages(messages)
         text = _format_chat_messages(messages, char_name)
         _atomic_write_text(filepath, text)
         chat_meta = save_chat_metadata(chats_dir, filename, messages)
@@ -25,6 +25,8 @@ import torch
 from flask import Flask, request, jsonify, send_file
 
 from tts_path_config import apply_tts_path_overrides
+from tts_synthesis_queue import SynthesisQueue
+from tts_cache import voice_file_version
 
 apply_tts_path_overrides()
 
@@ -232,6 +234,10 @@ app = Flask(__name__)
 _model      = None
 _model_lock = threading.Lock()
 _use_turbo  = False
+# Chatterbox generate() is not safe to run concurrently (Flask is threaded),
+# so every generation goes through one FIFO worker. generate() takes a single
+# text, so there is no batched path.
+synthesis_queue = SynthesisQueue("chatterbox")
 
 
 def get_model():
@@ -321,12 +327,16 @@ def status():
         "gpu":          gpu_name,
         "voices_dir":   VOICES_DIR,
         "model_loaded": _model is not None,
+        "queue":        synthesis_queue.stats(),
     })
 
 
 @app.route("/voices", methods=["GET"])
 def voices():
-    return jsonify({"voices": list_all_voices()})
+    names = list_all_voices()
+    # Reference-file stamps — HWUI keys its TTS audio cache on these.
+    versions = {n: voice_file_version(os.path.join(VOICES_DIR, f"{n}.wav")) for n in names}
+    return jsonify({"voices": names, "versions": versions})
 
 
 @app.route("/warmup", methods=["POST"])
@@ -337,7 +347,7 @@ def warmup():
         logging.info(f"Warmup requested (voice: {voice_name})")
         model    = get_model()
         wav_path = find_voice_wav(voice_name)
-        _generate(model, "Hello.", wav_path)
+        synthesis_queue.call(_generate, model, "Hello.", wav_path)
         torch.cuda.empty_cache()
         logging.info("Warmup complete.")
         return jsonify({"status": "ok"})
@@ -365,7 +375,7 @@ def tts_to_audio():
         if not wav_path:
             logging.warning(f"Voice '{voice_name}' not found — using default voice.")
 
-        wav = _generate(model, text, wav_path)
+        wav = synthesis_queue.call(_generate, model, text, wav_path)
         buf = _wav_to_bytes(wav, model.sr)
 
         # Release VRAM immediately after generation
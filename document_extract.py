@@ -0,0 +1,418 @@
+"""Background document extraction on a process pool, with a persistent text cache.
+
+/parse_document used to run PyPDF2 over every page inside the request, so a
+300-page PDF held a worker for a minute, and project uploads did no extraction
+at all — the first chat turn that touched the document paid for it instead.
+
+DocumentExtractor runs extraction as jobs:
+
+  • PDFs above PDF_SPLIT_MIN_PAGES are split into contiguous page ranges that
+    are extracted in parallel on a ProcessPoolExecutor (PyPDF2 is pure Python,
+    so threads would serialise on the GIL) and joined back in page order;
+  • other formats (.txt/.md/.docx/.odt/…) run as a single pool task;
+  • each job exposes progress (pages_done / pages_total) that callers poll or
+    stream (see job.events());
+  • finished text for files on disk goes into the extracted-text cache — in
+    memory and under doc_text_cache/ — keyed by path, size and mtime, so
+    _read_doc_content in app.py returns it without re-parsing.
+
+Worker processes only import this module. With spawn (Windows) or forkserver
+start-up, multiprocessing would normally re-run the launching script in every
+worker as __mp_main__ — for app.py that means the whole Flask app, a second
+stdout tee and another RotatingFileHandler on logs/hwui_full.log. Workers are
+therefore started with the launching script hidden (_launching_script_hidden).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doc_text_cache")
+PDF_SPLIT_MIN_PAGES = 24
+PDF_MIN_PAGES_PER_TASK = 8
+MEMORY_CACHE_MAX_CHARS = 64 * 1024 * 1024
+MAX_FINISHED_JOBS = 64
+
+SUPPORTED_EXTENSIONS = ('.txt', '.md', '.py', '.html', '.htm', '.docx', '.odt', '.pdf')
+
+
+class ExtractionError(Exception):
+    """Document could not be read (unsupported type, missing parser library)."""
+
+
+def _settings():
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _worker_count():
+    try:
+        configured = int(_settings().get("doc_extract_workers", 0))
+    except (TypeError, ValueError):
+        configured = 0
+    if configured > 0:
+        return configured
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+_spawn_lock = threading.Lock()
+
+
+@contextmanager
+def _launching_script_hidden():
+    """Start pool workers without re-running the launching script.
+
+    multiprocessing tells each spawned worker to re-import __main__ when the
+    main module has a __file__ (or a __spec__ for `python -m`). Pool workers
+    start inside executor.submit(), so clearing both for the duration of the
+    submit makes the child import only this module to unpickle its task.
+    """
+    main = sys.modules["__main__"]
+    with _spawn_lock:
+        saved = {name: main.__dict__[name] for name in ("__file__", "__spec__") if name in main.__dict__}
+        for name in saved:
+            setattr(main, name, None)
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                setattr(main, name, value)
+
+
+# ── worker-side functions (run in the pool; must stay module-level) ─────────
+def _pdf_page_count(path):
+    try:
+        import PyPDF2
+    except ImportError:
+        raise ExtractionError("PyPDF2 is required to read .pdf files")
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def _extract_pdf_range(path, start, end):
+    import PyPDF2
+    with open(path, "rb") as f:
+        pages = PyPDF2.PdfReader(f).pages
+        return "".join(pages[i].extract_text() or "" for i in range(start, min(end, len(pages))))
+
+
+def _extract_file(path):
+    """Whole-file extraction for every non-split format."""
+    name = path.lower()
+    if name.endswith(('.txt', '.md')):
+        with open(path, "rb") as f:
+            raw = f.read()
+        try:
+            return raw.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            return raw.decode("latin-1")
+    if name.endswith(('.py', '.html', '.htm')):
+        with open(path, "rb") as f:
+            return f.read().decode("utf-8", errors="replace")
+    if name.endswith('.docx'):
+        try:
+            import docx
+        except ImportError:
+            raise ExtractionError("python-docx is required to read .docx files")
+        return "\n".join(para.text for para in docx.Document(path).paragraphs)
+    if name.endswith('.odt'):
+        try:
+            from odf import text as odf_text, teletype
+            from odf.opendocument import load as odf_load
+        except ImportError:
+            raise ExtractionError("odfpy is required to read .odt files")
+        doc = odf_load(path)
+        return "\n".join(teletype.extractText(p) for p in doc.getElementsByType(odf_text.P))
+    if name.endswith('.pdf'):
+        return _extract_pdf_range(path, 0, _pdf_page_count(path))
+    raise ExtractionError(f"Unsupported file type: {os.path.basename(path)}")
+
+
+def page_ranges(page_count, workers):
+    """Contiguous [start, end) ranges, one or a few per worker."""
+    if page_count < PDF_SPLIT_MIN_PAGES or workers <= 1:
+        return [(0, page_count)]
+    size = max(PDF_MIN_PAGES_PER_TASK, -(-page_count // (workers * 2)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+# ── extracted-text cache ────────────────────────────────────────────────────
+class TextCache:
+    """path → text, valid while the file's size and mtime are unchanged."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_chars=MEMORY_CACHE_MAX_CHARS):
+        self.cache_dir = cache_dir
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # realpath -> (size, mtime_ns, text)
+        self._chars = 0
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, path):
+        key = os.path.realpath(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                self._memory.move_to_end(key)
+                return entry[2]
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("size") != st.st_size or data.get("mtime_ns") != st.st_mtime_ns:
+            return None
+        text = data.get("text", "")
+        self._remember(key, st.st_size, st.st_mtime_ns, text)
+        return text
+
+    def put(self, path, text, stat=None):
+        key = os.path.realpath(path)
+        try:
+            st = stat or os.stat(key)
+        except OSError:
+            return
+        self._remember(key, st.st_size, st.st_mtime_ns, text)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=".doctext_", dir=self.cache_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"path": key, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "text": text}, f)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            logging.warning(f"⚠️ Could not persist extracted text for {os.path.basename(key)}: {e}")
+
+    def _remember(self, key, size, mtime_ns, text):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old:
+                self._chars -= len(old[2])
+            self._memory[key] = (size, mtime_ns, text)
+            self._chars += len(text)
+            while self._chars > self.max_chars and len(self._memory) > 1:
+                _key, (_s, _m, evicted) = self._memory.popitem(last=False)
+                self._chars -= len(evicted)
+
+
+# ── jobs ────────────────────────────────────────────────────────────────────
+class ExtractionJob:
+    def __init__(self, path, filename, cache=True, cleanup=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.filename = filename or os.path.basename(path)
+        self.cache = cache
+        self.cleanup = cleanup
+        self.state = "queued"
+        self.pages_done = 0
+        self.pages_total = None
+        self.text = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cond = threading.Condition()
+        self._version = 0
+
+    def _update(self, **fields):
+        with self._cond:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self._version += 1
+            self._cond.notify_all()
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+    def snapshot(self, include_text=False):
+        data = {
+            "job": self.id,
+            "filename": self.filename,
+            "state": self.state,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "chars": len(self.text) if self.text is not None else None,
+            "error": self.error,
+        }
+        if include_text:
+            data["content"] = self.text
+        return data
+
+    def wait(self, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished, timeout)
+        return self.finished
+
+    def events(self, heartbeat=15.0):
+        """Yield a snapshot on every progress change until the job finishes.
+        A repeated snapshot every `heartbeat` seconds keeps proxies from
+        closing a quiet stream."""
+        seen = -1
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._version != seen, heartbeat)
+                seen = self._version
+                finished = self.finished
+            yield self.snapshot()
+            if finished:
+                return
+
+
+class DocumentExtractor:
+    def __init__(self, cache=None):
+        self.cache = cache or TextCache()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._workers = 0
+        self._jobs = OrderedDict()     # id -> job
+        self._by_path = {}             # realpath -> running job id
+
+    def _pool(self):
+        with self._lock:
+            workers = _worker_count()
+            if self._executor is None or workers != self._workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+                self._workers = workers
+            return self._executor, workers
+
+    def _reset_pool(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cached_text(self, path):
+        return self.cache.get(path)
+
+    def submit(self, path, filename=None, cache=True, cleanup=False):
+        """Start extracting `path` in the background and return its job.
+
+        A cache hit returns an already-finished job; a second submit for a
+        file that is still being extracted returns the running job.
+        """
+        key = os.path.realpath(path)
+        if cache:
+            text = self.cache.get(key)
+            if text is not None:
+                job = ExtractionJob(path, filename, cache=cache)
+                job._update(state="done", text=text, finished_at=time.time())
+                self._register(job)
+                return job
+            with self._lock:
+                running = self._jobs.get(self._by_path.get(key))
+                if running is not None and not running.finished:
+                    return running
+        job = ExtractionJob(path, filename, cache=cache, cleanup=cleanup)
+        self._register(job)
+        if cache:
+            with self._lock:
+                self._by_path[key] = job.id
+        threading.Thread(target=self._run, args=(job,), daemon=True, name=f"doc-extract-{job.id}").start()
+        return job
+
+    def submit_bytes(self, raw, filename):
+        """Extract an uploaded file that isn't kept on disk (/parse_document)."""
+        suffix = os.path.splitext(filename or "")[1].lower()
+        fd, tmp_path = tempfile.mkstemp(suffix=suffix, prefix="hwui_extract_")
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        return self.submit(tmp_path, filename=filename, cache=False, cleanup=True)
+
+    def extract(self, path, timeout=None):
+        """Blocking extraction through the cache and the pool; raises ExtractionError."""
+        job = self.submit(path)
+        job.wait(timeout)
+        if job.state != "done":
+            raise ExtractionError(job.error or "Extraction timed out")
+        return job.text
+
+    def _register(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [jid for jid, j in self._jobs.items() if j.finished]
+            for jid in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[jid]
+
+    def _run(self, job):
+        started = time.time()
+        try:
+            if not job.path.lower().endswith(SUPPORTED_EXTENSIONS):
+                raise ExtractionError(f"Unsupported file type: {job.filename}")
+            stat = os.stat(job.path)
+            job._update(state="running")
+            try:
+                text = self._extract(job)
+            except BrokenProcessPool:
+                # A worker died (e.g. a pathological PDF) — rebuild and retry once.
+                self._reset_pool()
+                text = self._extract(job)
+            if job.cache:
+                self.cache.put(job.path, text, stat)
+            job._update(state="done", text=text, finished_at=time.time())
+            if job.pages_total and job.pages_total >= PDF_SPLIT_MIN_PAGES:
+                print(f"📄 Extracted {job.filename}: {job.pages_total} pages, {len(text)} chars "
+                      f"in {time.time() - started:.1f}s")
+        except Exception as e:
+            if not isinstance(e, ExtractionError):
+                logging.error(f"❌ Document extraction failed for {job.filename}: {e}")
+            job._update(state="failed", error=str(e), finished_at=time.time())
+        finally:
+            if job.cleanup:
+                try:
+                    os.unlink(job.path)
+                except OSError:
+                    pass
+            with self._lock:
+                key = os.path.realpath(job.path)
+                if self._by_path.get(key) == job.id:
+                    del self._by_path[key]
+
+    @staticmethod
+    def _submit(executor, fn, *args):
+        with _launching_script_hidden():
+            return executor.submit(fn, *args)
+
+    def _extract(self, job):
+        executor, workers = self._pool()
+        if not job.path.lower().endswith('.pdf'):
+            return self._submit(executor, _extract_file, job.path).result()
+        page_count = self._submit(executor, _pdf_page_count, job.path).result()
+        job._update(pages_total=page_count, pages_done=0)
+        ranges = page_ranges(page_count, workers)
+        futures = {self._submit(executor, _extract_pdf_range, job.path, start, end): (start, end)
+                   for start, end in ranges}
+        parts = {}
+        for future in as_completed(futures):
+            start, end = futures[future]
+            parts[start] = future.result()
+            job._update(pages_done=job.pages_done + (end - start))
+        return "".join(parts[start] for start, _end in ranges)
+
+
+extractor = DocumentExtractor()
@@ -3,8 +3,6 @@ import os
 import json
 import base64
 from io import BytesIO
-from PIL import Image
-from PIL.PngImagePlugin import PngInfo
 
 # --------------------------------------------------
 # Blueprint setup
@@ -163,96 +161,105 @@ def restore_last_chat():
 # --------------------------------------------------
 # Opening Lines Management (Disk-Based)
 # --------------------------------------------------
-@extra.route('/get_opening_lines/<character>', methods=['GET'])
-def get_opening_lines(character):
-    """Load opening lines from disk for a character."""
+def load_opening_lines(character):
+    """Opening lines for a character with {{char}}/{{user}} already substituted.
+
+    Shared by the GET route and the TTS cache's opening-line pre-render, so
+    both see exactly the text the chat UI will show (and speak).
+    """
+    opening_lines_dir = os.path.join(os.path.dirname(__file__), "opening_lines")
+    os.makedirs(opening_lines_dir, exist_ok=True)
+
+    filepath = os.path.join(opening_lines_dir, f"{character}.json")
+
+    if not os.path.exists(filepath):
+        return {
+            "enabled": False,
+            "lines": [],
+            "questions_enabled": False,
+            "questions": []
+        }
+
+    with open(filepath, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    # 🏷️ {{char}}/{{user}} substitution happens on the BACKEND (not utils.js)
+    # so there is one Python definition of the placeholders. Reuse the same
+    # helper chat() uses (deferred import — app.py imports this module at load,
+    # so a top-level import would be circular).
+    from app_runtime_helpers import substitute_placeholders
+
+    _root = os.path.dirname(__file__)
+
+    # char label: characters/<character>.json -> "name", fallback to the URL
+    # param (same as chat(): char_data.get("name", character_name)).
+    _char_label = character
     try:
-        opening_lines_dir = os.path.join(os.path.dirname(__file__), "opening_lines")
-        os.makedirs(opening_lines_dir, exist_ok=True)
-        
-        filepath = os.path.join(opening_lines_dir, f"{character}.json")
+        _cpath = os.path.join(_root, "characters", f"{character}.json")
+        if os.path.exists(_cpath):
+            with open(_cpath, "r", encoding="utf-8") as _cf:
+                _cdata = json.load(_cf)
+            _char_label = _cdata.get("name") or character
+    except Exception as _ce:
+        print(f"⚠️ opening-lines: char label load failed: {_ce}")
+
+    # user label: this GET endpoint receives no user name, so resolve the
+    # ACTIVE persona the same way /get_active_user does (users/index.json ->
+    # the one with "active": true, else first) and use its display_name with
+    # name fallback (mirrors chat(): user_display_name or user_name).
+    _user_label = ""
+    try:
+        _users_dir = os.path.join(_root, "users")
+        with open(os.path.join(_users_dir, "index.json"), "r", encoding="utf-8") as _uf:
+            _ulist = json.load(_uf)
+        _chosen = None
+        for _n in _ulist:
+            _p = os.path.join(_users_dir, f"{_n}.json")
+            if os.path.exists(_p):
+                with open(_p, "r", encoding="utf-8") as _puf:
+                    _ud = json.load(_puf)
+                if _ud.get("active"):
+                    _chosen = _ud.get("display_name") or _n
+                    break
+        if _chosen is None and _ulist:
+            _first = _ulist[0]
+            _fp = os.path.join(_users_dir, f"{_first}.json")
+            if os.path.exists(_fp):
+                with open(_fp, "r", encoding="utf-8") as _fuf:
+                    _fd = json.load(_fuf)
+                _chosen = _fd.get("display_name") or _first
+            else:
+                _chosen = _first
+        _user_label = _chosen or ""
+    except Exception as _ue:
+        print(f"⚠️ opening-lines: user label resolve failed: {_ue}")
 
-        if not os.path.exists(filepath):
-            return jsonify({
-                "enabled": False,
-                "lines": [],
-                "questions_enabled": False,
-                "questions": []
-            })
+    # Substitute each opening line through the shared helper. Empty labels
+    # leave the placeholder untouched (handled inside the helper).
+    _lines = data.get("lines", [])
+    if isinstance(_lines, list):
+        data["lines"] = [
+            substitute_placeholders(_ln, _char_label, _user_label) for _ln in _lines
+        ]
 
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    _questions = data.get("questions", [])
+    if isinstance(_questions, list):
+        data["questions"] = [
+            substitute_placeholders(_question, _char_label, _user_label)
+            for _question in _questions
+        ]
 
-        # 🏷️ {{char}}/{{user}} substitution happens on the BACKEND (not utils.js)
-        # so there is one Python definition of the placeholders. Reuse the same
-        # helper chat() uses (deferred import — app.py imports this module at load,
-        # so a top-level import would be circular).
-        from app_runtime_helpers import substitute_placeholders
+    data.setdefault("questions_enabled", False)
+    data.setdefault("questions", [])
 
-        _root = os.path.dirname(__file__)
+    return data
 
-        # char label: characters/<character>.json -> "name", fallback to the URL
-        # param (same as chat(): char_data.get("name", character_name)).
-        _char_label = character
-        try:
-            _cpath = os.path.join(_root, "characters", f"{character}.json")
-            if os.path.exists(_cpath):
-                with open(_cpath, "r", encoding="utf-8") as _cf:
-                    _cdata = json.load(_cf)
-                _char_label = _cdata.get("name") or character
-        except Exception as _ce:
-            print(f"⚠️ opening-lines: char label load failed: {_ce}")
-
-        # user label: this GET endpoint receives no user name, so resolve the
-        # ACTIVE persona the same way /get_active_user does (users/index.json ->
-        # the one with "active": true, else first) and use its display_name with
-        # name fallback (mirrors chat(): user_display_name or user_name).
-        _user_label = ""
-        try:
-            _users_dir = os.path.join(_root, "users")
-            with open(os.path.join(_users_dir, "index.json"), "r", encoding="utf-8") as _uf:
-                _ulist = json.load(_uf)
-            _chosen = None
-            for _n in _ulist:
-                _p = os.path.join(_users_dir, f"{_n}.json")
-                if os.path.exists(_p):
-                    with open(_p, "r", encoding="utf-8") as _puf:
-                        _ud = json.load(_puf)
-                    if _ud.get("active"):
-                        _chosen = _ud.get("display_name") or _n
-                        break
-            if _chosen is None and _ulist:
-                _first = _ulist[0]
-                _fp = os.path.join(_users_dir, f"{_first}.json")
-                if os.path.exists(_fp):
-                    with open(_fp, "r", encoding="utf-8") as _fuf:
-                        _fd = json.load(_fuf)
-                    _chosen = _fd.get("display_name") or _first
-                else:
-                    _chosen = _first
-            _user_label = _chosen or ""
-        except Exception as _ue:
-            print(f"⚠️ opening-lines: user label resolve failed: {_ue}")
-
-        # Substitute each opening line through the shared helper. Empty labels
-        # leave the placeholder untouched (handled inside the helper).
-        _lines = data.get("lines", [])
-        if isinstance(_lines, list):
-            data["lines"] = [
-                substitute_placeholders(_ln, _char_label, _user_label) for _ln in _lines
-            ]
-
-        _questions = data.get("questions", [])
-        if isinstance(_questions, list):
-            data["questions"] = [
-                substitute_placeholders(_question, _char_label, _user_label)
-                for _question in _questions
-            ]
-
-        data.setdefault("questions_enabled", False)
-        data.setdefault("questions", [])
-
-        return jsonify(data)
+
+@extra.route('/get_opening_lines/<character>', methods=['GET'])
+def get_opening_lines(character):
+    """Load opening lines from disk for a character."""
+    try:
+        return jsonify(load_opening_lines(character))
         
     except Exception as e:
         print(f"âŒ Error loading opening lines for {character}: {e}")
@@ -1,8 +1,8 @@
 import sys
 import os
 import re
+import inspect
 import time
-import tempfile
 from io import BytesIO
 import numpy as np
 import soundfile as sf
@@ -11,6 +11,8 @@ from flask import Flask, request, send_file, jsonify
 import torch
 
 from tts_path_config import apply_tts_path_overrides
+from tts_synthesis_queue import SynthesisQueue
+from tts_cache import voice_file_version
 
 apply_tts_path_overrides()
 
@@ -49,7 +51,144 @@ print("-----------------------------------------------")
 from f5_tts.api import F5TTS
 tts = F5TTS(ckpt_file=F5_CHECKPOINT, device=device)
 tts_lock = Lock()
+# Requests are served one at a time in arrival order by the queue's worker.
+# F5's infer_batch_process concatenates its batches into one waveform, so
+# there is no per-sentence batched path to plug in — FIFO only.
+synthesis_queue = SynthesisQueue("f5")
 print("✅ F5-TTS model loaded and ready.")
+# ----------------------------------------------------------------
+# REFERENCE CACHE — per-voice preprocessed reference audio + text
+# ----------------------------------------------------------------
+# tts.infer(ref_file=...) re-runs preprocess_ref_audio_text (silence trim,
+# clip, re-export), reloads the wav and resamples it on EVERY sentence. The
+# reference never changes between sentences, so do that once per voice and
+# hand the cached tensor straight to infer_batch_process. Entries are keyed
+# on the wav/txt mtimes, so editing or replacing a voice picks up on the
+# next request without a restart.
+#
+# The fast path calls f5_tts internals directly, so the call shapes used below
+# are checked against their signatures once, here; a release that changed
+# them falls back to tts.infer. A TypeError at inference time is a real error.
+_FAST_PATH_CALLS = (
+    # (function name, positional args passed, keyword args passed)
+    ("preprocess_ref_audio_text", 2, ("show_info",)),
+    ("infer_batch_process", 5, ("mel_spec_type", "target_rms", "cross_fade_duration", "nfe_step",
+                                "cfg_strength", "sway_sampling_coef", "speed", "device")),
+    ("chunk_text", 1, ("max_chars",)),
+)
+
+
+def _fast_path_drift(functions):
+    """Describe the first fast-path call an f5_tts function no longer accepts, or None."""
+    for name, positional, keywords in _FAST_PATH_CALLS:
+        try:
+            inspect.signature(functions[name]).bind(*([None] * positional), **dict.fromkeys(keywords))
+        except TypeError as e:
+            return f"{name}(): {e}"
+    return None
+
+
+try:
+    import torchaudio
+    from f5_tts.infer.utils_infer import (
+        preprocess_ref_audio_text, infer_batch_process, chunk_text, target_sample_rate,
+    )
+    _drift = _fast_path_drift({
+        "preprocess_ref_audio_text": preprocess_ref_audio_text,
+        "infer_batch_process": infer_batch_process,
+        "chunk_text": chunk_text,
+    })
+    if _drift:
+        raise ImportError(f"f5_tts signature changed: {_drift}")
+    _ref_fast_path = True
+except Exception as _ref_import_err:
+    print(f"⚠️  Reference cache unavailable, using tts.infer per request: {_ref_import_err}")
+    _ref_fast_path = False
+
+_ref_cache = {}
+_ref_cache_lock = Lock()
+
+
+def voice_paths(voice):
+    return os.path.join(VOICES_DIR, f"{voice}.wav"), os.path.join(VOICES_DIR, f"{voice}.txt")
+
+
+def load_reference(voice):
+    """Return the cached reference entry for `voice`, (re)building it if the
+    voice files changed. Raises FileNotFoundError if the voice is missing."""
+    wav_path, txt_path = voice_paths(voice)
+    wav_stat, txt_stat = os.stat(wav_path), os.stat(txt_path)
+    stamp = (wav_stat.st_mtime_ns, wav_stat.st_size, txt_stat.st_mtime_ns, txt_stat.st_size)
+    with _ref_cache_lock:
+        entry = _ref_cache.get(voice)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry
+
+    with open(txt_path, "r", encoding="utf-8") as f:
+        raw_text = f.read().strip()
+    entry = {"stamp": stamp, "wav_path": wav_path, "raw_text": raw_text, "ref_text": raw_text}
+    if _ref_fast_path:
+        t_start = time.time()
+        processed_file, ref_text = preprocess_ref_audio_text(wav_path, raw_text, show_info=lambda *_: None)
+        audio, sr = torchaudio.load(processed_file)
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+        if sr != target_sample_rate:
+            audio = torchaudio.transforms.Resample(sr, target_sample_rate)(audio)
+            sr = target_sample_rate
+        entry.update({
+            "audio": audio,
+            "sr": sr,
+            "ref_text": ref_text,
+            "duration": audio.shape[-1] / sr,
+        })
+        print(f"🎙️  Reference cached: {voice} ({entry['duration']:.1f}s) in {time.time() - t_start:.2f}s")
+    with _ref_cache_lock:
+        _ref_cache[voice] = entry
+    return entry
+
+
+def synthesize(ref, gen_text, nfe_step, cfg_strength, speed=1.0):
+    """Run F5 on a cached reference. Returns (wav ndarray, sample_rate).
+
+    Mirrors what F5TTS.infer does after its own preprocessing: batch the text
+    to fit the 22s window the reference leaves, then infer_batch_process.
+    Caller holds tts_lock.
+    """
+    if _ref_fast_path and "audio" in ref:
+        duration = ref["duration"]
+        max_chars = int(len(ref["ref_text"].encode("utf-8")) / duration * (22 - duration) * speed)
+        result = infer_batch_process(
+            (ref["audio"], ref["sr"]),
+            ref["ref_text"],
+            chunk_text(gen_text, max_chars=max(max_chars, 1)),
+            tts.ema_model,
+            tts.vocoder,
+            mel_spec_type=tts.mel_spec_type,
+            target_rms=0.1,
+            cross_fade_duration=0.15,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=-1,
+            speed=speed,
+            device=device,
+        )
+        # Newer f5_tts makes infer_batch_process a generator (streaming support).
+        if hasattr(result, "__next__"):
+            result = next(result)
+        wav, sr, _ = result
+        return wav, sr
+    wav, sr, _ = tts.infer(
+        ref_file=ref["wav_path"],
+        ref_text=ref["raw_text"],
+        gen_text=gen_text,
+        speed=speed,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength
+    )
+    return wav, sr
+
+
 # ----------------------------------------------------------------
 # GPU WARMUP — silent inference on startup so first real request is fast
 # ----------------------------------------------------------------
@@ -62,23 +201,8 @@ def warmup():
             return
         # Use Sol as preferred warmup voice, fallback to first available
         voice = "Sol" if "Sol" in voices else voices[0]
-        wav_path = os.path.join(VOICES_DIR, f"{voice}.wav")
-        txt_path = os.path.join(VOICES_DIR, f"{voice}.txt")
-        with open(txt_path, "r", encoding="utf-8") as f:
-            ref_text = f.read().strip()
-        tmp_path = tempfile.mktemp(suffix=".wav")
         print(f"🔥 Warming up GPU with voice: {voice}...")
-        tts.infer(
-            ref_file=wav_path,
-            ref_text=ref_text,
-            gen_text=". Warmup.",
-            file_wave=tmp_path,
-            speed=1.0,
-            nfe_step=24,
-            cfg_strength=1.0
-        )
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        synthesize(load_reference(voice), ". Warmup.", nfe_step=24, cfg_strength=1.0)
         print("✅ GPU warmup complete — ready for fast first response.")
     except Exception as e:
         print(f"⚠️  Warmup failed (non-critical): {e}")
@@ -504,15 +628,11 @@ def tts_to_audio():
     if not text.strip():
         return jsonify({'error': 'No text provided'}), 400
 
-    wav_path = os.path.join(VOICES_DIR, f"{voice}.wav")
-    txt_path = os.path.join(VOICES_DIR, f"{voice}.txt")
-
-    if not os.path.exists(wav_path) or not os.path.exists(txt_path):
+    try:
+        ref = load_reference(voice)
+    except FileNotFoundError:
         return jsonify({'error': f'Voice files for "{voice}" not found in {VOICES_DIR}'}), 400
 
-    with open(txt_path, 'r', encoding='utf-8') as f:
-        ref_text = f.read().strip()
-
     try:
         # nfe_step = diffusion steps. It is the main speed knob — generation
         # time scales with it. F5 default is 32; we run lower. Quality cost of
@@ -525,15 +645,10 @@ def tts_to_audio():
         nfe = 16 if first_chunk else 20
 
         t_start = time.time()
-        with tts_lock:
-            wav, sr, _ = tts.infer(
-                ref_file=wav_path,
-                ref_text=ref_text,
-                gen_text=text,
-                speed=1.0,
-                nfe_step=nfe,
-                cfg_strength=2.0
-            )
+        def _run():
+            with tts_lock:
+                return synthesize(ref, text, nfe_step=nfe, cfg_strength=2.0)
+        wav, sr = synthesis_queue.call(_run)
         elapsed = time.time() - t_start
         print(f"✅ Generated in {elapsed:.2f}s | Voice: {voice} | nfe_step: {nfe}{'  [first chunk]' if first_chunk else ''}")
         wav = trim_leading_silence(wav, sr)
@@ -551,16 +666,13 @@ def warmup_endpoint():
     """Lightweight GPU warmup — low nfe_step to heat GPU fast without blocking real requests long."""
     data = request.json or {}
     voice = data.get('voice', DEFAULT_VOICE).replace('.wav', '')
-    wav_path = os.path.join(VOICES_DIR, f"{voice}.wav")
-    txt_path = os.path.join(VOICES_DIR, f"{voice}.txt")
+    wav_path, txt_path = voice_paths(voice)
     if not os.path.exists(wav_path) or not os.path.exists(txt_path):
         voice = DEFAULT_VOICE
-        wav_path = os.path.join(VOICES_DIR, f"{voice}.wav")
-        txt_path = os.path.join(VOICES_DIR, f"{voice}.txt")
     try:
-        with open(txt_path, 'r', encoding='utf-8') as f:
-            ref_text = f.read().strip()
-        tmp_path = tempfile.mktemp(suffix='.wav')
+        # Build (or refresh) the reference cache first — this is the part that
+        # matters for the voice the user just picked, and it needs no lock.
+        ref = load_reference(voice)
 
         # Try to acquire tts_lock non-blocking — if a real request is already running,
         # skip warmup entirely. F5 internals are not thread-safe; concurrent inferences
@@ -568,15 +680,12 @@ def warmup_endpoint():
         acquired = tts_lock.acquire(blocking=False)
         if not acquired:
             print(f"⚠️  Warmup skipped — real inference in progress")
-            return jsonify({"status": "skipped", "reason": "inference in progress"})
+            return jsonify({"status": "skipped", "reason": "inference in progress", "reference_cached": True})
         try:
-            tts.infer(ref_file=wav_path, ref_text=ref_text, gen_text=". Warmup.",
-                      file_wave=tmp_path, speed=1.0, nfe_step=8, cfg_strength=1.0)
+            synthesize(ref, ". Warmup.", nfe_step=8, cfg_strength=1.0)
         finally:
             tts_lock.release()
 
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
         print(f"🔥 Warmup complete for: {voice}")
         return jsonify({"status": "ok"})
     except Exception as e:
@@ -587,19 +696,23 @@ def status():
     return jsonify({
         "status": "online",
         "device": device,
-        "gpu": torch.cuda.get_device_name(0) if device == "cuda" else "none"
+        "gpu": torch.cuda.get_device_name(0) if device == "cuda" else "none",
+        "queue": synthesis_queue.stats(),
     })
 
 @app.route('/voices', methods=['GET'])
 def list_voices():
     """List available voices (any .wav with matching .txt)."""
     voices = []
+    versions = {}
     for f in os.listdir(VOICES_DIR):
         if f.endswith('.wav'):
             name = f.replace('.wav', '')
             if os.path.exists(os.path.join(VOICES_DIR, f"{name}.txt")):
                 voices.append(name)
-    return jsonify({"voices": voices})
+                # Same stamp load_reference() rebuilds on — HWUI keys its audio cache on it.
+                versions[name] = voice_file_version(*voice_paths(name))
+    return jsonify({"voices": voices, "versions": versions})
 
 if __name__ == '__main__':
     print(f"🚀 F5-TTS server starting on port 8003...")
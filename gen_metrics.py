@@ -0,0 +1,278 @@
+"""Generation metrics: Prometheus counters/histograms plus a per-turn window.
+
+/token_stats only shows the last turn (_LAST_TOKEN_STATS in app.py), which
+every turn overwrites — so a slow decode an hour ago, a drift in cache reuse
+or a run of `n_predict` cutoffs is invisible. This module keeps:
+
+  * process-lifetime counters and histograms (TTFT, prompt tokens, prefill and
+    decode tok/s from llama.cpp `timings`, cached-prompt reuse, stop reasons,
+    TTS synthesis time, web-search latency) labelled by backend, model and
+    character, rendered in Prometheus text format at GET /metrics;
+  * a bounded window of per-turn records for the token monitor, served at
+    GET /token_stats/history.
+
+Per-turn labels are bound by the request thread (chat() calls bind() once it
+knows the character) and picked up by observe_generation() at end-of-stream,
+so concurrent requests never mix their numbers. A stream that runs on a worker
+thread (an N-best candidate) binds a turn_labels() copy taken on the request
+thread. No prometheus_client dependency — the text format is simple enough to
+render here.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+WINDOW_SIZE = 240
+
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+TOKENS_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 40, 80, 160, 320, 640, 1280, 2560)
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 60)
+
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_num(x):
+    if x == float("inf"):
+        return "+Inf"
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._series.items())
+            lines.extend(self._render_series(items))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, items):
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        if value is None:
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def _render_series(self, items):
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                le = _fmt_labels(self.labelnames, key, [("le", _fmt_num(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _fmt_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_fmt_num(round(series['sum'], 6))}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=SECONDS_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+_GEN_LABELS = ("backend", "model", "character")
+
+generations_total = registry.counter(
+    "hwui_generations_total", "Completed generations.", _GEN_LABELS)
+generated_tokens_total = registry.counter(
+    "hwui_generated_tokens_total", "Tokens generated.", _GEN_LABELS)
+stop_reasons_total = registry.counter(
+    "hwui_stop_reasons_total", "Generations by stop reason (eos, word, limit, aborted, unknown).",
+    ("backend", "model", "reason"))
+ttft_seconds = registry.histogram(
+    "hwui_ttft_seconds", "Time from sending the request to the first streamed token.",
+    _GEN_LABELS, TTFT_BUCKETS)
+prompt_tokens = registry.histogram(
+    "hwui_prompt_tokens", "Prompt size in tokens.", _GEN_LABELS, TOKENS_BUCKETS)
+cached_prompt_tokens = registry.histogram(
+    "hwui_cached_prompt_tokens", "Prompt tokens reused from the llama.cpp slot's KV cache.",
+    _GEN_LABELS, TOKENS_BUCKETS)
+prefill_tokens_per_second = registry.histogram(
+    "hwui_prefill_tokens_per_second", "Prompt processing speed reported by llama.cpp.",
+    _GEN_LABELS, RATE_BUCKETS)
+decode_tokens_per_second = registry.histogram(
+    "hwui_decode_tokens_per_second", "Generation speed reported by llama.cpp.",
+    _GEN_LABELS, RATE_BUCKETS)
+tts_synthesis_seconds = registry.histogram(
+    "hwui_tts_synthesis_seconds", "Time to render one TTS sentence.", ("engine", "cache"))
+web_search_seconds = registry.histogram(
+    "hwui_web_search_seconds", "Web search latency including page fetches.", ("provider", "outcome"))
+
+_window = deque(maxlen=WINDOW_SIZE)
+_window_lock = threading.Lock()
+
+
+def bind(**labels):
+    """Attach per-turn labels/fields (character, prompt-side stats) to this thread."""
+    turn = getattr(_local, "turn", None)
+    if turn is None:
+        turn = _local.turn = {}
+    turn.update(labels)
+
+
+def reset():
+    _local.turn = {}
+
+
+def turn_labels():
+    """Copy of this thread's bound labels, to re-bind() on a worker thread."""
+    return dict(_turn())
+
+
+def _turn():
+    return getattr(_local, "turn", None) or {}
+
+
+def stop_reason_code(stop_type=None, eos=False, word=False, limit=False, aborted=False):
+    if aborted:
+        return "aborted"
+    if eos or stop_type == "eos":
+        return "eos"
+    if word or stop_type == "word":
+        return "word"
+    if limit or stop_type == "limit":
+        return "limit"
+    return "unknown"
+
+
+def observe_generation(backend, model, ttft=None, stop_reason=None, tokens_predicted=None,
+                       tokens_evaluated=None, tokens_cached=None, timings=None, elapsed=None):
+    """Record one finished generation; returns the window record."""
+    turn = _turn()
+    labels = {"backend": backend or "", "model": model or "", "character": turn.get("character") or ""}
+    timings = timings or {}
+    prefill_rate = timings.get("prompt_per_second")
+    decode_rate = timings.get("predicted_per_second")
+    if tokens_cached is None and isinstance(tokens_evaluated, int) and isinstance(timings.get("prompt_n"), int):
+        tokens_cached = max(0, tokens_evaluated - timings["prompt_n"])
+    n_prompt = tokens_evaluated if isinstance(tokens_evaluated, int) else turn.get("prompt_tokens")
+
+    generations_total.inc(**labels)
+    if isinstance(tokens_predicted, int):
+        generated_tokens_total.inc(tokens_predicted, **labels)
+    stop_reasons_total.inc(backend=labels["backend"], model=labels["model"], reason=stop_reason or "unknown")
+    ttft_seconds.observe(ttft, **labels)
+    prompt_tokens.observe(n_prompt, **labels)
+    cached_prompt_tokens.observe(tokens_cached, **labels)
+    prefill_tokens_per_second.observe(prefill_rate, **labels)
+    decode_tokens_per_second.observe(decode_rate, **labels)
+
+    record = dict(labels)
+    record.update({
+        "ts": time.time(),
+        "ttft_ms": round(ttft * 1000) if ttft is not None else None,
+        "elapsed_ms": round(elapsed * 1000) if elapsed is not None else None,
+        "prompt_tokens": n_prompt,
+        "cached_tokens": tokens_cached,
+        "generated_tokens": tokens_predicted,
+        "prefill_tps": round(prefill_rate, 1) if isinstance(prefill_rate, (int, float)) else None,
+        "decode_tps": round(decode_rate, 1) if isinstance(decode_rate, (int, float)) else None,
+        "stop_reason": stop_reason,
+        "ctx_size": turn.get("ctx_size"),
+        "n_predict": turn.get("n_predict"),
+    })
+    with _window_lock:
+        _window.append(record)
+    return record
+
+
+def window(limit=None):
+    """Per-turn records, oldest first."""
+    with _window_lock:
+        items = list(_window)
+    return items[-limit:] if limit else items
+
+
+def window_summary(records):
+    """Averages the token monitor shows next to the last turn."""
+    def avg(field):
+        values = [r[field] for r in records if isinstance(r.get(field), (int, float))]
+        return round(sum(values) / len(values), 1) if values else None
+    return {
+        "turns": len(records),
+        "avg_ttft_ms": avg("ttft_ms"),
+        "avg_prefill_tps": avg("prefill_tps"),
+        "avg_decode_tps": avg("decode_tps"),
+        "avg_cached_tokens": avg("cached_tokens"),
+    }
+
+
+def render():
+    return registry.render()
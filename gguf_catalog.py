@@ -0,0 +1,428 @@
+"""GGUF header reader and persistent model catalog for the model picker.
+
+read_gguf_header() maps a .gguf file and walks only the key/value metadata
+and tensor-info sections at the front of the file — tensor data (the other
+99.9% of a multi-GB model) is never touched, so a header costs a few pages of
+I/O. Large arrays (the tokenizer vocab, merges) are skipped by length rather
+than decoded.
+
+ModelCatalog keeps one summary per model (architecture, quantisation,
+parameter count, training context, chat-template family, file size) in
+model_catalog.json, stamped with the file's size and mtime so entries are only
+re-read when a model actually changes. Headers for new files are parsed on a
+background thread; /list_models serves whatever is already known and the
+rest fills in on the next call.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from typing import Any
+
+
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_catalog.json")
+CATALOG_VERSION = 1
+
+GGUF_MAGIC = b"GGUF"
+# Arrays longer than this are recorded by length only (tokenizer vocab etc.).
+MAX_INLINE_ARRAY = 64
+
+# GGUF value types → struct format (None = variable length).
+_SCALAR_FORMATS = {
+    0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i",
+    6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d",
+}
+_TYPE_STRING = 8
+_TYPE_ARRAY = 9
+
+# llama_ftype (general.file_type) → the name llama.cpp's quantize tool uses.
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S",
+    15: "Q4_K_M", 16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS",
+    20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S",
+    25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S", 29: "IQ2_M",
+    30: "IQ4_XS", 31: "IQ1_M", 32: "BF16", 36: "TQ1_0", 37: "TQ2_0",
+}
+_QUANT_IN_NAME_RE = re.compile(r"(?:^|[-_.])((?:I?Q\d(?:_[A-Z0-9]+)*)|F16|F32|BF16)(?=[-_.]|$)", re.IGNORECASE)
+
+# KV-cache element size per --cache-type-k/v value, for context sizing.
+_CACHE_TYPE_BYTES = {"f32": 4.0, "f16": 2.0, "bf16": 2.0, "q8_0": 1.0625, "q5_1": 0.75,
+                     "q5_0": 0.6875, "q4_1": 0.625, "q4_0": 0.5625, "iq4_nl": 0.5625}
+
+
+class GGUFError(Exception):
+    pass
+
+
+class _Reader:
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def unpack(self, fmt):
+        try:
+            value = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        except struct.error as e:
+            raise GGUFError(f"truncated header at byte {self.pos}") from e
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def string(self, decode=True):
+        length = self.unpack("<Q")
+        if self.pos + length > len(self.buf):
+            raise GGUFError(f"string runs past end of file at byte {self.pos}")
+        raw = self.buf[self.pos:self.pos + length] if decode else None
+        self.pos += length
+        return raw.decode("utf-8", errors="replace") if decode else None
+
+    def value(self, vtype):
+        if vtype in _SCALAR_FORMATS:
+            return self.unpack(_SCALAR_FORMATS[vtype])
+        if vtype == _TYPE_STRING:
+            return self.string()
+        if vtype == _TYPE_ARRAY:
+            etype = self.unpack("<I")
+            count = self.unpack("<Q")
+            if count > MAX_INLINE_ARRAY:
+                self.skip_array(etype, count)
+                return {"array_length": count}
+            return [self.value(etype) for _ in range(count)]
+        raise GGUFError(f"unknown value type {vtype} at byte {self.pos}")
+
+    def skip_array(self, etype, count):
+        if etype in _SCALAR_FORMATS:
+            self.pos += struct.calcsize(_SCALAR_FORMATS[etype]) * count
+        elif etype == _TYPE_STRING:
+            for _ in range(count):
+                self.string(decode=False)
+        else:
+            for _ in range(count):
+                self.value(etype)
+
+
+def read_gguf_header(path: str) -> dict[str, Any]:
+    """Return {'version', 'metadata', 'tensor_count', 'param_count'} for a .gguf file."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:4] != GGUF_MAGIC:
+                raise GGUFError("not a GGUF file")
+            reader = _Reader(buf)
+            reader.pos = 4
+            version = reader.unpack("<I")
+            if version < 2:
+                raise GGUFError(f"GGUF v{version} is not supported")
+            tensor_count = reader.unpack("<Q")
+            kv_count = reader.unpack("<Q")
+            metadata = {}
+            for _ in range(kv_count):
+                key = reader.string()
+                metadata[key] = reader.value(reader.unpack("<I"))
+            param_count = 0
+            for _ in range(tensor_count):
+                reader.string(decode=False)
+                n_dims = reader.unpack("<I")
+                elements = 1
+                for _ in range(n_dims):
+                    elements *= reader.unpack("<Q")
+                reader.pos += 4 + 8  # ggml type, data offset
+                param_count += elements
+    return {
+        "version": version,
+        "metadata": metadata,
+        "tensor_count": tensor_count,
+        "param_count": param_count,
+    }
+
+
+def _template_family(template):
+    if not template:
+        return None
+    markers = (
+        ("chatml", "<|im_start|>"),
+        ("llama3", "<|start_header_id|>"),
+        ("gemma", "<start_of_turn>"),
+        ("mistral", "[INST]"),
+        ("phi3", "<|assistant|>"),
+        ("deepseek", "<｜Assistant｜>"),
+    )
+    for family, marker in markers:
+        if marker in template:
+            return family
+    return "custom"
+
+
+def _quant_from_name(filename):
+    match = _QUANT_IN_NAME_RE.search(os.path.splitext(filename)[0])
+    return match.group(1).upper() if match else None
+
+
+def summarize_header(path: str, header: dict[str, Any]) -> dict[str, Any]:
+    meta = header["metadata"]
+    arch = meta.get("general.architecture")
+
+    def arch_key(name):
+        value = meta.get(f"{arch}.{name}") if arch else None
+        return value if isinstance(value, (int, float)) else None
+
+    file_type = meta.get("general.file_type")
+    template = meta.get("tokenizer.chat_template")
+    head_count = arch_key("attention.head_count")
+    head_count_kv = arch_key("attention.head_count_kv") or head_count
+    embedding = arch_key("embedding_length")
+    key_length = arch_key("attention.key_length")
+    value_length = arch_key("attention.value_length")
+    if head_count and embedding and not key_length:
+        key_length = value_length = embedding // head_count
+    return {
+        "architecture": arch,
+        "name": meta.get("general.name"),
+        "quant": FILE_TYPES.get(file_type) if isinstance(file_type, int) else _quant_from_name(os.path.basename(path)),
+        "param_count": header["param_count"],
+        "n_ctx_train": arch_key("context_length"),
+        "block_count": arch_key("block_count"),
+        "head_count_kv": head_count_kv,
+        "key_length": key_length,
+        "value_length": value_length or key_length,
+        "chat_template": _template_family(template if isinstance(template, str) else None),
+        "split_count": meta.get("split.count"),
+        "gguf_version": header["version"],
+    }
+
+
+def kv_bytes_per_token(entry, cache_type_k="f16", cache_type_v="f16"):
+    """Approximate KV-cache bytes per context token, or None if unknown."""
+    layers = entry.get("block_count")
+    heads = entry.get("head_count_kv")
+    k_len = entry.get("key_length")
+    v_len = entry.get("value_length")
+    if not (layers and heads and k_len and v_len):
+        return None
+    k = _CACHE_TYPE_BYTES.get(str(cache_type_k).lower(), 2.0)
+    v = _CACHE_TYPE_BYTES.get(str(cache_type_v).lower(), 2.0)
+    return int(layers * heads * (k_len * k + v_len * v))
+
+
+def recommended_ctx_size(entry, requested=None, fallback=16384):
+    """Pick a --ctx-size for a model.
+
+    An explicit positive `requested` is always kept — running above the
+    training context is legitimate with RoPE scaling, so callers only warn.
+    0 / "auto" / missing means "model's training context, capped at
+    `fallback`"; without catalog metadata that is `fallback` itself.
+    """
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        requested = 0
+    if requested > 0:
+        return requested
+    trained = (entry or {}).get("n_ctx_train")
+    return min(trained, fallback) if trained else fallback
+
+
+def _atomic_write_json(path, payload):
+    directory = os.path.dirname(path) or "."
+    fd, temporary = tempfile.mkstemp(suffix=".tmp", prefix=".catalog_", dir=directory, text=True)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False, indent=2)
+        os.replace(temporary, path)
+    except Exception:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+
+
+class ModelCatalog:
+    def __init__(self, catalog_file=CATALOG_FILE):
+        self.catalog_file = catalog_file
+        self._lock = threading.Lock()
+        self._entries = None      # abs path -> summary (+ size/mtime_ns stamp)
+        self._listing = {}        # folder -> (mtime_ns, [gguf names], [subdirs])
+        self._labels = {}         # folder -> (mtime_ns, {filename: label})
+        self._pending = []
+        self._worker = None
+
+    # ── persistence ─────────────────────────────────────────────────────────
+    def _load_locked(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            with open(self.catalog_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CATALOG_VERSION:
+                self._entries = data.get("models", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"⚠️ Model catalog unreadable, rebuilding: {e}")
+
+    def _save(self):
+        with self._lock:
+            payload = {"version": CATALOG_VERSION, "models": dict(self._entries)}
+        try:
+            _atomic_write_json(self.catalog_file, payload)
+        except Exception as e:
+            logging.error(f"⚠️ Model catalog write failed: {e}")
+
+    # ── directory listing ───────────────────────────────────────────────────
+    def _list_folder(self, folder):
+        """(gguf filenames, subfolder names), cached until the folder mtime changes."""
+        mtime = os.stat(folder).st_mtime_ns
+        cached = self._listing.get(folder)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        models, subdirs = [], []
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.name.lower().endswith(".gguf") and entry.is_file():
+                    models.append(entry.name)
+        models.sort()
+        subdirs.sort()
+        self._listing[folder] = (mtime, models, subdirs)
+        return models, subdirs
+
+    def labels(self, folder):
+        """Parse model_names.txt (filename = label), cached by mtime."""
+        names_file = os.path.join(folder, "model_names.txt")
+        try:
+            mtime = os.stat(names_file).st_mtime_ns
+        except OSError:
+            return {}
+        cached = self._labels.get(folder)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        labels = {}
+        try:
+            with open(names_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if "=" in line and not line.startswith("#"):
+                        key, val = line.split("=", 1)
+                        labels[key.strip()] = val.strip()
+        except Exception:
+            pass
+        self._labels[folder] = (mtime, labels)
+        return labels
+
+    def scan(self, models_dir):
+        """Return (groups, labels, metadata) for the model picker.
+
+        groups mirror the old /list_models shape: root models first (minus any
+        filename that also lives in a subfolder), then one group per subfolder.
+        metadata maps "folder/file.gguf" → catalog summary for files whose
+        header has been read; unread files are queued for the background indexer.
+        """
+        labels = dict(self.labels(models_dir))
+        root_models, subdirs = self._list_folder(models_dir)
+        subfolders = []
+        subfolder_filenames = set()
+        for sub in subdirs:
+            sub_path = os.path.join(models_dir, sub)
+            try:
+                sub_models, _ = self._list_folder(sub_path)
+            except OSError:
+                continue
+            labels.update(self.labels(sub_path))
+            if sub_models:
+                subfolder_filenames.update(sub_models)
+                subfolders.append({"folder": sub, "models": sub_models})
+        groups = []
+        root_models = [m for m in root_models if m not in subfolder_filenames]
+        if root_models:
+            groups.append({"folder": None, "models": root_models})
+        groups.extend(subfolders)
+
+        metadata = {}
+        for group in groups:
+            prefix = (group["folder"] + "/") if group["folder"] else ""
+            folder = os.path.join(models_dir, group["folder"]) if group["folder"] else models_dir
+            for name in group["models"]:
+                entry = self.get(os.path.join(folder, name), parse=False)
+                if entry is not None:
+                    metadata[prefix + name] = entry
+        return groups, labels, metadata
+
+    # ── entries ─────────────────────────────────────────────────────────────
+    def get(self, path, parse=True):
+        """Catalog summary for one model file.
+
+        With parse=False an unknown/stale file is queued for the background
+        indexer and None is returned; with parse=True the header is read now.
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            self._load_locked()
+            entry = self._entries.get(path)
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                return entry
+            if not parse:
+                if path not in self._pending:
+                    self._pending.append(path)
+                self._start_worker_locked()
+                return None
+        entry = self._index(path, stat)
+        self._save()
+        return entry
+
+    def _index(self, path, stat):
+        try:
+            entry = summarize_header(path, read_gguf_header(path))
+            entry["error"] = None
+        except Exception as e:
+            logging.warning(f"⚠️ GGUF header unreadable for {os.path.basename(path)}: {e}")
+            entry = {"quant": _quant_from_name(os.path.basename(path)), "error": str(e)}
+        entry["size"] = stat.st_size
+        entry["mtime_ns"] = stat.st_mtime_ns
+        with self._lock:
+            self._entries[path] = entry
+        return entry
+
+    def _start_worker_locked(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._drain, daemon=True, name="gguf-catalog-index")
+        self._worker.start()
+
+    def _drain(self):
+        indexed = 0
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._worker = None
+                    break
+                path = self._pending.pop(0)
+            try:
+                self._index(path, os.stat(path))
+                indexed += 1
+            except OSError:
+                continue
+        if indexed:
+            self._save()
+            logging.info(f"📚 Model catalog: indexed {indexed} GGUF header(s)")
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending) + (1 if self._worker is not None else 0)
+
+
+model_catalog = ModelCatalog()
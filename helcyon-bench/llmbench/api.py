@@ -3,7 +3,10 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
 import json
+import os
 from pathlib import Path
+import threading
+import time
 from typing import Any
 from urllib.parse import urlparse
 
@@ -34,6 +37,13 @@ class ChatCompletionResult:
 
 JUDGE_LOG_PATH = Path(__file__).resolve().parent.parent / "judge_logs" / "judge_io.jsonl"
 JUDGE_PIPELINE_DEBUG_PATH = Path(__file__).resolve().parent.parent / "judge_logs" / "judge_pipeline_debug.jsonl"
+ENDPOINT_CAPABILITIES_PATH = Path(__file__).resolve().parent.parent / ".llmbench_endpoint_capabilities.json"
+
+# A remembered request shape is only trusted for this long. Local endpoints in
+# particular can swap the model behind an unchanged name ("local-model"), so
+# profiles age out and get re-probed even if they never fail outright.
+CAPABILITY_PROFILE_MAX_AGE_SECONDS = 24 * 60 * 60
+TOKEN_PARAMS = ("max_tokens", "max_completion_tokens")
 
 _debug_logging_enabled = True
 
@@ -224,6 +234,98 @@ def json_parse_failure_details(text: str) -> tuple[str | None, str | None]:
         return None, f"{exc.__class__.__name__}: {exc}"
 
 
+_capability_lock = threading.Lock()
+_capability_profiles: dict[str, dict[str, Any]] | None = None
+
+
+def capability_profile_key(base_url: str, model: str) -> str:
+    return f"{str(base_url or '').strip().rstrip('/')}|{str(model or '').strip()}"
+
+
+def _load_capability_profiles_locked() -> dict[str, dict[str, Any]]:
+    global _capability_profiles
+    if _capability_profiles is None:
+        try:
+            raw = json.loads(ENDPOINT_CAPABILITIES_PATH.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            raw = {}
+        _capability_profiles = {
+            str(key): value for key, value in (raw.items() if isinstance(raw, dict) else []) if isinstance(value, dict)
+        }
+    return _capability_profiles
+
+
+def _save_capability_profiles_locked(profiles: dict[str, dict[str, Any]]) -> None:
+    try:
+        ENDPOINT_CAPABILITIES_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = ENDPOINT_CAPABILITIES_PATH.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(profiles, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        os.replace(tmp_path, ENDPOINT_CAPABILITIES_PATH)
+    except OSError:
+        pass
+
+
+def load_endpoint_capability_profile(base_url: str, model: str) -> dict[str, Any] | None:
+    """Return the remembered request shape for (endpoint, model), if still fresh.
+
+    A profile records which response_format mode, token-limit parameter and
+    temperature handling last produced a usable completion, so chat_completion
+    can send that shape first instead of rediscovering it on every judge call.
+    """
+    key = capability_profile_key(base_url, model)
+    with _capability_lock:
+        profile = _load_capability_profiles_locked().get(key)
+    if not profile:
+        return None
+    try:
+        age = time.time() - float(profile.get("recorded_at") or 0)
+    except (TypeError, ValueError):
+        return None
+    if age < 0 or age > CAPABILITY_PROFILE_MAX_AGE_SECONDS:
+        return None
+    if profile.get("token_param") not in TOKEN_PARAMS:
+        return None
+    return dict(profile)
+
+
+def record_endpoint_capability_profile(
+    base_url: str,
+    model: str,
+    *,
+    response_format_mode: str,
+    token_param: str,
+    omit_temperature: bool,
+) -> None:
+    key = capability_profile_key(base_url, model)
+    profile = {
+        "response_format_mode": response_format_mode,
+        "token_param": token_param,
+        "omit_temperature": bool(omit_temperature),
+        "recorded_at": time.time(),
+    }
+    with _capability_lock:
+        profiles = _load_capability_profiles_locked()
+        profiles[key] = profile
+        _save_capability_profiles_locked(profiles)
+
+
+def forget_endpoint_capability_profile(base_url: str, model: str) -> None:
+    key = capability_profile_key(base_url, model)
+    with _capability_lock:
+        profiles = _load_capability_profiles_locked()
+        if profiles.pop(key, None) is not None:
+            _save_capability_profiles_locked(profiles)
+
+
+def payloads_with_preferred_mode(
+    payloads: list[tuple[str, dict[str, Any]]],
+    preferred_mode: str | None,
+) -> list[tuple[str, dict[str, Any]]]:
+    """Move a remembered response_format mode to the front, keeping the rest in order."""
+    preferred = [item for item in payloads if item[0] == preferred_mode]
+    return preferred + [item for item in payloads if item[0] != preferred_mode]
+
+
 def chat_completion(
     *,
     base_url: str,
@@ -243,6 +345,88 @@ def chat_completion(
     allow_raw_on_json_parse_failure: bool = False,
     return_metadata: bool = False,
     extra_log_fields: dict[str, Any] | None = None,
+    use_capability_profile: bool = True,
+) -> str | ChatCompletionResult:
+    """POST a judge /chat/completions request, negotiating a working request shape.
+
+    Endpoints differ in which structured-output mode, token-limit parameter and
+    temperature handling they accept. The first successful combination for an
+    (endpoint, model) pair is remembered on disk and sent alone on later calls.
+    If the endpoint rejects that shape, the ladder continues with the
+    response_format modes after it — the remembered one is not sent twice. A
+    profile aged past CAPABILITY_PROFILE_MAX_AGE_SECONDS is ignored.
+    use_capability_profile=False always probes from scratch (the preflight does
+    this so "Test Judge Connection" refreshes the profile).
+    """
+    request_kwargs: dict[str, Any] = dict(
+        base_url=base_url,
+        api_key=api_key,
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        max_completion_tokens=max_completion_tokens,
+        json_schema=json_schema,
+        grammar=grammar,
+        extra_headers=extra_headers,
+        endpoint_name=endpoint_name,
+        prompt_id=prompt_id,
+        timeout=timeout,
+        prefer_json_object=prefer_json_object,
+        allow_raw_on_json_parse_failure=allow_raw_on_json_parse_failure,
+        return_metadata=return_metadata,
+        extra_log_fields=extra_log_fields,
+    )
+    capability_profile = load_endpoint_capability_profile(base_url, model) if use_capability_profile else None
+    if capability_profile is not None:
+        ladder = [name for name, _ in structured_output_payloads(json_schema, grammar, prefer_json_object=prefer_json_object)]
+        remembered_mode = capability_profile.get("response_format_mode")
+        try:
+            return _chat_completion(**request_kwargs, capability_profile=capability_profile)
+        except ApiError as exc:
+            # Only a rejected request shape is worth continuing the ladder for.
+            # Auth, rate limits, server errors and transport failures would fail
+            # every other shape the same way — and throw away a profile that
+            # still works. A profile whose mode isn't in this request's ladder
+            # already ran all of it.
+            if not is_request_shape_failure(exc) or remembered_mode not in ladder or len(ladder) == 1:
+                raise
+            log_judge_api_event(
+                "judge_capability_profile_failed",
+                {
+                    "prompt_id": prompt_id,
+                    "judge_model": model,
+                    "endpoint": endpoint_name or base_url,
+                    "capability_profile": capability_profile,
+                    "error": str(exc),
+                },
+            )
+            forget_endpoint_capability_profile(base_url, model)
+        return _chat_completion(**request_kwargs, capability_profile=None, skip_response_format_modes=(remembered_mode,))
+    return _chat_completion(**request_kwargs, capability_profile=None)
+
+
+def _chat_completion(
+    *,
+    base_url: str,
+    api_key: str,
+    model: str,
+    messages: list[dict[str, str]],
+    temperature: float,
+    max_tokens: int | None = None,
+    max_completion_tokens: int | None = None,
+    json_schema: dict[str, Any] | None = None,
+    grammar: str | None = None,
+    extra_headers: dict[str, str] | None = None,
+    endpoint_name: str = "",
+    prompt_id: str = "",
+    timeout: int = 120,
+    prefer_json_object: bool = False,
+    allow_raw_on_json_parse_failure: bool = False,
+    return_metadata: bool = False,
+    extra_log_fields: dict[str, Any] | None = None,
+    capability_profile: dict[str, Any] | None = None,
+    skip_response_format_modes: tuple[str, ...] = (),
 ) -> str | ChatCompletionResult:
     # extra_log_fields is a pass-through extension point for the concise
     # per-request diagnostic log (see post_with_logged_attempt) — e.g. the
@@ -267,14 +451,31 @@ def chat_completion(
         "max_tokens": max_tokens if max_tokens is not None else max_completion_tokens,
         "max_completion_tokens": max_completion_tokens if max_completion_tokens is not None else max_tokens,
     }
+    output_payloads = structured_output_payloads(json_schema, grammar, prefer_json_object=prefer_json_object)
+    if capability_profile is not None:
+        # Send only the request shape that last worked for this (endpoint,
+        # model); chat_completion continues the ladder after it if rejected.
+        # A mode this request's ladder doesn't offer keeps the whole ladder.
+        if capability_profile.get("omit_temperature"):
+            base_payload.pop("temperature", None)
+        if capability_profile.get("token_param") == fallback_param:
+            preferred_param, fallback_param = fallback_param, preferred_param
+        output_payloads = payloads_with_preferred_mode(output_payloads, capability_profile.get("response_format_mode"))
+        if output_payloads and output_payloads[0][0] == capability_profile.get("response_format_mode"):
+            output_payloads = output_payloads[:1]
+    if skip_response_format_modes:
+        output_payloads = [item for item in output_payloads if item[0] not in skip_response_format_modes]
     token_attempts = []
     structured_attempts = []
     response = None
     non_json_attempts = []
     prompt_length = prompt_character_length(messages)
+    attempt_state: dict[str, Any] = {}
 
     try:
-        for output_name, output_payload in structured_output_payloads(json_schema, grammar, prefer_json_object=prefer_json_object):
+        for output_name, output_payload in output_payloads:
+            if attempt_state.get("temperature_omitted"):
+                base_payload.pop("temperature", None)
             attempt_payload = base_payload | output_payload
             try:
                 response = post_with_logged_attempt(
@@ -293,6 +494,7 @@ def chat_completion(
                     max_tokens=max_tokens,
                     max_completion_tokens=max_completion_tokens,
                     extra_log_fields=extra_log_fields,
+                    attempt_state=attempt_state,
                 )
             except requests.Timeout:
                 raise
@@ -330,9 +532,12 @@ def chat_completion(
                     max_tokens=max_tokens,
                     max_completion_tokens=max_completion_tokens,
                     extra_log_fields=extra_log_fields,
+                    attempt_state=attempt_state,
                 )
                 structured_attempts.append((output_name, response.status_code, response.text))
                 token_attempts.append((fallback_param, response.status_code, response.text))
+                if response.status_code < 400:
+                    preferred_param, fallback_param = fallback_param, preferred_param
             if response.status_code < 400:
                 content = response_content_or_retry(
                     response=response,
@@ -351,6 +556,7 @@ def chat_completion(
                     max_tokens=max_tokens,
                     max_completion_tokens=max_completion_tokens,
                     extra_log_fields=extra_log_fields,
+                    attempt_state=attempt_state,
                 )
                 log_judge_pipeline_debug(
                     "RAW MODEL OUTPUT",
@@ -364,6 +570,16 @@ def chat_completion(
                 )
                 extracted_content, parse_error = json_parse_failure_details(content)
                 if extracted_content is not None:
+                    learned_shape = {
+                        "response_format_mode": output_name,
+                        "token_param": preferred_param,
+                        "omit_temperature": "temperature" not in attempt_payload
+                        or bool(attempt_state.get("temperature_omitted")),
+                    }
+                    if capability_profile is None or any(
+                        capability_profile.get(name) != value for name, value in learned_shape.items()
+                    ):
+                        record_endpoint_capability_profile(base_url, model, **learned_shape)
                     log_judge_pipeline_debug(
                         "AFTER API JSON EXTRACTION",
                         {
@@ -533,6 +749,7 @@ def preflight_chat_completion(
         endpoint_name=endpoint_name,
         prompt_id=prompt_id,
         timeout=timeout,
+        use_capability_profile=False,
     )
 
 
@@ -635,6 +852,7 @@ def response_content_or_retry(
     max_tokens: int | None,
     max_completion_tokens: int | None,
     extra_log_fields: dict[str, Any] | None = None,
+    attempt_state: dict[str, Any] | None = None,
 ) -> str:
     def retry_with_larger_token_budget(mode_suffix: str) -> tuple[dict[str, Any], str, str] | None:
         """Re-issues the request once with a much larger token budget.
@@ -663,6 +881,7 @@ def response_content_or_retry(
             max_tokens=max_tokens,
             max_completion_tokens=max_completion_tokens,
             extra_log_fields=extra_log_fields,
+            attempt_state=attempt_state,
         )
         if retry_response.status_code >= 400:
             return None
@@ -747,6 +966,7 @@ def post_with_logged_attempt(
     max_tokens: int | None,
     max_completion_tokens: int | None,
     extra_log_fields: dict[str, Any] | None = None,
+    attempt_state: dict[str, Any] | None = None,
 ) -> requests.Response:
     payload = dict(base_payload)
     if token_value is not None:
@@ -816,10 +1036,31 @@ def post_with_logged_attempt(
             )
             payload.pop("temperature", None)
             temperature_retry_available = False
+            if attempt_state is not None:
+                attempt_state["temperature_omitted"] = True
             continue
         return response
 
 
+# Statuses an endpoint uses to reject a request's parameters or schema.
+REQUEST_SHAPE_STATUS_CODES = {400, 422}
+
+
+def is_request_shape_failure(exc: ApiError) -> bool:
+    """Whether a failed call could succeed with a different request shape.
+
+    True for 400/422 rejections (unsupported parameter, response_format or
+    schema) and for a 2xx whose content was unusable in the structured-output
+    mode used; False for transport errors and every other HTTP status
+    (401/403, 404, 429, 5xx).
+    """
+    if isinstance(exc.__cause__, requests.RequestException):
+        return False
+    if exc.status_code is None:
+        return exc.raw_response is not None
+    return exc.status_code in REQUEST_SHAPE_STATUS_CODES
+
+
 def is_unsupported_temperature_value(response: requests.Response) -> bool:
     if response.status_code not in {400, 422}:
         return False
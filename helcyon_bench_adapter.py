@@ -17,6 +17,9 @@ BENCH_ROOT = REPO_ROOT / "helcyon-bench"
 PROMPT_PACK_DIR = BENCH_ROOT / "prompt_packs"
 BENCHMARK_DIR = BENCH_ROOT / "benchmarks"
 ALIASES_PATH = BENCH_ROOT / "dashboard_model_aliases.json"
+# Stored beside benchmarks/ rather than inside it: every file in benchmarks/ is
+# read as a judged comparison.
+THROUGHPUT_DIR = BENCH_ROOT / "throughput"
 
 
 def _read_json(path: Path) -> dict[str, Any] | None:
@@ -277,6 +280,63 @@ def load_benchmark_results(benchmark_dir: Path = BENCHMARK_DIR) -> list[dict[str
     return results
 
 
+def load_throughput_results(throughput_dir: Path = THROUGHPUT_DIR) -> list[dict[str, Any]]:
+    """Return compact saved throughput-run summaries, newest first."""
+    results: list[dict[str, Any]] = []
+    for path in sorted(throughput_dir.glob("*.json"), reverse=True):
+        payload = _read_json(path)
+        if not payload or payload.get("kind") != "throughput":
+            continue
+        summary = payload.get("summary") if isinstance(payload.get("summary"), dict) else {}
+        pack = payload.get("prompt_pack") if isinstance(payload.get("prompt_pack"), dict) else {}
+        launch_config = payload.get("launch_config")
+        results.append(
+            {
+                "source": path.name,
+                "generated_at": str(payload.get("generated_at") or ""),
+                "model": str(payload.get("model") or ""),
+                "launch_config": launch_config if isinstance(launch_config, dict) else {},
+                "prompt_pack": str(pack.get("name") or ""),
+                "summary": summary,
+            }
+        )
+    return results
+
+
+def _speed_by_model(
+    throughput_results: list[dict[str, Any]],
+    lookup: dict[str, str],
+) -> dict[str, dict[str, Any]]:
+    """Latest throughput run per display model, keyed like the quality leaderboard.
+
+    Throughput runs record the GGUF name; quality runs record whatever the user
+    typed. Both go through the alias lookup, and the GGUF stem is tried too, so
+    consolidating aliases also joins a model's speed to its quality score.
+    """
+    speed: dict[str, dict[str, Any]] = {}
+    for result in sorted(throughput_results, key=lambda row: _timestamp_key(row["generated_at"]), reverse=True):
+        raw_model = result["model"]
+        names = [raw_model, Path(raw_model).stem]
+        display = next((lookup[key] for name in names for key in _identity_keys(name) if key in lookup), Path(raw_model).stem)
+        if not display or display in speed:
+            continue
+        summary = result["summary"]
+
+        def median(metric: str) -> float | None:
+            stats = summary.get(metric)
+            return stats.get("median") if isinstance(stats, dict) else None
+
+        speed[display] = {
+            "ttft_ms": median("ttft_ms"),
+            "prompt_per_second": median("prompt_per_second"),
+            "predicted_per_second": median("predicted_per_second"),
+            "launch_config": result["launch_config"],
+            "generated_at": result["generated_at"],
+            "source": result["source"],
+        }
+    return speed
+
+
 def load_benchmark_result_detail(
     source: str,
     benchmark_dir: Path = BENCHMARK_DIR,
@@ -687,6 +747,7 @@ def _category_metrics(entries: list[dict[str, Any]]) -> dict[str, Any]:
 def load_strength_map(
     benchmark_dir: Path = BENCHMARK_DIR,
     aliases_path: Path = ALIASES_PATH,
+    throughput_dir: Path = THROUGHPUT_DIR,
 ) -> dict[str, Any]:
     """Expose the standalone dashboard dimensions through a read-only JSON shape."""
     aliases = load_model_aliases(aliases_path)
@@ -850,6 +911,9 @@ def load_strength_map(
                 ),
             }
         )
+    speed = _speed_by_model(load_throughput_results(throughput_dir), lookup)
+    for row in leaderboard_rows:
+        row["speed"] = speed.get(row["model"])
     leaderboard_rows.sort(key=lambda row: (-row["current"], row["model"].lower()))
     return {
         "models": models,
@@ -858,5 +922,6 @@ def load_strength_map(
         "benchmark_categories": benchmark_categories,
         "score_categories": score_categories,
         "aliases": aliases,
+        "speed": speed,
         "files_read": files_read,
     }
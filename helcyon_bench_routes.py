@@ -14,6 +14,7 @@ from helcyon_bench_adapter import (
     load_benchmark_results,
     load_prompt_packs,
     load_strength_map,
+    load_throughput_results,
     rename_model_alias,
     update_prompt_pack,
 )
@@ -37,6 +38,7 @@ from helcyon_bench_judge import (
     save_judge_api_key,
     test_judge_connection,
 )
+from helcyon_bench_throughput import ThroughputError, throughput_run_manager
 
 
 helcyon_bench_bp = Blueprint("helcyon_bench", __name__)
@@ -339,3 +341,38 @@ def cancel_integrated_judge_run(job_id):
         return jsonify({"job": judge_run_manager.cancel(job_id)})
     except IntegratedJudgeError as error:
         return jsonify({"error": str(error)}), 404
+
+
+@helcyon_bench_bp.route("/api/helcyon-bench/throughput/results", methods=["GET"])
+def get_throughput_results():
+    return jsonify({"results": load_throughput_results()})
+
+
+@helcyon_bench_bp.route("/api/helcyon-bench/throughput/runs", methods=["POST"])
+def start_throughput_run():
+    try:
+        return jsonify({"job": throughput_run_manager.start(request.get_json(silent=True) or {})}), 202
+    except ThroughputError as error:
+        return jsonify({"error": str(error)}), 422
+
+
+@helcyon_bench_bp.route(
+    "/api/helcyon-bench/throughput/runs/<job_id>",
+    methods=["GET"],
+)
+def get_throughput_run(job_id):
+    try:
+        return jsonify({"job": throughput_run_manager.get(job_id)})
+    except ThroughputError as error:
+        return jsonify({"error": str(error)}), 404
+
+
+@helcyon_bench_bp.route(
+    "/api/helcyon-bench/throughput/runs/<job_id>",
+    methods=["DELETE"],
+)
+def cancel_throughput_run(job_id):
+    try:
+        return jsonify({"job": throughput_run_manager.cancel(job_id)})
+    except ThroughputError as error:
+        return jsonify({"error": str(error)}), 404
@@ -0,0 +1,415 @@
+"""Throughput benchmark runner: TTFT, prefill and decode speed per model and launch config."""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+import requests
+
+from helcyon_bench_adapter import PROMPT_PACK_DIR, THROUGHPUT_DIR
+
+
+REPO_ROOT = Path(__file__).resolve().parent
+
+# llama_args keys that change prefill/decode speed. Recorded with every run so
+# two results are only compared when they were measured on the same config.
+LAUNCH_CONFIG_KEYS = (
+    "ctx_size",
+    "cache_type_k",
+    "cache_type_v",
+    "flash_attn",
+    "n_gpu_layers",
+    "parallel",
+)
+DEFAULT_TRIALS = 3
+DEFAULT_WARMUP = 1
+DEFAULT_N_PREDICT = 256
+MAX_TRIALS = 20
+MAX_N_PREDICT = 4096
+
+
+class ThroughputError(ValueError):
+    pass
+
+
+class ThroughputCancelled(ThroughputError):
+    pass
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _atomic_write_json(path: Path, payload: dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(
+        suffix=".tmp",
+        prefix=".hwui_bench_throughput_",
+        dir=str(path.parent),
+        text=True,
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False, indent=2)
+            handle.write("\n")
+        os.replace(temporary, path)
+    except Exception:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def _read_json(path: Path) -> dict[str, Any] | None:
+    try:
+        payload = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _load_settings(repo_root: Path = REPO_ROOT) -> dict[str, Any]:
+    try:
+        settings = json.loads((repo_root / "settings.json").read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def llama_api_url(settings: dict[str, Any]) -> str:
+    llama_args = settings.get("llama_args") if isinstance(settings.get("llama_args"), dict) else {}
+    return f"http://127.0.0.1:{llama_args.get('port', 8080)}"
+
+
+def launch_config_snapshot(settings: dict[str, Any]) -> dict[str, Any]:
+    llama_args = settings.get("llama_args") if isinstance(settings.get("llama_args"), dict) else {}
+    return {key: llama_args.get(key) for key in LAUNCH_CONFIG_KEYS}
+
+
+def _live_model(api_url: str) -> str:
+    try:
+        response = requests.get(f"{api_url}/v1/models", timeout=5)
+        data = response.json() if response.status_code == 200 else {}
+    except (requests.RequestException, ValueError):
+        return ""
+    models = data.get("data") if isinstance(data, dict) else None
+    if isinstance(models, list) and models and isinstance(models[0], dict):
+        return str(models[0].get("id") or "")
+    return ""
+
+
+def _pack_prompts(pack_id: str, prompt_pack_dir: Path = PROMPT_PACK_DIR) -> tuple[dict[str, Any], list[dict[str, str]]]:
+    safe_id = str(pack_id or "").strip()
+    if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9_-]{0,79}", safe_id):
+        raise ThroughputError("Select a prompt pack for the throughput run.")
+    pack = _read_json(prompt_pack_dir / f"{safe_id}.json")
+    if pack is None:
+        raise ThroughputError(f"Prompt pack was not found: {safe_id}")
+    prompts = []
+    for index, item in enumerate(pack.get("prompts", []), start=1):
+        if isinstance(item, dict) and str(item.get("prompt") or "").strip():
+            prompts.append(
+                {
+                    "test_id": str(item.get("id") or f"prompt_{index:02d}"),
+                    "prompt": str(item["prompt"]).strip(),
+                }
+            )
+    if not prompts:
+        raise ThroughputError("The selected prompt pack has no prompts.")
+    return pack, prompts
+
+
+def _chatml_prompt(prompt: str) -> str:
+    return f"<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n"
+
+
+def measure_completion(
+    api_url: str,
+    prompt: str,
+    *,
+    n_predict: int = DEFAULT_N_PREDICT,
+    timeout: int = 300,
+) -> dict[str, Any]:
+    """Run one streamed /completion and return client TTFT plus llama.cpp timings.
+
+    cache_prompt is disabled so every trial pays the full prefill; otherwise the
+    second trial would reuse the first trial's KV cache and report an inflated
+    prompt_per_second. The sampler is pinned so trials decode comparable text.
+    """
+    payload = {
+        "prompt": _chatml_prompt(prompt),
+        "n_predict": n_predict,
+        "stream": True,
+        "cache_prompt": False,
+        "temperature": 0.0,
+        "seed": 42,
+    }
+    started = time.perf_counter()
+    first_token_at = None
+    final: dict[str, Any] = {}
+    try:
+        with requests.post(f"{api_url}/completion", json=payload, stream=True, timeout=timeout) as response:
+            if response.status_code >= 400:
+                raise ThroughputError(
+                    f"llama-server returned HTTP {response.status_code}: {response.text[:300]}"
+                )
+            for raw_line in response.iter_lines():
+                if not raw_line:
+                    continue
+                line = raw_line.decode("utf-8", errors="replace").strip()
+                if not line.startswith("data:"):
+                    continue
+                try:
+                    chunk = json.loads(line[5:].strip())
+                except json.JSONDecodeError:
+                    continue
+                if first_token_at is None and chunk.get("content"):
+                    first_token_at = time.perf_counter()
+                if chunk.get("stop"):
+                    final = chunk
+                    break
+    except requests.RequestException as error:
+        raise ThroughputError(f"Could not reach llama-server at {api_url}: {error}") from error
+    finished = time.perf_counter()
+    timings = final.get("timings") if isinstance(final.get("timings"), dict) else {}
+    return {
+        "ttft_ms": round((first_token_at - started) * 1000, 2) if first_token_at else None,
+        "total_ms": round((finished - started) * 1000, 2),
+        "prompt_n": timings.get("prompt_n"),
+        "prompt_ms": timings.get("prompt_ms"),
+        "prompt_per_second": timings.get("prompt_per_second"),
+        "predicted_n": timings.get("predicted_n"),
+        "predicted_ms": timings.get("predicted_ms"),
+        "predicted_per_second": timings.get("predicted_per_second"),
+        "stop_type": str(final.get("stop_type") or ""),
+    }
+
+
+def _stats(values: list[Any]) -> dict[str, float] | None:
+    numbers = [float(value) for value in values if isinstance(value, (int, float))]
+    if not numbers:
+        return None
+    return {
+        "median": round(statistics.median(numbers), 2),
+        "mean": round(statistics.fmean(numbers), 2),
+        "min": round(min(numbers), 2),
+        "max": round(max(numbers), 2),
+    }
+
+
+def summarise_trials(trials: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "trial_count": len(trials),
+        "ttft_ms": _stats([trial.get("ttft_ms") for trial in trials]),
+        "prompt_per_second": _stats([trial.get("prompt_per_second") for trial in trials]),
+        "predicted_per_second": _stats([trial.get("predicted_per_second") for trial in trials]),
+        "prompt_tokens": _stats([trial.get("prompt_n") for trial in trials]),
+        "predicted_tokens": _stats([trial.get("predicted_n") for trial in trials]),
+    }
+
+
+def _bounded_int(value: Any, default: int, minimum: int, maximum: int) -> int:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(minimum, min(maximum, number))
+
+
+def _result_filename(model: str, pack_id: str, generated_at: str) -> str:
+    stamp = re.sub(r"[^0-9]", "", generated_at)[:14] or uuid.uuid4().hex[:14]
+    model_part = re.sub(r"[^A-Za-z0-9]+", "-", Path(model).stem).strip("-")[:60] or "model"
+    return f"{stamp}-{model_part}-{pack_id}-throughput.json"
+
+
+def run_throughput_benchmark(
+    *,
+    pack_id: str,
+    trials: int = DEFAULT_TRIALS,
+    warmup: int = DEFAULT_WARMUP,
+    n_predict: int = DEFAULT_N_PREDICT,
+    progress: Callable[[dict[str, Any]], None] | None = None,
+    cancelled: Callable[[], bool] | None = None,
+    throughput_dir: Path = THROUGHPUT_DIR,
+) -> dict[str, Any]:
+    settings = _load_settings()
+    api_url = llama_api_url(settings)
+    pack, prompts = _pack_prompts(pack_id)
+    model = _live_model(api_url) or str(settings.get("llama_last_model") or "")
+    if not model:
+        raise ThroughputError("No local model is loaded. Load a model before running a throughput benchmark.")
+    report = progress or (lambda updates: None)
+    is_cancelled = cancelled or (lambda: False)
+
+    # Warm-up passes page the weights in and let the backend settle its
+    # buffers; they are discarded so the first measured trial is not a
+    # cold-start outlier.
+    for index in range(warmup):
+        if is_cancelled():
+            raise ThroughputCancelled("Throughput run cancelled.")
+        report({"message": f"Warm-up {index + 1}/{warmup}..."})
+        measure_completion(api_url, prompts[0]["prompt"], n_predict=min(n_predict, 32))
+
+    passes_total = len(prompts) * trials
+    passes_done = 0
+    prompt_results = []
+    all_trials: list[dict[str, Any]] = []
+    for item in prompts:
+        prompt_trials = []
+        for _ in range(trials):
+            if is_cancelled():
+                raise ThroughputCancelled("Throughput run cancelled.")
+            report(
+                {
+                    "message": f"Measuring {item['test_id']} ({passes_done + 1}/{passes_total})...",
+                    "passes_done": passes_done,
+                    "passes_total": passes_total,
+                }
+            )
+            prompt_trials.append(measure_completion(api_url, item["prompt"], n_predict=n_predict))
+            passes_done += 1
+        all_trials.extend(prompt_trials)
+        prompt_results.append(
+            {
+                "test_id": item["test_id"],
+                "trials": prompt_trials,
+                "summary": summarise_trials(prompt_trials),
+            }
+        )
+
+    generated_at = _now()
+    payload = {
+        "generated_at": generated_at,
+        "kind": "throughput",
+        "model": model,
+        "launch_config": launch_config_snapshot(settings),
+        "prompt_pack": {
+            "id": pack_id,
+            "name": str(pack.get("name") or pack_id),
+            "category": str(pack.get("category") or ""),
+        },
+        "trials_per_prompt": trials,
+        "warmup_runs": warmup,
+        "n_predict": n_predict,
+        "prompts": prompt_results,
+        "summary": summarise_trials(all_trials),
+    }
+    filename = _result_filename(model, pack_id, generated_at)
+    _atomic_write_json(throughput_dir / filename, payload)
+    return {
+        "status": "completed",
+        "message": "Throughput run complete.",
+        "passes_done": passes_done,
+        "passes_total": passes_total,
+        "source": filename,
+        "summary": payload["summary"],
+    }
+
+
+class ThroughputRunManager:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._jobs: dict[str, dict[str, Any]] = {}
+
+    def start(self, data: dict[str, Any]) -> dict[str, Any]:
+        pack_id = str(data.get("pack_id") or "").strip()
+        _pack_prompts(pack_id)
+        with self._lock:
+            if any(job["status"] in {"queued", "running"} for job in self._jobs.values()):
+                raise ThroughputError("A throughput run is already in progress.")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "message": "Throughput run queued.",
+                "pack_id": pack_id,
+                "trials": _bounded_int(data.get("trials"), DEFAULT_TRIALS, 1, MAX_TRIALS),
+                "warmup": _bounded_int(data.get("warmup"), DEFAULT_WARMUP, 0, MAX_TRIALS),
+                "n_predict": _bounded_int(data.get("n_predict"), DEFAULT_N_PREDICT, 1, MAX_N_PREDICT),
+                "cancel_requested": False,
+                "created_at": _now(),
+            }
+        thread = threading.Thread(
+            target=self._run,
+            args=(job_id,),
+            name=f"helcyon-bench-throughput-{job_id[:8]}",
+            daemon=True,
+        )
+        thread.start()
+        return self.get(job_id)
+
+    def _update(self, job_id: str, updates: dict[str, Any]) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(updates)
+                self._jobs[job_id]["updated_at"] = _now()
+
+    def _run(self, job_id: str) -> None:
+        with self._lock:
+            job = dict(self._jobs[job_id])
+        self._update(job_id, {"status": "running", "message": "Starting throughput run..."})
+        try:
+            result = run_throughput_benchmark(
+                pack_id=job["pack_id"],
+                trials=job["trials"],
+                warmup=job["warmup"],
+                n_predict=job["n_predict"],
+                progress=lambda updates: self._update(job_id, updates),
+                cancelled=lambda: self._cancel_requested(job_id),
+            )
+            self._update(job_id, result)
+        except ThroughputCancelled as error:
+            self._update(job_id, {"status": "cancelled", "message": str(error)})
+        except (ThroughputError, OSError) as error:
+            self._update(job_id, {"status": "error", "message": str(error), "error": str(error)})
+        except Exception as error:
+            self._update(
+                job_id,
+                {
+                    "status": "error",
+                    "message": f"Throughput run failed: {error}",
+                    "error": str(error),
+                },
+            )
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            return bool(self._jobs.get(job_id, {}).get("cancel_requested"))
+
+    def cancel(self, job_id: str) -> dict[str, Any]:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise ThroughputError("Throughput run was not found.")
+            if self._jobs[job_id]["status"] in {"completed", "error", "cancelled"}:
+                return self._public(self._jobs[job_id])
+            self._jobs[job_id]["cancel_requested"] = True
+            self._jobs[job_id]["message"] = "Cancellation requested..."
+            return self._public(self._jobs[job_id])
+
+    def get(self, job_id: str) -> dict[str, Any]:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise ThroughputError("Throughput run was not found.")
+            return self._public(self._jobs[job_id])
+
+    @staticmethod
+    def _public(job: dict[str, Any]) -> dict[str, Any]:
+        return {
+            key: value
+            for key, value in job.items()
+            if key != "cancel_requested"
+        }
+
+
+throughput_run_manager = ThroughputRunManager()
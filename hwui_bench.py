@@ -0,0 +1,645 @@
+"""Synthetic-corpus benchmarks for HWUI's hot paths, with JSON baselines.
+
+Measures the code a chat turn actually waits on — chat-file parsing, the
+/chats/save autosave, chat-history search, project document loading, memory
+retrieval, history trimming, per-chunk ChatML stripping and end-to-end /chat
+time-to-first-token — against a generated corpus (thousands of chat files, a
+large memory file, PDF/DOCX/TXT project documents, long histories) and a
+deterministic stub llama-server (hwui_bench_stub.py).
+
+HWUI resolves chats/, memories/, projects/ and settings.json relative to its
+own files, so a run never touches real user data: the code is copied into a
+throwaway workspace, the corpus is generated there, and the benchmarks run in
+a worker process importing that copy. The stub server runs in the parent.
+
+    python hwui_bench.py run                          # standard corpus, compare with its baseline
+    python hwui_bench.py run --scale quick --save-baseline
+    python hwui_bench.py run --only chat_ttft,do_chat_search --fail-on-regression
+    python hwui_bench.py compare bench_results/baselines/standard.json bench_results/runs/<run>.json
+
+Each run is written to bench_results/runs/. When a baseline for the same scale
+exists (bench_results/baselines/<scale>.json, or --baseline NAME|PATH) the run
+is compared with it automatically: a median more than --threshold (default 10%)
+slower is a regression. Baselines are machine-specific; record one per machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+REPO_ROOT = Path(__file__).resolve().parent
+RESULTS_DIR = REPO_ROOT / "bench_results"
+BASELINE_DIR = RESULTS_DIR / "baselines"
+RUNS_DIR = RESULTS_DIR / "runs"
+SCHEMA_VERSION = 1
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_SEED = 1234
+
+# Copied into the workspace besides the top-level *.py modules.
+WORKSPACE_DIRS = ("utils", "system_prompts", "helcyon-bench")
+WORKSPACE_FILES = ("settings.default.json", "system_prompt.txt", "theme_presets.json")
+
+BENCH_CHARACTER = "Bench"
+BENCH_PROJECT = "BenchProject"
+
+SCALES: dict[str, dict[str, int]] = {
+    "quick":    {"chats": 300,  "turns": 40,  "memory_blocks": 300,  "documents": 24,  "history": 200,  "repeat": 5},
+    "standard": {"chats": 2000, "turns": 80,  "memory_blocks": 2000, "documents": 60,  "history": 600,  "repeat": 7},
+    "large":    {"chats": 5000, "turns": 120, "memory_blocks": 5000, "documents": 150, "history": 1500, "repeat": 5},
+}
+
+BENCHMARKS = (
+    "parse_chat_file",
+    "chats_save",
+    "do_chat_search",
+    "load_project_documents",
+    "retrieve_memory",
+    "trim_chat_history",
+    "strip_chatml_leakage",
+    "chat_ttft",
+)
+
+
+class BenchError(RuntimeError):
+    pass
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _atomic_write_json(path: Path, payload: dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(suffix=".tmp", prefix=".hwui_bench_", dir=str(path.parent), text=True)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False, indent=2)
+            handle.write("\n")
+        os.replace(temporary, path)
+    except Exception:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def _read_json(path: Path) -> dict[str, Any] | None:
+    try:
+        payload = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+# --------------------------------------------------
+# Synthetic corpus
+# --------------------------------------------------
+_SYLLABLES = ("ka", "lo", "mi", "ren", "to", "sa", "vel", "dor", "an", "is", "qu", "bri", "el", "mar", "no", "th")
+_COMMON = (
+    "the", "and", "that", "was", "with", "for", "you", "about", "remember", "when", "we", "talked",
+    "really", "think", "maybe", "tonight", "because", "little", "again", "house", "music", "garden",
+    "coffee", "letter", "project", "weekend", "train", "story", "dream", "walk", "rain", "city",
+)
+
+
+class Corpus:
+    """Deterministic text generator: the same seed always builds the same files."""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.topics = sorted({self._word(3) for _ in range(400)})
+
+    def _word(self, syllables: int) -> str:
+        return "".join(self.rng.choice(_SYLLABLES) for _ in range(syllables))
+
+    def sentence(self, words: int) -> str:
+        parts = [self.rng.choice(self.topics) if self.rng.random() < 0.15 else self.rng.choice(_COMMON)
+                 for _ in range(words)]
+        return " ".join(parts).capitalize() + self.rng.choice((".", ".", "?", "!"))
+
+    def paragraph(self, sentences: int) -> str:
+        return " ".join(self.sentence(self.rng.randint(6, 18)) for _ in range(sentences))
+
+    def messages(self, turns: int, start: datetime | None = None) -> list[dict[str, Any]]:
+        start = start or datetime(2026, 1, 1, 9, 0, 0)
+        out = []
+        for i in range(turns):
+            ts = datetime.fromtimestamp(start.timestamp() + i * 97).strftime("%Y-%m-%dT%H:%M:%S")
+            out.append({"role": "user", "content": self.paragraph(self.rng.randint(1, 3)), "timestamp": ts})
+            out.append({"role": "assistant", "content": "\n\n".join(
+                self.paragraph(self.rng.randint(2, 5)) for _ in range(self.rng.randint(1, 3))), "timestamp": ts})
+        return out
+
+    def memory_file(self, blocks: int) -> str:
+        parts = []
+        for i in range(blocks):
+            keywords = self.rng.sample(self.topics, 3)
+            parts.append(f"# Memory: {keywords[0].capitalize()} note {i}\n"
+                         f"Keywords: {', '.join(keywords)}\n{self.paragraph(self.rng.randint(2, 6))}\n")
+        return "\n".join(parts)
+
+
+def _pdf_bytes(lines: list[str], lines_per_page: int = 50) -> bytes:
+    """A minimal, valid text PDF (Helvetica, one content stream per page)."""
+    def esc(s: str) -> str:
+        return s.encode("latin-1", "replace").decode("latin-1").replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+    objects: list[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{' '.join(f'{p} 0 R' for p in page_ids)}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, page in enumerate(pages):
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({esc(line)}) '" for line in page) + " ET"
+        data = stream.encode("latin-1")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {page_ids[i] + 1} 0 R >>".encode())
+        objects.append(b"<< /Length " + str(len(data)).encode() + b" >>\nstream\n" + data + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def _docx_bytes(paragraphs: list[str]) -> bytes:
+    """A minimal .docx (document part only) that python-docx can open."""
+    from xml.sax.saxutils import escape
+    body = "".join(f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    ns = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    files = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>'),
+        "word/_rels/document.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"/>'),
+        "word/document.xml": (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<w:document xmlns:w="{ns}"><w:body>{body}</w:body></w:document>'),
+    }
+    buffer = tempfile.SpooledTemporaryFile()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, text in files.items():
+            archive.writestr(name, text)
+    buffer.seek(0)
+    return buffer.read()
+
+
+def build_corpus(root: Path, scale: dict[str, int], seed: int, format_chat: Callable[[list, str], str]) -> dict[str, Any]:
+    """Write the synthetic chats / memory / documents / character under `root`."""
+    corpus = Corpus(seed)
+    chats_dir = root / "chats"
+    chats_dir.mkdir(parents=True, exist_ok=True)
+    chat_files = []
+    total_bytes = 0
+    for i in range(scale["chats"]):
+        turns = max(2, int(corpus.rng.gauss(scale["turns"] / 2, scale["turns"] / 6)))
+        name = f"{BENCH_CHARACTER} - chat_{i:05d}.txt"
+        text = format_chat(corpus.messages(turns), BENCH_CHARACTER)
+        (chats_dir / name).write_text(text, encoding="utf-8")
+        chat_files.append(name)
+        total_bytes += len(text)
+
+    memory_dir = root / "memories"
+    memory_dir.mkdir(parents=True, exist_ok=True)
+    memory_text = corpus.memory_file(scale["memory_blocks"])
+    (memory_dir / f"{BENCH_CHARACTER.lower()}_memory.txt").write_text(memory_text, encoding="utf-8")
+
+    docs_dir = root / "projects" / BENCH_PROJECT / "documents"
+    docs_dir.mkdir(parents=True, exist_ok=True)
+    doc_topics = []
+    for i in range(scale["documents"]):
+        topic = corpus.topics[i % len(corpus.topics)]
+        doc_topics.append(topic)
+        paragraphs = [f"Keywords: {topic}, {corpus.rng.choice(corpus.topics)}"] + [
+            corpus.paragraph(corpus.rng.randint(3, 7)) for _ in range(corpus.rng.randint(10, 40))]
+        kind = ("pdf", "docx", "txt", "md")[i % 4]
+        path = docs_dir / f"{topic}_notes_{i:03d}.{kind}"
+        if kind == "pdf":
+            lines = [chunk for p in paragraphs for chunk in (p[j:j + 90] for j in range(0, len(p), 90))]
+            path.write_bytes(_pdf_bytes(lines))
+        elif kind == "docx":
+            path.write_bytes(_docx_bytes(paragraphs))
+        else:
+            path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+    characters_dir = root / "characters"
+    characters_dir.mkdir(parents=True, exist_ok=True)
+    (characters_dir / f"{BENCH_CHARACTER}.json").write_text(json.dumps({
+        "name": BENCH_CHARACTER,
+        "description": corpus.paragraph(4),
+        "main_prompt": corpus.paragraph(8),
+        "use_personal_memory": True,
+        "use_global_memory": False,
+        "use_web_search": False,
+    }, indent=2), encoding="utf-8")
+    (characters_dir / "index.json").write_text(json.dumps([BENCH_CHARACTER]), encoding="utf-8")
+
+    history = corpus.messages(scale["history"] // 2)
+    return {
+        "corpus": corpus,
+        "chat_files": chat_files,
+        "history": history,
+        "doc_topics": doc_topics,
+        "stats": {
+            "chat_files": len(chat_files),
+            "chat_bytes": total_bytes,
+            "memory_blocks": scale["memory_blocks"],
+            "memory_bytes": len(memory_text),
+            "documents": scale["documents"],
+            "history_messages": len(history),
+        },
+    }
+
+
+# --------------------------------------------------
+# Measurement
+# --------------------------------------------------
+def summarize(samples_ms: list[float]) -> dict[str, Any]:
+    ordered = sorted(samples_ms)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "n": len(ordered),
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(p95, 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "samples_ms": [round(s, 3) for s in samples_ms],
+    }
+
+
+def measure(fn: Callable[[int], Any], repeat: int, warmup: int = 1) -> list[float]:
+    for i in range(warmup):
+        fn(-1 - i)
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
+
+
+def _progress(message: str) -> None:
+    print(f"🧪 {message}", file=sys.stderr, flush=True)
+
+
+def run_worker(spec: dict[str, Any]) -> dict[str, Any]:
+    """Runs inside the workspace copy: build the corpus, import HWUI, measure."""
+    root = Path.cwd()
+    scale = spec["scale_params"]
+    repeat = spec.get("repeat") or scale["repeat"]
+    only = set(spec.get("only") or BENCHMARKS)
+
+    import chat_routes
+    _progress(f"building corpus ({spec['scale']})")
+    started = time.perf_counter()
+    data = build_corpus(root, scale, spec["seed"], chat_routes._format_chat_messages)
+    corpus_s = time.perf_counter() - started
+
+    _progress("importing app")
+    started = time.perf_counter()
+    import app as hwui
+    import truncation
+    import_s = time.perf_counter() - started
+    client = hwui.app.test_client()
+    rng = random.Random(spec["seed"] + 1)
+    corpus: Corpus = data["corpus"]
+    chats_dir = Path(chat_routes.get_chats_dir())
+    results: dict[str, Any] = {}
+
+    def bench(name: str, fn: Callable[[int], Any], unit_note: str = "") -> None:
+        if name not in only:
+            return
+        _progress(f"{name} …")
+        try:
+            entry = summarize(measure(fn, repeat))
+        except Exception as e:
+            entry = {"error": f"{type(e).__name__}: {e}"}
+        if unit_note:
+            entry["per"] = unit_note
+        results[name] = entry
+        if "median_ms" in entry:
+            _progress(f"{name}: median {entry['median_ms']:.2f} ms")
+        else:
+            _progress(f"{name}: {entry['error']}")
+
+    sample_files = rng.sample(data["chat_files"], min(25, len(data["chat_files"])))
+    bench("parse_chat_file", lambda i: [chat_routes._parse_chat_file(str(chats_dir / f), f, verbose=False)
+                                        for f in sample_files], f"{len(sample_files)} files")
+
+    save_name = f"{BENCH_CHARACTER} - save_target.txt"
+    save_messages = data["history"]
+    client.post("/chats/save", json={"filename": save_name, "messages": save_messages})
+
+    def save(_i: int) -> None:
+        r = client.post("/chats/save", json={"filename": save_name, "messages": save_messages,
+                                             "base_count": len(save_messages)})
+        if r.status_code != 200:
+            raise BenchError(f"/chats/save returned {r.status_code}: {r.get_data(as_text=True)[:200]}")
+    bench("chats_save", save, f"{len(save_messages)} messages")
+
+    search_queries = [" ".join(rng.sample(corpus.topics, 2)) for _ in range(max(repeat + 2, 4))]
+    bench("do_chat_search", lambda i: hwui.do_chat_search(search_queries[i % len(search_queries)],
+                                                          current_filename=data["chat_files"][0]),
+          f"{len(data['chat_files'])} chats")
+
+    doc_queries = [f"check the {t} document" for t in data["doc_topics"]] or ["check the document"]
+    bench("load_project_documents",
+          lambda i: hwui.load_project_documents(BENCH_PROJECT, doc_queries[i % len(doc_queries)]),
+          f"{len(data['doc_topics'])} documents")
+
+    char_data = json.loads((root / "characters" / f"{BENCH_CHARACTER}.json").read_text(encoding="utf-8"))
+    memory_queries = [f"do you remember the {' and the '.join(rng.sample(corpus.topics, 2))}?" for _ in range(8)]
+    bench("retrieve_memory", lambda i: hwui._retrieve_memory(char_data, BENCH_CHARACTER,
+                                                             memory_queries[i % len(memory_queries)], False, False),
+          f"{scale['memory_blocks']} blocks")
+
+    system = {"role": "system", "content": corpus.paragraph(40)}
+    trim_input = [system] + [{"role": m["role"], "content": m["content"]} for m in data["history"]]
+    bench("trim_chat_history", lambda i: truncation.trim_chat_history([dict(m) for m in trim_input]),
+          f"{len(trim_input)} messages")
+
+    leak_samples = ["\nassistant\nHello", ">user: hi", "user:\nyes", "═══ ⚠️ REMINDER: x ═══\n"]
+    chunks = [(" " + corpus.rng.choice(corpus.topics)) if k % 97 else leak_samples[k % len(leak_samples)]
+              for k in range(2000)]
+    bench("strip_chatml_leakage", lambda i: [hwui.strip_chatml_leakage(c) for c in chunks], f"{len(chunks)} chunks")
+
+    if "chat_ttft" in only:
+        history = [{"role": m["role"], "content": m["content"]} for m in data["history"][-120:]]
+        ttft_samples, total_samples, reply_chars = [], [], 0
+        for i in range(-1, repeat):
+            user_msg = corpus.sentence(12)
+            started = time.perf_counter()
+            response = client.post("/chat", buffered=False, json={
+                "message": user_msg,
+                "character": BENCH_CHARACTER,
+                "user_name": "User",
+                "current_chat_filename": data["chat_files"][0],
+                "conversation_history": history + [{"role": "user", "content": user_msg}],
+            })
+            first = None
+            body = b""
+            for chunk in response.response:
+                if chunk and first is None:
+                    first = time.perf_counter()
+                body += chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+            done = time.perf_counter()
+            response.close()
+            if response.status_code != 200 or first is None:
+                results["chat_ttft"] = {"error": f"/chat returned {response.status_code}: {body[:200]!r}"}
+                break
+            if i >= 0:
+                ttft_samples.append((first - started) * 1000.0)
+                total_samples.append((done - started) * 1000.0)
+                reply_chars = len(body)
+        else:
+            results["chat_ttft"] = summarize(ttft_samples)
+            results["chat_ttft"]["per"] = f"{len(history) + 1} history messages"
+            results["chat_total"] = summarize(total_samples)
+            results["chat_total"]["per"] = f"{reply_chars} reply bytes"
+        _progress(f"chat_ttft: {results['chat_ttft'].get('median_ms', results['chat_ttft'].get('error'))}")
+
+    return {
+        "benchmarks": results,
+        "corpus": dict(data["stats"], build_s=round(corpus_s, 2)),
+        "app_import_s": round(import_s, 2),
+    }
+
+
+# --------------------------------------------------
+# Orchestration
+# --------------------------------------------------
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(REPO_ROOT),
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def prepare_workspace(workspace: Path, stub_port: int) -> None:
+    for path in REPO_ROOT.glob("*.py"):
+        shutil.copy2(path, workspace / path.name)
+    for name in WORKSPACE_DIRS:
+        if (REPO_ROOT / name).is_dir():
+            shutil.copytree(REPO_ROOT / name, workspace / name,
+                            ignore=shutil.ignore_patterns("__pycache__"))
+    for name in WORKSPACE_FILES:
+        if (REPO_ROOT / name).exists():
+            shutil.copy2(REPO_ROOT / name, workspace / name)
+    settings = _read_json(workspace / "settings.default.json") or {}
+    settings.setdefault("llama_args", {})["port"] = stub_port
+    settings["llama_backends"] = []
+    settings["llama_last_model"] = "hwui-bench-stub.gguf"
+    _atomic_write_json(workspace / "settings.json", settings)
+
+
+def run(args: argparse.Namespace) -> int:
+    from hwui_bench_stub import StubLlamaServer
+
+    scale = SCALES[args.scale]
+    only = [b.strip() for b in args.only.split(",")] if args.only else list(BENCHMARKS)
+    unknown = sorted(set(only) - set(BENCHMARKS))
+    if unknown:
+        raise BenchError(f"unknown benchmark(s): {', '.join(unknown)} — choose from {', '.join(BENCHMARKS)}")
+
+    stub = StubLlamaServer(decode_ms_per_token=args.decode_ms, prefill_ms_per_1k=args.prefill_ms_per_1k).start()
+    workspace = Path(tempfile.mkdtemp(prefix="hwui_bench_"))
+    started = time.time()
+    try:
+        prepare_workspace(workspace, stub.port)
+        spec = {"scale": args.scale, "scale_params": scale, "seed": args.seed, "repeat": args.repeat,
+                "only": only, "out": str(workspace / "_results.json")}
+        spec_path = workspace / "_spec.json"
+        _atomic_write_json(spec_path, spec)
+        log_path = workspace / "bench.log"
+        print(f"🧪 HWUI bench — scale={args.scale} seed={args.seed} stub={stub.url} workspace={workspace}", flush=True)
+        with open(log_path, "w", encoding="utf-8") as log:
+            proc = subprocess.run([sys.executable, str(workspace / "hwui_bench.py"), "_worker", str(spec_path)],
+                                  cwd=str(workspace), stdout=log, env=dict(os.environ, PYTHONIOENCODING="utf-8"))
+        worker = _read_json(Path(spec["out"]))
+        if proc.returncode != 0 or worker is None:
+            raise BenchError(f"benchmark worker failed (exit {proc.returncode}) — see {log_path}")
+    except Exception:
+        args.keep_workspace = True
+        raise
+    finally:
+        stub.stop()
+        if not args.keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    result = {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": _now(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "scale_params": scale,
+        "seed": args.seed,
+        "stub": {"decode_ms_per_token": args.decode_ms, "prefill_ms_per_1k": args.prefill_ms_per_1k,
+                 "requests": dict(stub.requests)},
+        "elapsed_s": round(time.time() - started, 1),
+        **worker,
+    }
+    run_path = RUNS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{args.scale}.json"
+    _atomic_write_json(run_path, result)
+    print(f"💾 Results: {run_path}")
+    print_results(result)
+
+    status = 0
+    baseline_path = resolve_baseline(args.baseline or args.scale)
+    baseline = _read_json(baseline_path)
+    if baseline is not None:
+        rows = compare(baseline, result, args.threshold)
+        print(f"\n📊 Against baseline {baseline_path} ({baseline.get('git_commit') or '?'}, {baseline.get('created_at', '?')[:19]}):")
+        print_comparison(rows)
+        if args.fail_on_regression and any(r["verdict"] == "regression" for r in rows):
+            status = 1
+    elif not args.save_baseline:
+        print(f"\nℹ️ No baseline at {baseline_path} — record one with --save-baseline.")
+
+    if args.save_baseline:
+        target = resolve_baseline(args.save_baseline if isinstance(args.save_baseline, str) else args.scale)
+        _atomic_write_json(target, result)
+        print(f"📌 Saved as baseline: {target}")
+    return status
+
+
+def resolve_baseline(name: str) -> Path:
+    path = Path(name)
+    if path.suffix == ".json" or path.exists():
+        return path
+    return BASELINE_DIR / f"{name}.json"
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> list[dict[str, Any]]:
+    """Median-to-median comparison of every benchmark present in both runs."""
+    comparable = baseline.get("scale_params") == current.get("scale_params") and baseline.get("seed") == current.get("seed")
+    rows = []
+    base_benches = baseline.get("benchmarks") or {}
+    for name, entry in (current.get("benchmarks") or {}).items():
+        base = base_benches.get(name) or {}
+        row = {"name": name, "baseline_ms": base.get("median_ms"), "current_ms": entry.get("median_ms"),
+               "change": None, "verdict": "new" if not base else "error"}
+        if isinstance(row["baseline_ms"], (int, float)) and isinstance(row["current_ms"], (int, float)) and row["baseline_ms"] > 0:
+            row["change"] = row["current_ms"] / row["baseline_ms"] - 1.0
+            if not comparable:
+                row["verdict"] = "incomparable"
+            elif row["change"] > threshold:
+                row["verdict"] = "regression"
+            elif row["change"] < -threshold:
+                row["verdict"] = "improved"
+            else:
+                row["verdict"] = "same"
+        rows.append(row)
+    return rows
+
+
+def print_results(result: dict[str, Any]) -> None:
+    print(f"\n{'benchmark':<24}{'median':>12}{'p95':>12}{'min':>12}   per")
+    for name, entry in result.get("benchmarks", {}).items():
+        if "error" in entry:
+            print(f"{name:<24}  ❌ {entry['error']}")
+            continue
+        print(f"{name:<24}{entry['median_ms']:>10.2f}ms{entry['p95_ms']:>10.2f}ms{entry['min_ms']:>10.2f}ms   {entry.get('per', '')}")
+
+
+def print_comparison(rows: list[dict[str, Any]]) -> None:
+    marks = {"regression": "🔴", "improved": "🟢", "same": "⚪", "new": "🆕", "incomparable": "⚠️", "error": "❌"}
+    for row in rows:
+        change = f"{row['change'] * 100:+.1f}%" if row["change"] is not None else "—"
+        base = f"{row['baseline_ms']:.2f}" if isinstance(row["baseline_ms"], (int, float)) else "—"
+        cur = f"{row['current_ms']:.2f}" if isinstance(row["current_ms"], (int, float)) else "—"
+        print(f"  {marks.get(row['verdict'], '?')} {row['name']:<24}{base:>10} → {cur:<10}{change:>9}  {row['verdict']}")
+    if any(r["verdict"] == "incomparable" for r in rows):
+        print("  ⚠️ Corpus scale/seed differ from the baseline — numbers shown, not judged.")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="HWUI hot-path benchmarks on a synthetic corpus.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="build the corpus, run the benchmarks, compare with the baseline")
+    p_run.add_argument("--scale", choices=sorted(SCALES), default="standard")
+    p_run.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    p_run.add_argument("--repeat", type=int, default=None, help="samples per benchmark (default: per scale)")
+    p_run.add_argument("--only", default="", help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    p_run.add_argument("--baseline", default=None, help="baseline name or path (default: the scale name)")
+    p_run.add_argument("--save-baseline", nargs="?", const=True, default=False,
+                       help="store this run as the baseline (optionally under NAME)")
+    p_run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                       help="relative median change counted as a regression/improvement")
+    p_run.add_argument("--fail-on-regression", action="store_true", help="exit 1 when any benchmark regresses")
+    p_run.add_argument("--decode-ms", type=float, default=1.0, help="stub latency per generated token")
+    p_run.add_argument("--prefill-ms-per-1k", type=float, default=0.0, help="stub latency per 1000 prompt tokens")
+    p_run.add_argument("--keep-workspace", action="store_true", help="leave the generated workspace on disk")
+
+    p_cmp = sub.add_parser("compare", help="compare two result files (baseline first)")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    p_cmp.add_argument("--fail-on-regression", action="store_true")
+
+    p_worker = sub.add_parser("_worker", help=argparse.SUPPRESS)
+    p_worker.add_argument("spec")
+
+    args = parser.parse_args(argv)
+    if args.command == "_worker":
+        spec = _read_json(Path(args.spec))
+        if spec is None:
+            raise BenchError(f"unreadable spec {args.spec}")
+        _atomic_write_json(Path(spec["out"]), run_worker(spec))
+        # HWUI's background threads (probes, prewarm) must not hold the worker open.
+        sys.stdout.flush()
+        os._exit(0)
+    if args.command == "compare":
+        baseline = _read_json(resolve_baseline(args.baseline))
+        current = _read_json(resolve_baseline(args.current))
+        if baseline is None or current is None:
+            raise BenchError("could not read both result files")
+        rows = compare(baseline, current, args.threshold)
+        print_comparison(rows)
+        return 1 if args.fail_on_regression and any(r["verdict"] == "regression" for r in rows) else 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except BenchError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(2)
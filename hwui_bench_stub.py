@@ -0,0 +1,264 @@
+"""Deterministic stand-in for llama-server, used by the HWUI benchmark suite.
+
+Implements just enough of the llama.cpp HTTP API for HWUI's hot paths to run
+end to end without a model: `/completion` (SSE or JSON), `/tokenize`,
+`/detokenize`, `/v1/chat/completions` (SSE or JSON), `/v1/models`, `/health`
+and `/slots`. Replies are derived from a hash of the prompt, so the same
+request always streams the same tokens, and latency is synthetic and fixed
+(`prefill_ms_per_1k` per 1000 prompt tokens, `decode_ms_per_token` per
+token). That keeps a benchmark measuring HWUI rather than a GPU.
+
+    python hwui_bench_stub.py --port 8090 --decode-ms 2
+
+or from Python: `server = StubLlamaServer(port=0).start(); server.url`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+MODEL_ID = "hwui-bench-stub.gguf"
+DEFAULT_REPLY_TOKENS = 48
+DEFAULT_DECODE_MS = 1.0
+DEFAULT_PREFILL_MS_PER_1K = 0.0
+
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]|\s+")
+_WORDS = (
+    "the", "quiet", "lantern", "river", "morning", "signal", "garden", "copper",
+    "window", "story", "harbor", "winter", "letter", "bright", "shadow", "echo",
+    "north", "music", "stone", "velvet", "ember", "tide", "orchard", "silver",
+)
+
+
+def tokenize(text: str) -> list[int]:
+    """Stable pseudo-BPE: ~4-char word pieces, punctuation and whitespace runs."""
+    return [int(hashlib.blake2b(piece.encode("utf-8"), digest_size=4).hexdigest(), 16) % 32000
+            for piece in _TOKEN_RE.findall(text or "")]
+
+
+def reply_tokens(prompt: str, n: int) -> list[str]:
+    """The reply for `prompt`: n word pieces chosen by the prompt's hash."""
+    seed = hashlib.sha256((prompt or "").encode("utf-8", errors="replace")).digest()
+    out = []
+    for i in range(n):
+        word = _WORDS[(seed[i % len(seed)] + i) % len(_WORDS)]
+        out.append(("" if i == 0 else " ") + (word.capitalize() if i == 0 else word))
+    if out:
+        out[-1] += "."
+    return out
+
+
+class StubLlamaServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 decode_ms_per_token: float = DEFAULT_DECODE_MS,
+                 prefill_ms_per_1k: float = DEFAULT_PREFILL_MS_PER_1K,
+                 reply_tokens: int = DEFAULT_REPLY_TOKENS):
+        self.decode_ms_per_token = decode_ms_per_token
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.reply_tokens = reply_tokens
+        self.requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "StubLlamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="bench-stub-llama")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, path: str) -> None:
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def prefill_delay(self, n_prompt: int) -> float:
+        return self.prefill_ms_per_1k * n_prompt / 1000.0 / 1000.0
+
+    def decode_delay(self) -> float:
+        return self.decode_ms_per_token / 1000.0
+
+
+def _timings(n_prompt: int, n_predict: int, server: StubLlamaServer) -> dict[str, Any]:
+    prompt_ms = server.prefill_ms_per_1k * n_prompt / 1000.0
+    predicted_ms = server.decode_ms_per_token * n_predict
+    return {
+        "prompt_n": n_prompt,
+        "prompt_ms": round(prompt_ms, 3),
+        "prompt_per_second": round(n_prompt / (prompt_ms / 1000.0), 1) if prompt_ms else None,
+        "predicted_n": n_predict,
+        "predicted_ms": round(predicted_ms, 3),
+        "predicted_per_second": round(n_predict / (predicted_ms / 1000.0), 1) if predicted_ms else None,
+    }
+
+
+def _chat_prompt(messages: list[dict[str, Any]]) -> str:
+    parts = []
+    for m in messages or []:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+        parts.append(f"{m.get('role', '')}: {content or ''}")
+    return "\n".join(parts)
+
+
+def _make_handler(server: StubLlamaServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # silence per-request stderr lines
+            pass
+
+        def _json(self, payload: Any, status: int = 200) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> dict[str, Any]:
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            try:
+                return json.loads(self.rfile.read(length).decode("utf-8"))
+            except (ValueError, UnicodeDecodeError):
+                return {}
+
+        def _sse_start(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+        def _sse(self, payload: Any) -> None:
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        def do_GET(self):
+            server.count(self.path.split("?")[0])
+            if self.path.startswith("/health"):
+                return self._json({"status": "ok"})
+            if self.path.startswith("/slots"):
+                return self._json([{"id": 0, "is_processing": False}])
+            if self.path.startswith("/v1/models") or self.path.startswith("/models"):
+                return self._json({"object": "list", "data": [{"id": MODEL_ID, "object": "model"}]})
+            if self.path.startswith("/props"):
+                return self._json({"default_generation_settings": {"n_ctx": 16384}, "total_slots": 1})
+            return self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            server.count(path)
+            body = self._body()
+            try:
+                if path == "/tokenize":
+                    return self._json({"tokens": tokenize(body.get("content", ""))})
+                if path == "/detokenize":
+                    return self._json({"content": " ".join(str(t) for t in body.get("tokens", []))})
+                if path == "/completion":
+                    return self._completion(body)
+                if path == "/v1/chat/completions":
+                    return self._chat_completions(body)
+            except (BrokenPipeError, ConnectionResetError):
+                return None
+            return self._json({"error": "not found"}, 404)
+
+        def _completion(self, body: dict[str, Any]) -> None:
+            prompt = body.get("prompt") or ""
+            n_prompt = len(tokenize(prompt))
+            n_predict = int(body.get("n_predict", -1))
+            # The scripted reply ends in EOS unless n_predict cuts it short.
+            limited = 0 <= n_predict < server.reply_tokens
+            n_reply = n_predict if limited else server.reply_tokens
+            pieces = reply_tokens(prompt, n_reply)
+            time.sleep(server.prefill_delay(n_prompt))
+            final = {
+                "content": "", "stop": True, "stop_type": "limit" if limited else "eos",
+                "tokens_predicted": n_reply, "tokens_evaluated": n_prompt, "tokens_cached": 0,
+                "truncated": False, "timings": _timings(n_prompt, n_reply, server),
+            }
+            if not body.get("stream"):
+                time.sleep(server.decode_delay() * n_reply)
+                final["content"] = "".join(pieces)
+                return self._json(final)
+            self._sse_start()
+            for piece in pieces:
+                time.sleep(server.decode_delay())
+                self._sse({"content": piece, "stop": False, "tokens": [tokenize(piece)[0] if piece.strip() else 0]})
+            self._sse(final)
+
+        def _chat_completions(self, body: dict[str, Any]) -> None:
+            messages = body.get("messages") or []
+            prompt = _chat_prompt(messages)
+            n_prompt = len(tokenize(prompt))
+            system = next((m.get("content") for m in messages if m.get("role") == "system"), "") or ""
+            if isinstance(system, str) and "routing classifier" in system:
+                pieces = ["NO_SEARCH"]
+            else:
+                pieces = reply_tokens(prompt, min(server.reply_tokens, int(body.get("max_tokens") or server.reply_tokens)))
+            time.sleep(server.prefill_delay(n_prompt))
+            timings = _timings(n_prompt, len(pieces), server)
+            if not body.get("stream"):
+                time.sleep(server.decode_delay() * len(pieces))
+                return self._json({
+                    "id": "chatcmpl-bench", "object": "chat.completion", "model": MODEL_ID,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(pieces)}}],
+                    "usage": {"prompt_tokens": n_prompt, "completion_tokens": len(pieces)},
+                    "timings": timings,
+                })
+            self._sse_start()
+            for piece in pieces:
+                time.sleep(server.decode_delay())
+                self._sse({"object": "chat.completion.chunk", "model": MODEL_ID,
+                           "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            self._sse({"object": "chat.completion.chunk", "model": MODEL_ID,
+                       "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "timings": timings})
+            self._sse("[DONE]")
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--decode-ms", type=float, default=DEFAULT_DECODE_MS, help="latency per generated token")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=DEFAULT_PREFILL_MS_PER_1K,
+                        help="latency per 1000 prompt tokens")
+    parser.add_argument("--reply-tokens", type=int, default=DEFAULT_REPLY_TOKENS)
+    args = parser.parse_args()
+    server = StubLlamaServer(port=args.port, decode_ms_per_token=args.decode_ms,
+                             prefill_ms_per_1k=args.prefill_ms_per_1k, reply_tokens=args.reply_tokens).start()
+    print(f"🧪 Stub llama-server on {server.url} — Ctrl+C to stop", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
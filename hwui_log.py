@@ -0,0 +1,247 @@
+"""Queue-backed console/file logging for HWUI.
+
+The app runs inside an Electron wrapper where the live Flask console isn't
+visible, so everything print() emits is mirrored into logs/:
+
+    logs/hwui_full.log    — everything (RotatingFileHandler, ~10 MB x 5 backups)
+    logs/stop_reasons.log — only the 🩺/⏱️/⚠️ stop-reason lines, append-forever
+
+The mirror used to do all of that inside print(): the tee took a lock, wrote
+each line to both file handlers and scanned it for stop markers on the calling
+thread — so the streaming thread paid for disk I/O on every diagnostic line.
+Now TeeStream only splits lines and drops them on a queue (QueueHandler); a
+QueueListener thread does the file writes and the stop-marker filtering. The
+console write stays synchronous so the live console reads exactly as before.
+
+Categorised loggers carry the verbose output that shouldn't cost anything when
+nobody is looking:
+
+    diag   — prompt/trim dumps and payload logs (DEBUG when `diag_verbose`)
+    stream — per-chunk streaming diagnostics (e.g. ChatML leak stripping)
+    perf   — per-turn timing summaries (perf_trace.py)
+
+Their levels come from settings.json `log_levels` and are applied per request
+by apply_levels(); records go through the same queue to hwui_full.log and the
+console. Debug artefacts (`_last_messages_api_payload.json`) are written by
+write_artifact() on a background thread, and only when `debug_artifacts` is on.
+
+CRITICAL: every handler is encoding='utf-8' so the emoji markers (🩺 🔬 🧼 🚀)
+don't raise UnicodeEncodeError under Windows' default cp1252 console codec.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+
+# Lines routed to the dedicated stop-reason log (substring match, emoji-safe).
+STOP_MARKERS = ("🩺 STOP REASON", "⏱️ TEMP STOP", "PREMATURE EOS")
+
+CATEGORIES = ("diag", "stream", "perf")
+DEFAULT_LEVELS = {"diag": "INFO", "stream": "WARNING", "perf": "INFO"}
+
+_queue = queue.SimpleQueue()
+_listener = None
+_console = None          # the real stdout, for category records
+
+# print() mirror: lines arrive pre-formatted, the listener only files them.
+_tee_logger = logging.getLogger("hwui.tee")
+_tee_logger.setLevel(logging.INFO)
+_tee_logger.propagate = False
+
+diag = logging.getLogger("hwui.diag")
+stream = logging.getLogger("hwui.stream")
+perf = logging.getLogger("hwui.perf")
+
+
+class _StopMarkerFilter(logging.Filter):
+    def filter(self, record):
+        msg = record.getMessage()
+        return any(m in msg for m in STOP_MARKERS)
+
+
+class _CategoryOnly(logging.Filter):
+    """Console handler: print() lines already reached the console directly."""
+
+    def filter(self, record):
+        return record.name != "hwui.tee"
+
+
+class _ConsoleHandler(logging.Handler):
+    def emit(self, record):
+        stream_ = _console
+        if stream_ is None:
+            return
+        try:
+            text = self.format(record) + "\n"
+            try:
+                stream_.write(text)
+            except UnicodeEncodeError:
+                enc = getattr(stream_, "encoding", None) or "utf-8"
+                stream_.write(text.encode(enc, "replace").decode(enc))
+            stream_.flush()
+        except Exception:
+            pass
+
+
+class TeeStream:
+    """Wrap a console stream so every write is mirrored, line by line, onto the
+    logging queue. The original stream is left fully functional, so existing
+    print() calls keep showing on the console exactly as before."""
+
+    def __init__(self, stream_):
+        self._stream = stream_
+        self._buf = ""
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            # Queue the log copy FIRST so a console that can't render an emoji
+            # (e.g. a cp1252 pipe) never costs us the logfile copy.
+            self._buf += data
+            if "\n" in self._buf:
+                *lines, self._buf = self._buf.split("\n")
+                for line in lines:
+                    if line:
+                        try:
+                            _tee_logger.info(line)
+                        except Exception:
+                            # Logging must never take the request thread down.
+                            pass
+            # Then write to the real console. Tolerate a narrow console codec
+            # so an un-encodable emoji can never take the app down.
+            if self._stream is not None:
+                try:
+                    self._stream.write(data)
+                except UnicodeEncodeError:
+                    try:
+                        enc = getattr(self._stream, "encoding", None) or "utf-8"
+                        self._stream.write(data.encode(enc, "replace").decode(enc))
+                    except Exception:
+                        pass
+        return len(data)
+
+    def flush(self):
+        if self._stream is not None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        # Delegate isatty(), encoding, fileno(), etc. to the real stream.
+        return getattr(self._stream, name)
+
+
+def install(log_dir=LOG_DIR):
+    """Start the listener and tee stdout/stderr. Idempotent."""
+    global _listener, _console
+    if _listener is not None:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+
+    full_handler = RotatingFileHandler(
+        os.path.join(log_dir, "hwui_full.log"),
+        maxBytes=10 * 1024 * 1024,   # ~10 MB per file
+        backupCount=5,               # keep last 5 backups
+        encoding="utf-8",
+    )
+    full_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    # Stop-reason log — tiny lines, append forever (no rotation), timestamp prefix.
+    stop_handler = logging.FileHandler(os.path.join(log_dir, "stop_reasons.log"), encoding="utf-8")
+    stop_handler.setFormatter(logging.Formatter("%(asctime)s  %(message)s"))
+    stop_handler.addFilter(_StopMarkerFilter())
+
+    console_handler = _ConsoleHandler()
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    console_handler.addFilter(_CategoryOnly())
+
+    # Best-effort: make the underlying console UTF-8 too, so the live output
+    # can render the emoji markers instead of falling back to replacement
+    # chars. Safe no-op on streams without reconfigure() (e.g. a plain pipe).
+    for std in (sys.stdout, sys.stderr):
+        try:
+            std.reconfigure(encoding="utf-8")  # type: ignore[attr-defined]
+        except Exception:
+            pass
+    _console = sys.stdout
+
+    queue_handler = QueueHandler(_queue)
+    for logger in (_tee_logger, diag, stream, perf):
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+    apply_levels({})
+
+    _listener = QueueListener(_queue, full_handler, stop_handler, console_handler)
+    _listener.start()
+    atexit.register(shutdown)
+
+    # Install the tee. Guarded against a None stream (e.g. a windowed pythonw host).
+    if sys.stdout is not None:
+        sys.stdout = TeeStream(sys.stdout)
+    if sys.stderr is not None:
+        sys.stderr = TeeStream(sys.stderr)
+
+
+def shutdown():
+    """Drain the queue to disk (runs at exit)."""
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+        _listener = None
+
+
+def apply_levels(settings):
+    """Set category levels from settings `log_levels`; `diag_verbose` opens diag to DEBUG."""
+    levels = dict(DEFAULT_LEVELS)
+    levels.update(settings.get("log_levels") or {})
+    if settings.get("diag_verbose"):
+        levels["diag"] = "DEBUG"
+    for name in CATEGORIES:
+        level = logging.getLevelName(str(levels.get(name, "INFO")).upper())
+        logging.getLogger(f"hwui.{name}").setLevel(level if isinstance(level, int) else logging.INFO)
+
+
+# ── Debug artefacts ──────────────────────────────────────────────────────────
+_artifacts = queue.SimpleQueue()
+_artifact_thread = None
+_artifact_lock = threading.Lock()
+
+
+def _artifact_worker():
+    while True:
+        path, obj = _artifacts.get()
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".artifact_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(obj, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except Exception as e:
+            diag.warning(f"Could not write {path}: {e!r}")
+
+
+def write_artifact(path, obj, settings=None):
+    """Write `obj` as JSON to `path` off-thread, if `debug_artifacts` is on.
+
+    The object is serialised later on the writer thread — pass something the
+    caller won't mutate afterwards (a fresh list/dict, or a copy).
+    """
+    if not (settings or {}).get("debug_artifacts"):
+        return False
+    global _artifact_thread
+    with _artifact_lock:
+        if _artifact_thread is None:
+            _artifact_thread = threading.Thread(target=_artifact_worker, daemon=True, name="debug-artifacts")
+            _artifact_thread.start()
+    _artifacts.put((path, obj))
+    return True
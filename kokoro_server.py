@@ -1,16 +1,26 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context
 from kokoro import KPipeline
+from io import BytesIO
+from threading import Event
+import queue
+import numpy as np
 import soundfile as sf
-import tempfile
-import os
+import struct
 import re
 import torch
 
+from tts_synthesis_queue import SynthesisQueue
+
 app = Flask(__name__)
 
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 print(f"ðŸ–¥ï¸ Kokoro using device: {device}")
 pipeline = KPipeline(lang_code='en-gb', device=device)
+# KPipeline keeps G2P/model state between segments, so each request's whole
+# generator runs on the queue's single worker — one generator at a time.
+synthesis_queue = SynthesisQueue("kokoro")
+SAMPLE_RATE = 24000
+SPEED = 1.25
 print("âœ… Kokoro ready!")
 
 # All available English voices
@@ -41,12 +51,7 @@ def strip_emojis(text):
 def get_voices():
     return jsonify({"voices": VOICES})
 
-@app.route('/tts_to_audio', methods=['POST'])
-def tts_to_audio():
-    data = request.json
-    text = data.get('text', '')
-    voice = data.get('voice', 'af_heart')  # Use voice from request, fallback to af_heart
-
+def clean_text(text):
     text = text.replace('\u2019', "'").replace('\u2018', "'")
     text = text.replace('\u201c', '"').replace('\u201d', '"')
     text = text.replace('\u2013', ',').replace('\u2014', ',')  # en/em dash â†’ comma
@@ -60,20 +65,106 @@ def tts_to_audio():
     text = re.sub(r'(?<![a-zA-Z])x(?![a-zA-Z])', 'ex', text, flags=re.IGNORECASE)  # standalone x → ex
     text = text.strip()
     text = strip_emojis(text)
+    return text
+
+
+_SEGMENTS_DONE = object()
+
+
+def segments(text, voice):
+    """Yield each KPipeline segment as float32 mono audio, as soon as it exists.
+
+    The generator runs to completion on the synthesis queue's worker and hands
+    segments over as it produces them, so the caller sends one segment while
+    the next is computed. Closing this generator early stops the render.
+    """
+    out = queue.Queue()
+    cancelled = Event()
+
+    def _render():
+        try:
+            for _gs, _ps, audio in pipeline(text, voice=voice, speed=SPEED):
+                if cancelled.is_set():
+                    return
+                if audio is None:
+                    continue
+                if hasattr(audio, 'cpu'):
+                    audio = audio.cpu().numpy()
+                out.put(np.asarray(audio, dtype=np.float32).reshape(-1))
+        finally:
+            out.put(_SEGMENTS_DONE)
+
+    future = synthesis_queue.submit(_render)
+    try:
+        while True:
+            audio = out.get()
+            if audio is _SEGMENTS_DONE:
+                break
+            yield audio
+    finally:
+        cancelled.set()
+    future.result()  # re-raise a pipeline error
+
+
+def wav_stream_header(sample_rate=SAMPLE_RATE):
+    """44-byte PCM16 mono header with placeholder sizes (length unknown up front).
+    Same shape Qwen3-TTS Fast streams, so /api/tts/generate_stream clients decode both."""
+    data_size = 0x7FFFFF00
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", data_size + 36, b"WAVE", b"fmt ", 16,
+                       1, 1, sample_rate, sample_rate * 2, 2, 16, b"data", data_size)
 
+
+def pcm16(audio):
+    return (np.clip(audio, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+def _request_text():
+    data = request.json or {}
+    return clean_text(data.get('text', '')), data.get('voice', 'af_heart')  # voice from request, fallback af_heart
+
+
+@app.route('/tts_to_audio', methods=['POST'])
+def tts_to_audio():
+    text, voice = _request_text()
     if not text:
         return jsonify({'error': 'No text'}), 400
 
-    generator = pipeline(text, voice=voice, speed=1.25)
+    # Every segment, not just the first — long text used to be cut off here.
+    parts = list(segments(text, voice))
+    if not parts:
+        return jsonify({'error': 'No audio generated'}), 500
+    buf = BytesIO()
+    sf.write(buf, np.concatenate(parts), SAMPLE_RATE, format='WAV', subtype='PCM_16')
+    buf.seek(0)
+    return send_file(buf, mimetype='audio/wav')
+
+
+@app.route('/tts_stream', methods=['POST'])
+def tts_stream():
+    """Chunked WAV: header first, then each segment's PCM as it is generated."""
+    text, voice = _request_text()
+    if not text:
+        return jsonify({'error': 'No text'}), 400
+
+    def generate():
+        yield wav_stream_header()
+        for audio in segments(text, voice):
+            yield pcm16(audio)
+
+    return Response(stream_with_context(generate()), mimetype='audio/wav',
+                    headers={'X-Audio-Streaming': 'decoded-pcm'})
 
-    tmp_path = tempfile.mktemp(suffix='.wav')
 
-    for i, (gs, ps, audio) in enumerate(generator):
-        if i == 0:
-            sf.write(tmp_path, audio, 24000)
-            break
+@app.route('/status', methods=['GET'])
+def status():
+    return jsonify({
+        "status": "online",
+        "engine": "kokoro",
+        "device": device,
+        "gpu": torch.cuda.get_device_name(0) if device == 'cuda' else 'cpu',
+        "queue": synthesis_queue.stats(),
+    })
 
-    return send_file(tmp_path, mimetype='audio/wav')
 
 if __name__ == '__main__':
     app.run(port=8002)
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""Pre-stage GGUF files into the OS page cache ahead of a model switch.
+
+/load_model kills llama-server and starts a new one, and the new process then
+faults the whole model in from disk — on a multi-GB GGUF that read dominates
+the switch. When the UI signals intent (hovering a model in the picker, or
+pairing a model with a character) the ModelPrestager reads the file
+sequentially in the background so llama-server's mmap finds it already
+resident.
+
+On POSIX the read is preceded by posix_fadvise(SEQUENTIAL/WILLNEED) so the
+kernel reads ahead aggressively; on Windows plain large sequential reads do
+the same job through the standby list.
+
+psutil's `available` counts reclaimable page cache as free — including the
+pages of the model llama-server currently has mmapped, and every page staging
+reads in — so it barely moves while staging runs. The budget is therefore
+`available - model_prestage_headroom_mb - size of the active model's file`:
+what is left once the active model stays resident and processes keep their
+headroom. It is re-checked as staging runs (process memory growth shrinks
+it), and staging stops once it has read that much — warming a model must
+never push the current one (or the browser) out of RAM.
+
+One job runs at a time; staging a different model cancels the previous job.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+READ_CHUNK = 8 * 1024 * 1024
+BUDGET_RECHECK_BYTES = 256 * 1024 * 1024
+DEFAULT_HEADROOM_MB = 4096
+MIN_STAGE_BYTES = 256 * 1024 * 1024
+
+
+def _settings():
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _available_bytes():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+
+def resolve_model_path(model_id, models_dir=None):
+    """Map a picker id ("folder/file.gguf") to an absolute path inside models_dir, or None."""
+    if models_dir is None:
+        models_dir = _settings().get("llama_models_dir", "")
+    if not model_id or not models_dir:
+        return None
+    root = os.path.realpath(models_dir)
+    path = os.path.realpath(os.path.join(root, str(model_id).replace("\\", "/")))
+    if os.path.commonpath([root, path]) != root or not path.lower().endswith(".gguf"):
+        return None
+    return path if os.path.isfile(path) else None
+
+
+class ModelPrestager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}           # path -> status dict
+        self._current = None      # path being staged
+        self._target = None       # path of the most recently requested job
+        self._cancel = threading.Event()
+        self._thread = None
+        self._active = None       # GGUF llama-server was last launched with
+
+    def set_active_model(self, path):
+        """Record the GGUF the managed llama-server runs, so staging leaves it resident."""
+        with self._lock:
+            self._active = os.path.realpath(path) if path else None
+
+    def _active_bytes(self, staging_path):
+        with self._lock:
+            active = self._active
+        if active is None:
+            # Attached to an already-running server: assume it runs the last model.
+            active = resolve_model_path(_settings().get("llama_last_model"))
+        if not active or os.path.realpath(active) == os.path.realpath(staging_path):
+            return 0
+        try:
+            return os.path.getsize(active)
+        except OSError:
+            return 0
+
+    def status(self, path=None):
+        with self._lock:
+            if path is not None:
+                job = self._jobs.get(path)
+                return dict(job) if job else None
+            return {
+                "current": self._current,
+                "jobs": {p: dict(j) for p, j in self._jobs.items()},
+            }
+
+    def _update(self, path, **fields):
+        with self._lock:
+            self._jobs.setdefault(path, {}).update(fields)
+
+    def stage(self, path):
+        """Start staging `path` unless it is already staged or in progress."""
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            return {"state": "failed", "detail": str(e)}
+        with self._lock:
+            job = self._jobs.get(path)
+            if job and job.get("mtime_ns") == stat.st_mtime_ns:
+                if job["state"] == "staged" or (job["state"] in ("queued", "staging") and self._target == path):
+                    return dict(job)
+            if self._current and self._current != path:
+                self._cancel.set()
+            previous = self._thread
+            self._target = path
+            self._jobs[path] = {
+                "state": "queued", "detail": "", "bytes_done": 0, "bytes_total": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns, "started_at": None, "finished_at": None, "mb_per_s": None,
+            }
+            thread = threading.Thread(target=self._run, args=(path, previous), daemon=True,
+                                      name="model-prestage")
+            self._thread = thread
+            job = dict(self._jobs[path])
+        thread.start()
+        return job
+
+    def cancel_except(self, path=None):
+        """Stop any running job that isn't for `path` (e.g. right before a switch)."""
+        with self._lock:
+            if self._current and self._current != path:
+                self._cancel.set()
+
+    def _run(self, path, previous):
+        if previous is not None:
+            previous.join()
+        with self._lock:
+            if self._thread is not threading.current_thread():
+                # Superseded while waiting for the previous job to stop.
+                self._jobs[path].update(state="cancelled", detail="superseded")
+                return
+            self._current = path
+            self._cancel.clear()
+        try:
+            self._stage(path)
+        except Exception as e:
+            logging.error(f"❌ Model pre-stage failed for {os.path.basename(path)}: {e}")
+            self._update(path, state="failed", detail=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                if self._current == path:
+                    self._current = None
+
+    def _headroom_bytes(self):
+        try:
+            return int(_settings().get("model_prestage_headroom_mb", DEFAULT_HEADROOM_MB)) * 1024 * 1024
+        except (TypeError, ValueError):
+            return DEFAULT_HEADROOM_MB * 1024 * 1024
+
+    def _stage(self, path):
+        name = os.path.basename(path)
+        total = os.path.getsize(path)
+        headroom = self._headroom_bytes()
+        active = self._active_bytes(path)
+        available = _available_bytes()
+        if available is None:
+            self._update(path, state="skipped", detail="psutil not installed — no memory budget check")
+            return
+        budget = min(total, available - headroom - active)
+        if budget < min(total, MIN_STAGE_BYTES):
+            self._update(path, state="skipped", finished_at=time.time(),
+                         detail=f"only {available // 2**20} MB available, {headroom // 2**20} MB headroom "
+                                f"and {active // 2**20} MB for the active model required")
+            print(f"⏭️ Pre-stage skipped for {name}: not enough free memory")
+            return
+
+        started = time.time()
+        self._update(path, state="staging", started_at=started, bytes_total=budget)
+        print(f"📥 Pre-staging {name} ({budget / 2**30:.1f} of {total / 2**30:.1f} GB) into page cache")
+        done = 0
+        next_check = BUDGET_RECHECK_BYTES
+        buf = bytearray(READ_CHUNK)
+        view = memoryview(buf)
+        with open(path, "rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                try:
+                    os.posix_fadvise(f.fileno(), 0, budget, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(f.fileno(), 0, budget, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+            while done < budget:
+                if self._cancel.is_set():
+                    self._update(path, state="cancelled", detail="superseded", bytes_done=done,
+                                 finished_at=time.time())
+                    return
+                n = f.readinto(view[:min(READ_CHUNK, budget - done)])
+                if not n:
+                    break
+                done += n
+                self._update(path, bytes_done=done)
+                if done >= next_check:
+                    next_check += BUDGET_RECHECK_BYTES
+                    available = _available_bytes()
+                    if available is not None and available - headroom - active < done:
+                        self._update(path, state="partial", bytes_done=done, finished_at=time.time(),
+                                     detail="stopped to preserve memory headroom")
+                        print(f"⚠️ Pre-stage of {name} stopped at {done / 2**30:.1f} GB — memory headroom reached")
+                        return
+        elapsed = max(time.time() - started, 1e-6)
+        self._update(path, state="staged" if done >= total else "partial", bytes_done=done,
+                     finished_at=time.time(), mb_per_s=round(done / 2**20 / elapsed, 1))
+        print(f"✅ Pre-staged {name}: {done / 2**30:.1f} GB in {elapsed:.1f}s")
+
+
+model_prestager = ModelPrestager()
+
+
+def prestage_model_id(model_id):
+    """Resolve a picker id against llama_models_dir and stage it; returns status or None."""
+    if not _settings().get("model_prestage_enabled", True):
+        return None
+    path = resolve_model_path(model_id)
+    if not path:
+        return None
+    return model_prestager.stage(path)
@@ -0,0 +1,127 @@
+"""N-best candidate generation: several replies to one prompt, streamed together.
+
+Comparing alternatives used to mean pressing Regenerate repeatedly — each
+press a full sequential prefill + generation. With llama-server running
+`parallel > 1`, N /completion requests for the same prompt are scheduled on N
+slots and decoded in the same batches, so N candidates cost little more
+wall-clock time than one. Each request carries cache_prompt, so every slot
+keeps the prompt cached for the next round of candidates or a regenerate.
+
+multiplex() runs one stream per candidate on its own thread and interleaves
+their chunks into a single SSE response:
+
+    data: {"candidate": 0, "delta": "Hel"}
+    data: {"candidate": 1, "delta": "Hi"}
+    data: {"candidate": 0, "done": true, "chars": 812}
+    data: {"candidate": 1, "error": "…"}
+    data: {"done": true, "candidates": 2}
+
+The browser renders one pane per candidate and persists only the one the user
+picks — nothing is written to the chat server-side.
+"""
+
+import json
+import queue
+import threading
+
+
+DEFAULT_MAX_CANDIDATES = 4
+_END = object()
+
+
+def candidate_capacity(settings, pool_backends=()):
+    """How many candidates can run concurrently: the slots the backends report
+    (from /slots probes), else llama_args.parallel for the managed server."""
+    slots = sum(b.slots_total or 0 for b in pool_backends if b.healthy)
+    if slots:
+        return slots
+    try:
+        return max(1, int(settings.get("llama_args", {}).get("parallel", 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def candidate_slot_ctx(settings, ctx_size, pool_backends=()):
+    """Context each candidate gets for prompt + reply, and where it came from.
+
+    Candidates can land on any healthy backend, so this is the smallest
+    per-slot n_ctx the backends report (/slots or /props probes); only when
+    none report one is the managed server's ctx_size split by
+    llama_args.parallel.
+    """
+    reported = [b.slot_ctx for b in pool_backends if b.healthy and b.slot_ctx]
+    if reported:
+        return min(reported), "backend n_ctx per slot"
+    try:
+        parallel = max(1, int(settings.get("llama_args", {}).get("parallel", 1)))
+    except (TypeError, ValueError):
+        parallel = 1
+    return ctx_size // parallel, f"ctx_size {ctx_size} / parallel {parallel}"
+
+
+def clamp_candidates(requested, settings, pool_backends=()):
+    """Number of candidates to generate for a request asking for `requested`."""
+    try:
+        requested = int(requested or 1)
+        limit = int(settings.get("nbest_max_candidates", DEFAULT_MAX_CANDIDATES))
+    except (TypeError, ValueError):
+        return 1
+    return max(1, min(requested, limit, candidate_capacity(settings, pool_backends)))
+
+
+def _sse(event):
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def multiplex(sources, stop=None):
+    """Yield SSE events interleaving the chunks of every source.
+
+    `sources` are zero-argument callables returning an iterable of text chunks;
+    each runs on its own thread. Closing the generator (client disconnect)
+    sets `stop`, and every worker closes its stream at the next chunk.
+    """
+    stop = stop or threading.Event()
+    events = queue.Queue()
+
+    def run(index, source):
+        chars = 0
+        stream = None
+        try:
+            stream = source()
+            for chunk in stream:
+                if stop.is_set():
+                    break
+                if chunk:
+                    chars += len(chunk)
+                    events.put({"candidate": index, "delta": chunk})
+            events.put({"candidate": index, "done": True, "chars": chars})
+        except Exception as e:
+            print(f"❌ N-best candidate {index} failed: {e}", flush=True)
+            events.put({"candidate": index, "error": str(e)})
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                try:
+                    close()
+                except Exception:
+                    pass
+            events.put(_END)
+
+    workers = [
+        threading.Thread(target=run, args=(i, source), daemon=True, name=f"nbest-{i}")
+        for i, source in enumerate(sources)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        running = len(workers)
+        while running:
+            event = events.get()
+            if event is _END:
+                running -= 1
+                continue
+            yield _sse(event)
+        yield _sse({"done": True, "candidates": len(workers)})
+    finally:
+        stop.set()
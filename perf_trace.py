@@ -0,0 +1,276 @@
+"""Per-request timing spans for the /chat pipeline.
+
+chat() prints a lot but timed nothing, so a slow turn couldn't be pinned on
+settings reads, memory retrieval, document loading, the search intent gate,
+web search, trimming, /tokenize, llama prefill or decode. A Trace is begun at
+the top of a request and finished once its response has been sent (after the
+streamed reply is exhausted); in between, code records spans against it:
+
+    with span("retrieve_memory"):
+        ...
+
+    @timed("load_documents")
+    def _load_documents(...): ...
+
+    timer = stream_timer("llm")      # generators: connect / prefill / decode
+    timer.sent(); timer.first_token(); timer.done(tokens_predicted=...)
+
+The current trace is thread-local — Flask serves a request, including its
+streamed body, on one thread; work handed to other threads re-attaches it
+with attach(current()). When tracing is off (`perf_trace_enabled:
+false`) or no trace is active, span()/timed()/stream_timer() cost one
+attribute lookup and hand back shared no-op objects.
+
+Finished traces go to a ring buffer (/perf/recent) and, when
+`perf_trace_file` is set, are appended to that JSONL file.
+"""
+
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+RING_SIZE = 100
+
+_local = threading.local()
+_recent = deque(maxlen=RING_SIZE)
+_recent_lock = threading.Lock()
+_file_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+def _read_settings():
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return {}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class Trace:
+    def __init__(self, kind, trace_file=None, t0=None, **attrs):
+        self.id = next(_ids)
+        self.kind = kind
+        self.attrs = dict(attrs)
+        self.trace_file = trace_file
+        self.started_at = time.time()
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.spans = []
+        self.marks = []
+        self.depth = 0
+        self.finished = False
+
+    def record(self, name, start, end=None, depth=None, **attrs):
+        """Add a span from perf_counter() values `start`..`end` (default now)."""
+        end = time.perf_counter() if end is None else end
+        entry = {"name": name, "start_ms": _ms(start - self.t0), "dur_ms": _ms(end - start),
+                 "depth": self.depth if depth is None else depth}
+        if attrs:
+            entry["attrs"] = attrs
+        self.spans.append(entry)
+
+    def mark(self, name):
+        self.marks.append({"name": name, "at_ms": _ms(time.perf_counter() - self.t0)})
+
+    def annotate(self, **attrs):
+        self.attrs.update(attrs)
+
+    def summary(self):
+        totals = {}
+        for s in self.spans:
+            t = totals.setdefault(s["name"], {"count": 0, "total_ms": 0.0})
+            t["count"] += 1
+            t["total_ms"] = round(t["total_ms"] + s["dur_ms"], 2)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "total_ms": _ms(time.perf_counter() - self.t0),
+            "attrs": self.attrs,
+            "totals": totals,
+            "marks": self.marks,
+            "spans": self.spans,
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "start")
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.trace.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.depth -= 1
+        if exc_type is not None:
+            self.attrs = dict(self.attrs, error=exc_type.__name__)
+        self.trace.record(self.name, self.start, **self.attrs)
+        return False
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class StreamTimer:
+    """connect → prefill (first token) → decode spans for a streamed reply."""
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.t_start = time.perf_counter()
+        self.t_sent = None
+        self.t_first = None
+
+    def sent(self):
+        self.t_sent = time.perf_counter()
+
+    def first_token(self):
+        if self.t_first is None:
+            self.t_first = time.perf_counter()
+
+    def done(self, **attrs):
+        end = time.perf_counter()
+        sent = self.t_sent or self.t_start
+        self.trace.record(f"{self.name}.connect", self.t_start, sent)
+        if self.t_first is not None:
+            self.trace.record(f"{self.name}.prefill", sent, self.t_first)
+            self.trace.record(f"{self.name}.decode", self.t_first, end, **attrs)
+        else:
+            self.trace.record(f"{self.name}.no_output", sent, end, **attrs)
+
+
+class _NoopTimer:
+    def sent(self):
+        pass
+
+    def first_token(self):
+        pass
+
+    def done(self, **attrs):
+        pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def begin(kind, settings=None, t0=None, **attrs):
+    """Start the current thread's trace; returns it, or None when disabled.
+
+    `t0` backdates the trace to an earlier perf_counter() reading, e.g. route
+    entry before settings.json was read to decide whether to trace at all.
+    """
+    settings = _read_settings() if settings is None else settings
+    if not settings.get("perf_trace_enabled", True):
+        _local.trace = None
+        return None
+    trace = Trace(kind, trace_file=settings.get("perf_trace_file") or None, t0=t0, **attrs)
+    _local.trace = trace
+    return trace
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+def attach(trace):
+    """Make `trace` current on this thread — for worker threads that do part
+    of a request's work (N-best candidate streams). Returns the previous one."""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    return previous
+
+
+def span(name, **attrs):
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, attrs)
+
+
+def timed(name):
+    """Decorator: record every call of the function as a span."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = getattr(_local, "trace", None)
+            if trace is None:
+                return fn(*args, **kwargs)
+            with _Span(trace, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def stream_timer(name):
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return _NOOP_TIMER
+    return StreamTimer(trace, name)
+
+
+def mark(name):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.mark(name)
+
+
+def annotate(**attrs):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.annotate(**attrs)
+
+
+def finish(trace=None):
+    """End `trace` (default: the current thread's) and publish it; returns its
+    summary, or None if there was nothing to finish."""
+    current_trace = getattr(_local, "trace", None)
+    trace = trace or current_trace
+    if trace is None or trace.finished:
+        return None
+    trace.finished = True
+    if trace is current_trace:
+        _local.trace = None
+    summary = trace.summary()
+    with _recent_lock:
+        _recent.append(summary)
+    if trace.trace_file:
+        try:
+            line = json.dumps(summary, ensure_ascii=False, default=str)
+            with _file_lock:
+                with open(trace.trace_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            print(f"⚠️ Could not write perf trace to {trace.trace_file}: {e}", flush=True)
+    return summary
+
+
+def recent(limit=20, kind=None):
+    """Newest-first finished traces."""
+    with _recent_lock:
+        items = list(_recent)
+    if kind:
+        items = [t for t in items if t["kind"] == kind]
+    return items[::-1][:max(0, limit)]
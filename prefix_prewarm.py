@@ -0,0 +1,135 @@
+"""Speculative prefill of a chat's prompt prefix while the user is typing.
+
+On long chats most of the time-to-first-token is llama-server prefilling the
+part of the prompt that is already known before Send is pressed: the system
+block (with memories and documents retrieved for the draft), example dialogue
+and the trimmed history. /chat/prewarm runs the normal /chat pipeline on the
+committed history plus the draft, cuts the prompt before the final user turn,
+and hands that prefix to PrefixPrewarmer. The prewarmer sends it as a
+`n_predict: 0`, `cache_prompt: true` completion on the chat's sticky backend,
+so the slot holds the prefix in its KV cache. When the real request arrives,
+llama-server reuses the common prefix and evaluates only the new user turn and
+whatever volatile injections changed.
+
+A prewarm is speculative and must never delay a real reply: stream_model_response
+/ stream_vision_response cancel any running prewarm before they send, and
+a newer prewarm supersedes an older one. The request is streamed so closing
+the connection makes llama-server drop the task. A prefix identical to the one
+last warmed for the same chat is not sent again.
+"""
+
+import hashlib
+import threading
+import time
+
+
+RECENT_TTL = 600.0
+
+
+class PrefixPrewarmer:
+    def __init__(self, pool):
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._current = None          # {"key", "response", "cancelled"} of the running job
+        self._warm = {}               # chat key -> (prefix sha, finished_at)
+        self.last = None              # status dict of the most recent job
+
+    def _already_warm(self, key, sha):
+        entry = self._warm.get(key)
+        return bool(entry and entry[0] == sha and time.time() - entry[1] < RECENT_TTL)
+
+    def _remember_warm_locked(self, key, sha):
+        # One entry per chat ever prewarmed would grow for the life of the
+        # server; entries past RECENT_TTL can never match again, so drop them.
+        now = time.time()
+        for stale in [k for k, (_sha, at) in self._warm.items() if now - at >= RECENT_TTL]:
+            del self._warm[stale]
+        self._warm[key] = (sha, now)
+
+    def start(self, key, prefix, affinity=None):
+        """Prefill `prefix` in the background; returns the job's status dict."""
+        sha = hashlib.sha256(prefix.encode("utf-8", errors="replace")).hexdigest()
+        with self._lock:
+            if self._already_warm(key, sha):
+                return {"state": "warm", "chars": len(prefix)}
+            if self._current and self._current["sha"] == sha:
+                return {"state": "running", "chars": len(prefix)}
+            self._cancel_locked()
+            job = {"key": key, "sha": sha, "response": None, "cancelled": False}
+            self._current = job
+        thread = threading.Thread(target=self._run, args=(job, prefix, affinity),
+                                  daemon=True, name="prefix-prewarm")
+        thread.start()
+        return {"state": "started", "chars": len(prefix)}
+
+    def _cancel_locked(self):
+        job = self._current
+        if not job:
+            return False
+        job["cancelled"] = True
+        response = job["response"]
+        self._current = None
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+        return True
+
+    def cancel(self):
+        """Drop the running prewarm (a real generation is about to start)."""
+        with self._lock:
+            cancelled = self._cancel_locked()
+        if cancelled:
+            print("⏹️ Prefix prewarm cancelled — real generation starting", flush=True)
+        return cancelled
+
+    def _run(self, job, prefix, affinity):
+        started = time.time()
+        state, detail = "done", ""
+        try:
+            response = self._pool.post(
+                "/completion",
+                affinity=affinity,
+                json={"prompt": prefix, "n_predict": 0, "cache_prompt": True, "stream": True},
+                stream=True,
+                timeout=(5, None),
+            )
+            with self._lock:
+                if job["cancelled"]:
+                    response.close()
+                    return
+                job["response"] = response
+            try:
+                if response.status_code != 200:
+                    state, detail = "failed", f"HTTP {response.status_code}"
+                else:
+                    for _line in response.iter_lines():
+                        if job["cancelled"]:
+                            break
+            finally:
+                response.close()
+        except Exception as e:
+            state, detail = "failed", str(e)
+        if job["cancelled"]:
+            state = "cancelled"
+        elapsed = time.time() - started
+        with self._lock:
+            if state == "done":
+                self._remember_warm_locked(job["key"], job["sha"])
+            if self._current is job:
+                self._current = None
+            self.last = {"key": job["key"], "state": state, "detail": detail,
+                         "chars": len(prefix), "elapsed_s": round(elapsed, 2), "finished_at": time.time()}
+        if state == "done":
+            print(f"🔥 Prefix prewarmed for {job['key']}: {len(prefix)} chars in {elapsed:.1f}s", flush=True)
+        elif state == "failed":
+            print(f"⚠️ Prefix prewarm failed for {job['key']}: {detail}", flush=True)
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self._current["key"] if self._current else None,
+                "last": dict(self.last) if self.last else None,
+                "warm_chats": len(self._warm),
+            }
@@ -7,7 +7,8 @@ import shutil
 import subprocess
 from flask import Blueprint, jsonify, request
 from datetime import datetime
-from truncation import rough_token_count
+from truncation import rough_token_count, context_window_size
+from document_extract import extractor as document_extractor
 
 print("✅ project_routes blueprint loaded")
 
@@ -306,9 +307,13 @@ def upload_document(project_name):
         
         filepath = os.path.join(docs_dir, filename)
         file.save(filepath)
-        
+
+        # Extract now, in the background, so the first chat turn that pulls
+        # this document reads the cached text instead of parsing it.
+        job = document_extractor.submit(filepath)
+
         print(f"Uploaded document: {filename} to {project_name}")
-        return jsonify({"success": True, "filename": filename})
+        return jsonify({"success": True, "filename": filename, "job": job.snapshot()})
         
     except Exception as e:
         print(f"❌ Upload failed: {e}")
@@ -350,8 +355,10 @@ def upload_document_from_dialog(project_name):
         if not (os.path.exists(destination) and os.path.samefile(selected, destination)):
             shutil.copy2(selected, destination)
 
+        job = document_extractor.submit(destination)
+
         print(f"Uploaded document from picker: {filename} to {project_name}")
-        return jsonify({"success": True, "filename": filename})
+        return jsonify({"success": True, "filename": filename, "job": job.snapshot()})
 
     except Exception as e:
         print(f"Picker upload failed: {e}")
@@ -1322,7 +1329,7 @@ def _looks_like_character_voice_leak(text, user_name):
 
 
 def _request_document_completion(prompt, n_predict):
-    from app_runtime_helpers import get_api_url, get_stop_tokens
+    from app_runtime_helpers import get_stop_tokens, llama_request
 
     payload = {
         "prompt": prompt,
@@ -1333,7 +1340,7 @@ def _request_document_completion(prompt, n_predict):
         "stream": False,
         "stop": get_stop_tokens(),
     }
-    resp = requests.post(f"{get_api_url()}/completion", json=payload, timeout=90)
+    resp = llama_request("POST", "/completion", json=payload, timeout=90)
     if resp.status_code >= 400:
         body_text = resp.text[:500] if resp.text else ""
         raise RuntimeError(f"llama.cpp returned {resp.status_code}: {body_text or 'no body'}")
@@ -1362,11 +1369,7 @@ def save_global_document_from_chat():
     if not transcript:
         return jsonify({"success": False, "error": "No conversation content to save."}), 400
 
-    try:
-        with open("settings.json", "r", encoding="utf-8") as sf:
-            ctx_size = int((json.load(sf) or {}).get("llama_args", {}).get("ctx_size", 12288))
-    except Exception:
-        ctx_size = 12288
+    ctx_size = context_window_size(12288)
     gen_min = 256
     gen_target = 900
     est_real = int(rough_token_count(prompt) * 1.25)
@@ -0,0 +1,97 @@
+"""Versioned cache for the static segments of the chat system prompt.
+
+Every /chat turn used to rebuild the character context from scratch: reload
+the character JSON, run strip_chatml + substitute_placeholders over each
+field, re-read the system prompt / instruction layer / tone primer and walk
+the example-dialogue fallback chain (character JSON → global_example_dialog →
+.example.txt) — twice — then regex-count tokens over all of it.
+
+Those pieces only change when one of their inputs does, so app.py builds them
+through this cache with a key made of the inputs' versions: file
+(mtime_ns, size) for the character card, user persona, system-prompt files and
+settings.json, plus the placeholder labels and anything else the rendering
+reads. A version change is simply a different key; stale entries age out of
+the LRU. Only the per-turn parts (session summaries, documents, memory, time
+of day) are assembled fresh.
+
+Segment values carry their rough token count so the overhead/size accounting
+doesn't re-scan unchanged text either.
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from truncation import rough_token_count
+
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+MAX_ENTRIES = 256
+
+Segment = namedtuple("Segment", "text tokens")
+EMPTY_SEGMENT = Segment("", 0)
+
+
+def file_version(path):
+    """(mtime_ns, size) of `path`, or None when it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def settings_version():
+    return file_version(SETTINGS_FILE)
+
+
+def make_segment(text):
+    text = text or ""
+    return Segment(text, rough_token_count(text)) if text else EMPTY_SEGMENT
+
+
+class PromptSegmentCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, key, build):
+        """Cached build() for (kind, key). A None key bypasses the cache —
+        used when an input's version can't be determined."""
+        if key is None:
+            return build()
+        full_key = (kind, key)
+        with self._lock:
+            if full_key in self._entries:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return self._entries[full_key]
+            self.misses += 1
+        value = build()
+        with self._lock:
+            self._entries[full_key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def segment(self, kind, key, render):
+        """Like get(), for a rendered text: returns Segment(text, tokens)."""
+        return self.get(kind, key, lambda: make_segment(render()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            kinds = {}
+            for kind, _key in self._entries:
+                kinds[kind] = kinds.get(kind, 0) + 1
+            return {"entries": len(self._entries), "by_kind": kinds,
+                    "hits": self.hits, "misses": self.misses}
+
+
+prompt_segments = PromptSegmentCache()
@@ -1,7 +1,7 @@
 import os, json, re
 import requests
 from flask import Blueprint, request, jsonify
-from truncation import rough_token_count
+from truncation import rough_token_count, context_window_size
 
 session_summary_bp = Blueprint('session_summary', __name__)
 
@@ -215,7 +215,7 @@ def generate_session_summary():
     """
     try:
         try:
-            from app_runtime_helpers import get_api_url, get_stop_tokens
+            from app_runtime_helpers import get_api_url, get_stop_tokens, llama_request
         except Exception as helper_error:
             print(f"⚠️ summary helper import failed: {helper_error}", flush=True)
 
@@ -228,6 +228,9 @@ def generate_session_summary():
                     _port = 8080
                 return f"http://127.0.0.1:{_port}"
 
+            def llama_request(method, path, affinity=None, **kwargs):
+                return requests.request(method, f"{get_api_url()}{path}", **kwargs)
+
             def get_stop_tokens():
                 try:
                     with open("settings.json", "r", encoding="utf-8") as _sf:
@@ -467,11 +470,7 @@ def generate_session_summary():
         # and trusted the prompt fit; for big character cards (Helcyon's ~2k-token
         # example dialogue + main_prompt) plus 30 messages of transcript, this
         # could exceed available KV space and llama.cpp returns 400.
-        try:
-            with open("settings.json", "r", encoding="utf-8") as _snf:
-                _ctx_size_live = int(json.load(_snf).get("llama_args", {}).get("ctx_size", 12288))
-        except Exception:
-            _ctx_size_live = 12288
+        _ctx_size_live = context_window_size(12288)
 
         # Reserve space for generation. We aim for up to 600 tokens of summary
         # but will accept as little as 256 if context is tight.
@@ -529,7 +528,7 @@ def generate_session_summary():
         elif backend_mode == "anthropic" and cloud_enabled:
             summary_text = _generate_anthropic_summary(_build_cloud_user_prompt(transcript), _n_predict)
         else:
-            resp = requests.post(f"{get_api_url()}/completion", json=payload, timeout=60)
+            resp = llama_request("POST", "/completion", json=payload, timeout=60)
             if resp.status_code >= 400:
                 # Surface llama.cpp's actual error message — the bare HTTPError string
                 # (e.g. "400 Client Error: Bad Request for url: …") tells you nothing
@@ -1,7 +1,7 @@
 import os, json, re
 import requests
 from flask import Blueprint, request, jsonify
-from truncation import rough_token_count
+from truncation import rough_token_count, context_window_size
 
 shard_gen_bp = Blueprint('shard_gen', __name__)
 
@@ -155,7 +155,7 @@ def _load_settings():
 
 def _generate_local(system_prompt, max_new_tokens):
     """llama.cpp /completion path — same wiring as generate_session_summary."""
-    from app_runtime_helpers import get_api_url, get_stop_tokens
+    from app_runtime_helpers import get_stop_tokens, llama_request
 
     prompt = (
         f"<|im_start|>system\n{system_prompt}<|im_end|>\n"
@@ -166,17 +166,15 @@ def _generate_local(system_prompt, max_new_tokens):
 
     # Cap n_predict to actual KV space left after the prompt (rough_token_count
     # undercounts BPE by ~25% — same fudge as truncation.py / summary route).
-    try:
-        ctx_size = int(_load_settings().get("llama_args", {}).get("ctx_size", 12288))
-    except Exception:
-        ctx_size = 12288
+    ctx_size = context_window_size(12288)
     est_prompt = int(rough_token_count(prompt) * 1.25)
     n_predict = max(256, min(max_new_tokens, ctx_size - est_prompt - 64))
     print(f"🧩 shard gen: local path, prompt ~{est_prompt} real / {ctx_size} ctx, "
           f"n_predict={n_predict}", flush=True)
 
-    resp = requests.post(
-        f"{get_api_url()}/completion",
+    resp = llama_request(
+        "POST",
+        "/completion",
         json={
             "prompt": prompt,
             "temperature": 0.8,
@@ -0,0 +1,88 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_synthesis_queue import SynthesisQueue
+
+
+def _wait_for_depth(queue, depth, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while queue.stats()['depth'] < depth:
+        if time.monotonic() > deadline:
+            raise AssertionError(f'queue never reached depth {depth}')
+        time.sleep(0.005)
+
+
+class SynthesisQueueBatchingTest(unittest.TestCase):
+    def _submit_while_busy(self, queue, jobs):
+        """Park the worker on a blocking job, queue `jobs` from threads, then release it."""
+        release = threading.Event()
+        blocker = threading.Thread(target=queue.call, args=(release.wait,))
+        blocker.start()
+        deadline = time.monotonic() + 2.0
+        while queue.stats()['running'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        results = {}
+
+        def submit(key, item):
+            results[item] = queue.synthesize(key, item, lambda: ('single', item))
+
+        threads = [threading.Thread(target=submit, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        _wait_for_depth(queue, len(jobs))
+        release.set()
+        for thread in threads + [blocker]:
+            thread.join(timeout=2)
+        return results
+
+    def test_concurrent_same_voice_jobs_share_one_call(self):
+        calls = []
+
+        def run_batch(key, items):
+            calls.append((key, list(items)))
+            return [('batch', item) for item in items]
+
+        queue = SynthesisQueue('test-batch', run_batch=run_batch, batch_window=0.05, max_batch=4)
+        results = self._submit_while_busy(queue, [('Sol', 'one'), ('Sol', 'two'), ('Sol', 'three')])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][0], 'Sol')
+        self.assertCountEqual(calls[0][1], ['one', 'two', 'three'])
+        self.assertEqual(results, {item: ('batch', item) for item in ('one', 'two', 'three')})
+        self.assertEqual(queue.stats()['batches'], 1)
+        self.assertEqual(queue.stats()['batched_jobs'], 3)
+
+    def test_other_voices_and_fifo_queues_are_not_batched(self):
+        calls = []
+
+        def run_batch(key, items):
+            calls.append((key, list(items)))
+            return [('batch', item) for item in items]
+
+        queue = SynthesisQueue('test-mixed', run_batch=run_batch, batch_window=0.05)
+        results = self._submit_while_busy(queue, [('Sol', 'a'), ('Luna', 'b')])
+        self.assertEqual(calls, [])
+        self.assertEqual(results, {'a': ('single', 'a'), 'b': ('single', 'b')})
+
+        fifo = SynthesisQueue('test-fifo')
+        results = self._submit_while_busy(fifo, [('Sol', 'x'), ('Sol', 'y')])
+        self.assertEqual(results, {'x': ('single', 'x'), 'y': ('single', 'y')})
+        self.assertEqual(fifo.stats()['batches'], 0)
+
+    def test_failed_batch_falls_back_to_single_jobs(self):
+        def run_batch(key, items):
+            raise RuntimeError('engine rejected the batch')
+
+        queue = SynthesisQueue('test-fallback', run_batch=run_batch, batch_window=0.05)
+        results = self._submit_while_busy(queue, [('Sol', 'p'), ('Sol', 'q')])
+        self.assertEqual(results, {'p': ('single', 'p'), 'q': ('single', 'q')})
+        self.assertEqual(queue.stats()['batches'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
-import re, json, os, hashlib
+import re, json, os
+
+import attachment_store
 
 
 _INLINE_ATTACHED_DOC_RE = re.compile(
@@ -12,7 +14,12 @@ _MODEL_REFERENCE_DOC_RE = re.compile(
 
 
 def _collect_inline_attachments(messages):
-    """Return durable inline attachments found in message history."""
+    """Return durable inline attachments found in message history.
+
+    Reference bodies (attachment_store) are keyed by their stored hash and
+    left unloaded — _build_attachment_recall_block fetches the text only for
+    attachments that actually make it into the recall block.
+    """
     attachments = []
     seen = set()
     for msg in messages or []:
@@ -31,7 +38,12 @@ def _collect_inline_attachments(messages):
         if not matches:
             matches = _MODEL_REFERENCE_DOC_RE.findall(content)
         for filename, body in matches:
-            digest = hashlib.sha256(body.encode("utf-8", errors="replace")).hexdigest()
+            ref = attachment_store.parse_ref(body)
+            if ref:
+                digest, chars = ref
+                body = None
+            else:
+                digest, chars = attachment_store.digest(body), len(body)
             key = (filename.strip(), digest)
             if key in seen:
                 continue
@@ -39,7 +51,7 @@ def _collect_inline_attachments(messages):
             attachments.append({
                 "filename": filename.strip(),
                 "content": body,
-                "chars": len(body),
+                "chars": chars,
                 "sha256": digest,
             })
     return attachments
@@ -69,6 +81,11 @@ def _build_attachment_recall_block(attachments, token_budget):
         return ""
 
     per_doc = max(12, int(token_budget / len(attachments)) - 18)
+    for attachment in attachments:
+        if attachment.get("content") is None:
+            attachment["content"] = attachment_store.load_body(
+                attachment_store.make_ref(attachment["sha256"], attachment["chars"])
+            )
 
     while per_doc >= 8:
         sections = []
@@ -105,14 +122,28 @@ def _prepend_to_latest_user(messages, text):
         return True
     return False
 
-def _read_ctx_size() -> int:
-    """Read ctx_size live from settings.json — never stale even if changed without restart."""
+_effective_ctx_size = None   # set by app.py once the running server's ctx is known
+
+
+def set_effective_ctx_size(ctx_size):
+    """Record the ctx llama-server actually runs with (launch value or /props)."""
+    global _effective_ctx_size
+    _effective_ctx_size = int(ctx_size) if ctx_size else None
+
+
+def _read_ctx_size(default: int = 16384) -> int:
+    """ctx_size to budget against: the running server's value when app.py has
+    recorded it, else read live from settings.json — never stale even if changed
+    without restart. Missing, 0 or "auto" fall back to `default`."""
+    if _effective_ctx_size:
+        return _effective_ctx_size
     try:
         _sf = os.path.join(os.path.dirname(__file__), "settings.json")
         with open(_sf, "r", encoding="utf-8") as f:
-            return int(json.load(f).get("llama_args", {}).get("ctx_size", 16384))
+            ctx = int(json.load(f).get("llama_args", {}).get("ctx_size", default))
+        return ctx if ctx > 0 else default
     except Exception:
-        return 16384
+        return default
 
 
 def _read_max_prompt_tokens() -> int:
@@ -144,6 +175,11 @@ def _read_backend_mode() -> str:
         return "local"
 
 
+def context_window_size(default: int = 16384) -> int:
+    """Public form of _read_ctx_size() for routes that budget a local generation."""
+    return _read_ctx_size(default)
+
+
 CONTEXT_WINDOW     = _read_ctx_size()  # read live from settings.json at import time
 GENERATION_RESERVE = 2048   # tokens reserved for the model response
 SYSTEM_BUFFER      = 200    # small safety margin for ChatML overhead tokens
@@ -169,6 +205,39 @@ def rough_token_count(text) -> int:
     return len(re.findall(r'\w+|[^\s\w]', text))
 
 
+_ATTACHMENT_REF_RE = re.compile(r"\[ATTACHMENT REF sha256:([0-9a-f]{64}) chars:(\d+)\]")
+_ref_token_counts = {}     # sha -> rough tokens of the stored body (blobs are immutable)
+
+
+def _ref_body_tokens(sha, chars):
+    """Rough tokens of the document a reference line expands to."""
+    n = _ref_token_counts.get(sha)
+    if n is None:
+        body = attachment_store.get(sha)
+        # Missing blob: estimate from the recorded length (~4 chars per rough token).
+        n = rough_token_count(body) if body is not None else max(1, chars // 4)
+        _ref_token_counts[sha] = n
+    return n
+
+
+def message_token_count(content) -> int:
+    """rough_token_count of a message as the model will see it.
+
+    Attachment references are one short line in history but are expanded to
+    the full document after trimming, so each one is costed by its stored body.
+    """
+    n = rough_token_count(content)
+    if isinstance(content, list):
+        content = " ".join(
+            part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text"
+        )
+    if not isinstance(content, str) or "[ATTACHMENT REF sha256:" not in content:
+        return n
+    for m in _ATTACHMENT_REF_RE.finditer(content):
+        n += _ref_body_tokens(m.group(1), int(m.group(2))) - rough_token_count(m.group(0))
+    return n
+
+
 def trim_chat_history(messages, token_budget: int = None, extra_system_overhead: int = 0):
     if not messages:
         return []
@@ -178,7 +247,7 @@ def trim_chat_history(messages, token_budget: int = None, extra_system_overhead:
     body = messages[1:] if system_msg else messages
 
     # Measure actual system message size
-    system_tokens = rough_token_count(system_msg.get("content", "")) if system_msg else 0
+    system_tokens = message_token_count(system_msg.get("content", "")) if system_msg else 0
     print(f"📊 System message: ~{system_tokens} tokens")
 
     # Dynamically calculate how much room is left for conversation history.
@@ -225,7 +294,7 @@ def trim_chat_history(messages, token_budget: int = None, extra_system_overhead:
     trimmed = []
 
     for msg in reversed(body):
-        n = rough_token_count(msg.get("content", "")) + 20  # +20 for ChatML tags
+        n = message_token_count(msg.get("content", "")) + 20  # +20 for ChatML tags
         if total + n > conversation_budget and trimmed:
             break
         trimmed.insert(0, msg)
@@ -269,7 +338,7 @@ def trim_chat_history(messages, token_budget: int = None, extra_system_overhead:
     # Chats without attachments remain byte-for-byte on the old trim path.
     if dropped_attachments:
         kept_tokens = sum(
-            rough_token_count(msg.get("content", "")) + 20
+            message_token_count(msg.get("content", "")) + 20
             for msg in trimmed
         )
         available_tokens = max(conversation_budget - kept_tokens, 0)
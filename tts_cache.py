@@ -0,0 +1,196 @@
+"""Content-addressed disk cache for synthesised TTS audio.
+
+Audio is keyed by a SHA-256 of (engine, voice, voice version, normalised text,
+generation params), so replaying a message, re-reading it after a UI reload, or speaking
+a character's opening line again costs a file read instead of a synthesis.
+
+Layout: tts_cache/<key[:2]>/<key>.wav. The file mtime doubles as the LRU
+timestamp (bumped on every hit), so eviction order survives restarts without
+a separate index file. The in-memory index is rebuilt lazily from a directory
+scan on first use.
+
+The voice version is the mtime/size stamp of a cloned voice's reference files
+(voice_file_version(), reported by each engine's /voices), so replacing or
+re-recording a voice under the same name stops serving its old audio.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+
+
+TTS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_cache')
+DEFAULT_MAX_MB = 512
+
+
+def normalise_text(text):
+    """Whitespace/Unicode-normalise so trivially different strings share audio.
+
+    Case and punctuation are kept — both change prosody.
+    """
+    text = unicodedata.normalize('NFKC', str(text or ''))
+    return ' '.join(text.split())
+
+
+def voice_file_version(*paths):
+    """Version stamp for a voice from its reference files' mtime and size, or
+    None if any file is missing. Used by the TTS servers' /voices."""
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        parts.append(f'{stat.st_mtime_ns:x}.{stat.st_size:x}')
+    return '-'.join(parts)
+
+
+def cache_key(engine, voice, text, params=None, voice_version=None):
+    fields = {
+        'engine': engine,
+        'voice': voice,
+        'text': normalise_text(text),
+        'params': params or {},
+    }
+    # Built-in voices (Kokoro) have no version; their keys stay as they were.
+    if voice_version:
+        fields['voice_version'] = voice_version
+    material = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class TTSAudioCache:
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None  # key -> [size, last_used]
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.wav')
+
+    def _ensure_index_locked(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.wav'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                self._index[name[:-4]] = [stat.st_size, stat.st_mtime]
+                self._total += stat.st_size
+
+    def get(self, key):
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            self._ensure_index_locked()
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    audio = f.read()
+                now = time.time()
+                os.utime(path, (now, now))
+            except OSError:
+                self._total -= entry[0]
+                del self._index[key]
+                self.misses += 1
+                return None
+            entry[1] = now
+            self.hits += 1
+            return audio
+
+    def put(self, key, audio):
+        if self.max_bytes <= 0 or not audio or len(audio) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix='.tts_', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(audio)
+                os.replace(tmp_path, path)
+            except Exception:
+                try:
+                    os.unlink(tmp_path)
+                except Exception:
+                    pass
+                raise
+        except Exception as e:
+            logging.error(f"⚠️ TTS cache write failed: {e}")
+            return
+        with self._lock:
+            self._ensure_index_locked()
+            previous = self._index.get(key)
+            if previous is not None:
+                self._total -= previous[0]
+            self._index[key] = [len(audio), time.time()]
+            self._total += len(audio)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        if self._total <= self.max_bytes:
+            return
+        for key, (size, _used) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"⚠️ TTS cache evict failed for {key}: {e}")
+                continue
+            del self._index[key]
+            self._total -= size
+
+    def set_budget(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            if self._index is not None:
+                self._evict_locked()
+
+    def clear(self):
+        with self._lock:
+            self._ensure_index_locked()
+            for key in list(self._index):
+                try:
+                    os.unlink(self._path(key))
+                except OSError:
+                    pass
+            self._index = {}
+            self._total = 0
+
+    def stats(self):
+        with self._lock:
+            self._ensure_index_locked()
+            return {
+                'entries': len(self._index),
+                'bytes': self._total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+audio_cache = TTSAudioCache()
@@ -0,0 +1,141 @@
+"""Optional compressed transport for TTS audio (Opus-in-OGG or MP3).
+
+Engines hand back 16-bit WAV at ~384 kbit/s (24 kHz mono). Over Tailscale on
+a cellular link that stalls playback, so tts_routes can transcode on the way
+out when the client asks for it in its Accept header. Encoding goes through an
+ffmpeg subprocess — libopus/libmp3lame are far cheaper per second of audio
+than anything pure-Python, and ffmpeg reads the streamed WAV (placeholder
+sizes and all) incrementally, so encoded pages leave as soon as the engine's
+PCM arrives.
+
+Everything here is optional: without ffmpeg on PATH, or with
+tts_compression_enabled false in settings.json, negotiate() returns None and
+callers keep sending WAV.
+"""
+
+import logging
+import shutil
+import subprocess
+import threading
+
+
+DEFAULT_BITRATE_KBPS = 32
+
+# Accept token → (ffmpeg args, response mimetype)
+FORMATS = {
+    'audio/ogg': (
+        ['-c:a', 'libopus', '-application', 'voip', '-frame_duration', '20',
+         # 100 ms pages so the first audio leaves promptly on a stream.
+         '-page_duration', '100000', '-f', 'ogg'],
+        'audio/ogg; codecs=opus',
+    ),
+    'audio/mpeg': (
+        ['-c:a', 'libmp3lame', '-f', 'mp3'],
+        'audio/mpeg',
+    ),
+}
+
+_ffmpeg_path = None
+_ffmpeg_checked = False
+
+
+def ffmpeg_path():
+    global _ffmpeg_path, _ffmpeg_checked
+    if not _ffmpeg_checked:
+        _ffmpeg_path = shutil.which('ffmpeg')
+        _ffmpeg_checked = True
+        if not _ffmpeg_path:
+            logging.info("TTS compression unavailable — ffmpeg not found on PATH; serving WAV")
+    return _ffmpeg_path
+
+
+def negotiate(accept_header, settings):
+    """Pick an encoded format from the Accept header, or None for plain WAV.
+
+    Honours q-values; WAV (or */*) ranked above the compressed types wins.
+    """
+    if not accept_header or not settings.get('tts_compression_enabled', True):
+        return None
+    ranked = []
+    for position, part in enumerate(accept_header.split(',')):
+        pieces = [p.strip() for p in part.split(';')]
+        media = pieces[0].lower()
+        q = 1.0
+        for param in pieces[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        ranked.append((-q, position, media))
+    for _q, _pos, media in sorted(ranked):
+        if media in ('audio/wav', 'audio/x-wav', 'audio/wave', 'audio/*', '*/*'):
+            return None
+        if media in FORMATS:
+            return media if ffmpeg_path() else None
+    return None
+
+
+def bitrate_kbps(settings):
+    try:
+        return max(6, min(int(settings.get('tts_compressed_bitrate_kbps', DEFAULT_BITRATE_KBPS)), 320))
+    except (TypeError, ValueError):
+        return DEFAULT_BITRATE_KBPS
+
+
+def mimetype(fmt):
+    return FORMATS[fmt][1]
+
+
+def transcode(chunks, fmt, bitrate):
+    """Yield encoded bytes for an iterable of WAV bytes (one file or a stream).
+
+    A feeder thread writes the input while this generator yields whatever
+    ffmpeg has produced so far, so encoding overlaps with synthesis.
+    """
+    codec_args, _ = FORMATS[fmt]
+    proc = subprocess.Popen(
+        [ffmpeg_path(), '-hide_banner', '-loglevel', 'error',
+         '-f', 'wav', '-i', 'pipe:0', '-ac', '1', '-b:a', f'{bitrate}k',
+         *codec_args, '-flush_packets', '1', 'pipe:1'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+
+    def feed():
+        try:
+            for chunk in chunks:
+                if chunk:
+                    proc.stdin.write(chunk)
+                    proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        except Exception as e:
+            logging.error(f"TTS transcode input failed: {e}")
+        finally:
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+            # Runs the source generator's own cleanup (e.g. closing the
+            # upstream engine connection) even when the client went away.
+            close = getattr(chunks, 'close', None)
+            if close:
+                close()
+
+    feeder = threading.Thread(target=feed, daemon=True, name='tts-transcode-feed')
+    feeder.start()
+    try:
+        while True:
+            block = proc.stdout.read1(8192)
+            if not block:
+                break
+            yield block
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        proc.stdout.close()
+
+
+def encode_file(wav_bytes, fmt, bitrate):
+    return b''.join(transcode([wav_bytes], fmt, bitrate))
@@ -0,0 +1,350 @@
+"""Server-side sentence pipeline that tees the /chat stream into TTS synthesis.
+
+The browser path (utils.js bufferTextForTTS → /api/tts/generate per sentence)
+can only start synthesis once the client has received and split the text, and
+every sentence is a fresh HTTP round trip. With a pipeline session the /chat
+generator feeds its own output into a SentenceSegmenter here, synthesis jobs
+start as soon as each sentence is complete, and the audio for the whole reply
+is streamed back over a single connection (/api/tts/pipeline/<session_id>).
+
+Wire format of the audio stream: a sequence of frames, each a 4-byte
+big-endian length followed by one complete WAV file (one sentence). A
+zero-length frame marks the end of the reply.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+
+# Matches the literal sentinels app.py wraps extended-thinking text in
+# (THINK_OPEN / THINK_CLOSE). Reasoning is never spoken.
+THINK_OPEN = "\x02\x02THINK\x02\x02"
+THINK_CLOSE = "\x02\x02/THINK\x02\x02"
+
+DEFAULT_MAX_CHUNK_LENGTH = 300
+# Same engine-aware limits the browser uses (utils.js initTTSEngine).
+MAX_CHUNK_LENGTH_BY_ENGINE = {'chatterbox': 150, 'qwen-fast': 220}
+DEFAULT_PREFETCH = 3
+# A session nobody feeds or reads is dropped after this long, so an aborted
+# reply or a client that never opened the audio stream can't leak threads.
+SESSION_IDLE_TIMEOUT = 120.0
+FRAME_HEADER = struct.Struct('>I')
+
+_EMOJI = (
+    r'(?:[\U0001F000-\U0001FFFF]|[☀-⛿]|[✀-➿])'
+)
+_EMOJI_AFTER_WORD_RE = re.compile(r'(\w)\s*' + _EMOJI + r'+')
+_EMOJI_RE = re.compile(_EMOJI + r'+')
+_CHATML_RE = re.compile(r'<\|im_start\|>(?:assistant|user|system)?[^\n]*|<\|im_end\|>|</?\|im_end\|?>')
+_ANCHOR_RE = re.compile(r'<a\b[^>]*>.*?</a>', re.IGNORECASE | re.DOTALL)
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_MD_LINK_RE = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+_URL_RE = re.compile(r'(?:https?://|www\.)[^\s\])"\'>]+')
+_SOURCE_LINE_RE = re.compile(r'^\s*\W*\s*Source:.*$', re.MULTILINE)
+_INLINE_CODE_RE = re.compile(r'`[^`\n]*`')
+# Lazy up to the first terminator that is followed by whitespace, so decimals
+# and URLs don't end a sentence early.
+_SENTENCE_RE = re.compile(r'.*?(?:[.!?]+|' + _EMOJI + r'+)[)"\'*_]*\s+', re.DOTALL)
+
+
+def clean_sentence_for_tts(text: str) -> str:
+    """Strip markup that should never be spoken; mirrors splitAndQueue in utils.js."""
+    text = _CHATML_RE.sub('', text)
+    text = _SOURCE_LINE_RE.sub('', text)
+    text = re.sub(r'^\s*(?:User|Assistant):\s*', '', text, flags=re.IGNORECASE)
+    text = _ANCHOR_RE.sub('', text)
+    text = _MD_LINK_RE.sub(r'\1', text)
+    text = _HTML_TAG_RE.sub(' ', text)
+    text = _URL_RE.sub('', text)
+    text = text.replace('’', "'").replace('‘', "'")
+    text = re.sub(r'\.{2,}|…', '. ', text)
+    text = re.sub(r'\s*—\s*', ', ', text)
+    text = text.replace('\U0001F4AF', 'one hundred percent')
+    text = _EMOJI_AFTER_WORD_RE.sub(r'\1.', text)
+    text = _EMOJI_RE.sub('', text)
+    text = re.sub(r'[*_#`]', '', text)
+    text = re.sub(r'^\s*(?:[-•>]|\d+\.)\s+', '', text)
+    text = re.sub(r'\s*[()]\s*', '. ', text)
+    text = re.sub(r'\s*>\s*', '. ', text)
+    text = re.sub(r'\s+([.!?,])', r'\1', text)
+    text = re.sub(r'([.!?])(?:\s*\.)+', r'\1', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text if text.strip(' .,!?') else ''
+
+
+def split_long_sentence(sentence: str, max_length: int) -> list[str]:
+    """Split at commas, then dashes, then spaces — same policy as the browser."""
+    chunks = []
+    remaining = sentence
+    while len(remaining) > max_length:
+        window = remaining[:max_length]
+        floor = max_length * 0.4
+        comma, dash, space = window.rfind(','), window.rfind(' — '), window.rfind(' ')
+        if comma > floor:
+            split_at = comma + 1
+        elif dash > floor:
+            split_at = dash + 3
+        elif space > floor:
+            split_at = space
+        else:
+            split_at = max_length
+        chunks.append(remaining[:split_at].strip())
+        remaining = remaining[split_at:].strip()
+    chunks.append(remaining)
+    return [chunk if re.search(r'[.!?]$', chunk) else chunk + '.' for chunk in chunks if len(chunk) > 2]
+
+
+class SentenceSegmenter:
+    """Incrementally turn streamed reply text into speakable sentences.
+
+    Thinking blocks and fenced/inline code are removed statefully on the raw
+    stream (they routinely span chunks); everything else is cleaned per
+    completed sentence. A sentence only counts as complete once whitespace
+    follows its terminator, so "5." is held until the next token shows whether
+    it was "5.6".
+    """
+
+    def __init__(self, max_chunk_length: int = DEFAULT_MAX_CHUNK_LENGTH) -> None:
+        self.max_chunk_length = max_chunk_length
+        self._raw = ''
+        self._text = ''
+        self._in_think = False
+        self._in_fence = False
+
+    def _consume_raw(self, final: bool) -> None:
+        out = []
+        raw = self._raw
+        while raw:
+            if self._in_think:
+                end = raw.find(THINK_CLOSE)
+                if end == -1:
+                    raw = raw[-(len(THINK_CLOSE) - 1):] if not final else ''
+                    break
+                raw = raw[end + len(THINK_CLOSE):]
+                self._in_think = False
+                continue
+            if self._in_fence:
+                end = raw.find('```')
+                if end == -1:
+                    raw = raw[-2:] if not final else ''
+                    break
+                raw = raw[end + 3:]
+                self._in_fence = False
+                continue
+            think, fence = raw.find(THINK_OPEN), raw.find('```')
+            starts = [index for index in (think, fence) if index != -1]
+            if not starts:
+                # Hold back a tail that could be the start of a split marker.
+                hold = 0 if final else next(
+                    (n for n in range(min(len(raw), len(THINK_OPEN) - 1), 0, -1)
+                     if THINK_OPEN.startswith(raw[-n:]) or '```'.startswith(raw[-n:])),
+                    0,
+                )
+                out.append(raw[:len(raw) - hold])
+                raw = raw[len(raw) - hold:]
+                break
+            start = min(starts)
+            out.append(raw[:start])
+            if start == think:
+                self._in_think = True
+                raw = raw[start + len(THINK_OPEN):]
+            else:
+                self._in_fence = True
+                raw = raw[start + 3:]
+        self._raw = raw
+        self._text += ''.join(out)
+
+    @staticmethod
+    def _split_sentences(text: str) -> tuple[list[str], str]:
+        """Return (complete sentences, unterminated remainder)."""
+        text = _INLINE_CODE_RE.sub('', text)
+        pieces, last_end = [], 0
+        for match in _SENTENCE_RE.finditer(text):
+            pieces.append(match.group(0))
+            last_end = match.end()
+        return pieces, text[last_end:]
+
+    def _emit(self, pieces: Iterable[str]) -> list[str]:
+        sentences = []
+        for piece in pieces:
+            cleaned = clean_sentence_for_tts(piece)
+            if cleaned and len(cleaned) > 2:
+                sentences.extend(split_long_sentence(cleaned, self.max_chunk_length))
+        return sentences
+
+    def feed(self, chunk: str) -> list[str]:
+        if not chunk:
+            return []
+        self._raw += chunk
+        self._consume_raw(final=False)
+        lines = self._text.split('\n')
+        self._text = lines.pop()
+        pieces = []
+        for line in lines:
+            # A newline always ends a sentence (headings, list items).
+            complete, remainder = self._split_sentences(line)
+            pieces.extend(complete)
+            pieces.append(remainder)
+        # An unmatched inline backtick may still close in a later chunk.
+        if self._text.count('`') % 2 == 0:
+            complete, self._text = self._split_sentences(self._text)
+            pieces.extend(complete)
+        return self._emit(pieces)
+
+    def flush(self) -> list[str]:
+        self._consume_raw(final=True)
+        remaining, self._text = _INLINE_CODE_RE.sub('', self._text), ''
+        return self._emit(remaining.split('\n'))
+
+
+class PipelineSession:
+    """One reply's worth of sentences, shared by the /chat tee and the audio stream."""
+
+    def __init__(self, session_id: str, max_chunk_length: int = DEFAULT_MAX_CHUNK_LENGTH) -> None:
+        self.session_id = session_id
+        self.segmenter = SentenceSegmenter(max_chunk_length)
+        self._sentences: deque[str] = deque()
+        self._condition = threading.Condition()
+        self.finished = False
+        self.cancelled = False
+        self.touched_at = time.monotonic()
+
+    def feed(self, chunk: str) -> None:
+        if self.cancelled:
+            return
+        sentences = self.segmenter.feed(chunk)
+        with self._condition:
+            self.touched_at = time.monotonic()
+            if sentences:
+                self._sentences.extend(sentences)
+                self._condition.notify_all()
+
+    def close(self) -> None:
+        sentences = [] if self.cancelled else self.segmenter.flush()
+        with self._condition:
+            self._sentences.extend(sentences)
+            self.finished = True
+            self.touched_at = time.monotonic()
+            self._condition.notify_all()
+
+    def cancel(self) -> None:
+        with self._condition:
+            self.cancelled = True
+            self.finished = True
+            self._sentences.clear()
+            self._condition.notify_all()
+
+    def next_sentence(self, timeout: float | None) -> str | None:
+        """Pop the next sentence; wait up to `timeout` seconds (None = don't wait)."""
+        with self._condition:
+            if not self._sentences and not self.finished and timeout:
+                self._condition.wait(timeout)
+            if self._sentences:
+                self.touched_at = time.monotonic()
+                return self._sentences.popleft()
+            return None
+
+    def exhausted(self) -> bool:
+        with self._condition:
+            return self.finished and not self._sentences
+
+    def idle_for(self) -> float:
+        with self._condition:
+            return time.monotonic() - self.touched_at
+
+
+_sessions: dict[str, PipelineSession] = {}
+_sessions_lock = threading.Lock()
+_synthesis_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tts-pipeline')
+
+
+def get_session(session_id: str, max_chunk_length: int = DEFAULT_MAX_CHUNK_LENGTH) -> PipelineSession:
+    """Return the session for `session_id`, creating it on first use.
+
+    Either side may arrive first: the browser opens the audio stream just
+    before POSTing /chat, but the two requests race on the server.
+    """
+    with _sessions_lock:
+        for stale_id in [sid for sid, s in _sessions.items() if s.idle_for() > SESSION_IDLE_TIMEOUT]:
+            _sessions.pop(stale_id).cancel()
+        session = _sessions.get(session_id)
+        if session is None:
+            session = _sessions[session_id] = PipelineSession(session_id, max_chunk_length)
+        else:
+            session.segmenter.max_chunk_length = max_chunk_length
+        return session
+
+
+def discard_session(session_id: str) -> None:
+    with _sessions_lock:
+        session = _sessions.pop(session_id, None)
+    if session is not None:
+        session.cancel()
+
+
+def tee_chat_stream(stream: Iterable[str], session_id: str | None) -> Iterable[str]:
+    """Pass the /chat stream through unchanged, feeding a pipeline session on the way."""
+    if not session_id:
+        return stream
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+    return _tee(stream, session or get_session(session_id))
+
+
+def _tee(stream: Iterable[str], session: PipelineSession) -> Iterator[str]:
+    try:
+        for chunk in stream:
+            if isinstance(chunk, str):
+                try:
+                    session.feed(chunk)
+                except Exception as e:
+                    logging.error(f"TTS pipeline segmenter error: {e}")
+            yield chunk
+    finally:
+        session.close()
+
+
+def audio_frames(
+    session: PipelineSession,
+    synthesize: Callable[[str, bool], bytes],
+    prefetch: int = DEFAULT_PREFETCH,
+) -> Iterator[bytes]:
+    """Yield length-prefixed WAV frames for the session's sentences, in order.
+
+    Up to `prefetch` synthesis jobs run ahead of the frame being sent, so the
+    next sentences are already rendering while the client plays this one.
+    """
+    pending = deque()
+    first = True
+    try:
+        while True:
+            while len(pending) < prefetch:
+                sentence = session.next_sentence(None if pending else 0.25)
+                if sentence is None:
+                    break
+                pending.append(_synthesis_pool.submit(synthesize, sentence, first))
+                first = False
+            if not pending:
+                if session.exhausted() or session.idle_for() > SESSION_IDLE_TIMEOUT:
+                    break
+                continue
+            try:
+                audio = pending.popleft().result()
+            except Exception as e:
+                logging.error(f"TTS pipeline synthesis failed: {e}")
+                continue
+            if audio:
+                yield FRAME_HEADER.pack(len(audio)) + audio
+        yield FRAME_HEADER.pack(0)
+    finally:
+        for future in pending:
+            future.cancel()
+        discard_session(session.session_id)
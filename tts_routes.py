@@ -1,4 +1,4 @@
-"""TTS routes for F5-TTS, XTTS, Chatterbox, and Qwen3-TTS Fast."""
+"""TTS routes for F5-TTS, XTTS, Chatterbox, Kokoro, and Qwen3-TTS Fast."""
 
 from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context
 import requests
@@ -6,6 +6,15 @@ from io import BytesIO
 import logging
 import json
 import os
+import re
+import threading
+import time
+import wave
+
+import gen_metrics
+import tts_encoding
+import tts_pipeline
+from tts_cache import audio_cache, cache_key, DEFAULT_MAX_MB
 
 # Create blueprint
 tts_bp = Blueprint('tts', __name__)
@@ -14,8 +23,14 @@ tts_bp = Blueprint('tts', __name__)
 F5_SERVER_URL          = 'http://localhost:8003'
 XTTS_SERVER_URL        = 'http://localhost:8002'
 CHATTERBOX_SERVER_URL  = 'http://localhost:8004'
+KOKORO_SERVER_URL      = 'http://localhost:8002'
 QWEN_FAST_SERVER_URL   = 'http://127.0.0.1:8767'
 DEFAULT_VOICE = 'Sol'
+# Engines whose server exposes /tts_stream (decoded PCM as it is generated).
+STREAMING_ENGINES = {
+    'qwen-fast': ('Qwen Fast', QWEN_FAST_SERVER_URL),
+    'kokoro':    ('Kokoro', KOKORO_SERVER_URL),
+}
 SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json')
 VOICE_GROUPS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'voice_groups.json')
 
@@ -94,10 +109,177 @@ def get_server_url():
         return CHATTERBOX_SERVER_URL
     elif engine == 'qwen-fast':
         return QWEN_FAST_SERVER_URL
+    elif engine == 'kokoro':
+        return KOKORO_SERVER_URL
     else:
         return F5_SERVER_URL
 
 
+# One keep-alive session per worker thread: the sentence pipeline fires several
+# /tts_to_audio calls per reply and a fresh TCP connect for each adds up.
+_http = threading.local()
+
+
+def _http_session():
+    session = getattr(_http, 'session', None)
+    if session is None:
+        session = _http.session = requests.Session()
+    return session
+
+
+def _sync_cache_budget():
+    try:
+        max_mb = float(get_settings().get('tts_cache_max_mb', DEFAULT_MAX_MB))
+    except (TypeError, ValueError):
+        max_mb = DEFAULT_MAX_MB
+    budget = int(max(0.0, max_mb) * 1024 * 1024)
+    if budget != audio_cache.max_bytes:
+        audio_cache.set_budget(budget)
+
+
+VOICE_VERSION_TTL = 5.0
+_voice_versions = {}            # server url -> (fetched_at, {voice: version})
+_voice_versions_lock = threading.Lock()
+
+
+def voice_version(engine, voice, server_url=None):
+    """Reference-file stamp of a cloned voice, from the engine's /voices
+    ("versions"), refreshed every few seconds. Part of the audio cache key so a
+    replaced or re-recorded voice stops serving stale audio. None for engines
+    without versions (Kokoro's built-ins) or when the server can't be asked —
+    the last known map is kept across a failed refresh."""
+    if engine == 'none' or not voice:
+        return None
+    url = server_url or get_server_url()
+    now = time.monotonic()
+    with _voice_versions_lock:
+        cached = _voice_versions.get(url)
+    if cached is None or now - cached[0] > VOICE_VERSION_TTL:
+        versions = cached[1] if cached else {}
+        try:
+            response = _http_session().get(f'{url}/voices', timeout=2)
+            if response.status_code == 200:
+                versions = (response.json() or {}).get('versions') or {}
+        except (requests.RequestException, ValueError):
+            pass
+        cached = (now, versions)
+        with _voice_versions_lock:
+            _voice_versions[url] = cached
+    versions = cached[1]
+    name = str(voice)
+    return versions.get(name) or versions.get(name[:-4] if name.endswith('.wav') else name + '.wav')
+
+
+def _cache_params(first_chunk):
+    # first_chunk trades quality for latency on F5 (lower nfe_step), so it is
+    # a different rendering of the same text. Defaults are omitted so keys stay
+    # stable if more params are added later.
+    return {'first_chunk': True} if first_chunk else {}
+
+
+def cached_audio(engine, voice, text, first_chunk=False):
+    """Cached WAV for this rendering, or None.
+
+    A first_chunk request is happy with the full-quality rendering too — it
+    only asked for the fast path to cut latency, and a cache hit is faster.
+    """
+    _sync_cache_budget()
+    version = voice_version(engine, voice)
+    audio = audio_cache.get(cache_key(engine, voice, text, _cache_params(False), version))
+    if audio is None and first_chunk:
+        audio = audio_cache.get(cache_key(engine, voice, text, _cache_params(True), version))
+    return audio
+
+
+def synthesize_sentence(text, voice, first_chunk=False):
+    """Render one piece of text on the active engine and return the WAV bytes.
+
+    Served from the audio cache when the same (engine, voice version, text,
+    params) was rendered before. Raises requests exceptions on transport failure and
+    RuntimeError when the engine answers with a non-200 status.
+    """
+    engine = get_engine()
+    started = time.perf_counter()
+    audio = cached_audio(engine, voice, text, first_chunk)
+    if audio is not None:
+        gen_metrics.tts_synthesis_seconds.observe(time.perf_counter() - started, engine=engine, cache='hit')
+        return audio
+    response = _http_session().post(
+        f'{get_server_url()}/tts_to_audio',
+        json={'text': text, 'voice': voice, 'first_chunk': bool(first_chunk)},
+        timeout=60
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f'TTS generation failed: {response.status_code}')
+    audio_cache.put(cache_key(engine, voice, text, _cache_params(first_chunk), voice_version(engine, voice)),
+                    response.content)
+    gen_metrics.tts_synthesis_seconds.observe(time.perf_counter() - started, engine=engine, cache='miss')
+    return response.content
+
+
+def _prerender_opening_lines(character, voice):
+    # Deferred import — extra_routes pulls in PIL and app helpers.
+    from extra_routes import load_opening_lines
+    engine = get_engine()
+    if engine == 'none':
+        return
+    try:
+        data = load_opening_lines(character)
+    except Exception as e:
+        logging.error(f"⚠️ Opening-line pre-render skipped for {character}: {e}")
+        return
+    lines = data.get('lines') if isinstance(data.get('lines'), list) else []
+    rendered = 0
+    for line in lines:
+        segmenter = tts_pipeline.SentenceSegmenter(
+            tts_pipeline.MAX_CHUNK_LENGTH_BY_ENGINE.get(engine, tts_pipeline.DEFAULT_MAX_CHUNK_LENGTH)
+        )
+        sentences = segmenter.feed(str(line)) + segmenter.flush()
+        for sentence in sentences:
+            if get_engine() != engine:
+                return  # engine switched mid-run; these renders would be for the wrong key
+            try:
+                synthesize_sentence(sentence, voice)
+                rendered += 1
+            except Exception as e:
+                logging.warning(f"Opening-line pre-render stopped for {character}: {e}")
+                return
+    if rendered:
+        logging.info(f"TTS cache: pre-rendered {rendered} opening-line sentence(s) for {character} [{engine}/{voice}]")
+
+
+def prerender_opening_lines(character, voice):
+    """Warm the audio cache with a character's opening lines in the background."""
+    voice = _clean_voice(voice)
+    threading.Thread(
+        target=_prerender_opening_lines, args=(character, voice),
+        daemon=True, name=f'tts-prerender-{character}'
+    ).start()
+
+
+def _audio_response(wav_bytes, **headers):
+    """WAV as-is, or transcoded when the client's Accept header prefers Opus/MP3."""
+    settings = get_settings()
+    fmt = tts_encoding.negotiate(request.headers.get('Accept'), settings)
+    if fmt is None:
+        return send_file(BytesIO(wav_bytes), mimetype='audio/wav', as_attachment=False,
+                         download_name='tts_output.wav')
+    try:
+        encoded = tts_encoding.encode_file(wav_bytes, fmt, tts_encoding.bitrate_kbps(settings))
+    except Exception as e:
+        logging.error(f"TTS transcode failed, sending WAV: {e}")
+        return send_file(BytesIO(wav_bytes), mimetype='audio/wav', as_attachment=False,
+                         download_name='tts_output.wav')
+    return Response(encoded, mimetype=tts_encoding.mimetype(fmt), headers={'Vary': 'Accept', **headers})
+
+
+def _clean_voice(voice):
+    # Guard against 'null' string or empty string from mobile/JS
+    if not voice or str(voice).lower() in ('null', 'none', 'undefined'):
+        return DEFAULT_VOICE
+    return voice
+
+
 # --------------------------------------------------
 # VOICE GROUPS — per-build dropdown organisation
 # --------------------------------------------------
@@ -176,13 +358,19 @@ def save_voice_groups():
 # --------------------------------------------------
 @tts_bp.route('/engine', methods=['GET'])
 def get_tts_engine():
-    return jsonify({'engine': get_engine()})
+    settings = get_settings()
+    return jsonify({
+        'engine': settings.get('tts_engine', 'f5'),
+        # Opt-in: when on, the browser opens /pipeline/<id> alongside /chat and
+        # the server does the sentence splitting and synthesis scheduling.
+        'server_pipeline': bool(settings.get('tts_server_pipeline', False)),
+    })
 
 @tts_bp.route('/engine', methods=['POST'])
 def set_tts_engine():
     data = request.json
     engine = data.get('engine', 'f5')
-    if engine not in ('f5', 'xtts', 'chatterbox', 'qwen-fast', 'none'):
+    if engine not in ('f5', 'xtts', 'chatterbox', 'kokoro', 'qwen-fast', 'none'):
         return jsonify({'error': 'Invalid engine'}), 400
     save_settings({'tts_engine': engine})
     logging.info(f"TTS engine set to: {engine}")
@@ -203,40 +391,24 @@ def generate_tts():
 
         data = request.json
         text = data.get('text', '')
-        voice = data.get('voice') or DEFAULT_VOICE
+        voice = _clean_voice(data.get('voice'))
         # first_chunk lets the F5 server use a faster nfe_step for the opening
         # word (lower first-byte latency). Was previously dropped here, so the
         # fast path never actually fired.
         first_chunk = bool(data.get('first_chunk', False))
-        # Guard against 'null' string or empty string from mobile/JS
-        if not voice or voice.lower() in ('null', 'none', 'undefined'):
-            voice = DEFAULT_VOICE
 
         if not text:
             return jsonify({'error': 'No text provided'}), 400
 
-        server_url = get_server_url()
         logging.info(f"Generating TTS [{engine}] for: {text[:50]}...")
 
-        payload = {'text': text, 'voice': voice, 'first_chunk': first_chunk}
-
-        response = requests.post(
-            f'{server_url}/tts_to_audio',
-            json=payload,
-            timeout=60
-        )
+        try:
+            audio = synthesize_sentence(text, voice, first_chunk)
+        except RuntimeError as e:
+            logging.error(f"TTS server error: {e}")
+            return jsonify({'error': str(e)}), 500
 
-        if response.status_code == 200:
-            audio_data = BytesIO(response.content)
-            return send_file(
-                audio_data,
-                mimetype='audio/wav',
-                as_attachment=False,
-                download_name='tts_output.wav'
-            )
-        else:
-            logging.error(f"TTS server error: {response.status_code}")
-            return jsonify({'error': f'TTS generation failed: {response.status_code}'}), 500
+        return _audio_response(audio)
 
     except requests.exceptions.Timeout:
         logging.error("TTS server timeout")
@@ -249,19 +421,71 @@ def generate_tts():
         return jsonify({'error': str(e)}), 500
 
 
+def _stream_cache_params(data):
+    params = {}
+    if data.get('language', 'English') != 'English':
+        params['language'] = data.get('language')
+    if data.get('seed', 42) != 42:
+        params['seed'] = data.get('seed')
+    return params
+
+
+def _stream_pcm_from_wav(audio):
+    """PCM frames of a cached WAV if it matches the stream's 24 kHz mono int16
+    shape (the mobile decoder assumes it), else None."""
+    try:
+        with wave.open(BytesIO(audio), 'rb') as w:
+            if w.getnchannels() != 1 or w.getsampwidth() != 2 or w.getframerate() != 24000:
+                return None
+            return w.readframes(w.getnframes())
+    except Exception:
+        return None
+
+
+def _pcm_to_wav(pcm):
+    """Canonical 44-byte-header WAV around 24 kHz mono int16 PCM. Used both to
+    replay cache hits (the client strips exactly 44 bytes) and to store relayed
+    streams, whose own header sizes are placeholders."""
+    out = BytesIO()
+    with wave.open(out, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(24000)
+        w.writeframes(pcm)
+    return out.getvalue()
+
+
 @tts_bp.route('/generate_stream', methods=['POST'])
 def generate_tts_stream():
-    """Proxy genuine decoded Qwen PCM streaming through HWUI's own origin."""
-    if get_engine() != 'qwen-fast':
-        return jsonify({'error': 'Streaming is only available for Qwen3-TTS Fast'}), 400
+    """Proxy genuine decoded PCM streaming (Qwen3-TTS Fast, Kokoro) through
+    HWUI's own origin. Both servers send a 44-byte 24 kHz mono PCM16 header
+    followed by raw samples as they are decoded."""
+    engine = get_engine()
+    if engine not in STREAMING_ENGINES:
+        return jsonify({'error': 'Streaming is only available for Qwen3-TTS Fast and Kokoro'}), 400
+    label, server_url = STREAMING_ENGINES[engine]
     data = request.json or {}
     text = str(data.get('text') or '').strip()
     voice = data.get('voice') or DEFAULT_VOICE
     if not text:
         return jsonify({'error': 'No text provided'}), 400
+
+    settings = get_settings()
+    stream_format = tts_encoding.negotiate(request.headers.get('Accept'), settings)
+
+    _sync_cache_budget()
+    key = cache_key(engine, voice, text, _stream_cache_params(data), voice_version(engine, voice, server_url))
+    cached = audio_cache.get(key)
+    pcm = _stream_pcm_from_wav(cached) if cached is not None else None
+    if pcm is not None:
+        if stream_format is not None:
+            return _audio_response(_pcm_to_wav(pcm), **{'X-TTS-Cache': 'hit'})
+        return Response(_pcm_to_wav(pcm), mimetype='audio/wav',
+                        headers={'X-Audio-Streaming': 'decoded-pcm', 'X-TTS-Cache': 'hit'})
+
     try:
         upstream = requests.post(
-            f'{QWEN_FAST_SERVER_URL}/tts_stream',
+            f'{server_url}/tts_stream',
             json={
                 'text': text,
                 'voice': voice,
@@ -275,22 +499,82 @@ def generate_tts_stream():
         if upstream.status_code != 200:
             message = upstream.text[:500]
             upstream.close()
-            return jsonify({'error': message or f'Qwen Fast returned {upstream.status_code}'}), upstream.status_code
+            return jsonify({'error': message or f'{label} returned {upstream.status_code}'}), upstream.status_code
 
-        @stream_with_context
         def relay():
+            received = bytearray()
+            completed = False
             try:
                 for chunk in upstream.iter_content(chunk_size=4096):
                     if chunk:
+                        received.extend(chunk)
                         yield chunk
+                completed = True
             finally:
                 upstream.close()
-
-        return Response(relay(), mimetype='audio/wav', headers={'X-Audio-Streaming': 'decoded-pcm'})
+                # Only whole renders are cached; a client abort leaves a
+                # truncated body that must never be replayed.
+                if completed and len(received) > 44:
+                    audio_cache.put(key, _pcm_to_wav(bytes(received[44:])))
+
+        if stream_format is not None:
+            # Incremental transcode: encoded pages go out while PCM is still arriving.
+            return Response(
+                stream_with_context(tts_encoding.transcode(
+                    relay(), stream_format, tts_encoding.bitrate_kbps(settings))),
+                mimetype=tts_encoding.mimetype(stream_format),
+                headers={'X-Audio-Streaming': 'encoded', 'Vary': 'Accept'},
+            )
+        return Response(stream_with_context(relay()), mimetype='audio/wav',
+                        headers={'X-Audio-Streaming': 'decoded-pcm'})
     except requests.exceptions.Timeout:
-        return jsonify({'error': 'Qwen Fast streaming timed out'}), 504
+        return jsonify({'error': f'{label} streaming timed out'}), 504
     except requests.exceptions.ConnectionError:
-        return jsonify({'error': 'Cannot connect to Qwen Fast on port 8767'}), 503
+        return jsonify({'error': f'Cannot connect to {label} at {server_url}'}), 503
+
+
+# --------------------------------------------------
+# SENTENCE PIPELINE — audio for a /chat reply over one connection
+# --------------------------------------------------
+_PIPELINE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+@tts_bp.route('/pipeline/<session_id>', methods=['GET'])
+def stream_tts_pipeline(session_id):
+    """Stream length-prefixed WAV frames for the reply /chat is feeding into
+    `session_id` (see tts_pipeline for the framing)."""
+    engine = get_engine()
+    if engine == 'none':
+        return jsonify({'error': 'TTS engine is set to None'}), 503
+    if not _PIPELINE_ID_RE.match(session_id):
+        return jsonify({'error': 'Invalid session id'}), 400
+
+    voice = _clean_voice(request.args.get('voice'))
+    settings = get_settings()
+    try:
+        prefetch = max(1, min(int(settings.get('tts_pipeline_prefetch', tts_pipeline.DEFAULT_PREFETCH)), 8))
+    except (TypeError, ValueError):
+        prefetch = tts_pipeline.DEFAULT_PREFETCH
+    session = tts_pipeline.get_session(
+        session_id,
+        tts_pipeline.MAX_CHUNK_LENGTH_BY_ENGINE.get(engine, tts_pipeline.DEFAULT_MAX_CHUNK_LENGTH),
+    )
+    logging.info(f"TTS pipeline [{engine}] opened: {session_id}")
+
+    def synthesize(text, first_chunk):
+        return synthesize_sentence(text, voice, first_chunk)
+
+    return Response(
+        stream_with_context(tts_pipeline.audio_frames(session, synthesize, prefetch)),
+        mimetype='application/octet-stream',
+        headers={'X-Audio-Framing': 'length-prefixed-wav', 'Cache-Control': 'no-cache'},
+    )
+
+
+@tts_bp.route('/pipeline/<session_id>', methods=['DELETE'])
+def cancel_tts_pipeline(session_id):
+    tts_pipeline.discard_session(session_id)
+    return jsonify({'status': 'cancelled'})
 
 
 # --------------------------------------------------
@@ -346,6 +630,21 @@ def warmup_tts():
         return jsonify({'status': 'skipped', 'reason': str(e)})
 
 
+# --------------------------------------------------
+# AUDIO CACHE
+# --------------------------------------------------
+@tts_bp.route('/cache', methods=['GET'])
+def tts_cache_stats():
+    _sync_cache_budget()
+    return jsonify(audio_cache.stats())
+
+
+@tts_bp.route('/cache', methods=['DELETE'])
+def clear_tts_cache():
+    audio_cache.clear()
+    return jsonify({'status': 'cleared'})
+
+
 # --------------------------------------------------
 # STATUS CHECK
 # --------------------------------------------------
@@ -366,7 +665,8 @@ def tts_status():
                 'status': 'online',
                 'engine': engine,
                 'url': server_url,
-                'gpu': data.get('gpu', 'unknown')
+                'gpu': data.get('gpu', 'unknown'),
+                'queue': data.get('queue'),
             })
         else:
             return jsonify({'status': 'error', 'engine': engine}), 503
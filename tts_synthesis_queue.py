@@ -0,0 +1,180 @@
+"""Shared request queue for the single-model TTS servers.
+
+f5_server.py, xtts_server.py, chatterbox_server.py, kokoro_server.py and the
+Qwen3-TTS Fast service can each only run one inference at a time. Before this
+module every request thread raced for a global lock, so ordering was whatever
+the OS scheduler picked and nobody could see how deep the backlog was.
+
+A SynthesisQueue owns one worker thread that runs jobs strictly in arrival
+order (FIFO). Engines whose API can render several texts for one voice in a
+single call (the Qwen service's generate_voice_clone takes a list of texts)
+pass `run_batch`; jobs submitted through `synthesize()` with the same batch
+key that arrive within `batch_window` of each other are then handed over
+together. F5, XTTS, Chatterbox and Kokoro take one text per call and only use
+`call()`/`submit()`, so they stay plain FIFO. Any batch of one — or a batch
+whose run_batch fails — runs through the per-job callable, so batching is
+purely an optimisation.
+
+`stats()` is what each server adds to its /status payload: current depth,
+wait-time and run-time summaries over a rolling window, and batch counts.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+STATS_WINDOW = 200
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'batch_key', 'item', 'future', 'enqueued_at')
+
+    def __init__(self, fn, args, kwargs, batch_key=None, item=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.batch_key = batch_key
+        self.item = item
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+def _summary(values):
+    if not values:
+        return {'count': 0, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 1),
+        'p50_ms': round(pick(0.5), 1),
+        'p95_ms': round(pick(0.95), 1),
+        'max_ms': round(ordered[-1], 1),
+    }
+
+
+class SynthesisQueue:
+    def __init__(self, name, run_batch=None, batch_window=0.025, max_batch=4):
+        """`run_batch(batch_key, items)` must return one result per item, in order."""
+        self.name = name
+        self.run_batch = run_batch
+        self.batch_window = batch_window
+        self.max_batch = max(1, int(max_batch))
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waits = deque(maxlen=STATS_WINDOW)
+        self._runs = deque(maxlen=STATS_WINDOW)
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._batched_jobs = 0
+        self._worker = threading.Thread(target=self._loop, daemon=True, name=f'{name}-synthesis-queue')
+        self._worker.start()
+
+    # ── submission ──────────────────────────────────────────────────────────
+    def _enqueue(self, job):
+        with self._condition:
+            self._pending.append(job)
+            self._condition.notify()
+        return job.future
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) on the worker in FIFO order; return its Future."""
+        return self._enqueue(_Job(fn, args, kwargs))
+
+    def call(self, fn, *args, **kwargs):
+        """Like submit(), but block for the result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def synthesize(self, batch_key, item, fn, *args, **kwargs):
+        """Like call(), but eligible for batching with other jobs sharing
+        `batch_key` (e.g. voice + generation params) when run_batch is set."""
+        return self._enqueue(_Job(fn, args, kwargs, batch_key=batch_key, item=item)).result()
+
+    # ── worker ──────────────────────────────────────────────────────────────
+    def _take_locked(self):
+        head = self._pending.popleft()
+        if self.run_batch is None or head.batch_key is None or self.max_batch == 1:
+            return [head]
+        # Give sentences of the same reply a moment to arrive together.
+        deadline = head.enqueued_at + self.batch_window
+        while True:
+            remaining = deadline - time.monotonic()
+            same = sum(1 for job in self._pending if job.batch_key == head.batch_key)
+            if remaining <= 0 or same + 1 >= self.max_batch:
+                break
+            self._condition.wait(remaining)
+        batch = [head]
+        for job in list(self._pending):
+            if len(batch) >= self.max_batch:
+                break
+            if job.batch_key == head.batch_key:
+                self._pending.remove(job)
+                batch.append(job)
+        return batch
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                batch = self._take_locked()
+                self._running = len(batch)
+            started = time.monotonic()
+            for job in batch:
+                self._waits.append((started - job.enqueued_at) * 1000)
+            if len(batch) > 1:
+                self._run_batch(batch)
+            else:
+                self._run_one(batch[0])
+            self._runs.append((time.monotonic() - started) * 1000)
+            with self._condition:
+                self._running = 0
+
+    def _run_one(self, job):
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            job.future.set_result(job.fn(*job.args, **job.kwargs))
+            self._completed += 1
+        except BaseException as e:
+            job.future.set_exception(e)
+            self._failed += 1
+
+    def _run_batch(self, batch):
+        try:
+            results = self.run_batch(batch[0].batch_key, [job.item for job in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f'run_batch returned {len(results)} results for {len(batch)} jobs')
+        except Exception:
+            # A batch failure must not take every sentence down with it.
+            for job in batch:
+                self._run_one(job)
+            return
+        self._batches += 1
+        self._batched_jobs += len(batch)
+        for job, result in zip(batch, results):
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_result(result)
+                self._completed += 1
+
+    # ── metrics ─────────────────────────────────────────────────────────────
+    def stats(self):
+        with self._condition:
+            depth = len(self._pending)
+            running = self._running
+        return {
+            'name': self.name,
+            'depth': depth,
+            'running': running,
+            'completed': self._completed,
+            'failed': self._failed,
+            'batching': self.run_batch is not None,
+            'batches': self._batches,
+            'batched_jobs': self._batched_jobs,
+            'wait': _summary(list(self._waits)),
+            'run': _summary(list(self._runs)),
+        }
@@ -0,0 +1,145 @@
+"""Short-lived per-chat snapshots of a turn's assembled model context.
+
+Regenerate and Continue resend the same conversation the previous /chat turn
+was built from, yet chat() used to run the whole context pipeline again:
+memory retrieval, document scoring, search gating, system-text assembly,
+trimming and /tokenize. The result is the same payload — only the sampled
+reply differs.
+
+After building a turn chat() records what it sent to the model: the final
+payload (ChatML prompt or messages array, with any injected documents,
+memories and search results already folded in), which stream it went to, and
+the token-monitor figures. The snapshot is stored under the chat's key and a
+fingerprint of the conversation it was built from — role + content of each
+message (attachment bodies by hash), plus the character card version,
+settings.json version, model, user name and author's note. A regenerate or
+continue whose fingerprint matches goes straight to generation; anything else
+(an edited message, a changed setting, an expired entry) rebuilds as usual.
+
+One snapshot is kept per chat — the latest turn — and entries expire after
+`turn_snapshot_ttl_s` seconds, so memory/document changes made outside the
+fingerprinted inputs can only go stale for that long. A request carrying
+refresh_search bypasses the snapshot entirely.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import attachment_store
+from prompt_segments import settings_version
+
+
+DEFAULT_TTL = 300.0
+MAX_CHATS = 64
+
+
+def _content_for_fingerprint(content):
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") == "text":
+                parts.append(_content_for_fingerprint(part.get("text", "")))
+            elif part.get("type") == "image_url":
+                url = (part.get("image_url") or {}).get("url", "")
+                parts.append("image:" + attachment_store.digest(url))
+        return "\x1f".join(parts)
+    content = content if isinstance(content, str) else str(content or "")
+    if "[ATTACHED DOCUMENT:" not in content:
+        return content
+
+    # Inline and externalized copies of the same document fingerprint alike.
+    def _sub(m):
+        body = m.group(2)
+        ref = attachment_store.parse_ref(body)
+        sha = ref[0] if ref else attachment_store.digest(body)
+        return f"[ATTACHED DOCUMENT: {m.group(1)}]\n{sha}\n[END ATTACHED DOCUMENT]"
+
+    return attachment_store.ATTACHED_DOC_RE.sub(_sub, content)
+
+
+def fingerprint(messages, **inputs):
+    """SHA-256 over the conversation's role/content pairs plus `inputs`."""
+    h = hashlib.sha256()
+    for msg in messages or []:
+        if not isinstance(msg, dict):
+            continue
+        h.update(str(msg.get("role", "")).encode("utf-8"))
+        h.update(b"\x1e")
+        h.update(_content_for_fingerprint(msg.get("content", "")).encode("utf-8", errors="replace"))
+        h.update(b"\x1d")
+    h.update(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8"))
+    h.update(json.dumps(settings_version()).encode("utf-8"))
+    return h.hexdigest()
+
+
+class TurnSnapshotStore:
+    def __init__(self, ttl=DEFAULT_TTL, max_chats=MAX_CHATS):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # chat key -> snapshot dict
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, chat_key, fp, kind, payload, stats=None):
+        """Record the payload a turn sent to the model (kind: "completion" | "messages")."""
+        if not chat_key or not fp:
+            return
+        snapshot = {
+            "fingerprint": fp,
+            "kind": kind,
+            "payload": copy.deepcopy(payload),
+            "stats": dict(stats or {}),
+            "search": None,
+            "created": time.time(),
+        }
+        with self._lock:
+            self._entries[chat_key] = snapshot
+            self._entries.move_to_end(chat_key)
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+
+    def record_search(self, chat_key, fp, payload, query, source):
+        """Swap in the search-augmented payload so reuse keeps the same results."""
+        with self._lock:
+            snapshot = self._entries.get(chat_key)
+            if not snapshot or snapshot["fingerprint"] != fp:
+                return
+            snapshot["payload"] = copy.deepcopy(payload)
+            snapshot["search"] = {"query": query, "source": source}
+
+    def get(self, chat_key, fp, ttl=None):
+        """Deep copy of the matching, unexpired snapshot, or None."""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            snapshot = self._entries.get(chat_key) if chat_key else None
+            if snapshot and time.time() - snapshot["created"] > ttl:
+                del self._entries[chat_key]
+                snapshot = None
+            if not snapshot or snapshot["fingerprint"] != fp:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(snapshot)
+
+    def invalidate(self, chat_key):
+        with self._lock:
+            self._entries.pop(chat_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"chats": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "ttl_s": self.ttl}
+
+
+turn_snapshots = TurnSnapshotStore()
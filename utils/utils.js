@@ -60,6 +60,36 @@ function hwuiToast(message, kind = 'success', ms = 2200, placement = 'bottom') {
   setTimeout(() => { el.style.opacity = '0'; setTimeout(() => el.remove(), 220); }, ms);
 }
 
+// followDocumentJob(job[, onProgress]) → Promise<snapshot>. Follows a
+// server-side extraction job (/parse_document?async=1, project uploads) over
+// /document_jobs/<id>/events and resolves with the final snapshot. Finished
+// jobs (cache hits) resolve immediately.
+function followDocumentJob(job, onProgress) {
+  return new Promise((resolve) => {
+    if (!job || !job.job || job.state === 'done' || job.state === 'failed') { resolve(job); return; }
+    const source = new EventSource(`/document_jobs/${encodeURIComponent(job.job)}/events`);
+    source.onmessage = (e) => {
+      let snap;
+      try { snap = JSON.parse(e.data); } catch (_) { return; }
+      if (onProgress) onProgress(snap);
+      if (snap.state === 'done' || snap.state === 'failed') { source.close(); resolve(snap); }
+    };
+    source.onerror = () => {
+      // Stream dropped (server restart, proxy) — settle with one last poll.
+      source.close();
+      fetch(`/document_jobs/${encodeURIComponent(job.job)}`)
+        .then(r => r.json()).then(resolve)
+        .catch(() => resolve({ ...job, state: 'failed', error: 'lost connection to extraction job' }));
+    };
+  });
+}
+
+function describeDocumentJob(snap) {
+  if (!snap) return '';
+  if (snap.pages_total) return `${snap.pages_done || 0}/${snap.pages_total} pages`;
+  return snap.state === 'running' ? 'reading…' : (snap.state || '');
+}
+
 // hwuiConfirm(message[, opts]) → Promise<boolean>. Resolves true on confirm,
 // false on cancel / Escape. opts: {confirmText, cancelText, danger}.
 function hwuiConfirm(message, opts = {}) {
@@ -477,6 +507,9 @@ async function openProjectDocumentUploadPicker() {
 
     await loadProjectDocuments(projectName);
     hwuiToast(`Uploaded "${result.filename}"`, 'success');
+    followDocumentJob(result.job).then(snap => {
+      if (snap && snap.state === 'failed') hwuiToast(`Could not read "${result.filename}": ${snap.error}`, 'error', 4000);
+    });
   } catch (err) {
     console.error('Picker upload error:', err);
     hwuiToast('Failed to open document picker', 'error');
@@ -543,6 +576,12 @@ function initDocumentUpload() {
         
         // Clear input
         e.target.value = '';
+
+        // Text is extracted in the background at upload; report big ones.
+        followDocumentJob(result.job).then(snap => {
+          if (snap && snap.state === 'failed') hwuiToast(`Could not read "${result.filename}": ${snap.error}`, 'error', 4000);
+          else if (snap && snap.pages_total) hwuiToast(`📄 "${result.filename}" ready (${snap.pages_total} pages)`, 'success');
+        });
         
       } catch (err) {
         console.error('❌ Upload error:', err);
@@ -658,6 +697,14 @@ const TTS_START_THRESHOLD = 1;  // Start playing after this many sentences buffe
 
 let lastTTSResponseText = '';  // 🔊 Stored for Replay button
 
+// Server-side sentence pipeline (settings.json tts_server_pipeline). When on,
+// /chat tees its own output into the TTS segmenter and the audio for the whole
+// reply arrives on one /api/tts/pipeline/<id> stream, so the client-side
+// buffer/queue below sits idle for that reply.
+let ttsServerPipeline = false;
+let ttsPipelineSession = null;
+let ttsPipelineAbort = null;
+
 
 function toggleTTS() {
   ttsEnabled = !ttsEnabled;
@@ -748,6 +795,14 @@ function stopAllAudio() {
   ttsBacktickTail = '';
   ttsInsideLink = false;
   ttsLinkTagTail = '';
+  if (ttsPipelineAbort) {
+    ttsPipelineAbort.abort();
+    ttsPipelineAbort = null;
+  }
+  if (ttsPipelineSession) {
+    fetch(`/api/tts/pipeline/${ttsPipelineSession}`, { method: 'DELETE' }).catch(() => {});
+    ttsPipelineSession = null;
+  }
 
   const btn = document.getElementById('tts-toggle-btn');
   if (btn) btn.classList.remove('speaking');
@@ -893,7 +948,7 @@ function stripLinksForTTS(text) {
 
 // --- Called from streaming loop for each chunk ---
 function bufferTextForTTS(chunk) {
-  if (!ttsEnabled || !chunk) return;
+  if (!ttsEnabled || !chunk || ttsPipelineSession) return;
 
   // Reset code-block state at start of each new response — must happen
   // BEFORE stripCodeForTTS so stale state from a prior response can't gut
@@ -985,11 +1040,12 @@ async function initTTSEngine() {
     const data = await res.json();
     const engine = data.engine || 'f5';
     ttsEngine = engine;
+    ttsServerPipeline = !!data.server_pipeline;
     TTS_MAX_CHUNK_LENGTH = (engine === 'chatterbox') ? 150 : (engine === 'qwen-fast' ? 220 : 300);
     if (engine === 'qwen-fast' && (document.getElementById('tts-voice-select')?.options.length || 0) <= 1) {
       loadTTSVoices();
     }
-    console.log(`🔊 TTS engine: ${engine} — chunk length: ${TTS_MAX_CHUNK_LENGTH}`);
+    console.log(`🔊 TTS engine: ${engine} — chunk length: ${TTS_MAX_CHUNK_LENGTH}${ttsServerPipeline ? ' — server pipeline' : ''}`);
   } catch (e) {
     console.warn('Could not fetch TTS engine, using default chunk length');
   }
@@ -1077,7 +1133,7 @@ function splitAndQueue(text) {
 
 // --- Called when streaming finishes ---
 function flushTTSBuffer() {
-  if (!ttsEnabled) return;
+  if (!ttsEnabled || ttsPipelineSession) return;
 
   // Flush anything left in the buffer (no newline at end, no punctuation)
   const remaining = ttsSentenceBuffer.trim()
@@ -1247,6 +1303,92 @@ async function processQueue() {
 }
 
 
+// --- Server-side sentence pipeline ---
+// Returns the session id to send as `tts_session` in the /chat body (or null
+// when the pipeline is off), and starts playing that reply's audio stream.
+function beginTTSPipelineSession() {
+  if (!ttsEnabled || !ttsServerPipeline || ttsEngine === 'none') return null;
+  stopAllAudio();
+  const sessionId = (window.crypto && crypto.randomUUID)
+    ? crypto.randomUUID().replace(/-/g, '')
+    : `${Date.now().toString(36)}${Math.random().toString(36).slice(2, 12)}`;
+  ttsPipelineSession = sessionId;
+  playTTSPipeline(sessionId);
+  return sessionId;
+}
+
+// Frames are a 4-byte big-endian length followed by one WAV; length 0 ends it.
+async function playTTSPipeline(sessionId) {
+  const controller = new AbortController();
+  ttsPipelineAbort = controller;
+  const btn = document.getElementById('tts-toggle-btn');
+  const pending = [];
+  let streamEnded = false;
+  let wake = null;
+
+  async function readFrames() {
+    const res = await fetch(`/api/tts/pipeline/${sessionId}?voice=${encodeURIComponent(ttsVoice)}`,
+                            { signal: controller.signal });
+    if (!res.ok || !res.body) throw new Error(`pipeline ${res.status}`);
+    const reader = res.body.getReader();
+    let buffered = new Uint8Array(0);
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      const merged = new Uint8Array(buffered.length + value.length);
+      merged.set(buffered);
+      merged.set(value, buffered.length);
+      buffered = merged;
+      while (buffered.length >= 4) {
+        const size = new DataView(buffered.buffer, buffered.byteOffset, 4).getUint32(0);
+        if (size === 0) return;
+        if (buffered.length < 4 + size) break;
+        pending.push(URL.createObjectURL(new Blob([buffered.slice(4, 4 + size)], { type: 'audio/wav' })));
+        buffered = buffered.slice(4 + size);
+        if (wake) wake();
+      }
+    }
+  }
+
+  const readerDone = readFrames()
+    .catch(err => { if (err.name !== 'AbortError') console.warn('⚠️ TTS pipeline stream error:', err); })
+    .finally(() => { streamEnded = true; if (wake) wake(); });
+
+  if (btn) btn.classList.add('speaking');
+  while (!controller.signal.aborted) {
+    if (pending.length === 0) {
+      if (streamEnded) break;
+      await new Promise(r => { wake = r; });
+      wake = null;
+      continue;
+    }
+    const audioUrl = pending.shift();
+    await new Promise((resolve) => {
+      currentAudio = new Audio(audioUrl);
+      isPlayingAudio = true;
+      const done = () => {
+        URL.revokeObjectURL(audioUrl);
+        isPlayingAudio = false;
+        currentAudio = null;
+        resolve();
+      };
+      currentAudio.onended = done;
+      currentAudio.onerror = done;
+      currentAudio.onpause = () => { if (controller.signal.aborted) done(); };
+      currentAudio.play().catch(done);
+    });
+  }
+  await readerDone;
+  pending.forEach(url => URL.revokeObjectURL(url));
+  if (ttsPipelineSession === sessionId) {
+    ttsPipelineSession = null;
+    ttsPipelineAbort = null;
+    if (btn) btn.classList.remove('speaking');
+  }
+  console.log('✅ TTS pipeline complete');
+}
+
+
 // --- Voice Selection ---
 function setTTSVoice(voiceName) {
   ttsVoice = voiceName;
@@ -1351,6 +1493,152 @@ let mediaRecorder = null;
 let audioChunks = [];
 let isRecording = false;
 
+// Streaming voice input: raw 16 kHz PCM is posted to /api/whisper/stream/<id>
+// in ~250 ms chunks while recording; the server transcribes each pause-delimited
+// segment as it completes, so only the tail is left when the mic is released.
+// Falls back to the one-shot MediaRecorder upload if any of it is unavailable.
+const VOICE_STREAM_RATE = 16000;
+const VOICE_STREAM_CHUNK_MS = 250;
+let voiceStream = null;   // { id, ctx, source, processor, mic, buffered, sendChain, preview }
+
+function setMicButtonState(state) {
+  const micBtn = document.getElementById('mic-btn');
+  if (!micBtn) return;
+  micBtn.classList.remove('listening', 'processing');
+  if (state === 'listening') {
+    micBtn.classList.add('listening');
+    micBtn.style.background = '#5a0f0f';
+    micBtn.style.borderColor = '#ff4444';
+    micBtn.style.color = '#ff8888';
+  } else if (state === 'processing') {
+    micBtn.classList.add('processing');
+    micBtn.style.background = '#1a3a1a';
+    micBtn.style.borderColor = '#44aa44';
+    micBtn.style.color = '#88ff88';
+  } else {
+    micBtn.style.background = 'rgba(255,255,255,0.08)';
+    micBtn.style.borderColor = '#555';
+    micBtn.style.color = '#ccc';
+  }
+}
+
+function downsampleToPCM16(input, inputRate) {
+  const ratio = inputRate / VOICE_STREAM_RATE;
+  const length = Math.floor(input.length / ratio);
+  const out = new Int16Array(length);
+  for (let i = 0; i < length; i++) {
+    // Average the source samples that fall into this output sample (cheap low-pass).
+    const start = Math.floor(i * ratio);
+    const end = Math.min(input.length, Math.floor((i + 1) * ratio));
+    let sum = 0;
+    for (let j = start; j < end; j++) sum += input[j];
+    const v = Math.max(-1, Math.min(1, sum / Math.max(1, end - start)));
+    out[i] = v < 0 ? v * 0x8000 : v * 0x7fff;
+  }
+  return out;
+}
+
+function takeBufferedPCM(vs) {
+  const total = vs.buffered.reduce((n, a) => n + a.length, 0);
+  const merged = new Int16Array(total);
+  let offset = 0;
+  for (const part of vs.buffered) { merged.set(part, offset); offset += part.length; }
+  vs.buffered = [];
+  vs.bufferedSamples = 0;
+  return merged;
+}
+
+function showVoicePreview(vs, data) {
+  if (!data || !data.transcript) return;
+  const userInput = document.getElementById('user-input');
+  if (userInput) userInput.value = vs.preview + data.transcript;
+}
+
+async function startStreamingVoiceInput(mic) {
+  const AudioCtx = window.AudioContext || window.webkitAudioContext;
+  if (!AudioCtx) return false;
+  let session;
+  try {
+    const res = await fetch('/api/whisper/stream', { method: 'POST' });
+    if (!res.ok) return false;
+    session = (await res.json()).session;
+  } catch (err) {
+    return false;
+  }
+  if (!session) return false;
+
+  const ctx = new AudioCtx();
+  const source = ctx.createMediaStreamSource(mic);
+  // ScriptProcessor is deprecated but works everywhere without a worklet file.
+  const processor = ctx.createScriptProcessor(4096, 1, 1);
+  const userInput = document.getElementById('user-input');
+  const vs = {
+    id: session, ctx, source, processor, mic,
+    buffered: [], bufferedSamples: 0,
+    sendChain: Promise.resolve(),
+    preview: userInput && userInput.value ? userInput.value.trimEnd() + ' ' : '',
+  };
+  const chunkSamples = VOICE_STREAM_RATE * VOICE_STREAM_CHUNK_MS / 1000;
+
+  processor.onaudioprocess = (event) => {
+    if (voiceStream !== vs) return;
+    const pcm = downsampleToPCM16(event.inputBuffer.getChannelData(0), ctx.sampleRate);
+    vs.buffered.push(pcm);
+    vs.bufferedSamples += pcm.length;
+    if (vs.bufferedSamples < chunkSamples) return;
+    const body = takeBufferedPCM(vs);
+    // Chained so chunks reach the server in order.
+    vs.sendChain = vs.sendChain.then(async () => {
+      try {
+        const res = await fetch(`/api/whisper/stream/${vs.id}`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/octet-stream' },
+          body: body.buffer,
+        });
+        if (res.ok) showVoicePreview(vs, await res.json());
+      } catch (err) {
+        console.warn('🎤 Voice chunk upload failed:', err);
+      }
+    });
+  };
+  source.connect(processor);
+  processor.connect(ctx.destination);
+  voiceStream = vs;
+  return true;
+}
+
+async function stopStreamingVoiceInput() {
+  const vs = voiceStream;
+  voiceStream = null;
+  try { vs.processor.disconnect(); vs.source.disconnect(); } catch (e) {}
+  vs.mic.getTracks().forEach(t => t.stop());
+  vs.ctx.close().catch(() => {});
+
+  setMicButtonState('processing');
+  try {
+    await vs.sendChain;
+    const tail = takeBufferedPCM(vs);
+    const res = await fetch(`/api/whisper/stream/${vs.id}/finish`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/octet-stream' },
+      body: tail.buffer,
+    });
+    const data = await res.json();
+    if (data.transcript) {
+      const userInput = document.getElementById('user-input');
+      userInput.value = vs.preview + data.transcript;
+      console.log('✅ Transcript:', data.transcript);
+      sendPrompt();
+    } else {
+      console.error('❌ No transcript returned:', data);
+    }
+  } catch (err) {
+    console.error('❌ Whisper stream failed:', err);
+  } finally {
+    setMicButtonState('idle');
+  }
+}
+
 async function startVoiceInput() {
   if (isRecording) {
     stopVoiceInput();
@@ -1359,40 +1647,41 @@ async function startVoiceInput() {
 
   try {
     const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-    mediaRecorder = new MediaRecorder(stream);
-    audioChunks = [];
+    isRecording = true;
 
-    mediaRecorder.ondataavailable = (event) => {
-      if (event.data.size > 0) {
-        audioChunks.push(event.data);
-      }
-    };
+    if (!(await startStreamingVoiceInput(stream))) {
+      mediaRecorder = new MediaRecorder(stream);
+      audioChunks = [];
 
-    mediaRecorder.start();
-    isRecording = true;
+      mediaRecorder.ondataavailable = (event) => {
+        if (event.data.size > 0) {
+          audioChunks.push(event.data);
+        }
+      };
 
-    const micBtn = document.getElementById('mic-btn');
-    micBtn.classList.add('listening');
-    micBtn.style.background = '#5a0f0f';
-    micBtn.style.borderColor = '#ff4444';
-    micBtn.style.color = '#ff8888';
-    console.log('🎤 Recording started...');
+      mediaRecorder.start();
+    }
+
+    setMicButtonState('listening');
+    console.log(`🎤 Recording started${voiceStream ? ' (streaming)' : ''}...`);
 
   } catch (err) {
+    isRecording = false;
     console.error('🎤 Mic access error:', err);
     hwuiToast('Could not access microphone. Check Brave permissions.', 'info');
   }
 }
 
 async function stopVoiceInput() {
-  if (!isRecording || !mediaRecorder) return;
+  if (!isRecording) return;
+  if (voiceStream) {
+    isRecording = false;
+    return stopStreamingVoiceInput();
+  }
+  if (!mediaRecorder) return;
 
   isRecording = false;
-  const micBtn = document.getElementById('mic-btn');
-  micBtn.classList.remove('listening');
-  micBtn.style.background = 'rgba(255,255,255,0.08)';
-  micBtn.style.borderColor = '#555';
-  micBtn.style.color = '#ccc';
+  setMicButtonState('idle');
 
   return new Promise((resolve) => {
     mediaRecorder.onstop = async () => {
@@ -1403,10 +1692,7 @@ async function stopVoiceInput() {
       formData.append('audio', audioBlob, 'recording.webm');
 
       try {
-        micBtn.classList.add('processing');
-        micBtn.style.background = '#1a3a1a';
-        micBtn.style.borderColor = '#44aa44';
-        micBtn.style.color = '#88ff88';
+        setMicButtonState('processing');
 
         const response = await fetch('/api/whisper/transcribe', {
           method: 'POST',
@@ -1427,10 +1713,7 @@ async function stopVoiceInput() {
       } catch (err) {
         console.error('❌ Whisper request failed:', err);
       } finally {
-        micBtn.classList.remove('processing');
-        micBtn.style.background = 'rgba(255,255,255,0.08)';
-        micBtn.style.borderColor = '#555';
-        micBtn.style.color = '#ccc';
+        setMicButtonState('idle');
         // Stop all mic tracks to release the mic
         mediaRecorder.stream.getTracks().forEach(t => t.stop());
       }
@@ -1,6 +1,14 @@
 from flask import Blueprint, request, jsonify
-import whisper
+from array import array
+from collections import deque
+import json
+import math
+import queue
+import sys
 import tempfile
+import threading
+import time
+import uuid
 import os
 import logging
 
@@ -63,10 +71,175 @@ def correct_transcript(text):
         text = _re.sub(pattern, replacement, text, flags=_re.IGNORECASE)
     return text
 
-# Load model once at startup - 'base' is fast and accurate enough
-# Change to 'small' or 'medium' for better accuracy at cost of speed
-model = whisper.load_model("base")
-logging.info("✅ Whisper model loaded")
+# ----------------------------------------------------------------
+# MODEL LOADING — lazy, pluggable backend
+# ----------------------------------------------------------------
+# Importing whisper/torch used to happen at module import, so every HWUI start
+# paid for it even when voice input was never touched. The model is now built
+# on first transcription (or by the optional background prewarm after startup).
+#
+# Backends (settings.json → whisper_backend):
+#   "faster-whisper" — CTranslate2, int8 on CPU by default; several times
+#                      faster than openai-whisper at the same model size
+#   "openai-whisper" — the original PyTorch implementation
+#   "auto"           — faster-whisper if installed, else openai-whisper
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json')
+
+WHISPER_DEFAULTS = {
+    'whisper_backend': 'auto',
+    'whisper_model': 'base',          # 'small' / 'medium' for accuracy at cost of speed
+    'whisper_device': 'auto',         # 'cpu', 'cuda' or 'auto'
+    'whisper_compute_type': 'int8',   # faster-whisper only: int8, int8_float16, float16, float32
+    'whisper_cpu_threads': 0,         # faster-whisper only: 0 = library default
+    'whisper_beam_size': 1,
+    'whisper_prewarm': True,
+    'whisper_vad_silence_ms': 600,    # streaming: trailing silence that closes a segment
+    'whisper_vad_max_segment_s': 15,  # streaming: force a cut in long unbroken speech
+}
+
+
+def _whisper_settings():
+    try:
+        with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception:
+        data = {}
+    return {key: data.get(key, default) for key, default in WHISPER_DEFAULTS.items()}
+
+
+class _FasterWhisperBackend:
+    name = 'faster-whisper'
+
+    def __init__(self, cfg):
+        from faster_whisper import WhisperModel
+        device = cfg['whisper_device']
+        compute_type = cfg['whisper_compute_type']
+        if device == 'auto':
+            device = 'cpu'
+            try:
+                import ctranslate2
+                if ctranslate2.get_cuda_device_count() > 0:
+                    device = 'cuda'
+            except Exception:
+                pass
+        kwargs = {'device': device, 'compute_type': compute_type}
+        threads = int(cfg['whisper_cpu_threads'] or 0)
+        if threads > 0:
+            kwargs['cpu_threads'] = threads
+        self.beam_size = max(1, int(cfg['whisper_beam_size'] or 1))
+        self.model = WhisperModel(cfg['whisper_model'], **kwargs)
+        self.description = f"{cfg['whisper_model']} on {device} ({compute_type})"
+
+    def transcribe(self, path):
+        segments, _info = self.model.transcribe(
+            path, language='en', beam_size=self.beam_size, vad_filter=True,
+        )
+        # `segments` is a lazy generator — decoding happens while we iterate.
+        return ''.join(segment.text for segment in segments)
+
+    def transcribe_pcm(self, samples):
+        # Streaming segments are already VAD-trimmed — skip the built-in filter.
+        segments, _info = self.model.transcribe(samples, language='en', beam_size=self.beam_size)
+        return ''.join(segment.text for segment in segments)
+
+
+class _OpenAIWhisperBackend:
+    name = 'openai-whisper'
+
+    def __init__(self, cfg):
+        import whisper
+        device = cfg['whisper_device']
+        self.model = whisper.load_model(cfg['whisper_model'], device=None if device == 'auto' else device)
+        self.beam_size = max(1, int(cfg['whisper_beam_size'] or 1))
+        self.description = f"{cfg['whisper_model']} on {self.model.device}"
+
+    def transcribe(self, path):
+        options = {'language': 'en'}
+        if self.beam_size > 1:
+            options['beam_size'] = self.beam_size
+        # fp16 only means anything on GPU; on CPU it just triggers a warning.
+        options['fp16'] = str(self.model.device) != 'cpu'
+        return self.model.transcribe(path, **options)['text']
+
+    def transcribe_pcm(self, samples):
+        return self.transcribe(samples)
+
+
+_BACKENDS = {
+    'faster-whisper': _FasterWhisperBackend,
+    'openai-whisper': _OpenAIWhisperBackend,
+}
+
+_NON_MODEL_KEYS = ('whisper_prewarm', 'whisper_vad_silence_ms', 'whisper_vad_max_segment_s')
+
+_model = None
+_model_config = None
+_model_lock = threading.Lock()
+_load_error = None
+
+
+def _build_backend(cfg):
+    choice = str(cfg['whisper_backend'] or 'auto').lower()
+    order = [choice] if choice in _BACKENDS else ['faster-whisper', 'openai-whisper']
+    last_error = None
+    for name in order:
+        try:
+            return _BACKENDS[name](cfg)
+        except ImportError as e:
+            last_error = e
+            logging.info(f"🎤 Whisper backend '{name}' not installed: {e}")
+        except Exception as e:
+            last_error = e
+            logging.error(f"❌ Whisper backend '{name}' failed to load: {e}")
+    raise RuntimeError(f"No Whisper backend could be loaded: {last_error}")
+
+
+def get_model():
+    """Return the loaded backend, building it on first use.
+
+    A settings change (backend, model size, device…) is picked up on the next
+    call and triggers a reload.
+    """
+    global _model, _model_config, _load_error
+    cfg = _whisper_settings()
+    key = {k: v for k, v in cfg.items() if k.startswith('whisper_') and k not in _NON_MODEL_KEYS}
+    if _model is not None and _model_config == key:
+        return _model
+    with _model_lock:
+        if _model is not None and _model_config == key:
+            return _model
+        started = time.monotonic()
+        try:
+            backend = _build_backend(cfg)
+        except Exception as e:
+            _load_error = str(e)
+            raise
+        _model, _model_config, _load_error = backend, key, None
+        logging.info(f"✅ Whisper loaded: {backend.name} {backend.description} "
+                     f"in {time.monotonic() - started:.1f}s")
+        return _model
+
+
+def start_prewarm(delay=5.0):
+    """Load the model in the background shortly after startup.
+
+    Does nothing unless whisper_prewarm is set. The delay keeps the load off
+    the critical path while Flask and llama-server are still coming up.
+    """
+    if not _whisper_settings()['whisper_prewarm']:
+        return None
+
+    def _prewarm():
+        time.sleep(delay)
+        try:
+            get_model()
+        except Exception as e:
+            logging.error(f"❌ Whisper prewarm failed: {e}")
+
+    thread = threading.Thread(target=_prewarm, daemon=True, name='whisper-prewarm')
+    thread.start()
+    return thread
+
 
 # Allow only alphanumeric chars in the extension we derive from upload
 # filenames — guards against path-separator injection (e.g. a filename like
@@ -100,9 +273,8 @@ def transcribe():
 
         logging.info(f"🎤 Transcribing audio: {tmp_path}")
 
-        # Transcribe with Whisper
-        result = model.transcribe(tmp_path, language='en')
-        transcript = result['text'].strip()
+        # Transcribe with Whisper (loads the model on first use)
+        transcript = get_model().transcribe(tmp_path).strip()
 
         # Post-process: correct known misheard words
         transcript = correct_transcript(transcript)
@@ -120,3 +292,303 @@ def transcribe():
                 os.unlink(tmp_path)
             except OSError as _ce:
                 logging.warning(f"⚠️ Could not delete temp file {tmp_path}: {_ce}")
+
+
+@whisper_bp.route('/api/whisper/status', methods=['GET'])
+def whisper_status():
+    cfg = _whisper_settings()
+    model = _model
+    return jsonify({
+        'loaded': model is not None,
+        'loading': _model_lock.locked(),
+        'backend': model.name if model else None,
+        'model': model.description if model else None,
+        'configured_backend': cfg['whisper_backend'],
+        'configured_model': cfg['whisper_model'],
+        'error': _load_error,
+    })
+
+
+# ----------------------------------------------------------------
+# STREAMING VOICE INPUT — chunked upload + VAD + incremental transcripts
+# ----------------------------------------------------------------
+# The browser posts raw 16 kHz mono PCM16 (little-endian) in short chunks
+# while the user is still talking. Each session runs the audio through a
+# voice-activity detector; every time a stretch of speech is followed by
+# enough silence the segment is handed to a worker thread and transcribed
+# on its own, with correct_transcript() applied. By the time the user lets
+# go of the mic only the last segment is left to decode.
+#
+#   POST   /api/whisper/stream            → {session}
+#   POST   /api/whisper/stream/<id>       body = PCM16 chunk → partial transcripts so far
+#   POST   /api/whisper/stream/<id>/finish → final transcript
+#   DELETE /api/whisper/stream/<id>       → discard
+#
+# Separate short POSTs (rather than one long chunked request or a WebSocket)
+# because browsers can't stream a request body over HTTP/1.1 and Flask has
+# no WebSocket support without an extra dependency. Keep-alive makes the
+# per-chunk cost negligible.
+STREAM_SAMPLE_RATE = 16000
+STREAM_FRAME_MS = 30
+STREAM_PREROLL_MS = 300
+STREAM_MIN_SPEECH_MS = 250
+STREAM_IDLE_TIMEOUT = 120
+STREAM_MAX_BUFFER_S = 300      # whole-utterance fallback keeps at most this much audio
+_FRAME_SAMPLES = STREAM_SAMPLE_RATE * STREAM_FRAME_MS // 1000
+_SESSION_ID_RE = _re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+try:
+    import webrtcvad  # optional — sharper than the energy gate in noisy rooms
+except ImportError:
+    webrtcvad = None
+
+
+class _EnergyVAD:
+    """RMS gate with an adaptive noise floor, used when webrtcvad isn't installed.
+
+    The floor starts at a fixed quiet-room level rather than the first frame:
+    with push-to-talk the user is often already speaking when the mic opens,
+    and seeding from that frame put the threshold above their own voice.
+    """
+
+    INITIAL_NOISE_FLOOR = 60.0
+
+    def __init__(self):
+        self.noise_floor = self.INITIAL_NOISE_FLOOR
+
+    def is_speech(self, frame):
+        samples = array('h', frame)
+        if sys.byteorder != 'little':
+            samples.byteswap()
+        rms = math.sqrt(sum(v * v for v in samples) / max(1, len(samples)))
+        threshold = max(300.0, self.noise_floor * 3.0)
+        speech = rms > threshold
+        if not speech:
+            # Track the room slowly so a fan or hum doesn't count as speech.
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+
+class VoiceSegmenter:
+    """Splits a PCM16 stream into speech segments (bytes) at pauses."""
+
+    def __init__(self, silence_ms=600, max_segment_s=15):
+        if webrtcvad is not None:
+            vad = webrtcvad.Vad(2)
+            self._is_speech = lambda frame: vad.is_speech(frame, STREAM_SAMPLE_RATE)
+        else:
+            self._is_speech = _EnergyVAD().is_speech
+        self.silence_frames = max(1, int(silence_ms) // STREAM_FRAME_MS)
+        self.max_frames = max(1, int(float(max_segment_s) * 1000) // STREAM_FRAME_MS)
+        self.min_speech_frames = STREAM_MIN_SPEECH_MS // STREAM_FRAME_MS
+        self._pending = b''
+        self._preroll = deque(maxlen=STREAM_PREROLL_MS // STREAM_FRAME_MS)
+        self._segment = []
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def _close_segment(self):
+        segment, speech = self._segment, self._speech_frames
+        self._segment, self._speech_frames, self._silent_run = [], 0, 0
+        if speech < self.min_speech_frames:
+            return None
+        return b''.join(segment)
+
+    def feed(self, pcm):
+        """Consume a chunk; return any segments that finished inside it."""
+        self._pending += pcm
+        frame_bytes = _FRAME_SAMPLES * 2
+        finished = []
+        while len(self._pending) >= frame_bytes:
+            frame, self._pending = self._pending[:frame_bytes], self._pending[frame_bytes:]
+            speech = self._is_speech(frame)
+            if not self._segment:
+                if speech:
+                    self._segment = list(self._preroll) + [frame]
+                    self._preroll.clear()
+                    self._speech_frames = 1
+                else:
+                    self._preroll.append(frame)
+                continue
+            self._segment.append(frame)
+            if speech:
+                self._speech_frames += 1
+                self._silent_run = 0
+            else:
+                self._silent_run += 1
+            if self._silent_run >= self.silence_frames or len(self._segment) >= self.max_frames:
+                segment = self._close_segment()
+                if segment:
+                    finished.append(segment)
+        return finished
+
+    def flush(self):
+        if self._pending and self._segment:
+            self._segment.append(self._pending)
+        self._pending = b''
+        segment = self._close_segment() if self._segment else None
+        return [segment] if segment else []
+
+
+def _pcm16_to_float(pcm):
+    import numpy as np
+    return np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+
+
+class StreamingTranscription:
+    def __init__(self, session_id, cfg):
+        self.session_id = session_id
+        self.segmenter = VoiceSegmenter(cfg['whisper_vad_silence_ms'], cfg['whisper_vad_max_segment_s'])
+        self.partials = []
+        self.error = None
+        self.received_bytes = 0
+        self.segments_queued = 0
+        # Everything received, for the whole-utterance fallback in finish().
+        self._audio = bytearray()
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._feed_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._done = threading.Event()
+        self._worker = threading.Thread(target=self._run, daemon=True, name=f'whisper-stream-{session_id[:8]}')
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            pcm = self._queue.get()
+            if pcm is None:
+                break
+            try:
+                started = time.monotonic()
+                text = correct_transcript(get_model().transcribe_pcm(_pcm16_to_float(pcm)).strip())
+                logging.info(f"🎤 Segment ({len(pcm) / 2 / STREAM_SAMPLE_RATE:.1f}s audio, "
+                             f"{time.monotonic() - started:.2f}s): {text}")
+                if text:
+                    with self._lock:
+                        self.partials.append(text)
+            except Exception as e:
+                logging.error(f"❌ Whisper stream segment failed: {e}")
+                with self._lock:
+                    self.error = str(e)
+        self._done.set()
+
+    def feed(self, pcm):
+        self.last_used = time.monotonic()
+        with self._feed_lock:
+            self.received_bytes += len(pcm)
+            if len(self._audio) < STREAM_MAX_BUFFER_S * STREAM_SAMPLE_RATE * 2:
+                self._audio += pcm
+            for segment in self.segmenter.feed(pcm):
+                self.segments_queued += 1
+                self._queue.put(segment)
+
+    def finish(self, timeout=None):
+        with self._feed_lock:
+            for segment in self.segmenter.flush():
+                self.segments_queued += 1
+                self._queue.put(segment)
+            if not self.segments_queued and len(self._audio) >= STREAM_MIN_SPEECH_MS * STREAM_SAMPLE_RATE * 2 // 1000:
+                # The VAD never fired (quiet mic, odd gain) — transcribe the
+                # whole recording rather than returning nothing.
+                logging.info(f"🎤 No speech segment detected — transcribing all "
+                             f"{len(self._audio) / 2 / STREAM_SAMPLE_RATE:.1f}s of audio")
+                self.segments_queued += 1
+                self._queue.put(bytes(self._audio))
+            self._audio = bytearray()
+        self._queue.put(None)
+        self._done.wait(timeout)
+        return self.snapshot()
+
+    def cancel(self):
+        self._queue.put(None)
+
+    def snapshot(self):
+        with self._lock:
+            partials = list(self.partials)
+            error = self.error
+        return {
+            'session': self.session_id,
+            'partials': partials,
+            'transcript': ' '.join(partials),
+            'pending': self._queue.qsize(),
+            'audio_seconds': round(self.received_bytes / 2 / STREAM_SAMPLE_RATE, 2),
+            'error': error,
+        }
+
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+
+def _get_stream(session_id):
+    with _streams_lock:
+        stream = _streams.get(session_id)
+        if stream is not None:
+            stream.last_used = time.monotonic()
+        return stream
+
+
+@whisper_bp.route('/api/whisper/stream', methods=['POST'])
+def stream_start():
+    session_id = uuid.uuid4().hex
+    stream = StreamingTranscription(session_id, _whisper_settings())
+    with _streams_lock:
+        now = time.monotonic()
+        for stale_id in [sid for sid, s in _streams.items() if now - s.last_used > STREAM_IDLE_TIMEOUT]:
+            _streams.pop(stale_id).cancel()
+        _streams[session_id] = stream
+    # Start loading the model now so it's ready by the first finished segment.
+    threading.Thread(target=_load_quietly, daemon=True, name='whisper-stream-load').start()
+    return jsonify({
+        'session': session_id,
+        'sample_rate': STREAM_SAMPLE_RATE,
+        'vad': 'webrtcvad' if webrtcvad is not None else 'energy',
+    })
+
+
+def _load_quietly():
+    try:
+        get_model()
+    except Exception as e:
+        logging.error(f"❌ Whisper load failed: {e}")
+
+
+@whisper_bp.route('/api/whisper/stream/<session_id>', methods=['POST'])
+def stream_chunk(session_id):
+    if not _SESSION_ID_RE.match(session_id):
+        return jsonify({'error': 'Invalid session id'}), 400
+    stream = _get_stream(session_id)
+    if stream is None:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    pcm = request.get_data(cache=False)
+    if len(pcm) % 2:
+        return jsonify({'error': 'Chunk must be whole 16-bit samples'}), 400
+    stream.feed(pcm)
+    return jsonify(stream.snapshot())
+
+
+@whisper_bp.route('/api/whisper/stream/<session_id>/finish', methods=['POST'])
+def stream_finish(session_id):
+    if not _SESSION_ID_RE.match(session_id):
+        return jsonify({'error': 'Invalid session id'}), 400
+    with _streams_lock:
+        stream = _streams.pop(session_id, None)
+    if stream is None:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    pcm = request.get_data(cache=False)
+    if pcm and len(pcm) % 2 == 0:
+        stream.feed(pcm)
+    result = stream.finish(timeout=120)
+    if result['error'] and not result['partials']:
+        return jsonify(result), 500
+    logging.info(f"✅ Streamed transcript: {result['transcript']}")
+    return jsonify(result)
+
+
+@whisper_bp.route('/api/whisper/stream/<session_id>', methods=['DELETE'])
+def stream_cancel(session_id):
+    with _streams_lock:
+        stream = _streams.pop(session_id, None)
+    if stream is not None:
+        stream.cancel()
+    return jsonify({'status': 'ok'})
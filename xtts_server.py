@@ -13,6 +13,8 @@ import re
 import glob
 
 from tts_path_config import apply_tts_path_overrides
+from tts_synthesis_queue import SynthesisQueue
+from tts_cache import voice_file_version
 
 apply_tts_path_overrides()
 
@@ -28,6 +30,34 @@ DEFAULT_VOICE = "Sol.wav"
 
 # Prevents multiple simultaneous requests overwhelming Docker XTTS
 generation_lock = Lock()
+# Orders waiting requests FIFO and reports the backlog on /status. The Docker
+# xtts-api-server takes one text per call, so there is nothing to batch.
+synthesis_queue = SynthesisQueue("xtts")
+
+# Outcome of the last forward to Docker. /status trusts a recent success and
+# probes the relay target otherwise, so a dead Docker host isn't reported as
+# healthy just because this relay process is up.
+RELAY_FRESH_S = 30.0
+RELAY_PROBE_TIMEOUT = 1.5
+relay_state = {"ok": None, "at": 0.0, "error": None}
+
+
+def _record_relay(ok, error=None):
+    relay_state.update(ok=ok, at=time.monotonic(), error=error)
+
+
+def _relay_reachable():
+    if relay_state["ok"] and time.monotonic() - relay_state["at"] < RELAY_FRESH_S:
+        return True, None
+    try:
+        # Any HTTP answer means the xtts-api-server is up; only 5xx counts as unhealthy.
+        response = requests.get(DOCKER_BASE_URL, timeout=RELAY_PROBE_TIMEOUT)
+        ok = response.status_code < 500
+        error = None if ok else f"HTTP {response.status_code}"
+    except requests.RequestException as e:
+        ok, error = False, str(e)
+    _record_relay(ok, error)
+    return ok, error
 
 # --------------------------------------------------
 # XTTS SAMPLING SETTINGS
@@ -119,8 +149,18 @@ def tts_to_audio():
         print(f" > Forwarding to Docker XTTS: \"{text[:60]}...\" [voice: {voice}]")
 
         # Lock ensures only one request hits Docker at a time
-        with generation_lock:
-            response = requests.post(DOCKER_XTTS_URL, json=payload, timeout=60)
+        def _forward():
+            with generation_lock:
+                return requests.post(DOCKER_XTTS_URL, json=payload, timeout=60)
+        try:
+            response = synthesis_queue.call(_forward)
+        except requests.RequestException as e:
+            _record_relay(False, str(e))
+            raise
+        if response.status_code >= 500:
+            _record_relay(False, f"HTTP {response.status_code}")
+        else:
+            _record_relay(True)
 
         if response.status_code == 200:
             content_type = response.headers.get('Content-Type', '')
@@ -168,17 +208,33 @@ def tts_to_audio():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/status', methods=['GET'])
+def status():
+    """Relay health (Docker XTTS reachability) plus the local request queue."""
+    reachable, error = _relay_reachable()
+    payload = {
+        "status": "online" if reachable else "relay_offline",
+        "engine": "xtts",
+        "gpu": f"docker@{MUSIC_PC_IP}",
+        "relay": {"url": DOCKER_BASE_URL, "reachable": reachable, "error": error},
+        "queue": synthesis_queue.stats(),
+    }
+    return jsonify(payload), 200 if reachable else 503
+
+
 @app.route('/voices', methods=['GET'])
 def get_voices():
     """Return list of available voice .wav files"""
     wav_files = glob.glob(os.path.join(VOICE_FOLDER, "*.wav"))
     # Exclude the debug output file from the voice list
+    wav_files = [f for f in wav_files if os.path.basename(f) != "last_generated_output.wav"]
     voices = [
         {"name": os.path.basename(f), "label": os.path.basename(f).replace('.wav', '')}
         for f in wav_files
-        if os.path.basename(f) != "last_generated_output.wav"
     ]
-    return jsonify({"voices": voices})
+    # Reference-file stamps — HWUI keys its TTS audio cache on these.
+    versions = {os.path.basename(f): voice_file_version(f) for f in wav_files}
+    return jsonify({"voices": voices, "versions": versions})
 
 
 if __name__ == '__main__':